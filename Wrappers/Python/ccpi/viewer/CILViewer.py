@@ -14,6 +14,9 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import logging
+import weakref
+
 import numpy
 import vtk
 from ccpi.viewer import (
@@ -34,6 +37,10 @@ from ccpi.viewer import (
 from ccpi.viewer.CILViewerBase import CILViewerBase
 from ccpi.viewer.utils import colormaps
 from ccpi.viewer.utils import CameraData
+from ccpi.viewer.utils.conversion import vtkImageResampler
+from ccpi.viewer.utils.isosurface import cilIsoSurfaceExtractor
+from ccpi.viewer.utils.memory import cilMemoryManager, get_data_size
+from ccpi.viewer.utils.occupancy import cilVolumeOccupancyGrid
 
 
 class CILInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
@@ -46,6 +53,8 @@ class CILInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self.AddObserver("KeyPressEvent", self.OnKeyPress, 1.0)
         self.AddObserver("LeftButtonPressEvent", self.OnLeftMouseClick)
         self.AddObserver("LeftButtonReleaseEvent", self.OnLeftMouseRelease)
+        self.AddObserver("StartInteractionEvent", self.OnStartInteraction)
+        self.AddObserver("EndInteractionEvent", self.OnEndInteraction)
         # self.AddObserver('RightButtonPressEvent', self.OnRightMousePress, -0.5)
         # self.AddObserver('RightButtonReleaseEvent', self.OnRightMouseRelease, -0.5)
         self.htext = None
@@ -168,6 +177,14 @@ class CILInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self.SetDecimalisation(0.0)
         self.OnLeftButtonUp()
 
+    def OnStartInteraction(self, interactor, event):
+        # render the low resolution volume while the camera is moving
+        self._viewer.setVolumeRenderInteractive(True)
+
+    def OnEndInteraction(self, interactor, event):
+        # back to full resolution for the still render
+        self._viewer.setVolumeRenderInteractive(False)
+
     def OnRightMousePress(self, interactor, event):
         ctrl = interactor.GetControlKey()
         alt = interactor.GetAltKey()
@@ -330,6 +347,8 @@ class CILInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         viewer.plane = plane
         viewer.planew = planew
         planew.AddObserver("InteractionEvent", self.update_clipping_plane, 0.5)
+        planew.AddObserver("StartInteractionEvent", self.OnStartInteraction)
+        planew.AddObserver("EndInteractionEvent", self.OnEndInteraction)
         self._viewer.clipping_plane_initialised = True
 
         return planew
@@ -552,9 +571,29 @@ class CILViewer(CILViewerBase):
         self.volume_render_initialised = False
         self.clipping_plane_initialised = False
 
+        # Level of detail (LOD) volume render, see setVolumeRenderLOD
+        self.volume_lod_enabled = False
+        self.volume_lod_target_size = 128**3
+        self.volume_lod_target_frame_time = None
+        self.volume_lod_mapper = None
+        self._volume_lod_resampler = None
+        # whether the volume mapper renders a downsampled copy of the image, see _setVolumeMapperInput
+        self.volume_render_downsampled = False
+        # the levels of the dataset context rendered by the mappers, by mapper, see _pinPyramidLevel
+        self._pinned_pyramid_levels = {}
+
+        # Empty space skipping, see setVolumeRenderEmptySpaceSkipping
+        self.volume_empty_space_skipping = False
+        self.volume_occupancy_grid = cilVolumeOccupancyGrid()
+
         # volume
         self.volume = None
 
+        # isosurface
+        self.isosurface_extractor = cilIsoSurfaceExtractor()
+        self.isosurface_actor = None
+        self.isosurface_value = None
+
     def createPolyDataActor(self, polydata):
         """
         Creates and returns an actor for a given polydata.
@@ -629,6 +668,12 @@ class CILViewer(CILViewerBase):
 
     def setInput3DData(self, imageData):
         self.img3D = imageData
+        self._acquireDatasetContext(imageData)
+
+        # the isosurface actor is removed with the other actors by installPipeline
+        self.isosurface_extractor.SetInputData(imageData)
+        self.isosurface_actor = None
+        self.isosurface_value = None
 
         # Have to overwrite old volume and clipping planes if they
         # were previously created:
@@ -727,6 +772,52 @@ class CILViewer(CILViewerBase):
         self.iren.Initialize()
         self.renWin.Render()
 
+    def setIsoSurface(self, isovalue, coarse=False):
+        """
+        Displays the isosurface of the image at isovalue.
+
+        Meshes are cached by isosurface_extractor, so displaying again an isovalue
+        that was already extracted is fast.
+
+        :param isovalue: The value of the isosurface.
+        :type isovalue: float
+        :param coarse: If True the surface is extracted from a downsampled image, to preview it quickly.
+        :type coarse: bool
+        """
+        if self.img3D is None:
+            return
+        self.isosurface_extractor.SetInputData(self.img3D)
+        mesh = self.isosurface_extractor.GetOutput(isovalue, coarse=coarse)
+
+        if self.isosurface_actor is None:
+            mapper = vtk.vtkPolyDataMapper()
+            mapper.ScalarVisibilityOff()
+            actor = vtk.vtkActor()
+            actor.SetMapper(mapper)
+            self.ren.AddActor(actor)
+            self.isosurface_actor = actor
+        self.isosurface_actor.GetMapper().SetInputData(mesh)
+        self.isosurface_actor.VisibilityOn()
+        self.isosurface_value = isovalue
+
+        self.renWin.Render()
+
+    def getIsoSurfaceValue(self):
+        """
+        Returns the value of the displayed isosurface, or None if no isosurface is displayed.
+        """
+        return self.isosurface_value
+
+    def removeIsoSurface(self):
+        """
+        Removes the isosurface from the render.
+        """
+        if self.isosurface_actor is not None:
+            self.ren.RemoveActor(self.isosurface_actor)
+            self.isosurface_actor = None
+            self.isosurface_value = None
+            self.renWin.Render()
+
     def saveDefaultCamera(self):
         """
         Saves the default camera settings for a particular
@@ -751,6 +842,9 @@ class CILViewer(CILViewerBase):
         :type mapper: vtkVolumeMapper
         """
         self.volume_mapper = mapper
+        # the LOD mapper is created again from the new mapper when needed
+        self._pinPyramidLevel("volume_lod")
+        self.volume_lod_mapper = None
 
     def getVolumeMapper(self):
         """
@@ -758,6 +852,247 @@ class CILViewer(CILViewerBase):
         """
         return self.volume_mapper
 
+    def setVolumeRenderLOD(self, enabled=True, target_size=None):
+        """
+        Enables or disables the level of detail (LOD) volume render.
+
+        When enabled, a downsampled copy of the volume is rendered while the user
+        interacts with the camera or the clipping plane, and the full resolution
+        volume is rendered again as soon as the interaction ends.
+        The downsampled copy is created with vtkImageResampler and shares the
+        volume property (colour and opacity) and the clipping planes with the
+        full resolution volume, so the two levels always display the same settings.
+
+        :param enabled: Whether to use the LOD volume render.
+        :type enabled: bool
+        :param target_size: Approximate size in bytes of the downsampled copy. If None the current value is kept.
+        :type target_size: int
+        """
+        if target_size is not None:
+            target_size = int(target_size)
+            if target_size != self.volume_lod_target_size:
+                self.volume_lod_target_size = target_size
+                # the downsampled copy may be shared with the other viewers, it is created again when needed
+                self._pinPyramidLevel("volume_lod")
+                self.volume_lod_mapper = None
+                self._volume_lod_resampler = None
+        self.volume_lod_enabled = enabled
+        if not enabled:
+            self.setVolumeRenderInteractive(False)
+        elif self.volume_render_initialised:
+            self._installVolumeRenderLODPipeline()
+
+    def getVolumeRenderLOD(self):
+        """
+        Returns whether the level of detail (LOD) volume render is enabled.
+        """
+        return self.volume_lod_enabled
+
+    def setVolumeRenderTargetFrameTime(self, frame_time):
+        """
+        Sets the time per frame to aim for while interacting with the volume render.
+        The volume mappers adjust their sample distance automatically to reach it,
+        while still renders are done at full quality.
+
+        :param frame_time: Target time per frame in seconds.
+        :type frame_time: float
+        """
+        if frame_time <= 0:
+            raise ValueError("The target frame time must be positive, got {}".format(frame_time))
+        self.volume_lod_target_frame_time = frame_time
+        self.iren.SetDesiredUpdateRate(1.0 / frame_time)
+        for mapper in (self.volume_mapper, self.volume_lod_mapper):
+            if mapper is not None and hasattr(mapper, "AutoAdjustSampleDistancesOn"):
+                mapper.AutoAdjustSampleDistancesOn()
+
+    def getVolumeRenderTargetFrameTime(self):
+        """
+        Returns the time per frame to aim for while interacting with the volume render,
+        or None if it was not set.
+        """
+        return self.volume_lod_target_frame_time
+
+    def setVolumeRenderInteractive(self, interactive):
+        """
+        Switches the volume render between the downsampled and the full resolution volume.
+        The downsampled volume is only used if the LOD volume render is enabled.
+
+        :param interactive: If True render the downsampled volume, otherwise the full resolution one.
+        :type interactive: bool
+        """
+        if not self.volume_render_initialised:
+            return
+        if interactive and self.volume_lod_enabled:
+            if self.volume_lod_mapper is None or self._volume_lod_resampler.GetInputDataObject(0, 0) is not self.img3D:
+                self._installVolumeRenderLODPipeline()
+            mapper = self.volume_lod_mapper
+        else:
+            mapper = self.volume_mapper
+        if self.volume.GetMapper() is not mapper:
+            self.volume.SetMapper(mapper)
+
+    def setVolumeRenderEmptySpaceSkipping(self, enabled=True, block_size=None):
+        """
+        Enables or disables empty space skipping in the volume render.
+
+        When enabled, the image is divided in blocks and the volume mappers are cropped
+        to the region containing the blocks which are not fully transparent with the
+        current opacity transfer function, so that the render does not march through
+        empty space. The minimum and maximum of each block are computed once per image,
+        so the cropping region can be updated each time the opacity changes.
+
+        :param enabled: Whether to skip the empty space.
+        :type enabled: bool
+        :param block_size: Size of the side of the blocks in voxels. If None the current value is kept.
+        :type block_size: int
+        """
+        if block_size is not None:
+            self.volume_occupancy_grid.SetBlockSize(block_size)
+        self.volume_empty_space_skipping = enabled
+        if self.volume_render_initialised:
+            self.updateVolumePipeline()
+            if not self.volume.GetVisibility():
+                # updateVolumePipeline only runs on visible volumes
+                _, opacity = self.getColorOpacityForVolumeRender()
+                self._updateVolumeCropping(opacity)
+
+    def getVolumeRenderEmptySpaceSkipping(self):
+        """
+        Returns whether empty space skipping is enabled in the volume render.
+        """
+        return self.volume_empty_space_skipping
+
+    def _updateVolumeCropping(self, opacity):
+        """
+        Crops the volume mappers to the region which is visible with the opacity function.
+
+        :param opacity: The opacity transfer function, mapping either the image values or their gradient magnitude.
+        :type opacity: vtkPiecewiseFunction
+        """
+        mappers = [mapper for mapper in (self.volume_mapper, self.volume_lod_mapper) if mapper is not None]
+        bounds = None
+        if self.volume_empty_space_skipping:
+            grid = self.volume_occupancy_grid
+            grid.SetInputData(self.img3D)
+            # the gradient magnitude is shared with the volume render and the other viewers
+            grid.SetDatasetContext(self.getDatasetContext())
+            grid.SetMethod(self.getVolumeRenderOpacityMethod())
+            bounds = grid.GetCroppingBounds(opacity)
+        for mapper in mappers:
+            if bounds is None:
+                mapper.CroppingOff()
+            else:
+                mapper.CroppingOn()
+                mapper.SetCroppingRegionPlanes(*bounds)
+                mapper.SetCroppingRegionFlagsToSubVolume()
+
+    def _installVolumeRenderLODPipeline(self):
+        """
+        Creates the downsampled copy of the volume and its mapper for the LOD volume render.
+        """
+        context = self.getDatasetContext()
+        if context is not None:
+            # the downsampled volume is shared with the other viewers of the image
+            resampler = context.GetPyramidResampler(self.volume_lod_target_size)
+            self._pinPyramidLevel("volume_lod", context, self.volume_lod_target_size)
+        else:
+            self._pinPyramidLevel("volume_lod")
+            resampler = vtkImageResampler()
+            resampler.SetInputDataObject(self.img3D)
+            resampler.SetTargetSize(self.volume_lod_target_size)
+            resampler.Update()
+        self._volume_lod_resampler = resampler
+
+        mapper = self.volume_mapper.NewInstance()
+        mapper.SetInputConnection(resampler.GetOutputPort())
+        mapper.SetBlendMode(self.volume_mapper.GetBlendMode())
+        if hasattr(mapper, "SetRequestedRenderMode"):
+            mapper.SetRequestedRenderMode(self.volume_mapper.GetRequestedRenderMode())
+        if self.volume_lod_target_frame_time is not None and hasattr(mapper, "AutoAdjustSampleDistancesOn"):
+            mapper.AutoAdjustSampleDistancesOn()
+
+        # both levels share the same collection of clipping planes, so that adding or
+        # removing a plane through volume.GetMapper() applies to both of them
+        planes = self.volume_mapper.GetClippingPlanes()
+        if planes is None:
+            planes = vtk.vtkPlaneCollection()
+            self.volume_mapper.SetClippingPlanes(planes)
+        mapper.SetClippingPlanes(planes)
+
+        # and the same cropping region
+        mapper.SetCropping(self.volume_mapper.GetCropping())
+        mapper.SetCroppingRegionPlanes(self.volume_mapper.GetCroppingRegionPlanes())
+        mapper.SetCroppingRegionFlags(self.volume_mapper.GetCroppingRegionFlags())
+
+        self.volume_lod_mapper = mapper
+
+    def getDatasetProducts(self):
+        """
+        Returns the ranges of values of the image the viewer maps, as in CILViewerBase, including
+        the ones of the volume render once it is initialised, which need the gradient magnitude.
+        """
+        products = super().getDatasetProducts()
+        if self.volume_render_initialised:
+            parameters = self.style.GetVolumeRenderParameters()
+            products += [(tuple(parameters["color_percentiles"]), "scalar"),
+                         (tuple(parameters["scalar_opacity_percentiles"]), "scalar"),
+                         (tuple(parameters["gradient_opacity_percentiles"]), "gradient")]
+        return products
+
+    def _setVolumeMapperInput(self):
+        """
+        Sets the input of the volume mapper to the image, or to a downsampled copy of it if the buffers
+        of the mapper would not fit in the budget of the cilMemoryManager once its caches are evicted,
+        and registers the buffers of the mapper with the manager. The downsampled copy is a pyramid level
+        of the dataset context, counted by the context and pinned while the mapper renders it.
+        """
+        manager = cilMemoryManager.GetInstance()
+        size = get_data_size(self.img3D)
+        target_size = manager.Reserve(size,
+                                      minimum_size=min(size, self.volume_lod_target_size),
+                                      replaced=[(self, "volume_mapper")])
+        context = self.getDatasetContext()
+        if target_size < size and context is not None:
+            logging.warning(
+                "The volume is rendered downsampled to {} bytes to fit in the memory budget".format(target_size))
+            # the downsampled image is shared with the other viewers of the image, and counted by the context
+            resampler = context.GetPyramidResampler(target_size)
+            self._pinPyramidLevel("volume_mapper", context, target_size)
+            self.volume_mapper.SetInputConnection(resampler.GetOutputPort())
+            self.volume_render_downsampled = True
+            manager.Unregister(self, "volume_mapper")
+        else:
+            self._pinPyramidLevel("volume_mapper")
+            self.volume_mapper.SetInputData(self.img3D)
+            self.volume_render_downsampled = False
+            # the mapper allocates textures or gradient tables of about the size of its input
+            manager.Register(self, "volume_mapper", self.img3D)
+
+    def _pinPyramidLevel(self, mapper_name, context=None, target_size=None):
+        """
+        Pins the pyramid level of the dataset context rendered by a mapper, so that it is not evicted
+        while the mapper renders it, and unpins the level the mapper rendered before, if any.
+
+        :param mapper_name: "volume_mapper" or "volume_lod"
+        :param context: The cilDatasetContext of the level, or None if the mapper renders no level.
+        :param target_size: The target size of the level.
+        """
+        previous = self._pinned_pyramid_levels.pop(mapper_name, None)
+        # the other mapper may render the same level
+        if previous is not None and previous[0]() is not None and previous not in self._pinned_pyramid_levels.values():
+            previous[0]().UnpinPyramidLevel(previous[1], self)
+        if context is not None:
+            context.PinPyramidLevel(target_size, self)
+            # the context is held weakly, it is released with the image
+            self._pinned_pyramid_levels[mapper_name] = (weakref.ref(context), target_size)
+
+    def getVolumeRenderDownsampled(self):
+        """
+        Returns whether the volume render displays a downsampled copy of the image, because the
+        image did not fit in the budget of the cilMemoryManager.
+        """
+        return self.volume_render_downsampled
+
     def installVolumeRenderActorPipeline(self):
         """
         Sets up and initializes the volume rendering pipeline for 3D image visualization.
@@ -766,7 +1101,11 @@ class CILViewer(CILViewerBase):
         volumeProperty = vtk.vtkVolumeProperty()
 
         self.volume_property = volumeProperty
-        self.volume_mapper.SetInputData(self.img3D)
+        self._setVolumeMapperInput()
+        # the downsampled copy of the previous image is out of date
+        self._pinPyramidLevel("volume_lod")
+        self.volume_lod_mapper = None
+        self._volume_lod_resampler = None
 
         # The volume holds the mapper and the property and
         # can be used to position/orient the volume.
@@ -804,8 +1143,12 @@ class CILViewer(CILViewerBase):
         self.volume_property.ShadeOn()
         self.volume_property.SetInterpolationTypeToLinear()
 
+        self._updateVolumeCropping(opacity)
+
         self.ren.AddVolume(self.volume)
         self.volume_render_initialised = True
+        if self.volume_lod_enabled:
+            self._installVolumeRenderLODPipeline()
         self.volume.VisibilityOff()
         self.addHeadlight()
 
@@ -1167,6 +1510,8 @@ class CILViewer(CILViewerBase):
                 self.volume_property.DisableGradientOpacityOn()
                 self.volume_property.SetScalarOpacity(opacity)
 
+            self._updateVolumeCropping(opacity)
+
             self.renWin.Render()
 
     def adjustCamera(self, resetcamera=False):
@@ -16,11 +16,16 @@
 
 import numpy
 import vtk
-from ccpi.viewer import (ALT_KEY, CONTROL_KEY, SHIFT_KEY, CROSSHAIR_ACTOR, CURSOR_ACTOR, HELP_ACTOR, HISTOGRAM_ACTOR,
-                         LINEPLOT_ACTOR, OVERLAY_ACTOR, SLICE_ACTOR, WIPE_ACTOR, SLICE_ORIENTATION_XY,
+from ccpi.viewer import (ALT_KEY, CONTROL_KEY, SHIFT_KEY, COMPARISON_ACTOR, CROSSHAIR_ACTOR, CURSOR_ACTOR, HELP_ACTOR,
+                         HISTOGRAM_ACTOR, LINEPLOT_ACTOR, OVERLAY_ACTOR, SLICE_ACTOR, WIPE_ACTOR, SLICE_ORIENTATION_XY,
                          SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ)
 from ccpi.viewer.CILViewerBase import CILViewerBase
 from ccpi.viewer.utils import Converter
+from ccpi.viewer.utils.comparison import COMPARISON_OPERATIONS, cilImageComparison
+from ccpi.viewer.utils.reslice import cilResampleToReference, same_sampling
+from ccpi.viewer.utils.memory import cilMemoryManager
+from ccpi.viewer.utils.sinogram_cache import cilAcquisitionDataReader
+from ccpi.viewer.utils.slab import SLAB_PROJECTIONS, cilSlabProjection
 
 from ccpi.viewer.widgets import cilviewerBoxWidget, SliceSliderRepresentation, SliderCallback
 
@@ -408,6 +413,15 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
                 self._viewer.imageSlice.GetProperty().SetInterpolationTypeToLinear()
             self._viewer.updatePipeline()
 
+        elif interactor.GetKeyCode() == "p":
+            # cycle through single slice and the slab projections
+            projections = [None] + SLAB_PROJECTIONS
+            current = projections.index(self._viewer.getSlabProjection())
+            self._viewer.setSlabProjection(projections[(current + 1) % len(projections)])
+        elif interactor.GetKeyCode() in ["+", "-"]:
+            step = 2 if interactor.GetKeyCode() == "+" else -2
+            self._viewer.setSlabThickness(max(1, self._viewer.getSlabThickness() + step))
+
         elif interactor.GetKeyCode() == '1':
             ev = 'RECTILINEAR_WIPE'
             if self.GetViewerEvent(ev):
@@ -425,6 +439,19 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
                     self.SetCharEvent(orient[self.GetSliceOrientation()])
                     self.SetEventActive('RECTILINEAR_WIPE')
 
+        elif interactor.GetKeyCode() == '3':
+            if self._viewer.image2 is not None:
+                if self._viewer.vis_mode != CILViewer2D.IMAGE_COMPARISON:
+                    ev = 'RECTILINEAR_WIPE'
+                    if self.GetViewerEvent(ev):
+                        self.SetEventInactive(ev)
+                    self._viewer.setVisualisationToImageComparison()
+                else:
+                    # cycle through the comparison operations
+                    operations = COMPARISON_OPERATIONS
+                    current = operations.index(self._viewer.getComparisonOperation())
+                    self._viewer.setComparisonOperation(operations[(current + 1) % len(operations)])
+
         else:
             self.log("Unhandled event %s" % (interactor.GetKeyCode()))
 
@@ -941,6 +968,12 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
                 s: Save Current Image
                 t: Tracing
                 i: Toggle interpolation of slice
+                p: Cycle slab projection (off, max, min, mean)
+                +/-: Increase/decrease slab thickness
+                1: Image with overlay
+                2: Rectilinear wipe of the 2 images
+                3: Comparison of the 2 images, press again to cycle
+                   (difference, absolute difference, ratio, threshold)
                 """
         textMapperC.SetInput(self.htext)
         tprop = textMapperC.GetTextProperty()
@@ -1071,6 +1104,7 @@ class CILViewer2D(CILViewerBase):
     # visualisation modes
     IMAGE_WITH_OVERLAY = 0
     RECTILINEAR_WIPE = 1
+    IMAGE_COMPARISON = 2
 
     def __init__(self, dimx=600, dimy=600, ren=None, renWin=None, iren=None, debug=False, enableSliderWidget=True):
         CILViewerBase.__init__(self, dimx=dimx, dimy=dimy, ren=ren, renWin=renWin, iren=iren, debug=debug)
@@ -1095,6 +1129,32 @@ class CILViewer2D(CILViewerBase):
         # input 2
         self.image2 = None
         self.voi2 = vtk.vtkExtractVOI()
+
+        # thick slab projection of the images, None shows single slices
+        self.slab_projection = None
+        self.slab = cilSlabProjection()
+        self.slab2 = cilSlabProjection()
+        self.slab.SetThickness(9)
+        self.slab2.SetThickness(9)
+        # resampling of image2 on the grid of img3D, if they are sampled differently
+        self.resample2 = cilResampleToReference()
+
+        # sinograms of acquisition data read from a cilSinogramCache, see setSinogramCache
+        self.sinogram_cache = None
+        self.sinogramReader = cilAcquisitionDataReader()
+        self.sinogramResample = cilResampleToReference()
+        self.sinogramResample.SetInputConnection(0, self.sinogramReader.GetOutputPort())
+        self._sinogram_cache_in_use = False
+
+        # comparison of img3D and image2, computed for the displayed slice only
+        self.comparison = cilImageComparison()
+        self.comparisonVOI = vtk.vtkExtractVOI()
+        self.comparisonVOI.SetInputConnection(self.comparison.GetOutputPort())
+        self.comparisonSliceMapper = vtk.vtkImageSliceMapper()
+        self.comparisonSliceMapper.SetInputConnection(self.comparisonVOI.GetOutputPort())
+        self.comparisonActor = vtk.vtkImageSlice()
+        self.comparisonActor.SetMapper(self.comparisonSliceMapper)
+        self.comparisonActor.GetProperty().SetInterpolationTypeToNearest()
         self.imageSlice2 = vtk.vtkImageSlice()
         self.imageSliceMapper2 = vtk.vtkImageSliceMapper()
         self.imageSlice2.SetMapper(self.imageSliceMapper2)
@@ -1240,13 +1300,17 @@ class CILViewer2D(CILViewerBase):
         self.log("setInputData")
         self.reset()
         self.img3D = imageData
+        self._acquireDatasetContext(imageData)
         self.installPipeline()
         self.axes_initialised = True
 
     def setInputData2(self, imageData):
         self.image2 = imageData
-        # TODO resample on image1
-        # print ("setInputData2")
+        if imageData is None:
+            cilMemoryManager.GetInstance().Unregister(self, 'image2')
+        else:
+            cilMemoryManager.GetInstance().Register(self, 'image2', imageData)
+        # image2 is resampled on the grid of image1 in connectSliceExtraction
         self.installPipeline2()
 
     def setInputAsNumpy(self,
@@ -1297,6 +1361,8 @@ class CILViewer2D(CILViewerBase):
             self.updateImageWithOverlayPipeline(resetcamera=resetcamera)
         elif self.vis_mode == CILViewer2D.RECTILINEAR_WIPE:
             self.updateRectilinearWipePipeline(resetcamera=resetcamera)
+        elif self.vis_mode == CILViewer2D.IMAGE_COMPARISON:
+            self.updateImageComparisonPipeline(resetcamera=resetcamera)
 
         self.AdjustCamera(resetcamera)
         self.renWin.Render()
@@ -1304,17 +1370,35 @@ class CILViewer2D(CILViewerBase):
     def updateRectilinearWipePipeline(self, resetcamera=False):
         extent = self.updateMainVOI()
         self.voi.SetVOI(*extent)
-        #TODO what happens if image2 has a different sampling?
+        # image2 is resampled on the grid of image1 if it has a different sampling
         self.voi2.SetVOI(*extent)
         self.wipeSliceMapper.SetOrientation(self.sliceOrientation)
 
+    def updateImageComparisonPipeline(self, resetcamera=False):
+        extent = self.updateMainVOI()
+        self.comparisonVOI.SetVOI(*extent)
+        self.comparisonSliceMapper.SetOrientation(self.sliceOrientation)
+        self.comparisonActor.Update()
+
+        text = self.createAnnotationText("slice",
+                                         (self.getActiveSlice(), self.img3D.GetDimensions()[self.sliceOrientation] - 1))
+        stats = self.comparison.GetStatistics(extent)
+        if text is not None and stats is not None:
+            text += "\n{} mean {:.4g} std {:.4g}".format(self.getComparisonOperation(), stats['mean'], stats['std'])
+        self.updateCornerAnnotation(text, 0)
+
     def updateMainVOI(self):
+        if self.isSinogramCacheInUse() != self._sinogram_cache_in_use:
+            self.connectSliceExtraction()
         # get the current slice
         extent = [i for i in self.img3D.GetExtent()]
         extent[self.sliceOrientation * 2] = self.getActiveSlice()
         extent[self.sliceOrientation * 2 + 1] = self.getActiveSlice()
         self.voi.SetVOI(extent[0], extent[1], extent[2], extent[3], extent[4], extent[5])
         self.log("extent {0}".format(extent))
+        self.slab.SetOrientation(self.sliceOrientation)
+        self.slab2.SetOrientation(self.sliceOrientation)
+        self.updateSlab2Thickness()
         self.voi.Update()
         self.log("VOI dimensions {0}".format(self.voi.GetOutput().GetDimensions()))
         return extent
@@ -1332,6 +1416,8 @@ class CILViewer2D(CILViewerBase):
 
         text = self.createAnnotationText("slice",
                                          (self.getActiveSlice(), self.img3D.GetDimensions()[self.sliceOrientation] - 1))
+        if self.slab_projection is not None and text is not None:
+            text += " {} slab {}".format(self.slab_projection, self.getSlabThickness())
         self.updateCornerAnnotation(text, 0)
 
         if self.displayHistogram:
@@ -1365,7 +1451,7 @@ class CILViewer2D(CILViewerBase):
 
     @vis_mode.setter
     def vis_mode(self, value):
-        if value in [CILViewer2D.IMAGE_WITH_OVERLAY, CILViewer2D.RECTILINEAR_WIPE]:
+        if value in [CILViewer2D.IMAGE_WITH_OVERLAY, CILViewer2D.RECTILINEAR_WIPE, CILViewer2D.IMAGE_COMPARISON]:
             self.__vis_mode = value
 
     def setVisualisationPipelineMethodTo(self, method):
@@ -1381,12 +1467,182 @@ class CILViewer2D(CILViewerBase):
             self.vis_mode = method
             self.installPipeline()
 
+    def connectSliceExtraction(self):
+        '''Connects the slice extraction to the images
+
+        The slices are extracted from the slab projections of the images if enabled.
+        Sinograms of the image are read from the sinogram cache if it is set and ready.
+        If the second image is not sampled like the first, it is resampled on the grid
+        of the first, one slice at a time. The comparison of the images uses the same
+        inputs as the slice extraction.
+        '''
+        self._sinogram_cache_in_use = self.isSinogramCacheInUse()
+        for image, voi, slab in ((self.img3D, self.voi, self.slab), (self.image2, self.voi2, self.slab2)):
+            if image is None:
+                continue
+            if image is self.img3D and self._sinogram_cache_in_use:
+                # the sinogram is read from the cache, and resampled like the image
+                self.sinogramResample.SetInputDataObject(1, image)
+                voi.SetInputConnection(self.sinogramResample.GetOutputPort())
+                continue
+            if self.slab_projection is not None:
+                slab.SetInputDataObject(image)
+                slab.SetOrientation(self.sliceOrientation)
+            if image is self.image2 and self.img3D is not None and not same_sampling(self.img3D, image):
+                if self.slab_projection is None:
+                    self.resample2.SetInputDataObject(0, image)
+                else:
+                    self.resample2.SetInputConnection(0, slab.GetOutputPort())
+                self.resample2.SetInputDataObject(1, self.img3D)
+                voi.SetInputConnection(self.resample2.GetOutputPort())
+            elif self.slab_projection is None:
+                voi.SetInputData(image)
+            else:
+                voi.SetInputConnection(slab.GetOutputPort())
+        if self.img3D is not None and self.image2 is not None:
+            # the comparison is computed on the inputs of the slice extraction, for the displayed slice only
+            self.comparison.SetInputConnection(0, self.voi.GetInputConnection(0, 0))
+            self.comparison.SetInputConnection(1, self.voi2.GetInputConnection(0, 0))
+
+    def setSinogramCache(self, cache):
+        '''
+        Reads the sinograms of the image from a cilSinogramCache, once it is built.
+
+        The image must be the acquisition data in the cache, one projection per z,
+        possibly downsampled on x and y. When the slice orientation is XZ the
+        displayed sinogram is read from the cache, which is contiguous on disk,
+        and resampled on the grid of the image.
+
+        :param cache: the cache, see ImageReader.GetSinogramCache, None to stop using it.
+        :type cache: cilSinogramCache
+        '''
+        self.sinogram_cache = cache
+        if cache is not None:
+            cache.Refresh()
+        self.sinogramReader.SetSinogramCache(cache)
+        if self.img3D is not None:
+            self.connectSliceExtraction()
+            self.updatePipeline()
+
+    def getSinogramCache(self):
+        return self.sinogram_cache
+
+    def isSinogramCacheInUse(self):
+        '''Returns whether the displayed slice is read from the sinogram cache'''
+        return (self.sinogram_cache is not None and self.img3D is not None
+                and self.sliceOrientation == SLICE_ORIENTATION_XZ and self.slab_projection is None
+                and self.sinogram_cache.IsReady())
+
+    def setSlabProjection(self, projection='max', thickness=None):
+        '''
+        Displays the projection of a slab of slices centred on the active slice,
+        instead of the active slice.
+
+        :param projection: 'max', 'min' or 'mean' for the maximum, minimum or mean
+            intensity projection, None to display single slices.
+        :type projection: str
+        :param thickness: Number of slices in the slab. If None the current value is kept.
+        :type thickness: int
+        '''
+        if projection is not None:
+            self.slab.SetProjection(projection)
+            self.slab2.SetProjection(projection)
+        if thickness is not None:
+            self.slab.SetThickness(thickness)
+            self.updateSlab2Thickness()
+        self.slab_projection = projection
+        self.connectSliceExtraction()
+        if self.img3D is not None:
+            self.updatePipeline()
+
+    def getSlabProjection(self):
+        '''Returns the slab projection displayed, None if single slices are displayed'''
+        return self.slab_projection
+
+    def setSlabThickness(self, thickness):
+        '''
+        Sets the number of slices in the slab projection.
+
+        :param thickness: Number of slices in the slab.
+        :type thickness: int
+        '''
+        self.slab.SetThickness(thickness)
+        self.updateSlab2Thickness()
+        if self.img3D is not None and self.slab_projection is not None:
+            self.updatePipeline()
+
+    def getSlabThickness(self):
+        return self.slab.GetThickness()
+
+    def updateSlab2Thickness(self):
+        '''
+        Sets the thickness of the slab of the second image, so that it covers the same depth as the slab of
+        the image when the second image is sampled differently along the slice orientation.
+        '''
+        thickness = self.slab.GetThickness()
+        if self.img3D is not None and self.image2 is not None:
+            orientation = self.sliceOrientation
+            ratio = self.img3D.GetSpacing()[orientation] / self.image2.GetSpacing()[orientation]
+            thickness = max(1, int(round(thickness * ratio)))
+        self.slab2.SetThickness(thickness)
+
     def setVisualisationToImageWithOverlay(self):
         self.setVisualisationPipelineMethodTo(CILViewer2D.IMAGE_WITH_OVERLAY)
 
     def setVisualisationToRectilinearWipe(self):
         self.setVisualisationPipelineMethodTo(CILViewer2D.RECTILINEAR_WIPE)
 
+    def setVisualisationToImageComparison(self):
+        '''Displays the comparison of the image and the second image, see setComparisonOperation'''
+        if self.image2 is None:
+            raise ValueError("The second image must be set to compare the images.")
+        self.setVisualisationPipelineMethodTo(CILViewer2D.IMAGE_COMPARISON)
+
+    def setComparisonOperation(self, operation, threshold=None):
+        '''
+        Sets how the images are compared in the comparison visualisation.
+
+        :param operation: 'difference' (image - image2), 'absolute_difference', 'ratio'
+            (image / image2) or 'threshold' (1 where the absolute difference is above threshold).
+        :type operation: str
+        :param threshold: Absolute difference above which voxels are shown by the 'threshold'
+            operation. If None the current value is kept.
+        :type threshold: float
+        '''
+        self.comparison.SetOperation(operation)
+        if threshold is not None:
+            self.comparison.SetThreshold(threshold)
+        if self.img3D is not None and self.vis_mode == CILViewer2D.IMAGE_COMPARISON:
+            self.updatePipeline()
+            self.autoWindowLevelComparison()
+
+    def getComparisonOperation(self):
+        return self.comparison.GetOperation()
+
+    def getComparisonStatistics(self):
+        '''Returns the statistics of the comparison on the displayed slice, see cilImageComparison.GetStatistics'''
+        return self.comparison.GetStatistics(self.comparisonVOI.GetVOI())
+
+    def autoWindowLevelComparison(self):
+        '''Sets the window and level of the comparison from the distribution of its values on the displayed slice
+
+        The difference is displayed symmetrically around 0, the other operations
+        between the 1st and 99th percentiles.
+        '''
+        stats = self.getComparisonStatistics()
+        if stats is None:
+            return
+        lower, upper = stats['percentiles']
+        if self.getComparisonOperation() == 'threshold':
+            lower, upper = 0, 1
+        elif self.getComparisonOperation() == 'difference':
+            upper = max(abs(lower), abs(upper))
+            lower = -upper
+        window, level = self.getSliceWindowLevelFromRange(lower, upper)
+        self.comparisonActor.GetProperty().SetColorWindow(max(window, 1e-6))
+        self.comparisonActor.GetProperty().SetColorLevel(level)
+        self.renWin.Render()
+
     def installPipeline(self):
         if self.vis_mode == CILViewer2D.IMAGE_WITH_OVERLAY:
             if self.img3D is not None:
@@ -1395,6 +1651,8 @@ class CILViewer2D(CILViewerBase):
                 self.installPipeline2()
         elif self.vis_mode == CILViewer2D.RECTILINEAR_WIPE:
             self.installRectilinearWipePipeline()
+        elif self.vis_mode == CILViewer2D.IMAGE_COMPARISON:
+            self.installImageComparisonPipeline()
 
         if self.getSliderWidgetEnabled():
             self.installSliceSliderWidgetPipeline()
@@ -1421,6 +1679,9 @@ class CILViewer2D(CILViewerBase):
                 self.installImageWithOverlayPipeline2()
             elif self.vis_mode == CILViewer2D.RECTILINEAR_WIPE:
                 pass
+            elif self.vis_mode == CILViewer2D.IMAGE_COMPARISON:
+                self.connectSliceExtraction()
+                self.updatePipeline()
         else:
             self.log("installPipeline2 no data")
 
@@ -1429,7 +1690,7 @@ class CILViewer2D(CILViewerBase):
         self.log("installPipeline")
         self.ren.AddViewProp(self.cornerAnnotation)
 
-        self.voi.SetInputData(self.img3D)
+        self.connectSliceExtraction()
         #select one slice in Z
         extent = [i for i in self.img3D.GetExtent()]
         for i in range(len(self.slicenos)):
@@ -1473,7 +1734,7 @@ class CILViewer2D(CILViewerBase):
         if self.image2 is not None:
             # render image2
             self.voi2.SetVOI(self.voi.GetVOI())
-            self.voi2.SetInputData(self.image2)
+            self.connectSliceExtraction()
             self.voi2.Update()
             lut = vtk.vtkLookupTable()
 
@@ -1521,6 +1782,7 @@ class CILViewer2D(CILViewerBase):
         extent1[orient + 1] = active_slice_num
         extent2 = extent1[:]
 
+        self.connectSliceExtraction()
         self.voi.SetVOI(*extent1)
         self.voi2.SetVOI(*extent2)
 
@@ -1549,6 +1811,20 @@ class CILViewer2D(CILViewerBase):
 
         self.AddActor(wipeSlice, WIPE_ACTOR)
 
+    def installImageComparisonPipeline(self):
+        '''Create the pipeline comparing the displayed slice of the 2 images'''
+        self.log("installImageComparisonPipeline")
+        self.ren.AddViewProp(self.cornerAnnotation)
+        extent = list(self.img3D.GetExtent())
+        for i in range(len(self.slicenos)):
+            self.slicenos[i] = round((extent[i * 2 + 1] + extent[i * 2]) / 2)
+
+        self.connectSliceExtraction()
+        self.updateImageComparisonPipeline()
+        self.autoWindowLevelComparison()
+
+        self.AddActor(self.comparisonActor, COMPARISON_ACTOR)
+
     def installSliceSliderWidgetPipeline(self):
         '''Create the pipeline for the slice slider widget
         
@@ -1937,6 +2213,8 @@ class CILViewer2D(CILViewerBase):
             self.removeActor([SLICE_ACTOR, HISTOGRAM_ACTOR])
         elif self.vis_mode == CILViewer2D.RECTILINEAR_WIPE:
             self.removeActor(WIPE_ACTOR)
+        elif self.vis_mode == CILViewer2D.IMAGE_COMPARISON:
+            self.removeActor(COMPARISON_ACTOR)
 
     def removeActor(self, actor):
         '''remove named actor'''
@@ -1951,8 +2229,8 @@ class CILViewer2D(CILViewerBase):
     def uninstallPipeline2(self):
         if self.vis_mode == CILViewer2D.IMAGE_WITH_OVERLAY:
             self.removeActor(OVERLAY_ACTOR)
-        elif self.vis_mode == CILViewer2D.RECTILINEAR_WIPE:
-            # rectilinear wipe visualises 2 images in the same pipeline
+        elif self.vis_mode in [CILViewer2D.RECTILINEAR_WIPE, CILViewer2D.IMAGE_COMPARISON]:
+            # rectilinear wipe and comparison visualise 2 images in the same pipeline
             pass
 
     def reset(self):
@@ -2,6 +2,8 @@ import vtk
 from ccpi.viewer import (ALT_KEY, CONTROL_KEY, CROSSHAIR_ACTOR, CURSOR_ACTOR, HELP_ACTOR, HISTOGRAM_ACTOR,
                          LINEPLOT_ACTOR, OVERLAY_ACTOR, SHIFT_KEY, SLICE_ACTOR, SLICE_ORIENTATION_XY,
                          SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ)
+from ccpi.viewer.utils.dataset_context import cilDatasetContext
+from ccpi.viewer.utils.memory import cilMemoryManager
 from ccpi.viewer.utils.io import SaveRenderToPNG
 import logging
 
@@ -78,6 +80,8 @@ class CILViewerBase():
 
         # img 3D as slice
         self.img3D = None
+        # statistics, gradient etc. of img3D, shared with the other viewers of the same image
+        self.dataset_context = None
         self.slicenos = [0, 0, 0]
         self.sliceOrientation = SLICE_ORIENTATION_XY
 
@@ -182,6 +186,74 @@ class CILViewerBase():
     def setInput3DData(self, imageData):
         raise NotImplementedError("Implemented in the subclasses.")
 
+    def swapInputData(self, imageData):
+        '''
+        Displays the values of imageData, which must have the same extent as the displayed image,
+        updating the current pipeline instead of installing a new one, e.g. to play a time series.
+
+        The scalars of the image set with setInputData are replaced by those of imageData.
+        '''
+        if self.img3D is None:
+            raise ValueError("The input data must be set before swapping it.")
+        if imageData.GetExtent() != self.img3D.GetExtent():
+            raise ValueError("Expected an image with extent {}, got {}".format(self.img3D.GetExtent(),
+                                                                               imageData.GetExtent()))
+        self.img3D.GetPointData().SetScalars(imageData.GetPointData().GetScalars())
+        self.img3D.Modified()
+        self.updatePipeline()
+
+    def setDatasetContext(self, context):
+        '''
+        Sets the cilDatasetContext holding the statistics and other products of the image,
+        which can be shared with other viewers. The viewer is unregistered from its previous context.
+        '''
+        if context is self.dataset_context:
+            return
+        if self.dataset_context is not None:
+            self.dataset_context.UnRegister(self)
+        self.dataset_context = context
+        if context is not None:
+            context.Register(self)
+
+    def getDatasetContext(self):
+        '''
+        Returns the cilDatasetContext of the displayed image, or None if the viewer
+        has no context for the displayed image.
+        '''
+        context = self.dataset_context
+        if context is None or self.img3D is None or context.GetImage() is not self.img3D:
+            return None
+        return context
+
+    def getMemoryUsage(self):
+        '''
+        Returns the number of bytes of the buffers registered with the cilMemoryManager by the viewer,
+        and by the context of the displayed image, i.e. the image and its cached products,
+        which are shared with the other viewers of the image.
+        '''
+        manager = cilMemoryManager.GetInstance()
+        buffers = manager.GetBuffers(self)
+        context = self.getDatasetContext()
+        if context is not None:
+            buffers += manager.GetBuffers(context)
+        return sum(buffer['size'] for buffer in buffers)
+
+    def _acquireDatasetContext(self, imageData):
+        '''Uses the context of imageData, shared by all the viewers displaying it.'''
+        if imageData is None:
+            self.setDatasetContext(None)
+        else:
+            self.setDatasetContext(cilDatasetContext.GetContext(imageData))
+
+    def getDatasetProducts(self):
+        '''
+        Returns the products of the image the viewer computes when the image is set as its input,
+        as a list of (percentiles, method) of the ranges of values it maps, for
+        cilDatasetContext.Precompute to compute them beforehand.
+        '''
+        # the slice window/level is set to the 5th and 95th percentiles of the volume
+        return [((5., 95.), 'scalar')]
+
     def getImageHistogramStatistics(self, method, slice=False):
         '''
         returns histogram statistics for either the image
@@ -189,6 +261,10 @@ class CILViewerBase():
         if slice = True, calculates for the slice instead of
         the entire image volume.
         '''
+        context = self.getDatasetContext()
+        if not slice and context is not None:
+            return context.GetHistogramStatistics(method)
+
         ia = vtk.vtkImageHistogramStatistics()
 
         if slice:
@@ -213,6 +289,11 @@ class CILViewerBase():
         the image or image gradient (depending on method) for which
         the colormap or opacity are displayed.
         '''
+        context = self.getDatasetContext()
+        if context is not None:
+            # the statistics are computed once for all the viewers of the image
+            return context.GetMapRange(percentiles, method)
+
         ia = self.getImageHistogramStatistics(method)
         ia.SetAutoRangePercentiles(*percentiles)
         ia.Update()
@@ -231,6 +312,9 @@ class CILViewerBase():
             'scalar' - returns full range of values in the 3D image
             'gradient' - returns full range of values in 3D image's gradient
         '''
+        context = self.getDatasetContext()
+        if context is not None:
+            return context.GetWholeRange(method)
 
         ia = self.getImageHistogramStatistics(method)
 
@@ -422,4 +506,4 @@ class CILViewerBase():
         om = self.orientation_marker.GetOrientationMarker()
         om.SetXAxisLabelText(labels[0])
         om.SetYAxisLabelText(labels[1])
-        om.SetZAxisLabelText(labels[2])
\ No newline at end of file
+        om.SetZAxisLabelText(labels[2])
@@ -4,6 +4,7 @@ from ccpi.viewer.utils.settings_tooltips import TOOLTIPS_3D_TOOLBAR
 from ccpi.viewer.ui.SettingsDialog import SettingsDialog
 from ccpi.viewer.ui.VolumeRenderSettingsDialog import VolumeRenderSettingsDialog
 from ccpi.viewer.ui.CaptureRenderDialog import CaptureRenderDialog
+from ccpi.viewer.utils.memory import make_weak_callback
 
 
 class QCILViewer3DToolBar(QtWidgets.QToolBar):
@@ -36,6 +37,12 @@ class QCILViewer3DToolBar(QtWidgets.QToolBar):
 
         self._setUpSettingsMenu()
         self._setUpCameraMenu()
+        self._setUpIsoSurfaceSlider()
+
+        # the viewer removes the isosurface when its input changes, the controls are reset when it renders
+        self._isosurface_image = self.viewer.img3D
+        callback = make_weak_callback(self._checkIsoSurfaceInput)
+        self.viewer.getRenderWindow().AddObserver("StartEvent", lambda caller, event: callback())
 
     def _setUpSettingsMenu(self):
         """
@@ -91,6 +98,86 @@ class QCILViewer3DToolBar(QtWidgets.QToolBar):
 
         self.addWidget(camera_menu_button)
 
+    def _setUpIsoSurfaceSlider(self):
+        """
+        Configures the isosurface QCheckBox and QSlider.
+
+        The QCheckBox shows/hides the isosurface. The QSlider sets the isovalue as a
+        percentage of the image's scalar range: while it is dragged, the isosurface is
+        previewed on a downsampled image, and it is extracted at full resolution once the
+        slider is released.
+        """
+        isosurface_checkbox = QtWidgets.QCheckBox("Isosurface", parent=self)
+        isosurface_checkbox.setToolTip(TOOLTIPS_3D_TOOLBAR["isosurface_checkbox"])
+        isosurface_checkbox.toggled.connect(self.toggleIsoSurface)
+
+        isosurface_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal, parent=self)
+        isosurface_slider.setRange(0, 100)
+        isosurface_slider.setValue(50)
+        isosurface_slider.setMaximumWidth(150)
+        isosurface_slider.setEnabled(False)
+        isosurface_slider.setToolTip(TOOLTIPS_3D_TOOLBAR["isosurface_slider"])
+        isosurface_slider.valueChanged.connect(self.previewIsoSurface)
+        isosurface_slider.sliderReleased.connect(self.updateIsoSurface)
+
+        self.isosurface_checkbox = isosurface_checkbox
+        self.isosurface_slider = isosurface_slider
+
+        self.addWidget(isosurface_checkbox)
+        self.addWidget(isosurface_slider)
+
+    def resetIsoSurfaceControls(self):
+        """
+        Unchecks the isosurface QCheckBox and moves the QSlider back to the middle, without updating the viewer.
+        """
+        self.isosurface_checkbox.blockSignals(True)
+        self.isosurface_slider.blockSignals(True)
+        self.isosurface_checkbox.setChecked(False)
+        self.isosurface_slider.setValue(50)
+        self.isosurface_slider.setEnabled(False)
+        self.isosurface_checkbox.blockSignals(False)
+        self.isosurface_slider.blockSignals(False)
+
+    def _checkIsoSurfaceInput(self):
+        if self.viewer.img3D is not self._isosurface_image:
+            self._isosurface_image = self.viewer.img3D
+            self.resetIsoSurfaceControls()
+
+    def getIsoValueFromSlider(self):
+        """
+        Returns the isovalue corresponding to the position of the isosurface slider.
+        """
+        cmin, cmax = self.viewer.img3D.GetScalarRange()
+        return cmin + (cmax - cmin) * self.isosurface_slider.value() / 100
+
+    def toggleIsoSurface(self, checked):
+        """
+        Shows or hides the isosurface in the viewer.
+        """
+        self.isosurface_slider.setEnabled(checked)
+        if checked:
+            self.updateIsoSurface()
+        else:
+            self.viewer.removeIsoSurface()
+
+    def previewIsoSurface(self):
+        """
+        Displays the isosurface extracted from a downsampled image while the slider is being dragged.
+        """
+        if self.isosurface_slider.isSliderDown():
+            self.updateIsoSurface(coarse=True)
+        else:
+            # e.g. keyboard or click on the slider track
+            self.updateIsoSurface()
+
+    def updateIsoSurface(self, coarse=False):
+        """
+        Displays the isosurface at the isovalue selected with the slider.
+        """
+        if self.viewer.img3D is None or not self.isosurface_checkbox.isChecked():
+            return
+        self.viewer.setIsoSurface(self.getIsoValueFromSlider(), coarse=coarse)
+
     def openDialog(self, mode):
         """
         Creates/opens a dialog. Dialogs are stored in a dictionary, allowing their
@@ -14,8 +14,29 @@ CURSOR_ACTOR = 'cursor_actor'
 CROSSHAIR_ACTOR = 'crosshair_actor'
 LINEPLOT_ACTOR = 'lineplot_actor'
 WIPE_ACTOR = 'wipe_actor'
+COMPARISON_ACTOR = 'comparison_actor'
 
-from .CILViewer import CILViewer as viewer3D
-from .CILViewer2D import CILViewer2D as viewer2D
-from .CILViewer import CILInteractorStyle as istyle3D
-from .CILViewer2D import CILInteractorStyle as istyle2D
+# The viewers load the rendering modules of VTK, so they are imported on first access
+# rather than with the package, e.g. the resample command line tool does not need them.
+_LAZY_ATTRIBUTES = {
+    'viewer3D': ('.CILViewer', 'CILViewer'),
+    'viewer2D': ('.CILViewer2D', 'CILViewer2D'),
+    'istyle3D': ('.CILViewer', 'CILInteractorStyle'),
+    'istyle2D': ('.CILViewer2D', 'CILInteractorStyle'),
+}
+
+
+def __getattr__(name):
+    import importlib
+    if name not in _LAZY_ATTRIBUTES:
+        # the submodules, e.g. ccpi.viewer.CILViewer2D, which importing adds to the package
+        try:
+            return importlib.import_module('.' + name, __name__)
+        except ModuleNotFoundError as e:
+            if e.name != '{}.{}'.format(__name__, name):
+                raise
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    module_name, attribute = _LAZY_ATTRIBUTES[name]
+    value = getattr(importlib.import_module(module_name, __name__), attribute)
+    globals()[name] = value
+    return value
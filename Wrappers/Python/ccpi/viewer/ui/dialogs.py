@@ -1,17 +1,19 @@
 import os
 import h5py
+from eqt.threading import Worker
 from eqt.ui import FormDialog
 from eqt.ui.SessionDialogs import AppSettingsDialog, ErrorDialog
 from qtpy import QtCore, QtGui, QtWidgets
 from qtpy.QtWidgets import QCheckBox, QDoubleSpinBox, QLabel, QLineEdit, QComboBox, QPushButton
 import numpy as np
 from ccpi.viewer.utils import Converter
-from ccpi.viewer.utils.conversion import cilRawCroppedReader
+from ccpi.viewer.utils.hdf5_io import HDF5FileBrowser
+from ccpi.viewer.utils.raw_preview import cilRawPreview
 from ccpi.viewer.QCILViewerWidget import QCILViewerWidget
 from ccpi.viewer.CILViewer2D import CILViewer2D as viewer2D
 import numpy as np
 import vtk
-from functools import reduce
+from functools import partial, reduce
 import tempfile
 import logging
 
@@ -19,6 +21,7 @@ import logging
 class ViewerSettingsDialog(AppSettingsDialog):
     ''' This is a dialog window which allows the user to set:
     - maximum size to downsample images to for display
+    - the memory budget of the viewers, see cilMemoryManager
     - Whether to use GPU for volume rendering
     '''
 
@@ -40,6 +43,16 @@ class ViewerSettingsDialog(AppSettingsDialog):
 
         self.addWidget(vis_size_entry, vis_size, 'vis_size')
 
+        memory_budget = QLabel("Memory budget of the viewers (GB): ")
+        memory_budget_entry = QDoubleSpinBox()
+        memory_budget_entry.setMaximum(4096.0)
+        memory_budget_entry.setMinimum(0.0)
+        memory_budget_entry.setSingleStep(0.5)
+        # 0 is shown as no limit
+        memory_budget_entry.setSpecialValueText("No limit")
+
+        self.addWidget(memory_budget_entry, memory_budget, 'memory_budget')
+
         self.formWidget.addSeparator('adv_separator')
 
         self.formWidget.addTitle(QLabel("Advanced Settings"), 'adv_settings_title')
@@ -65,6 +78,10 @@ class RawInputDialog(FormDialog):
     - fortran ordering
 
     The dialog can let the user preview the data and verify that it is correct.
+    The preview slice is read from a memory map of the file, see cilRawPreview,
+    and is updated in the same preview window whenever the parameters change.
+    The dialog can also guess the parameters, from the size of the file and the
+    correlation of its values, and list the most likely ones to choose from.
 
     Example:
     --------
@@ -81,6 +98,7 @@ class RawInputDialog(FormDialog):
 
     def __init__(self, parent, fname):
         super(RawInputDialog, self).__init__(parent, fname)
+        self.raw_preview = cilRawPreview()
         self.setFileName(fname)
         self.setWindowFlag(QtCore.Qt.WindowContextHelpButtonHint, False)
         fw = self.formWidget
@@ -139,6 +157,25 @@ class RawInputDialog(FormDialog):
         self.preview_open = False
         previewButton.clicked.connect(self.preview)
 
+        # guessing the parameters
+        inferButton = QtWidgets.QPushButton("Guess Parameters")
+        fw.addWidget(inferButton, "", "infer_button")
+        inferButton.clicked.connect(self.inferParameters)
+        candidatesLabel = QLabel("Guesses")
+        candidatesValue = QComboBox()
+        candidatesValue.setEnabled(False)
+        fw.addWidget(candidatesValue, candidatesLabel, "candidates")
+        candidatesValue.activated.connect(self.applyCandidate)
+        self.candidates = []
+
+        self.preview_dialog = None
+        self.preview_viewer_widget = None
+        # the open preview follows the parameters
+        for name in ['dim_Width', 'dim_Height', 'dim_Images', 'preview_slice']:
+            self.getWidget(name).textChanged.connect(self.onParametersChanged)
+        for name in ['dimensionality', 'dtype', 'endianness', 'is_fortran']:
+            self.getWidget(name).currentIndexChanged.connect(self.onParametersChanged)
+
         self.setLayout(fw.uiElements['verticalLayout'])
 
         self.Cancel.clicked.connect(self.close)
@@ -146,6 +183,7 @@ class RawInputDialog(FormDialog):
     def setFileName(self, filename):
         '''Set the filename used in the dialog and the dialog title.'''
         self.fname = os.path.abspath(filename)
+        self.raw_preview.SetFileName(self.fname)
         title = "Config for " + os.path.basename(filename)
         self.setWindowTitle(title)
 
@@ -199,38 +237,18 @@ class RawInputDialog(FormDialog):
             widgets['dim_Images_field'].setEnabled(False)
 
     def preview(self):
+        '''Opens the preview of the slice set in the dialog, after checking the size of the file'''
         pars = self.getRawAttrs()
-
-        # retrieve info about image file from interface
         dimensionality = [3, 2][self.getWidget('dimensionality').currentIndex()]
-        dimX, dimY, dimZ = pars['shape']
-        isFortran = pars['is_fortran']
-        isBigEndian = pars['is_big_endian']
-        # typecode = pars['typecode']
-        typecode = self.getWidget('dtype').currentText()
-
-        shape = (dimX, dimY)
-        if dimensionality == 3:
-            shape = (dimX, dimY, dimZ)
-
-        # Construct a data type
-        dt = np.dtype(typecode)
-
-        if isBigEndian:
-            dt_txt = ">"  # big endian
-        else:
-            dt_txt = "<"
-        dt = dt.newbyteorder(dt_txt)
-
-        bytes_per_element = dt.itemsize
+        shape = pars['shape'][:dimensionality]
+        dt = np.dtype(self.getWidget('dtype').currentText())
 
         # basic sanity check
         file_size = os.stat(self.fname).st_size
 
-        expected_size = reduce(lambda x, y: x * y, shape, 1) * bytes_per_element
+        expected_size = reduce(lambda x, y: x * y, shape, 1) * dt.itemsize
 
         if file_size < expected_size:
-            errors = {"type": "size", "file_size": file_size, "expected_size": expected_size}
             dmsg = f'The file size is smaller than expected.\nThe file size is {file_size} bytes, while the expected size is {expected_size} bytes'
             # open a critical dialog
             msg = QtWidgets.QMessageBox.critical(self, "Error", dmsg, QtWidgets.QMessageBox.Ok,
@@ -243,57 +261,113 @@ class RawInputDialog(FormDialog):
             msg = QtWidgets.QMessageBox.warning(self, "Warning", dmsg, QtWidgets.QMessageBox.Ok,
                                                 QtWidgets.QMessageBox.Ok)
 
-        # read centre slice
-        offset = 0
-        slice_size = -1
-        if dimensionality == 3:
-            # read the slice indicated by the user
-            slice_size = shape[1] * shape[0]
-            offset = pars['preview_slice'] * slice_size
-
-        # use the cilRawCroppedReader to read the slice
-        reader2 = cilRawCroppedReader()
-        reader2.SetFileName(self.fname)
-        reader2.SetTargetZExtent((pars['preview_slice'], pars['preview_slice']))
-        reader2.SetBigEndian(isBigEndian)
-        reader2.SetIsFortran(isFortran)
-        reader2.SetTypeCodeName(dt.name)
-        reader2.SetStoredArrayShape(shape)
-        reader2.Update()
+        if self.preview_dialog is None:
+            self.createPreviewDialog()
+        self.updatePreview()
+        # the dialog is not modal, so that the parameters can be changed while it is open
+        self.preview_dialog.show()
+        self.preview_dialog.raise_()
+        self.preview_open = True
 
+    def createPreviewDialog(self):
+        '''Creates the preview window, with a viewer whose input is replaced by updatePreview'''
         diag = QtWidgets.QDialog(parent=self)
-        diag.setModal(True)
-        if dimensionality == 3:
-            if pars['is_fortran'] is True:
-                slicing = 'image'
-            else:
-                slicing = 'width'
-            diag.setWindowTitle(f"Preview: {slicing} = {pars['preview_slice']}")
-        else:
-            diag.setWindowTitle(f'Preview Image')
         diag.setWindowFlag(QtCore.Qt.WindowContextHelpButtonHint, False)
         diag.setWindowFlag(QtCore.Qt.WindowMaximizeButtonHint)
         # add a layout
         verticalLayout = QtWidgets.QVBoxLayout(diag)
         verticalLayout.setContentsMargins(10, 10, 10, 10)
 
-        # add a CILViewer widget
+        # add a label for the parameters which do not describe the file, and a CILViewer widget
+        status = QLabel()
+        status.setWordWrap(True)
         sc = QCILViewerWidget(diag, viewer=viewer2D, enableSliderWidget=False)
-        sc.viewer.setInputData(reader2.GetOutput())
-
-        # add it to the layout of the dialog
+        verticalLayout.addWidget(status)
         verticalLayout.addWidget(sc)
-        # add the layout to the dialog
         diag.setLayout(verticalLayout)
+        diag.finished.connect(self.onPreviewClosed)
 
         # save the dialog and canvas so that it doesn't crash
         self.preview_dialog = diag
-        self.preview_mpl_canvas = sc
+        self.preview_status_label = status
+        self.preview_viewer_widget = sc
+
+    def updatePreview(self):
+        '''
+        Decodes the preview slice with the current parameters and shows it in the preview window.
+
+        Returns
+        -------
+        bool
+            whether the slice could be read with the current parameters, otherwise the reason is
+            shown in the preview window and the last slice read is kept.
+        '''
+        if self.preview_dialog is None:
+            self.createPreviewDialog()
+        try:
+            pars = self.getRawAttrs()
+            dimensionality = [3, 2][self.getWidget('dimensionality').currentIndex()]
+            self.raw_preview.SetStoredArrayShape(pars['shape'][:dimensionality])
+            self.raw_preview.SetTypeCodeName(pars['typecode'])
+            self.raw_preview.SetBigEndian(pars['is_big_endian'])
+            self.raw_preview.SetIsFortran(pars['is_fortran'])
+            preview_slice = pars['preview_slice'] if dimensionality == 3 else 0
+            image = self.raw_preview.GetSliceImage(preview_slice)
+        except (ValueError, IndexError) as err:
+            self.preview_status_label.setText(str(err))
+            self.preview_status_label.setVisible(True)
+            return False
+        self.preview_status_label.setVisible(False)
+        self.preview_viewer_widget.viewer.setInputData(image)
+        if dimensionality == 3:
+            slicing = 'image' if pars['is_fortran'] else 'width'
+            self.preview_dialog.setWindowTitle(f"Preview: {slicing} = {preview_slice}")
+        else:
+            self.preview_dialog.setWindowTitle('Preview Image')
+        return True
 
-        # the dialog must delete the temp file when it is closed
-        # diag.finished.connect(lambda: os.remove(rawfname))
-        # finally open the dialog
-        diag.open()
+    def onParametersChanged(self):
+        '''Updates the preview, if it is open, when a parameter is changed'''
+        if self.preview_open:
+            self.updatePreview()
+
+    def onPreviewClosed(self):
+        self.preview_open = False
+
+    def inferParameters(self):
+        '''
+        Ranks the parameters which could describe the file, see cilRawPreview.InferParameters,
+        lists them in the 'candidates' combobox and applies the most likely one.
+        Only the data types supported by the dialog are considered.
+        '''
+        supported = [np.dtype(dt).name for dt in self.supported_types]
+        self.candidates = self.raw_preview.InferParameters(typecodes=supported)
+        candidates_widget = self.getWidget('candidates')
+        candidates_widget.clear()
+        for candidate in self.candidates:
+            ordering = '' if np.dtype(candidate['typecode']).itemsize == 1 else \
+                [' little endian', ' big endian'][candidate['is_big_endian']]
+            candidates_widget.addItem('{} {}{} (score {:.2f})'.format('x'.join(str(dim) for dim in candidate['shape']),
+                                                                      candidate['typecode'], ordering,
+                                                                      candidate['score']))
+        candidates_widget.setEnabled(len(self.candidates) > 0)
+        if len(self.candidates) > 0:
+            self.applyCandidate(0)
+
+    def applyCandidate(self, index):
+        '''Sets the parameters of the dialog to those of a candidate listed by inferParameters'''
+        candidate = self.candidates[index]
+        shape = candidate['shape']
+        self.getWidget('dimensionality').setCurrentIndex(0 if len(shape) == 3 else 1)
+        self.getWidget('dim_Width').setText(str(shape[0]))
+        self.getWidget('dim_Height').setText(str(shape[1]))
+        if len(shape) == 3:
+            self.getWidget('dim_Images').setText(str(shape[2]))
+            self.getWidget('preview_slice').setText(str(shape[2] // 2))
+        self.getWidget('dtype').setCurrentText(candidate['typecode'])
+        self.getWidget('endianness').setCurrentIndex(0 if candidate['is_big_endian'] else 1)
+        self.getWidget('is_fortran').setCurrentIndex(0 if candidate['is_fortran'] else 1)
+        self.getWidget('candidates').setCurrentIndex(index)
 
 
 class SaveableRawInputDialog(RawInputDialog):
@@ -438,14 +512,183 @@ class SaveableRawInputDialog(RawInputDialog):
             print("Settings not found")
 
 
+class HDF5TreeModel(QtGui.QStandardItemModel):
+    '''
+    Model of the contents of a HDF5 file for a QTreeView, with the members of a group,
+    or the attributes of a dataset, as its children.
+
+    The contents are listed lazily, with a HDF5FileBrowser, in a worker thread:
+    the children of an item are listed when it is expanded, a page at a time. When an item has more
+    children than a page, the last row of its children is a 'more' row, which lists the next page
+    with loadMore.
+
+    The model shows the contents of one group or dataset at a time, set with setRootPath,
+    or the datasets whose path matches a pattern, set with setSearchPattern.
+
+    Parameters
+    ----------
+    file_name : str
+        The name of the HDF5 file.
+    page_size : int, default 200
+        The number of children listed at a time.
+    '''
+
+    PathRole = QtCore.Qt.UserRole + 1
+    KindRole = QtCore.Qt.UserRole + 2
+    NumberOfChildrenRole = QtCore.Qt.UserRole + 3
+    NumberListedRole = QtCore.Qt.UserRole + 4
+
+    def __init__(self, file_name, page_size=200, parent=None):
+        super(HDF5TreeModel, self).__init__(parent)
+        self.browser = HDF5FileBrowser(file_name)
+        self.page_size = page_size
+        self.threadpool = QtCore.QThreadPool()
+        self._root_path = None
+        self._search_pattern = None
+        # the items of the groups and datasets, by path
+        self._items = {}
+        self._listing = set()
+        # the results of the workers started before the model was reset are ignored
+        self._generation = 0
+
+    def getRootPath(self):
+        return self._root_path
+
+    def getSearchPattern(self):
+        return self._search_pattern
+
+    def setRootPath(self, path):
+        '''Shows the members of the group, or the attributes of the dataset, at path'''
+        self._reset(path, None)
+
+    def setSearchPattern(self, pattern):
+        '''Shows the datasets whose path matches pattern, see HDF5FileBrowser.Search.
+        The paths are indexed in a worker thread the first time.'''
+        self._reset(None, pattern)
+
+    def _reset(self, path, pattern):
+        self._generation += 1
+        self.clear()
+        self.setHorizontalHeaderLabels(['Name', 'Contents'])
+        self._root_path = path
+        self._search_pattern = pattern
+        root = self.invisibleRootItem()
+        # the root of the search results has no path, None is not stored as it is not a QVariant
+        root.setData(path or '', self.PathRole)
+        root.setData('search' if pattern is not None else 'group', self.KindRole)
+        root.setData(0, self.NumberOfChildrenRole)
+        root.setData(0, self.NumberListedRole)
+        self._items = {path or '': root}
+        self._listing = set()
+        self.listNextPage(root)
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        item = self._getItem(parent)
+        if item is not None and item.data(self.KindRole) in ('group', 'dataset') and parent.isValid():
+            return bool(item.data(self.NumberOfChildrenRole)) or item.rowCount() > 0
+        return super(HDF5TreeModel, self).hasChildren(parent)
+
+    def canFetchMore(self, parent):
+        item = self._getItem(parent)
+        if item is None or not parent.isValid() or item.data(self.KindRole) not in ('group', 'dataset'):
+            return False
+        # the first page is listed when the item is expanded, the next ones with the 'more' row
+        return bool(item.data(self.NumberOfChildrenRole)) and not item.data(self.NumberListedRole) \
+            and item.data(self.PathRole) not in self._listing
+
+    def fetchMore(self, parent):
+        item = self._getItem(parent)
+        if item is not None:
+            self.listNextPage(item)
+
+    def loadMore(self, index):
+        '''Lists the next page of children of the parent of the 'more' row at index'''
+        item = self._getItem(index)
+        if item is not None and item.data(self.KindRole) == 'more':
+            parent = item.parent() or self.invisibleRootItem()
+            self.listNextPage(parent)
+
+    def isListing(self):
+        '''Whether some children are being listed'''
+        return len(self._listing) > 0
+
+    def listNextPage(self, item):
+        '''Lists the next page of children of the item in a worker thread'''
+        path = item.data(self.PathRole)
+        if path in self._listing:
+            return
+        self._listing.add(path)
+        start = item.data(self.NumberListedRole) or 0
+        worker = Worker(self._listPage, path, start, self._search_pattern)
+        worker.signals.result.connect(partial(self._addPage, self._generation, path, start))
+        worker.signals.error.connect(partial(self._onListingError, self._generation, path))
+        self.threadpool.start(worker)
+
+    def _listPage(self, path, start, pattern, **kwargs):
+        if pattern is not None:
+            return self.browser.Search(pattern, start, self.page_size)
+        return self.browser.ListChildren(path, start, self.page_size)
+
+    def _addPage(self, generation, path, start, result):
+        if generation != self._generation:
+            return
+        self._listing.discard(path)
+        item = self._items.get(path)
+        if item is None:
+            return
+        total, children = result
+        # remove the 'more' row
+        if item.rowCount() > 0 and item.child(item.rowCount() - 1).data(self.KindRole) == 'more':
+            item.removeRow(item.rowCount() - 1)
+        for name, child_path, kind, description, number_of_children in children:
+            name_item = self._createItem(name)
+            name_item.setData(child_path, self.PathRole)
+            name_item.setData(kind, self.KindRole)
+            name_item.setData(number_of_children or 0, self.NumberOfChildrenRole)
+            name_item.setData(0, self.NumberListedRole)
+            contents_item = self._createItem(description)
+            contents_item.setToolTip(description)
+            if kind in ('group', 'dataset'):
+                self._items[child_path] = name_item
+            item.appendRow([name_item, contents_item])
+        listed = start + len(children)
+        item.setData(total, self.NumberOfChildrenRole)
+        item.setData(listed, self.NumberListedRole)
+        if listed < total:
+            more_item = self._createItem("Show {} more of {}...".format(min(self.page_size, total - listed),
+                                                                        total - listed))
+            more_item.setData(path, self.PathRole)
+            more_item.setData('more', self.KindRole)
+            item.appendRow([more_item, self._createItem("")])
+
+    def _onListingError(self, generation, path, error):
+        if generation != self._generation:
+            return
+        self._listing.discard(path)
+        logging.error("Could not list {} in {}: {}".format(path, self.browser.GetFileName(), error[1]))
+
+    def _createItem(self, text):
+        item = QtGui.QStandardItem(str(text))
+        item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
+        return item
+
+    def _getItem(self, index):
+        if not index.isValid():
+            return self.invisibleRootItem()
+        if index.column() != 0:
+            index = index.sibling(index.row(), 0)
+        return self.itemFromIndex(index)
+
+
 class HDF5InputDialog(FormDialog):
     '''
     This is a dialog window which allows the user to set:
     - the dataset name
     - whether the Z axis should be downsampled (should not be done for acquisition data)
     
-    For selecting the dataset name, this dialog uses a table widget to display the
-    contents of the HDF5 file.
+    For selecting the dataset name, this dialog uses a tree view to display the
+    contents of the HDF5 file, see HDF5TreeModel, and a search box to find datasets
+    by their path.
 
     Parameters
     ----------
@@ -468,8 +711,9 @@ class HDF5InputDialog(FormDialog):
 
         # set the focus on the Browse button
         push_button.setDefault(True)
-        # create table widget
-        tw = self.createTableWidget()
+        # create tree view of the contents of the file
+        tw = self.createTreeView()
+        search_line_edit = self.createSearchLineEdit()
 
         dataset_selector_widget = QtWidgets.QWidget()
 
@@ -478,6 +722,7 @@ class HDF5InputDialog(FormDialog):
         # add Widgets to layout
         vl.addLayout(hl)
         vl.addWidget(push_button)
+        vl.addWidget(search_line_edit)
         vl.addWidget(tw)
 
         dataset_selector_widget.setLayout(vl)
@@ -486,7 +731,8 @@ class HDF5InputDialog(FormDialog):
 
         fw.addSpanningWidget(dataset_selector_widget, 'dataset_selector_widget')
 
-        self.tableWidget = tw
+        self.treeView = tw
+        self.search_line_edit = search_line_edit
         self.push_button = push_button
         self.line_edit = line_edit
 
@@ -566,16 +812,44 @@ class HDF5InputDialog(FormDialog):
 
         return self.hdf5_attrs
 
-    def createTableWidget(self):
+    def createTreeView(self):
         '''
-        Create a table widget to display the contents of the HDF5 file.
+        Create a tree view to display the contents of the HDF5 file, listed lazily by a HDF5TreeModel.
         '''
-        tableWidget = QtWidgets.QTableWidget()
-        tableWidget.itemDoubleClicked.connect(self.fillLineEditWithDoubleClickedTableItem)
-        tableWidget.setColumnWidth(1, 40)
-        header = tableWidget.horizontalHeader()
+        self.tree_model = HDF5TreeModel(self.file_name, parent=self)
+        treeView = QtWidgets.QTreeView()
+        treeView.setModel(self.tree_model)
+        treeView.setUniformRowHeights(True)
+        treeView.doubleClicked.connect(self.onTreeItemDoubleClicked)
+        header = treeView.header()
         header.setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
-        return tableWidget
+        return treeView
+
+    def createSearchLineEdit(self):
+        '''
+        Create a line edit to search the datasets by their path.
+        The search starts when the user stops typing.
+        '''
+        le = QtWidgets.QLineEdit(self)
+        le.setPlaceholderText("Search datasets, e.g. data or */data/*")
+        le.setClearButtonEnabled(True)
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(300)
+        self.search_timer.timeout.connect(self.searchDatasets)
+        le.textChanged.connect(self.search_timer.start)
+        return le
+
+    def searchDatasets(self):
+        '''
+        Shows the datasets whose path matches the text of the search box,
+        or the current group if the search box is empty.
+        '''
+        pattern = self.search_line_edit.text().strip()
+        if pattern:
+            self.tree_model.setSearchPattern(pattern)
+        else:
+            self.tree_model.setRootPath(self.current_group)
 
     def createLineEditForDatasetName(self):
         '''
@@ -606,89 +880,75 @@ class HDF5InputDialog(FormDialog):
         '''
         self.widgets['dataset_name_field'].setText(text)
 
+    def onTreeItemDoubleClicked(self, index):
+        '''
+        This method is called when an item of the tree view is double clicked.
+        If the item is a group or a dataset, it will fill the line edit with its path,
+        and then show the contents of the group, or the attributes of the dataset.
+        If the item is the last row of a long list, it will list the next items.
+        '''
+        item = self.tree_model.itemFromIndex(index.sibling(index.row(), 0))
+        kind = item.data(HDF5TreeModel.KindRole)
+        if kind == 'more':
+            self.tree_model.loadMore(index)
+        elif kind in ('group', 'dataset'):
+            new_path = item.data(HDF5TreeModel.PathRole)
+            self.line_edit.setText(new_path)
+            self.current_group = new_path
+            self.descendHDF5AndFillTable()
+
+    @property
+    def tableWidget(self):
+        '''
+        The view of the contents of the HDF5 file, which was a table before the tree view.
+        Kept for compatibility, use treeView instead.
+        '''
+        return self.treeView
+
     def fillLineEditWithDoubleClickedTableItem(self, item):
         '''
-        This method is called when a table item is double clicked.
-        It will fill the line edit with the path to the selected item.
-        It will then descend into the selected item and fill the table with
-        the contents of the selected item.
+        Kept for compatibility with the table of the previous versions, calls onTreeItemDoubleClicked
+        for the item of the tree model.
         '''
-        row = item.row()
-        fsitem = self.tableWidget.item(row, 0)
-        new_group = fsitem.text()
-        current_group = self.line_edit.text()
-        with h5py.File(self.file_name, 'r') as f:
-            # Try to use the current group entered in the line edit
-            # if it does not exist, use the current group saved to memory,
-            # which was the last group that was successfully opened.
-            try:
-                f[current_group]
-            except KeyError:
-                current_group = self.current_group
-
-            new_path = current_group + "/" + fsitem.text()
-
-            if new_group in f[current_group]:
-                self.line_edit.setText(new_path)
-                self.current_group = new_path
-                self.descendHDF5AndFillTable()
-            else:
-                error_dialog = ErrorDialog(
-                    self, "Error", "The selected item could not be opened.",
-                    f"{new_path} either does not exist, or is not a group or dataset, so can't be opened.")
-                error_dialog.open()
+        self.onTreeItemDoubleClicked(item.index())
+
+    def loadIntoTableWidget(self, data):
+        '''
+        Kept for compatibility with the table of the previous versions: shows the rows of data,
+        the names and the contents of the members of the current group, instead of the contents listed by the
+        tree model. Double clicking a row descends into the member.
+        '''
+        if len(data) <= 0:
+            return
+        self.tree_model.clear()
+        self.tree_model.setHorizontalHeaderLabels(['Name', 'Contents'])
+        for name, contents in data:
+            name_item = self.tree_model._createItem(name)
+            name_item.setData(self.current_group.rstrip('/') + '/' + str(name), HDF5TreeModel.PathRole)
+            name_item.setData('group', HDF5TreeModel.KindRole)
+            contents_item = self.tree_model._createItem(contents)
+            contents_item.setToolTip(str(contents))
+            self.tree_model.appendRow([name_item, contents_item])
 
     def descendHDF5AndFillTable(self):
         '''
-        This descends into the HDF5 file and fills the table with the contents
-        of the group.
+        This descends into the HDF5 file and shows the contents of the group,
+        or the attributes of the dataset, entered in the line edit.
+        The contents are listed in a worker thread, see HDF5TreeModel.
         '''
-        # set OverrideCursor to WaitCursor
-        QtGui.QGuiApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
         group = self.line_edit.text()
 
         with h5py.File(self.file_name, 'r') as f:
-            try:
-                obj = f[group]
-            except:
+            if group not in f:
                 error_dialog = ErrorDialog(self, "Error", "Could not open group: " + group)
                 error_dialog.open()
-                QtGui.QGuiApplication.restoreOverrideCursor()
                 return
 
-            list_of_items = []
-
-            if type(obj) in [h5py._hl.group.Group, h5py._hl.files.File]:
-                for key in obj.keys():
-                    list_of_items.append((key, str(obj[key])))
-            elif isinstance(obj, h5py._hl.dataset.Dataset):
-                for key in obj.attrs.keys():
-                    list_of_items.append((key, obj.attrs[key]))
-
-        self.loadIntoTableWidget(list_of_items)
-        # restore OverrideCursor
-        QtGui.QGuiApplication.restoreOverrideCursor()
-
-    def loadIntoTableWidget(self, data):
-        '''
-        This loads the data into the table widget.
-        '''
-        if len(data) <= 0:
-            return
-        self.tableWidget.setRowCount(len(data))
-        self.tableWidget.setColumnCount(len(data[0]))
-        for i, v in enumerate(data):
-            for j, w in enumerate(v):
-                item = QtWidgets.QTableWidgetItem(str(w))
-                item.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
-                if j == 1:
-                    item.setToolTip(str(w))
-                self.tableWidget.setItem(i, j, item)
-
-        self.tableWidget.setHorizontalHeaderLabels(['Name', 'Contents'])
-
-        self.tableWidget.sortItems(1, order=QtCore.Qt.AscendingOrder)
-        self.tableWidget.resizeColumnsToContents()
+        self.current_group = group
+        self.search_line_edit.blockSignals(True)
+        self.search_line_edit.clear()
+        self.search_line_edit.blockSignals(False)
+        self.tree_model.setRootPath(group)
 
     def goToParentGroup(self):
         '''
@@ -1,23 +1,10 @@
-from vtk.util import colors
-
-try:
-    import matplotlib.pyplot as plt
-except ImportError:
-    # Add optional overload to allow plt.colormaps to be called without matplotlib
-    from ccpi.viewer.utils import CILColorMaps
-
-    class BackupColorMaps:
-
-        @staticmethod
-        def colormaps():
-            return ["viridis", "plasma", "inferno", "magma"]
-
-    plt = BackupColorMaps()
+from ccpi.viewer.utils.colormaps import CILColorMaps
+from vtkmodules.util import colors
 
 
 def color_scheme_list():
     """Return a list of color schemes for the color scheme dropdown menu."""
-    initial_list = plt.colormaps()
+    initial_list = CILColorMaps.get_color_map_names()
     initial_list.insert(0, initial_list.pop(initial_list.index("viridis")))
     return initial_list
 
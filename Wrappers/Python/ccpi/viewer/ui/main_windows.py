@@ -1,5 +1,7 @@
 import os
 import sys
+import threading
+from dataclasses import asdict
 from functools import partial
 from pathlib import Path
 import ccpi.viewer.viewerLinker as vlink
@@ -15,15 +17,19 @@ from ccpi.viewer.ui.dialogs import (
     SaveableRawInputDialog,
 )
 from ccpi.viewer.ui.qt_widgets import ViewerCoordsDockWidget
-from ccpi.viewer.utils import cilPlaneClipper
-from ccpi.viewer.utils.io import ImageReader
+from ccpi.viewer.utils import CameraData, cilPlaneClipper
+from ccpi.viewer.utils.dataset_context import cilDatasetContext
+from ccpi.viewer.utils.io import ImageReader, WriteMemoryMappableImage, cilviewerHDF5Reader
+from ccpi.viewer.utils.memory import cilMemoryManager, format_size
+from eqt.io import zip_directory
 from eqt.threading import Worker
+from eqt.ui.ProgressTimerDialog import ProgressTimerDialog
 from eqt.ui.SessionDialogs import ErrorDialog
 from eqt.ui.MainWindowWithSessionManagement import (
     MainWindowWithProgressDialogs,
     MainWindowWithSessionManagement,
 )
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, QTimer
 from qtpy.QtWidgets import QApplication, QFileDialog, QMainWindow, QSizePolicy
 
 
@@ -79,9 +85,18 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         self._viewer_docks = []
         self._frames = []
         self._vs_dialog = None
+        self.raw_attrs = {}
+        self.hdf5_attrs = {}
 
         self.createViewerCoordsDockWidget()
 
+        self.applyMemoryBudget()
+        # the memory used by the viewers is shown in the viewer coords dock widget
+        self.memory_usage_timer = QTimer(self)
+        self.memory_usage_timer.setInterval(1000)
+        self.memory_usage_timer.timeout.connect(self.updateViewerCoordsDockWidgetWithMemoryUsage)
+        self.memory_usage_timer.start()
+
     @property
     def viewers(self):
         """The list of viewers in the window"""
@@ -136,6 +151,10 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         else:
             sw["gpu_checkbox_field"].setChecked(True)
 
+        # the default budget of the cilMemoryManager is shown until one is set
+        memory_budget = cilMemoryManager.GetInstance().GetBudget()
+        sw["memory_budget_field"].setValue(0 if memory_budget is None else memory_budget / (1024**3))
+
     def acceptViewerSettings(self):
         """This is called when the user clicks the OK button on the
         app settings dialog.
@@ -143,6 +162,8 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         """
 
         self.settings.setValue("vis_size", float(self.vs_dialog.widgets["vis_size_field"].value()))
+        self.settings.setValue("memory_budget", float(self.vs_dialog.widgets["memory_budget_field"].value()))
+        self.applyMemoryBudget()
 
         # Check if the user has changed the volume mapper setting:
         current_setting = self.settings.value("use_gpu_volume_mapper")
@@ -295,7 +316,7 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         hdf5_image_attrs = self.hdf5_attrs
         dataset_name = hdf5_image_attrs.get("dataset_name")
         resample_z = hdf5_image_attrs.get("resample_z", True)
-        target_size = self.getTargetImageSize()
+        target_size = self.reserveImageMemory(self.getTargetImageSize(), viewers, input_num)
         if isinstance(image, str) or isinstance(image, list):
             image_reader = ImageReader(file_name=image)
         else:
@@ -309,7 +330,7 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         if image_name is None and isinstance(image, str):
             image_name = image
         image_reader_worker.signals.result.connect(
-            partial(self.displayImage, viewers, input_num, image_reader, image_name))
+            partial(self.prepareImage, viewers, input_num, image_reader, image_name))
         image_reader_worker.signals.finished.connect(lambda: self.finishProcess("Reading Image"))
         image_reader_worker.signals.error.connect(self.processErrorDialog)
         self.threadpool.start(image_reader_worker)
@@ -321,6 +342,53 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         dialog = ErrorDialog(self, "Error", str(error[1]), str(error[2]))
         dialog.open()
 
+    def prepareImage(self, viewers, input_num, reader, image_name, image):
+        """
+        Computes the products of the image the viewer/s use, e.g. the histogram statistics
+        and the gradient magnitude, in a worker thread, then displays the image with displayImage.
+        Setting the input of the viewers then only attaches the products to the actors, rather than
+        freezing the window while they are computed.
+
+        The computation can be cancelled from its progress window, in which case the image is not displayed.
+
+        Parameters are the same as displayImage.
+        """
+        if image is None:
+            return
+        map_ranges = []
+        if input_num == 1:
+            for viewer in (viewers if isinstance(viewers, list) else [viewers]):
+                map_ranges += [product for product in viewer.getDatasetProducts() if product not in map_ranges]
+        if not map_ranges:
+            self.displayImage(viewers, input_num, reader, image_name, image)
+            return
+        process_name = "Preparing Image"
+        stop_event = threading.Event()
+        progress_window = ProgressTimerDialog(process_name, parent=self, cancel_method=stop_event.set)
+        progress_window.setRange(0, 100)
+        self.saveReferenceToProgressWindow(progress_window, process_name)
+        progress_window.show()
+        # the context is held until the image is displayed, the viewers then hold it
+        context = cilDatasetContext.GetContext(image)
+        worker = Worker(self._precomputeDatasetProducts, context, map_ranges, stop_event)
+        worker.signals.progress.connect(progress_window.setValue)
+        worker.signals.result.connect(
+            partial(self._displayPreparedImage, viewers, input_num, reader, image_name, image, context))
+        worker.signals.finished.connect(lambda: self.finishProcess(process_name))
+        worker.signals.error.connect(self.processErrorDialog)
+        self.threadpool.start(worker)
+
+    def _precomputeDatasetProducts(self, context, map_ranges, stop_event, **kwargs):
+        return context.Precompute(map_ranges, progress_callback=kwargs.get('progress_callback'), stop_event=stop_event)
+
+    def _displayPreparedImage(self, viewers, input_num, reader, image_name, image, context, completed):
+        if completed:
+            self.displayImage(viewers, input_num, reader, image_name, image)
+            return
+        # the products of a cancelled image are released, unless another viewer displays it
+        if context.GetReferenceCount() == 0:
+            context.Release()
+
     def displayImage(self, viewers, input_num, reader, image_name, image):
         """
         Displays an image on the viewer/s.
@@ -347,6 +415,8 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
             viewers = [viewers]
         for viewer in viewers:
             if input_num == 1:
+                # the viewers displaying the same image share its cilDatasetContext,
+                # so its statistics and gradient are only computed once
                 viewer.setInputData(image)
             elif input_num == 2:
                 if isinstance(viewer, CILViewer2D):
@@ -366,6 +436,19 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         """
         self.updateViewerCoordsDockWidgetWithCoords(reader)
         self.updateViewerCoordsDockWidgetWithImageFileName(image_name)
+        self.updateViewerCoordsDockWidgetWithMemoryUsage()
+
+    def updateViewerCoordsDockWidgetWithMemoryUsage(self):
+        """
+        Updates the viewer coordinates dock widget with the memory used by the buffers
+        of the viewers and the memory budget, and lists the largest buffers in its tooltip.
+        """
+        manager = cilMemoryManager.GetInstance()
+        field = self.viewer_coords_dock.getWidgets()["memory_usage_field"]
+        field.setText(manager.GetUsageDescription())
+        buffers = manager.GetBuffers()[:10]
+        field.setToolTip("\n".join("{} {}: {}".format(buffer["owner"], buffer["name"], format_size(buffer["size"]))
+                                   for buffer in buffers))
 
     def updateViewerCoordsDockWidgetWithImageFileName(self, image_name=None):
         """
@@ -422,7 +505,8 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
             resampled = False
         else:
             loaded_image_attrs = reader.GetLoadedImageAttrs()
-            resampled = loaded_image_attrs.get("resampled")
+            # a numpy.bool_ if read from an HDF5 file, the widgets expect a bool
+            resampled = bool(loaded_image_attrs.get("resampled"))
 
             if resampled:
                 # Check if the image was actually resampled:
@@ -441,7 +525,7 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
             widgets["loaded_image_dims_field"].setText(displayed_image_dims)
         else:
             original_image_attrs = reader.GetOriginalImageAttrs()
-            original_image_dims = str(list(original_image_attrs.get("shape")))
+            original_image_dims = str([int(dim) for dim in original_image_attrs.get("shape")])
             spacing = image.GetSpacing()
             for _viewer in self.viewer_coords_dock.viewers:
                 _viewer.setVisualisationDownsampling(spacing)
@@ -481,6 +565,54 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
             target_size = self.getDefaultDownsampledSize()
         return target_size
 
+    def getMemoryBudget(self):
+        """Get the memory budget of the viewers in bytes, see cilMemoryManager.
+        None if there is no limit, or if it was not set, in which case the default budget
+        of the cilMemoryManager is used."""
+        memory_budget = self.settings.value("memory_budget")
+        if memory_budget is None or float(memory_budget) == 0:
+            return None
+        return int(float(memory_budget) * (1024**3))
+
+    def applyMemoryBudget(self):
+        """Sets the budget of the cilMemoryManager to the memory budget in the settings, if it was set."""
+        memory_budget = self.settings.value("memory_budget")
+        if memory_budget is not None:
+            cilMemoryManager.GetInstance().SetBudget(self.getMemoryBudget())
+
+    def reserveImageMemory(self, target_size, viewers, input_num=1):
+        """
+        Returns the size in bytes to downsample an image to before displaying it in the viewers,
+        at most target_size, which fits in the memory budget once the caches are evicted,
+        see cilMemoryManager.Reserve. The images the new image replaces in the viewers are
+        counted as free, unless other viewers display them.
+
+        Parameters
+        ----------
+        target_size: int
+            The target size of the image in bytes, see getTargetImageSize.
+        viewers: CILViewer2D or CILViewer, or list of CILViewer2D or CILViewer
+            The viewer(s) to display the image in.
+        input_num : int
+            The input number to the viewer. 1 or 2, where 2 is the overlay image of the 2D viewers.
+        """
+        if not isinstance(viewers, list):
+            viewers = [viewers]
+        replaced = []
+        for viewer in viewers:
+            if input_num == 2:
+                replaced.append((viewer, "image2"))
+                continue
+            context = viewer.getDatasetContext()
+            if context is None or (context, "image") in replaced:
+                continue
+            if context.GetReferenceCount() <= sum(v.getDatasetContext() is context for v in viewers):
+                replaced.append((context, "image"))
+        # the image is downsampled to a coarser level if it does not fit, but not below the size of a preview
+        return cilMemoryManager.GetInstance().Reserve(target_size,
+                                                      minimum_size=min(target_size, 128**3),
+                                                      replaced=replaced)
+
     def setDefaultDownsampledSize(self, value):
         """Set the default size for an image to be displayed in bytes"""
         self.default_downsampled_size = int(value)
@@ -497,6 +629,13 @@ class ViewerMainWindowWithSessionManagement(MainWindowWithSessionManagement, Vie
     Instead it creates a main window with many of the tools needed for a window
     that will house a viewer.
 
+    If setCacheSessionData is set to True, saving a session also saves, in the session folder,
+    the images displayed on the viewers as they were downsampled, their statistics, the cameras
+    and the slices and window/level of the viewers. Loading the session then memory maps the
+    saved images, rather than reading and downsampling the image files again. An image whose
+    file has changed since the session was saved is read again from the file.
+    A subclass reimplementing getSessionConfig or finishLoadConfig should call the method of this class.
+
     Parameters
     ----------
     title : str, optional
@@ -525,6 +664,217 @@ class ViewerMainWindowWithSessionManagement(MainWindowWithSessionManagement, Vie
             settings_name=settings_name,
             organisation_name=organisation_name,
         )
+        # the images displayed on the viewers, by input number
+        self._session_images = {}
+        self._pending_viewer_states = []
+        self._session_data_config = {}
+        self._saved_viewer_states = None
+
+    def setCacheSessionData(self, value):
+        """Sets whether saving a session also saves the images displayed on the viewers,
+        their statistics and the state of the viewers, so that they are restored quickly.
+        This is saved in the app settings."""
+        self.settings.setValue("cache_session_data", bool(value))
+
+    def getCacheSessionData(self):
+        """Whether saving a session also saves the images displayed on the viewers,
+        their statistics and the state of the viewers."""
+        return str(self.settings.value("cache_session_data")).lower() == "true"
+
+    def setViewersInput(self, image, viewers, input_num=1, image_name=None):
+        """
+        Displays an image in the viewer/s, see ViewerMainWindow.setViewersInput.
+        Images read from files are recorded, so that they can be saved with the session.
+        """
+        if isinstance(image, (str, list)):
+            self._session_images[input_num] = {
+                "source": image,
+                "image_name": image_name,
+                "raw_attrs": dict(self.raw_attrs),
+                "hdf5_attrs": dict(self.hdf5_attrs)
+            }
+        else:
+            self._session_images.pop(input_num, None)
+        super(ViewerMainWindowWithSessionManagement, self).setViewersInput(image, viewers, input_num, image_name)
+
+    def displayImage(self, viewers, input_num, reader, image_name, image):
+        """
+        Displays an image on the viewer/s, see ViewerMainWindow.displayImage.
+        Once the main image is displayed, restores the state of the viewers saved with the
+        session being loaded, if any.
+        """
+        super(ViewerMainWindowWithSessionManagement, self).displayImage(viewers, input_num, reader, image_name, image)
+        if image is None:
+            return
+        entry = self._session_images.get(input_num)
+        if entry is not None:
+            viewers = viewers if isinstance(viewers, list) else [viewers]
+            entry.update(viewers=[self.viewers.index(viewer) for viewer in viewers if viewer in self.viewers],
+                         reader=reader,
+                         image=image)
+        if input_num == 1 and self._pending_viewer_states:
+            for viewer, state in zip(self.viewers, self._pending_viewer_states):
+                self.setViewerState(viewer, state)
+            self._pending_viewer_states = []
+
+    def getViewerState(self, viewer):
+        """Returns the camera, the slices and the window/level of the viewer, as a dictionary
+        which can be saved to JSON."""
+        state = {"camera": asdict(CameraData(viewer.getCamera()))}
+        if viewer.img3D is not None:
+            state.update(slicenos=[int(sliceno) for sliceno in viewer.slicenos],
+                         slice_window=viewer.getSliceColorWindow(),
+                         slice_level=viewer.getSliceColorLevel())
+        return state
+
+    def setViewerState(self, viewer, state):
+        """Restores the state of the viewer returned by getViewerState."""
+        if viewer.img3D is not None and "slicenos" in state:
+            viewer.slicenos = list(state["slicenos"])
+            viewer.updatePipeline()
+            viewer.setSliceColorWindowLevel(state["slice_window"], state["slice_level"])
+        camera_data = CameraData(viewer.getCamera())
+        vars(camera_data).update(state["camera"])
+        CameraData.CopyDataToCamera(camera_data, viewer.getCamera())
+        viewer.getRenderWindow().Render()
+
+    def runSaveSessionWorker(self, session_name, compress, event):
+        """
+        Saves the session in a thread, see MainWindowWithSessionManagement.runSaveSessionWorker.
+        The state of the viewers is read on the GUI thread, before the thread starts, as VTK objects
+        are not to be used from other threads. The thread only writes the files of the session.
+        """
+        self._saved_viewer_states = [self.getViewerState(viewer) for viewer in self.viewers]
+        super(ViewerMainWindowWithSessionManagement, self).runSaveSessionWorker(session_name, compress, event)
+
+    def saveSession(self, session_name, compress, **kwargs):
+        """
+        Saves the session to a zip file, see MainWindowWithSessionManagement.saveSession.
+        If getCacheSessionData is True, the data to restore the viewers is saved in the session
+        folder first, see saveSessionData, with the state of the viewers read by runSaveSessionWorker.
+        """
+        viewer_states, self._saved_viewer_states = self._saved_viewer_states, None
+        self.moveSessionFolder(session_name)
+        self._session_data_config = self.saveSessionData(viewer_states) if self.getCacheSessionData() else {}
+        self.saveSessionConfigToJson()
+        zip_directory(self.current_session_folder, compress)
+
+    def getSessionConfig(self):
+        """
+        Returns the session config. Contains the data to restore the viewers saved by saveSessionData,
+        if any, under the key 'viewer_session_data'.
+        """
+        return {"viewer_session_data": self._session_data_config}
+
+    def saveSessionData(self, viewer_states=None):
+        """
+        Saves the images displayed on the viewers in the current session folder, in the cilviewerHDF5Writer
+        layout without chunking, so that they can be memory mapped when the session is loaded.
+
+        Parameters
+        ----------
+        viewer_states: list of dict, optional
+            The state of each viewer, as returned by getViewerState. Read from the viewers if None, which
+            must then be done on the GUI thread.
+
+        Returns
+        -------
+        dict
+            The config to restore the viewers with restoreSessionData. For each image, contains the size and
+            modification time of its files, the statistics of the image, the viewers it is displayed on and
+            the file and attributes to read it again. Also contains the state of each viewer.
+        """
+        images = []
+        for input_num, entry in sorted(self._session_images.items()):
+            if entry.get("image") is None or not entry.get("viewers"):
+                continue
+            cache_file = "viewer_image_{}.hdf5".format(input_num)
+            file_name = os.path.join(self.current_session_folder, cache_file)
+            # an image restored from the session folder is still in it, moved with the folder
+            if entry.get("cache_file") != cache_file or not os.path.isfile(file_name):
+                WriteMemoryMappableImage(file_name, entry["reader"], entry["image"])
+                entry["cache_file"] = cache_file
+            context = cilDatasetContext.GetContext(entry["image"])
+            images.append({
+                "input_num": input_num,
+                "viewers": entry["viewers"],
+                "source": entry["source"],
+                "image_name": entry["image_name"],
+                "raw_attrs": entry["raw_attrs"],
+                "hdf5_attrs": entry["hdf5_attrs"],
+                "source_files": self._getSourceFilesState(entry["source"]),
+                "cache_file": cache_file,
+                "statistics": context.GetStatisticsCache()
+            })
+        if viewer_states is None:
+            viewer_states = [self.getViewerState(viewer) for viewer in self.viewers]
+        return {"images": images, "viewers": viewer_states}
+
+    def _getSourceFilesState(self, source):
+        if isinstance(source, list):
+            files = source
+        elif os.path.isdir(source):
+            files = sorted(os.path.join(source, f) for f in os.listdir(source))
+        else:
+            files = [source]
+        state = []
+        for file_name in files:
+            stat = os.stat(file_name)
+            state.append([os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns])
+        return state
+
+    def isSessionImageUnchanged(self, image_config):
+        """Whether the files of an image saved by saveSessionData have the same size and
+        modification time as when the session was saved."""
+        try:
+            return self._getSourceFilesState(image_config["source"]) == image_config["source_files"]
+        except OSError:
+            return False
+
+    def finishLoadConfig(self, process_name):
+        """
+        Called when the config of the session has been loaded.
+        Restores the viewers with restoreSessionData, if their data were saved with the session.
+        """
+        super(ViewerMainWindowWithSessionManagement, self).finishLoadConfig(process_name)
+        self.restoreSessionData(self.config.get("viewer_session_data"))
+
+    def restoreSessionData(self, session_data):
+        """
+        Restores the images displayed on the viewers and the state of the viewers saved by saveSessionData.
+
+        The images saved in the session folder are memory mapped and shown with their saved statistics.
+        An image whose files have changed since the session was saved is read again from the files.
+        The state of the viewers is restored once the main image is displayed.
+
+        Parameters
+        ----------
+        session_data: dict
+            As returned by saveSessionData, or None
+        """
+        if not session_data:
+            return
+        self._pending_viewer_states = session_data.get("viewers", [])
+        for image_config in sorted(session_data.get("images", []), key=lambda image_config: image_config["input_num"]):
+            viewers = [self.viewers[i] for i in image_config["viewers"] if i < len(self.viewers)]
+            if not viewers:
+                continue
+            input_num = image_config["input_num"]
+            cache_file = os.path.join(self.current_session_folder, image_config["cache_file"])
+            if self.isSessionImageUnchanged(image_config) and os.path.isfile(cache_file):
+                reader = cilviewerHDF5Reader()
+                reader.SetFileName(cache_file)
+                image = reader.GetMemoryMappedOutput()
+                cilDatasetContext.GetContext(image).SetStatisticsCache(image_config["statistics"])
+                self._session_images[input_num] = {
+                    key: image_config[key]
+                    for key in ("source", "image_name", "raw_attrs", "hdf5_attrs", "cache_file")
+                }
+                self.displayImage(viewers, input_num, reader, image_config["image_name"], image)
+            else:
+                self.raw_attrs = image_config["raw_attrs"]
+                self.hdf5_attrs = image_config["hdf5_attrs"]
+                self.setViewersInput(image_config["source"], viewers, input_num, image_config["image_name"])
 
 
 class TwoViewersMainWindowMixin(object):
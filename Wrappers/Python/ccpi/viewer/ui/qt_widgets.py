@@ -8,7 +8,8 @@ class ViewerCoordsDockWidget(FormDockWidget):
     ''' This is the dockwidget which
     shows the original and downsampled image
     size and the user can select whether coordinates
-    are displayed in system of original or downsampled image'''
+    are displayed in system of original or downsampled image.
+    It also shows the memory used by the buffers of the viewers, see cilMemoryManager.'''
 
     def __init__(self, parent, title="Viewer Information", viewers=None):
         '''
@@ -68,6 +69,8 @@ class ViewerCoordsDockWidget(FormDockWidget):
 
         form.addSpanningWidget(viewer_coords_widgets['coords_warning'], 'coords_warning')
 
+        form.addWidget(QLabel(""), QLabel("Memory Usage: "), 'memory_usage')
+
     @property
     def viewers(self):
         ''' Get the viewers which this dock widget will display information for.
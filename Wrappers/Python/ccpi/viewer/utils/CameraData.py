@@ -17,8 +17,10 @@
 #
 
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
 
-import vtk
+if TYPE_CHECKING:
+    from vtkmodules.vtkRenderingCore import vtkCamera
 
 
 @dataclass(init=False)
@@ -30,7 +32,7 @@ class CameraData:
     focalPoint: list
     viewUp: list
 
-    def __init__(self, camera: vtk.vtkCamera):
+    def __init__(self, camera: 'vtkCamera'):
         self.position = camera.GetPosition()
         self.focalPoint = camera.GetFocalPoint()
         self.viewUp = camera.GetViewUp()
@@ -27,8 +27,9 @@
 # You should have received a copy of the CC0 legalcode along with this
 # work.  If not, see <http://creativecommons.org/publicdomain/zero/1.0/>.
 
-import vtk
+from vtkmodules.vtkCommonDataModel import vtkPiecewiseFunction
 import numpy
+from collections import OrderedDict
 
 _magma_data = [[0.001462, 0.000466, 0.013866], [0.002258, 0.001295, 0.018331], [0.003279, 0.002305, 0.023708],
                [0.004512, 0.003490, 0.029965], [0.005950, 0.004843, 0.037130], [0.007588, 0.006356, 0.044973],
@@ -419,58 +420,153 @@ def relu(x, xmin, xmax, scaling=1):
     :param scaling: (optional) max value, defaults to 1
 
     '''
-    out = []
-    dx = xmax - xmin
-    for i, val in enumerate(x):
-        if val < xmin:
-            out.append(0)
-        elif val > xmax:
-            out.append(scaling)
-        else:
-            out.append(scaling * ((val - xmin) / dx))
-    return numpy.asarray(out)
+    x = numpy.asarray(x, dtype=numpy.float64)
+    out = numpy.empty_like(x)
+    below = x < xmin
+    above = x > xmax
+    inside = ~(below | above)
+    out[below] = 0
+    out[above] = scaling
+    if xmax > xmin:
+        out[inside] = scaling * ((x[inside] - xmin) / (xmax - xmin))
+    else:
+        # step function when xmin == xmax
+        out[inside] = scaling
+    return out
 
 
 class CILColorMaps(object):
+    '''Builds colour and opacity transfer functions for the volume render.
+
+    The transfer functions are filled in bulk from NumPy tables and are memoised,
+    so that asking again for the same colour map and range, or for the same
+    opacity function and parameters, returns the already built VTK object instead
+    of rebuilding an identical table.
+    '''
+
+    # maximum number of transfer functions kept in each cache
+    cache_size = 32
+    _color_map_cache = {}
+    _color_tf_cache = OrderedDict()
+    _opacity_tf_cache = OrderedDict()
+
+    @staticmethod
+    def get_color_map_names():
+        '''Returns the names of the colour maps of matplotlib, or of the built in colour maps without matplotlib'''
+        try:
+            # matplotlib is imported here rather than pyplot, which takes much longer to import
+            import matplotlib
+            try:
+                return list(matplotlib.colormaps)
+            except AttributeError:
+                # matplotlib < 3.5
+                from matplotlib import cm
+                return list(cm.cmap_d)
+        except ImportError:
+            return list(_color_map_dict.keys())
 
     @staticmethod
     def get_color_map(cmap):
+        '''Returns the colour map as a (N, 3) array of RGB values'''
+        colors = CILColorMaps._color_map_cache.get(cmap, None)
+        if colors is not None:
+            return colors
+
         if not cmap in _color_map_dict.keys():
 
             try:
-                from matplotlib import cm
-
-                colors = []
-                for x in range(0, 255):
-                    color = cm.get_cmap(cmap)(x)
-                    colors.append([color[0], color[1], color[2]])
+                import matplotlib
+                try:
+                    mpl_cmap = matplotlib.colormaps[cmap]
+                except AttributeError:
+                    # matplotlib < 3.5
+                    from matplotlib import cm
+                    mpl_cmap = cm.get_cmap(cmap)
+                # sample the first 255 entries of the lookup table in one call
+                colors = numpy.asarray(mpl_cmap(numpy.arange(0, 255)))[:, :3]
             except ImportError:
                 print("To use colormaps other than: ",
                       "{}, please install matplotlib.".format(str(list(_color_map_dict.keys()))))
 
         else:
-            colors = _color_map_dict[cmap]
+            colors = numpy.asarray(_color_map_dict[cmap], dtype=numpy.float64)
+        colors.flags.writeable = False
+        CILColorMaps._color_map_cache[cmap] = colors
         return colors
 
     @classmethod
     def get_color_transfer_function(cls, cmap, color_range):
+        '''Returns a vtkColorTransferFunction mapping the colour map onto color_range
 
-        tf = vtk.vtkColorTransferFunction()
+        :param cmap: name of the colour map
+        :param color_range: (min, max) of the values to map the colour map on
+        '''
+        key = (cmap, float(color_range[0]), float(color_range[1]))
+        tf = cls._get_cached(cls._color_tf_cache, key)
+        if tf is not None:
+            return tf
 
         colors = cls.get_color_map(cmap)
 
         N = len(colors)
-        for i, color in enumerate(colors):
-            level = color_range[0] + \
-                (color_range[1] - color_range[0]) * i / (N-1)
-            tf.AddRGBPoint(level, color[0], color[1], color[2])
+        levels = numpy.linspace(key[1], key[2], num=N)
+        # each node is stored as x, r, g, b
+        table = numpy.ascontiguousarray(numpy.column_stack((levels, colors)), dtype=numpy.float64)
+
+        # deferred, so that importing the colour maps does not load the rendering modules
+        from vtkmodules.vtkRenderingCore import vtkColorTransferFunction
+        tf = vtkColorTransferFunction()
+        tf.FillFromDataPointer(N, table.ravel())
 
+        cls._set_cached(cls._color_tf_cache, key, tf)
         return tf
 
-    @staticmethod
-    def get_opacity_transfer_function(x, function, *params):
-        opacity = vtk.vtkPiecewiseFunction()
-        vals = function(x, *params)
-        for _x, _y in zip(x, vals):
-            opacity.AddPoint(_x, _y)
+    @classmethod
+    def get_opacity_transfer_function(cls, x, function, *params):
+        '''Returns a vtkPiecewiseFunction with the values of function(x, *params) at x
+
+        :param x: ndarray of the values at which the opacity is defined
+        :param function: function returning the opacity at x, i.e. relu
+        :param params: additional parameters passed to function
+        '''
+        x = numpy.asarray(x, dtype=numpy.float64)
+        key = (function, x.tobytes(), params)
+        opacity = cls._get_cached(cls._opacity_tf_cache, key)
+        if opacity is not None:
+            return opacity
+
+        vals = numpy.asarray(function(x, *params), dtype=numpy.float64)
+        # each node is stored as x, y
+        table = numpy.ascontiguousarray(numpy.column_stack((x, vals)), dtype=numpy.float64)
+
+        opacity = vtkPiecewiseFunction()
+        opacity.FillFromDataPointer(len(x), table.ravel())
+
+        cls._set_cached(cls._opacity_tf_cache, key, opacity)
         return opacity
+
+    @classmethod
+    def clear_cache(cls):
+        '''Empties the caches of colour maps and transfer functions'''
+        cls._color_map_cache.clear()
+        cls._color_tf_cache.clear()
+        cls._opacity_tf_cache.clear()
+
+    @staticmethod
+    def _get_cached(cache, key):
+        try:
+            value = cache[key]
+        except (KeyError, TypeError):
+            # TypeError if any of the parameters is not hashable
+            return None
+        cache.move_to_end(key)
+        return value
+
+    @classmethod
+    def _set_cached(cls, cache, key, value):
+        try:
+            cache[key] = value
+        except TypeError:
+            return
+        while len(cache) > cls.cache_size:
+            cache.popitem(last=False)
@@ -0,0 +1,203 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from collections import OrderedDict
+
+import numpy
+import vtk
+from vtk.util import numpy_support
+from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+COMPARISON_OPERATIONS = ['difference', 'absolute_difference', 'ratio', 'threshold']
+
+
+class cilImageComparison(VTKPythonAlgorithmBase):
+    '''vtkAlgorithm to compare 2 vtkImageData with the same sampling, voxel by voxel
+
+    The output is, depending on the operation:
+
+    - 'difference': image - image2
+    - 'absolute_difference': abs(image - image2)
+    - 'ratio': image / image2, 0 where image2 is 0
+    - 'threshold': 1 where abs(image - image2) > Threshold, else 0
+
+    Only the update extent of the output is computed, and the same extent is
+    requested from both inputs, so a vtkExtractVOI of a slice downstream only
+    compares that slice. The compared extents and their statistics are kept in a
+    least recently used cache, which is cleared when either input is modified.
+
+    Example:
+    --------
+
+    >>> comparison = cilImageComparison()
+    >>> comparison.SetInputDataObject(0, image)
+    >>> comparison.SetInputDataObject(1, image2)
+    >>> comparison.SetOperation('difference')
+    >>> voi = vtk.vtkExtractVOI()
+    >>> voi.SetInputConnection(comparison.GetOutputPort())
+    '''
+
+    def __init__(self):
+        VTKPythonAlgorithmBase.__init__(self,
+                                        nInputPorts=2,
+                                        inputType="vtkImageData",
+                                        nOutputPorts=1,
+                                        outputType="vtkImageData")
+        self._Operation = 'difference'
+        self._Threshold = 0.
+        self._CacheSize = 16
+        self._cache = OrderedDict()
+        self._cache_key = None
+
+    def SetOperation(self, value):
+        '''Sets the comparison, one of 'difference', 'absolute_difference', 'ratio' or 'threshold' '''
+        if value not in COMPARISON_OPERATIONS:
+            raise ValueError("Operation must be one of {}, got {}".format(COMPARISON_OPERATIONS, value))
+        if value != self._Operation:
+            self._Operation = value
+            self.Modified()
+
+    def GetOperation(self):
+        return self._Operation
+
+    def SetThreshold(self, value):
+        '''Sets the absolute difference above which voxels are set to 1 by the 'threshold' operation'''
+        if value != self._Threshold:
+            self._Threshold = float(value)
+            self.Modified()
+
+    def GetThreshold(self):
+        return self._Threshold
+
+    def SetCacheSize(self, value):
+        '''Sets the maximum number of compared extents kept in the cache'''
+        if value < 1:
+            raise ValueError("Cache size must be at least 1, got {}".format(value))
+        self._CacheSize = int(value)
+        self._trimCache()
+
+    def GetCacheSize(self):
+        return self._CacheSize
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def GetStatistics(self, extent):
+        '''Returns the statistics of the comparison in the extent, if it has been computed, else None
+
+        The statistics are a dict with the 'minimum', 'maximum', 'mean', 'std' and the
+        1st and 99th 'percentiles' of the values.
+        '''
+        cached = self._cache.get(tuple(extent))
+        if cached is None:
+            return None
+        return cached[1]
+
+    def GetLastStatistics(self):
+        '''Returns the statistics of the last computed extent, None if there is none'''
+        if len(self._cache) == 0:
+            return None
+        return next(reversed(self._cache.values()))[1]
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        out_info = outInfo.GetInformationObject(0)
+        if self._Operation == 'threshold':
+            vtk.vtkDataObject.SetPointDataActiveScalarInfo(out_info, vtk.VTK_UNSIGNED_CHAR, 1)
+        else:
+            vtk.vtkDataObject.SetPointDataActiveScalarInfo(out_info, vtk.VTK_FLOAT, 1)
+        return 1
+
+    def RequestUpdateExtent(self, request, inInfo, outInfo):
+        sddp = vtk.vtkStreamingDemandDrivenPipeline
+        update_extent = outInfo.GetInformationObject(0).Get(sddp.UPDATE_EXTENT())
+        for port in range(2):
+            inInfo[port].GetInformationObject(0).Set(sddp.UPDATE_EXTENT(), update_extent, 6)
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        image = vtk.vtkImageData.GetData(inInfo[0])
+        image2 = vtk.vtkImageData.GetData(inInfo[1])
+        outData = vtk.vtkImageData.GetData(outInfo)
+        out_info = outInfo.GetInformationObject(0)
+        update_extent = tuple(out_info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT()))
+
+        self._checkCache()
+        try:
+            self._cache.move_to_end(update_extent)
+        except KeyError:
+            compared = self._compare(self._getExtent(image, update_extent), self._getExtent(image2, update_extent))
+            self._cache[update_extent] = (compared, self._computeStatistics(compared))
+            self._trimCache()
+        compared = self._cache[update_extent][0]
+
+        outData.SetExtent(update_extent)
+        outData.SetSpacing(image.GetSpacing())
+        outData.SetOrigin(image.GetOrigin())
+        # the vtk array keeps a reference to the cached numpy array
+        out_scalars = numpy_support.numpy_to_vtk(compared.ravel(), deep=0)
+        out_scalars.SetName(self._Operation)
+        outData.GetPointData().SetScalars(out_scalars)
+        return 1
+
+    @staticmethod
+    def _getExtent(image, extent):
+        '''Returns a numpy view of the extent of the scalars of the image, ordered z, y, x'''
+        image_extent = image.GetExtent()
+        dims = image.GetDimensions()
+        array = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+        if array.ndim > 1:
+            # compare the first component
+            array = array[:, 0]
+        array = array.reshape(dims[::-1])
+        crop = []
+        for i in (2, 1, 0):
+            start = extent[2 * i] - image_extent[2 * i]
+            crop.append(slice(start, start + extent[2 * i + 1] - extent[2 * i] + 1))
+        return array[tuple(crop)]
+
+    def _compare(self, array, array2):
+        if self._Operation == 'ratio':
+            compared = numpy.zeros(array.shape, dtype=numpy.float32)
+            numpy.divide(array, array2, out=compared, where=array2 != 0, casting='unsafe')
+            return compared
+        difference = numpy.subtract(array, array2, dtype=numpy.float32)
+        if self._Operation == 'difference':
+            return difference
+        numpy.abs(difference, out=difference)
+        if self._Operation == 'absolute_difference':
+            return difference
+        return (difference > self._Threshold).astype(numpy.uint8)
+
+    @staticmethod
+    def _computeStatistics(compared):
+        percentiles = numpy.percentile(compared, (1, 99))
+        return {
+            'minimum': float(compared.min()),
+            'maximum': float(compared.max()),
+            'mean': float(compared.mean(dtype=numpy.float64)),
+            'std': float(compared.std(dtype=numpy.float64)),
+            'percentiles': (float(percentiles[0]), float(percentiles[1]))
+        }
+
+    def _checkCache(self):
+        # the pipeline modified time of the inputs accounts for the filters upstream,
+        # while the output data of a filter is new at each execution
+        key = tuple(self.GetInputAlgorithm(port, 0).GetExecutive().GetPipelineMTime()
+                    for port in range(2)) + (self._Operation, self._Threshold)
+        if key != self._cache_key:
+            self._cache.clear()
+            self._cache_key = key
+
+    def _trimCache(self):
+        while len(self._cache) > self._CacheSize:
+            self._cache.popitem(last=False)
@@ -22,9 +22,12 @@ Created on Wed Jan 16 14:21:00 2019
 import os
 import math
 import numpy
-import vtk
-from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
-from vtk.util import numpy_support
+from vtkmodules.vtkCommonCore import VTK_DOUBLE, VTK_FLOAT, VTK_INT, VTK_SHORT, VTK_SIGNED_CHAR, VTK_UNSIGNED_CHAR, VTK_UNSIGNED_INT, VTK_UNSIGNED_SHORT, vtkStringArray
+from vtkmodules.vtkCommonDataModel import vtkDataObject, vtkImageData
+from vtkmodules.vtkIOImage import vtkImageReader2, vtkMetaImageReader, vtkTIFFReader
+from vtkmodules.vtkImagingCore import vtkImageReslice
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
+from vtkmodules.util import numpy_support
 
 import tempfile
 import numpy as np
@@ -42,37 +45,37 @@ class Converter(object):
     # Converting to vtk: --------------------------------
 
     MetaImageType_to_vtkType = {
-        "MET_CHAR": vtk.VTK_SIGNED_CHAR,  # int8
-        "MET_UCHAR": vtk.VTK_UNSIGNED_CHAR,  # uint8
-        "MET_SHORT": vtk.VTK_SHORT,  # int16
-        "MET_USHORT": vtk.VTK_UNSIGNED_SHORT,  # uint16
-        "MET_INT": vtk.VTK_INT,  # int32
-        "MET_UINT": vtk.VTK_UNSIGNED_INT,  # uint32
-        "MET_FLOAT": vtk.VTK_FLOAT,  # float32
-        "MET_DOUBLE": vtk.VTK_DOUBLE,  # float64
+        "MET_CHAR": VTK_SIGNED_CHAR,  # int8
+        "MET_UCHAR": VTK_UNSIGNED_CHAR,  # uint8
+        "MET_SHORT": VTK_SHORT,  # int16
+        "MET_USHORT": VTK_UNSIGNED_SHORT,  # uint16
+        "MET_INT": VTK_INT,  # int32
+        "MET_UINT": VTK_UNSIGNED_INT,  # uint32
+        "MET_FLOAT": VTK_FLOAT,  # float32
+        "MET_DOUBLE": VTK_DOUBLE,  # float64
     }
 
     dtype_name_to_vtkType = {
-        "int8": vtk.VTK_SIGNED_CHAR,
-        "uint8": vtk.VTK_UNSIGNED_CHAR,
-        "int16": vtk.VTK_SHORT,
-        "uint16": vtk.VTK_UNSIGNED_SHORT,
-        "int32": vtk.VTK_INT,
-        "uint32": vtk.VTK_UNSIGNED_INT,
-        "float32": vtk.VTK_FLOAT,
-        "float64": vtk.VTK_DOUBLE,
+        "int8": VTK_SIGNED_CHAR,
+        "uint8": VTK_UNSIGNED_CHAR,
+        "int16": VTK_SHORT,
+        "uint16": VTK_UNSIGNED_SHORT,
+        "int32": VTK_INT,
+        "uint32": VTK_UNSIGNED_INT,
+        "float32": VTK_FLOAT,
+        "float64": VTK_DOUBLE,
     }
 
     # Converting from vtk to bytes: -------------------------------------------
     vtkType_to_bytes = {
-        vtk.VTK_SIGNED_CHAR: 1,  # int8
-        vtk.VTK_UNSIGNED_CHAR: 1,  # uint8
-        vtk.VTK_SHORT: 2,  # int16
-        vtk.VTK_UNSIGNED_SHORT: 2,  # uint16
-        vtk.VTK_INT: 4,  # int32
-        vtk.VTK_UNSIGNED_INT: 4,  # uint32
-        vtk.VTK_FLOAT: 4,  # float32
-        vtk.VTK_DOUBLE: 8,  # float64
+        VTK_SIGNED_CHAR: 1,  # int8
+        VTK_UNSIGNED_CHAR: 1,  # uint8
+        VTK_SHORT: 2,  # int16
+        VTK_UNSIGNED_SHORT: 2,  # uint16
+        VTK_INT: 4,  # int32
+        VTK_UNSIGNED_INT: 4,  # uint32
+        VTK_FLOAT: 4,  # float32
+        VTK_DOUBLE: 8,  # float64
     }
 
     dtype_name_to_MetaImageType = {
@@ -120,7 +123,7 @@ class Converter(object):
         )
 
         if output is None:
-            img_data = vtk.vtkImageData()
+            img_data = vtkImageData()
         else:
             if output.GetNumberOfPoints() > 0:
                 raise ValueError("Output variable must be an empty vtkImageData object.")
@@ -397,7 +400,7 @@ class cilReaderInterface(VTKPythonAlgorithmBase):
 
     def FillOutputPortInformation(self, port, info):
         """output should be of vtkImageData type"""
-        info.Set(vtk.vtkDataObject.DATA_TYPE_NAME(), "vtkImageData")
+        info.Set(vtkDataObject.DATA_TYPE_NAME(), "vtkImageData")
         return 1
 
     def GetStoredArrayShape(self):
@@ -486,10 +489,10 @@ class cilReaderInterface(VTKPythonAlgorithmBase):
         ----------
         value:
             must be one of the values in this list:
-            [vtk.VTK_SIGNED_CHAR,vtk.VTK_UNSIGNED_CHAR,
-            vtk.VTK_SHORT, vtk.VTK_UNSIGNED_SHORT,
-            vtk.VTK_INT, vtk.VTK_UNSIGNED_INT,
-            vtk.VTK_FLOAT, vtk.VTK_DOUBLE]
+            [VTK_SIGNED_CHAR,VTK_UNSIGNED_CHAR,
+            VTK_SHORT, VTK_UNSIGNED_SHORT,
+            VTK_INT, VTK_UNSIGNED_INT,
+            VTK_FLOAT, VTK_DOUBLE]
         """
         if value not in Converter.MetaImageType_to_vtkType.values():
             raise ValueError("Unexpected Type:  {}".format(value))
@@ -898,7 +901,7 @@ class cilTIFFImageReaderInterface(cilReaderInterface):
         self.SetIsFortran(True)
         self.SetBigEndian(False)
         # get one slice size
-        reader = vtk.vtkTIFFReader()
+        reader = vtkTIFFReader()
         reader.SetFileName(self.GetFileName()[0])
         # Set orientation type due to issue:
         # https://github.com/vais-ral/CILViewer/issues/296
@@ -1023,10 +1026,10 @@ class cilBaseResampleReader(cilReaderInterface):
         This method creates these files, with the header file containing the information
         for a dataset which is equal to the size of a chunk needed in the downsampling.
 
-        We have to make a new metaimage header so that the vtk.vtkMetaImageReader
+        We have to make a new metaimage header so that the vtkMetaImageReader
         knows the extent it needs to read when we read a chunk.
 
-        TODO: In future we need to use the vtk.vtkImageReader2 to replace this
+        TODO: In future we need to use the vtkImageReader2 to replace this
         and remove the need for re-writing out chunks.
         """
         raise NotImplemented
@@ -1062,7 +1065,7 @@ class cilBaseResampleReader(cilReaderInterface):
 
     def RequestData(self, request, inInfo, outInfo):
         try:
-            outData = vtk.vtkImageData.GetData(outInfo)
+            outData = vtkImageData.GetData(outInfo)
 
             if self.GetFileName() is None:
                 raise Exception("FileName must be set.")
@@ -1116,7 +1119,7 @@ class cilBaseResampleReader(cilReaderInterface):
                     num_chunks,
                 )
 
-                resampler = vtk.vtkImageReslice()
+                resampler = vtkImageReslice()
 
                 element_spacing = self.GetElementSpacing()
 
@@ -1126,7 +1129,7 @@ class cilBaseResampleReader(cilReaderInterface):
                     element_spacing[2] / z_axis_magnification,
                 )
                 # resampled data
-                resampled_image = vtk.vtkImageData()
+                resampled_image = vtkImageData()
 
                 resampled_image.SetExtent(
                     0,
@@ -1234,16 +1237,16 @@ class cilBaseBinaryBlobResampleReader(cilBaseResampleReader):
         This method creates these files, with the header file containing the information
         for a dataset which is equal to the size of a chunk needed in the downsampling.
 
-        We have to make a new metaimage header so that the vtk.vtkMetaImageReader
+        We have to make a new metaimage header so that the vtkMetaImageReader
         knows the extent it needs to read when we read a chunk.
 
-        TODO: In future we need to use the vtk.vtkImageReader2 to replace this
+        TODO: In future we need to use the vtkImageReader2 to replace this
         and remove the need for re-writing out chunks.
         """
         tmpdir = tempfile.mkdtemp()
         self._SetTempDir(tmpdir)
         header_filename = os.path.join(tmpdir, "header.mhd")
-        reader = vtk.vtkMetaImageReader()
+        reader = vtkMetaImageReader()
         reader.SetFileName(header_filename)
 
         chunk_file_name = os.path.join(tmpdir, "chunk.raw")
@@ -1461,7 +1464,7 @@ class cilTIFFResampleReader(cilBaseResampleReader, cilTIFFImageReaderInterface):
     def _GetInternalChunkReader(self):
         """returns a reader which will only read a specific chunk of the data.
         This is a chunk which will get resampled into a single slice."""
-        reader = vtk.vtkTIFFReader()
+        reader = vtkTIFFReader()
         reader.SetOrientationType(self.GetOrientationType())
         self._ChunkReader = reader
         return reader
@@ -1479,7 +1482,7 @@ class cilTIFFResampleReader(cilBaseResampleReader, cilTIFFImageReaderInterface):
         dims = self.GetStoredArrayShape()
 
         fnames = self.GetFileName()
-        chunk = vtk.vtkStringArray()
+        chunk = vtkStringArray()
         for i in range(start_slice, end_slice + 1):
             chunk.InsertNextValue(fnames[i])
         self._ChunkReader.SetFileNames(chunk)
@@ -1519,7 +1522,7 @@ class cilBaseCroppedReader(cilReaderInterface):
         return self._TargetZExtent
 
     def RequestData(self, request, inInfo, outInfo):
-        outData = vtk.vtkImageData.GetData(outInfo)
+        outData = vtkImageData.GetData(outInfo)
 
         self.ReadDataSetInfo()
 
@@ -1536,7 +1539,7 @@ class cilBaseCroppedReader(cilReaderInterface):
 
         tmpdir = tempfile.mkdtemp()
         header_filename = os.path.join(tmpdir, "header.mhd")
-        reader = vtk.vtkMetaImageReader()
+        reader = vtkMetaImageReader()
         reader.SetFileName(header_filename)
 
         slice_length = self._GetSliceLengthInFile()
@@ -1615,7 +1618,7 @@ class cilBaseCroppedReader(cilReaderInterface):
 
             # Once we have read the data, update the extent to reflect where
             # we have cut the cropped dataset out of the original image
-            Data = vtk.vtkImageData()
+            Data = vtkImageData()
             extent = (
                 0,
                 shape[0] - 1,
@@ -1750,7 +1753,7 @@ class cilHDF5CroppedReader(cilBaseCroppedReader, cilHDF5ReaderInterface):
         return self._TargetExtent
 
     def RequestData(self, request, inInfo, outInfo):
-        outData = vtk.vtkImageData.GetData(outInfo)
+        outData = vtkImageData.GetData(outInfo)
 
         full_reader = HDF5Reader()
         full_reader.SetFileName(self.GetFileName())
@@ -1799,7 +1802,7 @@ class cilTIFFCroppedReader(cilBaseCroppedReader, cilTIFFImageReaderInterface):
         self._TargetExtent = None
 
     def RequestData(self, request, inInfo, outInfo):
-        outData = vtk.vtkImageData.GetData(outInfo)
+        outData = vtkImageData.GetData(outInfo)
 
         self.ReadDataSetInfo()
 
@@ -1812,12 +1815,12 @@ class cilTIFFCroppedReader(cilBaseCroppedReader, cilTIFFImageReaderInterface):
         else:
             shape = list(readshape)[::-1]
 
-        reader = vtk.vtkTIFFReader()
+        reader = vtkTIFFReader()
         # Set orientation type due to issue:
         # https://github.com/vais-ral/CILViewer/issues/296
         # https://gitlab.kitware.com/vtk/vtk/-/merge_requests/6155
         reader.SetOrientationType(self.GetOrientationType())
-        sa = vtk.vtkStringArray()
+        sa = vtkStringArray()
 
         extent = [0, -1, 0, -1, self.GetTargetZExtent()[0], self.GetTargetZExtent()[1]]
 
@@ -1846,7 +1849,7 @@ class cilTIFFCroppedReader(cilBaseCroppedReader, cilTIFFImageReaderInterface):
         # Once we have read the data, update the extent to reflect where
         # we have cut the cropped dataset out of the original image
 
-        Data = vtk.vtkImageData()
+        Data = vtkImageData()
         extent = (
             0,
             shape[0] - 1,
@@ -1956,8 +1959,8 @@ class vtkImageResampler(VTKPythonAlgorithmBase):
         return self._StoredArrayShape
 
     def RequestData(self, request, inInfo, outInfo):
-        inData = vtk.vtkImageData.GetData(inInfo[0])
-        outData = vtk.vtkImageData.GetData(outInfo)
+        inData = vtkImageData.GetData(inInfo[0])
+        outData = vtkImageData.GetData(outInfo)
 
         self.ReadDataSetInfo(inData)
 
@@ -1993,7 +1996,7 @@ class vtkImageResampler(VTKPythonAlgorithmBase):
                 num_chunks,
             )
 
-            resampler = vtk.vtkImageReslice()
+            resampler = vtkImageReslice()
 
             element_spacing = self.GetElementSpacing()
 
@@ -2077,7 +2080,7 @@ if __name__ == "__main__":
     # plt.imshow(a[10,:,:])
     # plt.show()
 
-    reader = vtk.vtkMetaImageReader()
+    reader = vtkMetaImageReader()
     reader.SetFileName(arfn + ".mhd")
     reader.Update()
 
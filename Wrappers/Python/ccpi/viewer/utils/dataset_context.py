@@ -0,0 +1,301 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import weakref
+from functools import partial
+
+import numpy as np
+import vtk
+from vtkmodules.util import numpy_support
+
+from ccpi.viewer.utils.conversion import vtkImageResampler
+from ccpi.viewer.utils.memory import cilMemoryManager
+
+
+class cilDatasetContext(object):
+    '''Holds a vtkImageData and the products derived from it, so they can be shared by several viewers
+
+    The products are computed the first time they are requested and cached until the
+    image is modified:
+
+    - the histogram statistics of the image and of its gradient magnitude, and the
+      ranges of values between percentiles,
+    - the gradient magnitude of the image,
+    - downsampled copies of the image (pyramid levels), by target size.
+
+    There is one context per image: GetContext returns the same context to all the
+    viewers displaying the same vtkImageData. Each viewer registers with the context,
+    and the context releases the image and its products when the last viewer
+    unregisters. The contexts and their owners are held with weak references, so a
+    context is also freed when the last viewer holding it is garbage collected.
+
+    The image is registered with the cilMemoryManager, once for all the viewers, and the
+    gradient magnitude and the pyramid levels are registered as caches, which
+    it evicts when the buffers of the viewers exceed its budget.
+
+    Example:
+    --------
+
+    >>> context = cilDatasetContext.GetContext(image)
+    >>> context.Register(viewer)
+    >>> cmin, cmax = context.GetMapRange((5., 95.), 'scalar')
+    >>> context.UnRegister(viewer)
+    '''
+
+    # contexts by id of their image, each context holds its image so the id is not reused
+    _contexts = weakref.WeakValueDictionary()
+
+    def __init__(self, image):
+        self._Image = image
+        self._owners = weakref.WeakSet()
+        self._statistics = {}
+        self._map_ranges = {}
+        self._whole_ranges = {}
+        self._gradient = None
+        self._pyramid = {}
+        self._cache_mtime = image.GetMTime()
+        cilMemoryManager.GetInstance().Register(self, 'image', image)
+
+    @classmethod
+    def GetContext(cls, image):
+        '''Returns the context of the image, creating it if there is none'''
+        context = cls._contexts.get(id(image))
+        if context is None or context.GetImage() is not image:
+            context = cls(image)
+            cls._contexts[id(image)] = context
+        return context
+
+    @classmethod
+    def GetNumberOfContexts(cls):
+        return len(cls._contexts)
+
+    def GetImage(self):
+        return self._Image
+
+    def Register(self, owner):
+        '''Adds a reference to the context from owner, i.e. a viewer, which must support weak references'''
+        self._owners.add(owner)
+
+    def UnRegister(self, owner):
+        '''Removes the reference from owner, the context is released when no reference is left'''
+        self._owners.discard(owner)
+        if len(self._owners) == 0:
+            self.Release()
+
+    def GetReferenceCount(self):
+        return len(self._owners)
+
+    def Release(self):
+        '''Clears the cached products and removes the context from the contexts of the images'''
+        self.ClearCache()
+        cilMemoryManager.GetInstance().Unregister(self)
+        if cilDatasetContext._contexts.get(id(self._Image)) is self:
+            del cilDatasetContext._contexts[id(self._Image)]
+        self._Image = None
+
+    def ClearCache(self):
+        self._statistics = {}
+        self._map_ranges = {}
+        self._whole_ranges = {}
+        self.ReleaseGradientMagnitude()
+        for target_size in list(self._pyramid):
+            self.ReleasePyramidLevel(target_size)
+
+    def ReleaseGradientMagnitude(self):
+        '''Releases the gradient magnitude and its histogram statistics, the ranges of values are kept'''
+        self._gradient = None
+        self._statistics.pop('gradient', None)
+        cilMemoryManager.GetInstance().Unregister(self, 'gradient')
+
+    def ReleasePyramidLevel(self, target_size):
+        '''Releases the image downsampled to about target_size bytes'''
+        resampler = self._pyramid.pop(int(target_size), None)
+        if resampler is not None:
+            # the viewers still using the resampler read the image again when they update
+            resampler.GetOutput().ReleaseData()
+        cilMemoryManager.GetInstance().Unregister(self, 'pyramid_{}'.format(int(target_size)))
+
+    def GetGradientMagnitude(self):
+        '''Returns the 3D gradient magnitude of the image'''
+        self._checkModified()
+        if self._gradient is None:
+            grad = vtk.vtkImageGradientMagnitude()
+            grad.SetInputData(self._Image)
+            grad.SetDimensionality(3)
+            grad.Update()
+            self._gradient = grad.GetOutput()
+            cilMemoryManager.GetInstance().Register(self,
+                                                    'gradient',
+                                                    self._gradient,
+                                                    evict=self.ReleaseGradientMagnitude)
+        else:
+            cilMemoryManager.GetInstance().Touch(self, 'gradient')
+        return self._gradient
+
+    def GetHistogramStatistics(self, method='scalar'):
+        '''Returns a vtkImageHistogramStatistics of the image ('scalar') or of its gradient magnitude ('gradient')
+
+        The returned filter is shared, use GetMapRange for the range between percentiles.
+        '''
+        self._checkModified()
+        if method not in self._statistics:
+            self._statistics[method] = self._computeStatistics(method)
+        return self._statistics[method]
+
+    def GetMapRange(self, percentiles, method='scalar'):
+        '''Returns the values at the percentiles of the image ('scalar') or of its gradient magnitude ('gradient')
+
+        The values are found in the histogram of GetHistogramStatistics, so the image is read once for all
+        the percentiles. The range is the auto range of vtkImageHistogramStatistics for the percentiles.
+        '''
+        self._checkModified()
+        key = (tuple(float(p) for p in percentiles), method)
+        if key not in self._map_ranges:
+            self._map_ranges[key] = self._computeMapRange(self.GetHistogramStatistics(method), key[0])
+        return self._map_ranges[key]
+
+    def GetWholeRange(self, method='scalar'):
+        '''Returns the minimum and maximum of the image ('scalar') or of its gradient magnitude ('gradient')'''
+        self._checkModified()
+        if method not in self._whole_ranges:
+            ia = self.GetHistogramStatistics(method)
+            self._whole_ranges[method] = (ia.GetMinimum(), ia.GetMaximum())
+        return self._whole_ranges[method]
+
+    def GetStatisticsCache(self):
+        '''Returns the ranges of values computed so far, as a dictionary which can be saved to JSON
+
+        See SetStatisticsCache.
+        '''
+        self._checkModified()
+        return {
+            'map_ranges': [[list(percentiles), method, list(value_range)]
+                           for (percentiles, method), value_range in self._map_ranges.items()],
+            'whole_ranges': {
+                method: list(value_range)
+                for method, value_range in self._whole_ranges.items()
+            }
+        }
+
+    def SetStatisticsCache(self, cache):
+        '''Adds the ranges of values of the image previously returned by GetStatisticsCache
+
+        The ranges are then returned by GetMapRange and GetWholeRange without computing
+        the histogram statistics, until the image is modified.
+
+        Parameters
+        ----------
+        cache: dict
+            as returned by GetStatisticsCache for the same image
+        '''
+        self._checkModified()
+        for percentiles, method, value_range in cache.get('map_ranges', []):
+            self._map_ranges[(tuple(float(p) for p in percentiles), method)] = tuple(value_range)
+        for method, value_range in cache.get('whole_ranges', {}).items():
+            self._whole_ranges[method] = tuple(value_range)
+
+    def Precompute(self, map_ranges, progress_callback=None, stop_event=None):
+        '''Computes the products the viewers request when the image is set as their input
+
+        Meant to be run in a worker thread before the image is set as input of the viewers,
+        so that setting the input only attaches the cached products to the actors, see
+        CILViewerBase.getDatasetProducts.
+
+        Parameters
+        ----------
+        map_ranges: list of (percentiles, method)
+            the ranges of values between percentiles of the image ('scalar') or of its
+            gradient magnitude ('gradient') to compute, with the histogram statistics
+            and the gradient magnitude they need
+        progress_callback: Qt signal, optional
+            emitted with the percentage of the products computed
+        stop_event: threading.Event, optional
+            the computation stops before the next product when it is set
+
+        Returns
+        -------
+        bool: whether all the products were computed
+        '''
+        methods = sorted(set(method for _, method in map_ranges), key=lambda method: method != 'scalar')
+        steps = []
+        if 'gradient' in methods:
+            steps.append(self.GetGradientMagnitude)
+        steps += [partial(self.GetHistogramStatistics, method) for method in methods]
+        steps += [partial(self.GetMapRange, percentiles, method) for percentiles, method in map_ranges]
+        for i, step in enumerate(steps):
+            if stop_event is not None and stop_event.is_set():
+                return False
+            step()
+            if progress_callback is not None:
+                progress_callback.emit(int(100 * (i + 1) / len(steps)))
+        return True
+
+    def GetPyramidResampler(self, target_size):
+        '''Returns the vtkImageResampler downsampling the image to about target_size bytes'''
+        self._checkModified()
+        target_size = int(target_size)
+        if target_size not in self._pyramid:
+            resampler = vtkImageResampler()
+            resampler.SetInputDataObject(self._Image)
+            resampler.SetTargetSize(target_size)
+            self._pyramid[target_size] = resampler
+        resampler = self._pyramid[target_size]
+        resampler.Update()
+        cilMemoryManager.GetInstance().Register(self,
+                                                'pyramid_{}'.format(target_size),
+                                                resampler.GetOutput(),
+                                                evict=partial(self.ReleasePyramidLevel, target_size))
+        return resampler
+
+    def PinPyramidLevel(self, target_size, user):
+        '''Keeps the image downsampled to about target_size bytes from being evicted while user, e.g. a mapper
+        of a viewer, renders it, see cilMemoryManager.Pin'''
+        cilMemoryManager.GetInstance().Pin(self, 'pyramid_{}'.format(int(target_size)), user)
+
+    def UnpinPyramidLevel(self, target_size, user):
+        cilMemoryManager.GetInstance().Unpin(self, 'pyramid_{}'.format(int(target_size)), user)
+
+    def GetPyramidLevel(self, target_size):
+        '''Returns the image downsampled to about target_size bytes'''
+        return self.GetPyramidResampler(target_size).GetOutput()
+
+    def _checkModified(self):
+        if self._Image is None:
+            raise ValueError("The context has been released.")
+        if self._Image.GetMTime() != self._cache_mtime:
+            self.ClearCache()
+            self._cache_mtime = self._Image.GetMTime()
+            # e.g. the scalars were replaced
+            cilMemoryManager.GetInstance().Register(self, 'image', self._Image)
+
+    @staticmethod
+    def _computeMapRange(ia, percentiles):
+        # as vtkImageHistogramStatistics.GetAutoRange: the last bins whose cumulative count is at most the
+        # percentiles of the count, the range then expanded by whole bins and clamped to the values
+        cumulative = np.cumsum(numpy_support.vtk_to_numpy(ia.GetHistogram()))
+        low, high = np.searchsorted(cumulative, cumulative[-1] * np.asarray(percentiles) * 0.01, side='right') - 1
+        width = high - low
+        expansion = ia.GetAutoRangeExpansionFactors()
+        low -= int(width * expansion[0])
+        high += int(width * expansion[1])
+        return (float(max(ia.GetBinOrigin() + low * ia.GetBinSpacing(),
+                          ia.GetMinimum())), float(min(ia.GetBinOrigin() + high * ia.GetBinSpacing(), ia.GetMaximum())))
+
+    def _computeStatistics(self, method):
+        ia = vtk.vtkImageHistogramStatistics()
+        if method == 'scalar':
+            ia.SetInputData(self._Image)
+        else:
+            ia.SetInputData(self.GetGradientMagnitude())
+        ia.Update()
+        return ia
@@ -0,0 +1,372 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import vtk
+from ccpi.viewer import SLICE_ORIENTATION_XY
+from ccpi.viewer.CILViewer import CILViewer
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.io import ImageReader
+from vtk.util import numpy_support
+
+logger = logging.getLogger(__name__)
+
+
+def render_to_image(renderer, resolution):
+    '''Renders the renderer at resolution (width, height) and returns the vtkImageData
+
+    Resolutions larger than the render window are rendered in tiles of the size of the
+    window with vtkRenderLargeImage, so the resolution is not limited by the screen.
+    '''
+    render_window = renderer.GetRenderWindow()
+    width, height = resolution
+    window_width, window_height = render_window.GetSize()
+    magnification = max(1, math.ceil(width / window_width), math.ceil(height / window_height))
+    if magnification > 1 or (window_width, window_height) != (width, height):
+        render_window.SetSize(math.ceil(width / magnification), math.ceil(height / magnification))
+    render_window.Render()
+    large_image = vtk.vtkRenderLargeImage()
+    large_image.SetInput(renderer)
+    large_image.SetMagnification(magnification)
+    large_image.Update()
+    if large_image.GetOutput().GetDimensions()[:2] == (width, height):
+        return large_image.GetOutput()
+    voi = vtk.vtkExtractVOI()
+    voi.SetInputConnection(large_image.GetOutputPort())
+    voi.SetVOI(0, width - 1, 0, height - 1, 0, 0)
+    voi.Update()
+    return voi.GetOutput()
+
+
+def image_to_rgb_array(image):
+    '''Returns a rendered vtkImageData as a numpy array of shape (height, width, components), top row first'''
+    width, height, _ = image.GetDimensions()
+    array = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+    return array.reshape(height, width, -1)[::-1]
+
+
+def write_rgb_array_to_png(array, filename):
+    '''Writes a numpy array of shape (height, width, components), top row first, to a PNG file'''
+    height, width, components = array.shape
+    image = vtk.vtkImageData()
+    image.SetDimensions(width, height, 1)
+    scalars = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(array[::-1]).reshape(-1, components), deep=1)
+    image.GetPointData().SetScalars(scalars)
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(filename)
+    writer.SetInputData(image)
+    writer.Write()
+
+
+def split_frames(number_of_frames, number_of_ranges):
+    '''Splits range(number_of_frames) into at most number_of_ranges disjoint consecutive ranges'''
+    number_of_ranges = max(1, min(number_of_ranges, number_of_frames))
+    bounds = numpy.linspace(0, number_of_frames, number_of_ranges + 1).astype(int)
+    return [range(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+class cilOffscreenExporter(object):
+    '''Renders sequences of slices, orbits of the volume and montages of slices offscreen to PNG files
+
+    The image is displayed in offscreen CILViewer2D (slices and montages) or
+    CILViewer (orbits) instances. The frames are rendered across a pool of
+    processes, each of which reads the image, creates its own viewer and renders
+    a disjoint range of consecutive frames, so that the frames are the same
+    whatever the number of processes. The frames are rendered at Resolution,
+    which can be larger than the screen, see render_to_image.
+
+    Each export returns and logs the number of frames, the time and the frames
+    per second.
+
+    Example:
+    --------
+
+    >>> exporter = cilOffscreenExporter(file_name='head.mha', reader_kwargs={'resample': False})
+    >>> exporter.SetResolution((1920, 1080))
+    >>> exporter.ExportSlices('frames', orientation=SLICE_ORIENTATION_XY)
+    >>> exporter.ExportOrbit('orbit', number_of_frames=72)
+    '''
+
+    def __init__(self, file_name=None, vtk_image=None, reader_kwargs=None, resolution=(600, 600), processes=None):
+        '''
+        Parameters
+        ----------
+        file_name: str, default None
+            file name of the image, read by each process with ImageReader
+        vtk_image: vtkImageData, default None
+            image in memory, must be given if file_name is None. It is sent to each process.
+        reader_kwargs: dict, default None
+            keyword arguments of ImageReader, i.e. resample and target_size
+        resolution: tuple, default (600, 600)
+            width and height of the frames in pixels
+        processes: int, default None
+            number of processes rendering the frames, default the number of CPUs.
+            With 1 process the frames are rendered in this process.
+        '''
+        if file_name is None and vtk_image is None:
+            raise ValueError('Path to file (file_name) or vtk image (vtk_image) is required.')
+        self._FileName = file_name
+        self._VTKImage = vtk_image
+        self._ReaderKwargs = dict(reader_kwargs or {})
+        self.SetResolution(resolution)
+        self.SetNumberOfProcesses(processes)
+        self._LastStatistics = None
+
+    def SetResolution(self, value):
+        '''Sets the width and height of the frames in pixels'''
+        width, height = value
+        if width < 1 or height < 1:
+            raise ValueError("Resolution must be positive, got {}".format(value))
+        self._Resolution = (int(width), int(height))
+
+    def GetResolution(self):
+        return self._Resolution
+
+    def SetNumberOfProcesses(self, value):
+        '''Sets the number of processes rendering the frames, None for the number of CPUs'''
+        if value is None:
+            value = os.cpu_count() or 1
+        if value < 1:
+            raise ValueError("Number of processes must be at least 1, got {}".format(value))
+        self._NumberOfProcesses = int(value)
+
+    def GetNumberOfProcesses(self):
+        return self._NumberOfProcesses
+
+    def GetLastStatistics(self):
+        '''Returns the statistics of the last export, a dict with the number of 'frames',
+        the 'seconds' it took, the 'fps' and the 'processes' used'''
+        return self._LastStatistics
+
+    def ExportSlices(self, directory, orientation=SLICE_ORIENTATION_XY, slices=None, basename='slice'):
+        '''Renders slices of the image in the 2D viewer to numbered PNG files
+
+        Parameters
+        ----------
+        directory: str
+            directory of the PNG files, created if it does not exist
+        orientation: int, default SLICE_ORIENTATION_XY
+            orientation of the slices
+        slices: list of int, default None
+            slices to render, default all the slices
+        basename: str, default 'slice'
+            frame i is written to basename_iiii.png
+
+        Returns
+        -------
+        list of the file names of the frames
+        '''
+        if slices is None:
+            slices = range(self._getNumberOfSlices(orientation))
+        frames = [('slice', orientation, sliceno) for sliceno in slices]
+        return self._exportToFiles(directory, basename, frames)
+
+    def ExportOrbit(self, directory, number_of_frames=36, elevation=0., volume_render=True, basename='orbit'):
+        '''Renders a 360 degree orbit of the camera around the image in the 3D viewer to numbered PNG files
+
+        Parameters
+        ----------
+        directory: str
+            directory of the PNG files, created if it does not exist
+        number_of_frames: int, default 36
+            number of frames in the orbit, the azimuth of the camera changes by 360 / number_of_frames
+            degrees between frames
+        elevation: float, default 0.
+            elevation of the camera in degrees
+        volume_render: bool, default True
+            whether to show the volume render, the slice is shown otherwise
+        basename: str, default 'orbit'
+            frame i is written to basename_iiii.png
+
+        Returns
+        -------
+        list of the file names of the frames
+        '''
+        frames = [('orbit', 360. * i / number_of_frames, elevation, volume_render) for i in range(number_of_frames)]
+        return self._exportToFiles(directory, basename, frames)
+
+    def ExportMontage(self, file_name, orientation=SLICE_ORIENTATION_XY, slices=None, columns=None):
+        '''Renders slices of the image in the 2D viewer and writes them as a grid to a PNG file
+
+        Each slice is rendered at Resolution, so the montage is columns * width
+        by rows * height pixels.
+
+        Parameters
+        ----------
+        file_name: str
+            file name of the montage
+        orientation: int, default SLICE_ORIENTATION_XY
+            orientation of the slices
+        slices: list of int, default None
+            slices to render, default 16 slices evenly spaced through the image
+        columns: int, default None
+            number of columns of the montage, default the square root of the number of slices
+
+        Returns
+        -------
+        the montage as a numpy array of shape (height, width, components)
+        '''
+        if slices is None:
+            number_of_slices = self._getNumberOfSlices(orientation)
+            slices = numpy.unique(numpy.linspace(0, number_of_slices - 1, min(16, number_of_slices)).astype(int))
+        slices = [int(sliceno) for sliceno in slices]
+        if columns is None:
+            columns = math.ceil(math.sqrt(len(slices)))
+        rows = math.ceil(len(slices) / columns)
+        tiles = self._export([('slice', orientation, sliceno) for sliceno in slices])
+
+        height, width, components = tiles[0].shape
+        montage = numpy.zeros((rows * height, columns * width, components), dtype=tiles[0].dtype)
+        for i, tile in enumerate(tiles):
+            row, column = divmod(i, columns)
+            montage[row * height:(row + 1) * height, column * width:(column + 1) * width] = tile
+        directory = os.path.dirname(os.path.abspath(file_name))
+        os.makedirs(directory, exist_ok=True)
+        write_rgb_array_to_png(montage, file_name)
+        return montage
+
+    def _exportToFiles(self, directory, basename, frames):
+        os.makedirs(directory, exist_ok=True)
+        file_names = [os.path.join(directory, '{}_{:04d}.png'.format(basename, i)) for i in range(len(frames))]
+        self._export(frames, file_names)
+        return file_names
+
+    def _export(self, frames, file_names=None):
+        if len(frames) == 0:
+            raise ValueError("There are no frames to export")
+        source = self._getSource()
+        ranges = split_frames(len(frames), self._NumberOfProcesses)
+        jobs = []
+        for frame_range in ranges:
+            jobs.append((source, self._Resolution, frames[frame_range.start:frame_range.stop],
+                         None if file_names is None else file_names[frame_range.start:frame_range.stop]))
+
+        start = time.perf_counter()
+        if len(jobs) == 1:
+            results = [render_frames(*jobs[0])]
+        else:
+            # spawn rather than fork, the rendering context of this process must not be shared
+            with ProcessPoolExecutor(max_workers=len(jobs), mp_context=multiprocessing.get_context('spawn')) as pool:
+                results = list(pool.map(render_frames, *zip(*jobs)))
+        seconds = time.perf_counter() - start
+
+        self._LastStatistics = {
+            'frames': len(frames),
+            'seconds': seconds,
+            'fps': len(frames) / seconds if seconds > 0 else float('inf'),
+            'processes': len(jobs)
+        }
+        logger.info("Exported {frames} frames in {seconds:.2f} s with {processes} processes, {fps:.2f} fps".format(
+            **self._LastStatistics))
+        return [image for result in results for image in result]
+
+    def _getSource(self):
+        if self._FileName is not None:
+            return ('file', self._FileName, self._ReaderKwargs)
+        if self._NumberOfProcesses == 1:
+            return ('image', self._VTKImage)
+        image = self._VTKImage
+        return ('array', numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()), image.GetExtent(),
+                image.GetSpacing(), image.GetOrigin())
+
+    def _getNumberOfSlices(self, orientation):
+        if self._VTKImage is None:
+            self._VTKImage = read_source(('file', self._FileName, self._ReaderKwargs))
+        return self._VTKImage.GetDimensions()[orientation]
+
+
+def read_source(source):
+    '''Returns the vtkImageData of a source of cilOffscreenExporter'''
+    if source[0] == 'image':
+        return source[1]
+    if source[0] == 'file':
+        _, file_name, reader_kwargs = source
+        return ImageReader(file_name=file_name, **reader_kwargs).Read()
+    _, array, extent, spacing, origin = source
+    image = vtk.vtkImageData()
+    image.SetExtent(extent)
+    image.SetSpacing(spacing)
+    image.SetOrigin(origin)
+    image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(array, deep=1))
+    return image
+
+
+def render_frames(source, resolution, frames, file_names=None):
+    '''Renders frames of a source in an offscreen viewer, in this process
+
+    Frames are ('slice', orientation, sliceno) or ('orbit', azimuth, elevation, volume_render).
+    Each frame is written to the corresponding file name, or returned as a numpy array
+    if file_names is None.
+    '''
+    image = read_source(source)
+    viewers = {}
+    images = []
+    for i, frame in enumerate(frames):
+        if frame[0] == 'slice':
+            viewer = viewers.get('2D')
+            if viewer is None:
+                viewer = viewers['2D'] = _createViewer2D(image, resolution)
+            _, orientation, sliceno = frame
+            if viewer.getSliceOrientation() != orientation:
+                viewer.setSliceOrientation('xyz'[orientation])
+            viewer.style.SetActiveSlice(sliceno)
+            viewer.style.UpdatePipeline()
+        else:
+            viewer = viewers.get('3D')
+            if viewer is None:
+                viewer = viewers['3D'] = _createViewer3D(image, resolution, frame[3])
+            _, azimuth, elevation, _ = frame
+            viewer.resetCameraToDefault()
+            camera = viewer.getCamera()
+            camera.Azimuth(azimuth)
+            camera.Elevation(elevation)
+            camera.OrthogonalizeViewUp()
+            viewer.getRenderer().ResetCameraClippingRange()
+
+        rendered = render_to_image(viewer.getRenderer(), resolution)
+        if file_names is None:
+            images.append(image_to_rgb_array(rendered).copy())
+        else:
+            writer = vtk.vtkPNGWriter()
+            writer.SetFileName(file_names[i])
+            writer.SetInputData(rendered)
+            writer.Write()
+            images.append(file_names[i])
+    for viewer in viewers.values():
+        viewer.setDatasetContext(None)
+        viewer.getRenderWindow().Finalize()
+    return images
+
+
+def _createViewer2D(image, resolution):
+    viewer = CILViewer2D(dimx=resolution[0], dimy=resolution[1], enableSliderWidget=False)
+    viewer.getRenderWindow().SetOffScreenRendering(1)
+    viewer.setInputData(image)
+    return viewer
+
+
+def _createViewer3D(image, resolution, volume_render):
+    viewer = CILViewer(dimx=resolution[0], dimy=resolution[1])
+    viewer.getRenderWindow().SetOffScreenRendering(1)
+    viewer.setInputData(image)
+    if volume_render:
+        viewer.style.ToggleVolumeVisibility()
+        viewer.style.ToggleSliceVisibility()
+    return viewer
@@ -1,9 +1,15 @@
-import vtk
-from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
+import fnmatch
+import os
+import threading
+from collections import OrderedDict
+
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkCommonExecutionModel import vtkStreamingDemandDrivenPipeline
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
 import h5py
 import numpy as np
-from vtk.numpy_interface import dataset_adapter as dsa
-from vtk.util import numpy_support
+from vtkmodules.numpy_interface import dataset_adapter as dsa
+from vtkmodules.util import numpy_support
 
 # Methods for reading and writing HDF5 files:
 
@@ -71,7 +77,7 @@ class HDF5Reader(VTKPythonAlgorithmBase):
             shape = np.shape(f[self._DatasetName])
             # print("keys:", list(f.keys()))
             # print(shape)
-            ue = info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT())
+            ue = info.Get(vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT())
             # Note that we flip the update extents because VTK is Fortran order
             # whereas h5py reads in C order. When writing we pretend that the
             # data was C order so we have to flip the extents/dimensions.
@@ -89,7 +95,7 @@ class HDF5Reader(VTKPythonAlgorithmBase):
             else:
                 raise Exception("Currently only 3D and 4D datasets are supported.")
             # print("attributes: ", f.attrs.items())
-            output = dsa.WrapDataObject(vtk.vtkImageData.GetData(outInfo))
+            output = dsa.WrapDataObject(vtkImageData.GetData(outInfo))
             output.SetExtent(ue)
             output.PointData.append(data.ravel(), self._DatasetName)
             output.PointData.SetActiveScalars(self._DatasetName)
@@ -167,9 +173,11 @@ class HDF5Reader(VTKPythonAlgorithmBase):
 
     def RequestInformation(self, request, inInfo, outInfo):
         dims = self.GetDimensions()
+        if len(dims) == 4:
+            # only 1 slice is read along the 4th dimension, dims are in reverse order
+            dims = [d for i, d in enumerate(dims) if i != 3 - self._4DIndex]
         info = outInfo.GetInformationObject(0)
-        info.Set(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(), (0, dims[0] - 1, 0, dims[1] - 1, 0, dims[2] - 1),
-                 6)
+        info.Set(vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(), (0, dims[0] - 1, 0, dims[1] - 1, 0, dims[2] - 1), 6)
         return 1
 
 
@@ -200,15 +208,15 @@ class HDF5SubsetReader(VTKPythonAlgorithmBase):
 
     def RequestInformation(self, request, inInfo, outInfo):
         info = outInfo.GetInformationObject(0)
-        info.Set(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(), self.__UpdateExtent, 6)
+        info.Set(vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(), self.__UpdateExtent, 6)
         return 1
 
     def RequestUpdateExtent(self, request, inInfo, outInfo):
         if self.__UpdateExtent is not None:
             info = inInfo[0].GetInformationObject(0)
 
-            whole_extent = info.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
-            set_extent = list(info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT()))
+            whole_extent = info.Get(vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+            set_extent = list(info.Get(vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT()))
 
             for i, value in enumerate(set_extent):
                 if value == -1:
@@ -227,12 +235,12 @@ class HDF5SubsetReader(VTKPythonAlgorithmBase):
 
             self.SetUpdateExtent(set_extent)
 
-            info.Set(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT(), self.__UpdateExtent, 6)
+            info.Set(vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT(), self.__UpdateExtent, 6)
         return 1
 
     def RequestData(self, request, inInfo, outInfo):
-        inp = vtk.vtkImageData.GetData(inInfo[0])
-        opt = vtk.vtkImageData.GetData(outInfo)
+        inp = vtkImageData.GetData(inInfo[0])
+        opt = vtkImageData.GetData(outInfo)
         opt.ShallowCopy(inp)
         return 1
 
@@ -246,3 +254,166 @@ class HDF5SubsetReader(VTKPythonAlgorithmBase):
 
     def GetOutput(self):
         return self.GetOutputDataObject(0)
+
+
+class HDF5FileBrowser(object):
+    '''
+    Lists the contents of a HDF5 file a page at a time, for browsing files with
+    groups of many thousands of members without reading all of them.
+
+    The children of a group are its members, and the children of a dataset are its attributes.
+    The listings are cached, for all the browsers of the same file, until the file is modified,
+    i.e. they are keyed on the file name, its size and modification time.
+
+    The methods may be called from worker threads.
+
+    Example:
+    --------
+
+    >>> browser = HDF5FileBrowser("scan.nxs")
+    >>> total, children = browser.ListChildren("/entry1", start=0, count=100)
+    >>> total, datasets = browser.Search("*data*")
+    '''
+
+    # the cached listings of the most recently browsed files
+    _caches = OrderedDict()
+    _caches_lock = threading.Lock()
+    _max_cached_files = 4
+
+    # attribute values are described by their first characters
+    _max_description_length = 200
+
+    def __init__(self, file_name):
+        self._FileName = file_name
+
+    def GetFileName(self):
+        return self._FileName
+
+    def ListChildren(self, path, start=0, count=None):
+        '''
+        Lists the members of a group, or the attributes of a dataset, from start.
+
+        Parameters
+        ----------
+        path: str
+            path of the group or dataset in the file
+        start: int
+            index of the first child to list
+        count: int, optional
+            maximum number of children to list, all the children from start if None
+
+        Returns
+        -------
+        tuple (total, children)
+            the number of children of the group or dataset, and a list of
+            (name, path, kind, description, number_of_children) where kind is one of
+            'group', 'dataset', 'attribute' or 'link', for a link that can't be resolved.
+        '''
+        cache = self._getCache()
+        with h5py.File(self._FileName, 'r') as f:
+            obj = f[path]
+            with cache['lock']:
+                if path not in cache['names']:
+                    cache['names'][path] = list(obj.attrs.keys() if isinstance(obj, h5py.Dataset) else obj.keys())
+                names = cache['names'][path]
+            stop = len(names) if count is None else min(len(names), start + count)
+            children = []
+            for name in names[start:stop]:
+                child_path = path.rstrip('/') + '/' + name
+                with cache['lock']:
+                    child = cache['children'].get(child_path)
+                if child is None:
+                    child = self._describeChild(obj, name, child_path)
+                    with cache['lock']:
+                        cache['children'][child_path] = child
+                children.append(child)
+        return len(names), children
+
+    def GetNumberOfChildren(self, path):
+        '''Returns the number of members of a group, or of attributes of a dataset'''
+        with h5py.File(self._FileName, 'r') as f:
+            obj = f[path]
+            return len(obj.attrs) if isinstance(obj, h5py.Dataset) else len(obj)
+
+    def GetIndex(self):
+        '''
+        Returns the paths and descriptions of all the datasets in the file, as a list of (path, description).
+        Visits the whole file the first time it is called, until the file is modified.
+        '''
+        cache = self._getCache()
+        # concurrent calls wait for the index built by the first one
+        with cache['index_lock']:
+            if cache['index'] is None:
+                index = []
+
+                def add_dataset(name, obj):
+                    if isinstance(obj, h5py.Dataset):
+                        index.append(('/' + name, str(obj)))
+
+                with h5py.File(self._FileName, 'r') as f:
+                    f.visititems(add_dataset)
+                cache['index'] = index
+            return cache['index']
+
+    def Search(self, pattern, start=0, count=None):
+        '''
+        Searches the paths of the datasets in the file, see GetIndex.
+
+        Parameters
+        ----------
+        pattern: str
+            case insensitive pattern matched against the whole path, with the wildcards of fnmatch.
+            A pattern without wildcards matches the paths which contain it.
+        start: int
+            index of the first match to return
+        count: int, optional
+            maximum number of matches to return, all the matches from start if None
+
+        Returns
+        -------
+        tuple (total, matches)
+            the number of matches, and a list of (name, path, kind, description, number_of_children)
+            of the datasets, as ListChildren, where the name is the path of the dataset and
+            the number of children, i.e. of attributes, is not counted and set to 0.
+        '''
+        pattern = pattern.lower()
+        if not any(c in pattern for c in '*?['):
+            pattern = '*' + pattern + '*'
+        paths = [(path, description) for path, description in self.GetIndex()
+                 if fnmatch.fnmatchcase(path.lower(), pattern)]
+        stop = len(paths) if count is None else min(len(paths), start + count)
+        return len(paths), [(path, path, 'dataset', description, 0) for path, description in paths[start:stop]]
+
+    def _describeChild(self, obj, name, child_path):
+        if isinstance(obj, h5py.Dataset):
+            description = str(obj.attrs[name])
+            if len(description) > self._max_description_length:
+                description = description[:self._max_description_length] + '...'
+            return (name, child_path, 'attribute', description, 0)
+        try:
+            child = obj[name]
+        except (KeyError, OSError):
+            return (name, child_path, 'link', 'Unresolved link', 0)
+        if isinstance(child, h5py.Dataset):
+            return (name, child_path, 'dataset', str(child), len(child.attrs))
+        return (name, child_path, 'group', str(child), len(child))
+
+    def _getCache(self):
+        stat = os.stat(self._FileName)
+        key = (os.path.abspath(self._FileName), stat.st_size, stat.st_mtime_ns)
+        with HDF5FileBrowser._caches_lock:
+            cache = HDF5FileBrowser._caches.get(key)
+            if cache is None:
+                cache = {
+                    'names': {},
+                    'children': {},
+                    'index': None,
+                    'lock': threading.Lock(),
+                    'index_lock': threading.Lock()
+                }
+                HDF5FileBrowser._caches[key] = cache
+                while len(HDF5FileBrowser._caches) > HDF5FileBrowser._max_cached_files:
+                    HDF5FileBrowser._caches.popitem(last=False)
+            else:
+                HDF5FileBrowser._caches.move_to_end(key)
+            return cache
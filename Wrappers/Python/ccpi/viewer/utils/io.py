@@ -7,7 +7,9 @@ from functools import partial
 
 import h5py
 import numpy as np
-import vtk
+from vtkmodules.vtkCommonCore import vtkCommand
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkIOImage import vtkMetaImageWriter, vtkPNGWriter
 from ccpi.viewer.utils import Converter
 from ccpi.viewer.utils.conversion import (cilHDF5CroppedReader, cilHDF5ResampleReader, cilMetaImageCroppedReader,
                                           cilMetaImageResampleReader, cilNumpyCroppedReader, cilNumpyResampleReader,
@@ -15,10 +17,11 @@ from ccpi.viewer.utils.conversion import (cilHDF5CroppedReader, cilHDF5ResampleR
                                           cilTIFFResampleReader, vtkImageResampler)
 from ccpi.viewer.utils.error_handling import EndObserver, ErrorObserver
 from ccpi.viewer.utils.hdf5_io import HDF5Reader
+from ccpi.viewer.utils.sinogram_cache import cilSinogramCache
 #from ccpi.viewer.version import version
 from schema import Optional, Or, Schema, SchemaError
-from vtk.util import numpy_support
-from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
+from vtkmodules.util import numpy_support
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
 
 
 def SaveRenderToPNG(render_window, filename):
@@ -32,7 +35,9 @@ def SaveRenderToPNG(render_window, filename):
     filename: str
         name of file to write PNG to.
     '''
-    w2if = vtk.vtkWindowToImageFilter()
+    # deferred, so that reading and writing images does not load the rendering modules
+    from vtkmodules.vtkRenderingCore import vtkWindowToImageFilter
+    w2if = vtkWindowToImageFilter()
     w2if.SetInput(render_window)
     w2if.Update()
 
@@ -54,7 +59,7 @@ def SaveRenderToPNG(render_window, filename):
 
     saveFilename = '{}_{:04d}.png'.format(os.path.join(directory, basename), number)
 
-    writer = vtk.vtkPNGWriter()
+    writer = vtkPNGWriter()
     writer.SetFileName(saveFilename)
     writer.SetInputConnection(w2if.GetOutputPort())
     writer.Write()
@@ -81,7 +86,8 @@ class ImageReader(object):
                  resample_z=False,
                  raw_image_attrs=None,
                  hdf5_dataset_name="entry1/tomo_entry/data/data",
-                 log_file=None):
+                 log_file=None,
+                 build_sinogram_cache=False):
         '''
         Constructor
 
@@ -113,6 +119,9 @@ class ImageReader(object):
             Name of the hdf5 dataset to be read, if file format is hdf5
         log_file: str, optional, default None
             log verbose output to file of this name            
+        build_sinogram_cache: bool, default False
+            whether to build, in the background, a transposed copy of acquisition
+            data for reading sinograms (see SetBuildSinogramCache).
         '''
         if file_name is None and vtk_image is None:
             raise Exception('Path to file (file_name) or vtk image (vtk_image) is required.')
@@ -129,6 +138,8 @@ class ImageReader(object):
         self.SetHDF5DatasetName(hdf5_dataset_name)
         self.SetRawImageAttributes(raw_image_attrs)
         self.SetLogFileName(log_file)
+        self.SetBuildSinogramCache(build_sinogram_cache)
+        self._SinogramCache = None
 
     def SetFileName(self, file_name):
         '''
@@ -222,6 +233,27 @@ class ImageReader(object):
         '''
         self._SetUpLogger(log_file)
 
+    def SetBuildSinogramCache(self, build_sinogram_cache, cache_file_name=None, memory_limit=256 * 1024**2):
+        '''
+        Parameters
+        ----------
+        build_sinogram_cache: bool, default False
+            whether to build, in the background after reading, a cilSinogramCache of the
+            file. Only applies to acquisition data (resample_z False) in npy or HDF5 files.
+            The cache is reused if already built for the file.
+        cache_file_name: str, default None
+            file to store the cache in, by default a file in the temporary directory
+        memory_limit: int, default 256 MB
+            maximum number of bytes read at once while building the cache
+        '''
+        self._BuildSinogramCache = build_sinogram_cache
+        self._SinogramCacheFileName = cache_file_name
+        self._SinogramCacheMemoryLimit = memory_limit
+
+    def GetSinogramCache(self):
+        '''Returns the cilSinogramCache of the file read, None if it is not built'''
+        return self._SinogramCache
+
     def SetRawImageAttributes(self, raw_image_attrs):
         if raw_image_attrs is not None and raw_image_attrs != {}:
             try:
@@ -259,6 +291,9 @@ class ImageReader(object):
 
         self._UpdateOriginalImageAttrs(reader)
 
+        if self._BuildSinogramCache:
+            self._StartSinogramCache(reader)
+
         return data
 
     def GetOriginalImageAttrs(self):
@@ -361,13 +396,12 @@ class ImageReader(object):
             reader.SetTargetSize(int(target_size))
 
         # Add observers:
-        reader.AddObserver(vtk.vtkCommand.ProgressEvent,
-                           partial(self._ReportProgress, progress_callback=progress_callback))
+        reader.AddObserver(vtkCommand.ProgressEvent, partial(self._ReportProgress, progress_callback=progress_callback))
 
         # Prints the error if an error occurs in the reader.
         # Otherwise this wouldn't print at all.
         error_obs = ErrorObserver(callback_fn=print)
-        reader.AddObserver(vtk.vtkCommand.ErrorEvent, error_obs)
+        reader.AddObserver(vtkCommand.ErrorEvent, error_obs)
         # Could add end observer so that we don't continue to do anything
         # else if an error does occur in reader?
 
@@ -455,6 +489,23 @@ class ImageReader(object):
 
         return reader
 
+    def _StartSinogramCache(self, reader):
+        '''Starts building the sinogram cache of the file in the background'''
+        if self._ResampleZ:
+            self.logger.warning("The sinogram cache is only built for acquisition data, set resample_z to False.")
+            return
+        if isinstance(self._FileName, list) or self._FileName is None or \
+                os.path.splitext(self._FileName)[1] not in ['.npy', '.nxs', '.h5', '.hdf5']:
+            self.logger.warning("The sinogram cache is only built for npy and HDF5 files.")
+            return
+        self._SinogramCache = cilSinogramCache(self._FileName,
+                                               self._HDF5DatasetName,
+                                               cache_file_name=self._SinogramCacheFileName,
+                                               memory_limit=self._SinogramCacheMemoryLimit)
+        self._SinogramCache.SetElementSpacing(reader.GetElementSpacing())
+        self._SinogramCache.SetOrigin(reader.GetOrigin())
+        self._SinogramCache.BuildInBackground()
+
     def _SetUpLogger(self, fname=None, log_level=logging.INFO):
         """Set up the logger """
         self.logger = logging.getLogger("ccpi.viewer.utils.io.ImageReader")
@@ -572,8 +623,8 @@ class ImageWriterInterface(object):
         attributes: dict
             dictionary containing attributes of original dataset
         '''
-        if not isinstance(original_dataset, vtk.vtkImageData) and not (original_dataset is None):
-            raise Exception("'original_dataset' must be vtk.vtkImageData or None")
+        if not isinstance(original_dataset, vtkImageData) and not (original_dataset is None):
+            raise Exception("'original_dataset' must be vtkImageData or None")
 
         self._validate_original_dataset_attributes(original_dataset, attributes)
         self._OriginalDataset = original_dataset
@@ -599,8 +650,8 @@ class ImageWriterInterface(object):
         original_attributes_schema.validate(attributes)
 
     def AddChildDataset(self, child_dataset, attributes=None):
-        if not isinstance(child_dataset, vtk.vtkImageData):
-            raise Exception("child_dataset must be vtk.vtkImageData")
+        if not isinstance(child_dataset, vtkImageData):
+            raise Exception("child_dataset must be vtkImageData")
         # check type is vtkImageData
         self._ValidateChildDatasetAttributes(child_dataset, attributes)
         self._ChildDatasets.append(child_dataset)
@@ -723,7 +774,7 @@ class ImageWriter(ImageWriterInterface):
         return writer
 
     def _GetMetaImageWriter(self):
-        writer = vtk.vtkMetaImageWriter()
+        writer = vtkMetaImageWriter()
         writer.SetInputData(self._ChildDatasets[0])
         return writer
 
@@ -930,3 +981,60 @@ class cilviewerHDF5Reader(HDF5Reader):
         Returns a dictionary of the attributes of the dataset that is currently loaded.
         '''
         return self.GetDataSetAttributes()
+
+    def GetMemoryMappedOutput(self):
+        '''
+        Returns the dataset as vtkImageData whose values are memory mapped from the file, rather than
+        read into memory, so that it is available at once. The pages of the file are read when the
+        values are first accessed.
+
+        The dataset must have been written without chunking or compression, i.e. with
+        `cilviewerHDF5Writer.SetChunking(False)`.
+
+        Returns
+        -------
+        vtkImageData
+        '''
+        with h5py.File(self._FileName, 'r') as f:
+            dataset = f[self._DatasetName]
+            offset = dataset.id.get_offset()
+            if offset is None or dataset.chunks is not None:
+                raise ValueError("Dataset {} in {} is chunked or compressed, so it can't be memory mapped.".format(
+                    self._DatasetName, self._FileName))
+            shape, dtype = dataset.shape, dataset.dtype
+            origin, spacing = dataset.attrs['origin'], dataset.attrs['spacing']
+        # copy on write, so that the file is never modified through the image
+        array = np.memmap(self._FileName, dtype=dtype, mode='c', offset=offset, shape=shape)
+        return Converter.numpy2vtkImage(array, spacing=tuple(spacing), origin=tuple(origin))
+
+
+def WriteMemoryMappableImage(file_name, reader, image):
+    '''
+    Writes an image read with an ImageReader in the cilviewerHDF5Writer layout, without chunking, so that
+    it can be memory mapped with cilviewerHDF5Reader.GetMemoryMappedOutput. The attributes of the original
+    dataset and of the image are the ones of the reader.
+
+    The file is replaced, rather than overwritten, as a previous image may be memory mapped from it.
+
+    Parameters
+    ----------
+    file_name: str
+        the HDF5 file to write
+    reader: ImageReader
+        the reader which read the image
+    image: vtkImageData
+        the image read by the reader
+    '''
+    original_attrs = {key: value for key, value in reader.GetOriginalImageAttrs().items() if value is not None}
+    if not isinstance(original_attrs.get("file_name"), str):
+        # TIFF stack
+        original_attrs["file_name"] = os.path.dirname(str(original_attrs["file_name"][0]))
+    loaded_attrs = {key: value for key, value in reader.GetLoadedImageAttrs().items() if value is not None}
+    loaded_attrs.update(spacing=list(image.GetSpacing()), origin=list(image.GetOrigin()))
+    writer = cilviewerHDF5Writer()
+    writer.SetFileName(file_name + ".tmp")
+    writer.SetOriginalDataset(None, original_attrs)
+    writer.AddChildDataset(image, loaded_attrs)
+    writer.SetChunking(False)
+    writer.Write()
+    os.replace(file_name + ".tmp", file_name)
@@ -0,0 +1,206 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+from collections import OrderedDict
+
+import vtk
+
+from ccpi.viewer.utils.conversion import vtkImageResampler
+from ccpi.viewer.utils.memory import cilMemoryManager
+
+
+class cilIsoSurfaceExtractor(object):
+    '''Extracts isosurfaces from a vtkImageData and caches the resulting meshes
+
+    The surface is extracted with vtkFlyingEdges3D, which runs in parallel through
+    vtkSMPTools, (vtkMarchingCubes if the former is not available) and can optionally
+    be decimated and smoothed.
+
+    Meshes are kept in a least recently used cache keyed by the isovalue, the level
+    of detail and the modified time of the input, so going back to an isovalue
+    which was already extracted does not run the extraction again. The cached meshes
+    are registered with the cilMemoryManager, which clears the cache when the buffers
+    of the viewers exceed its budget.
+
+    A coarse level is available to preview the surface quickly, i.e. while dragging
+    a slider: the surface is extracted from a copy of the input downsampled with
+    vtkImageResampler.
+
+    Example:
+    --------
+
+    >>> extractor = cilIsoSurfaceExtractor()
+    >>> extractor.SetInputData(image)
+    >>> extractor.SetTargetReduction(0.5)
+    >>> preview = extractor.GetOutput(100, coarse=True)
+    >>> surface = extractor.GetOutput(100)
+    '''
+
+    def __init__(self):
+        self._InputData = None
+        self._TargetReduction = 0.0
+        self._SmoothingIterations = 0
+        self._CoarseTargetSize = 64**3
+        self._CacheSize = 8
+        self._cache = OrderedDict()
+        self._coarse_resampler = None
+
+    def SetInputData(self, image):
+        '''Sets the vtkImageData to extract the isosurfaces from'''
+        if image is not self._InputData:
+            self._InputData = image
+            self._coarse_resampler = None
+            self.ClearCache()
+
+    def GetInputData(self):
+        return self._InputData
+
+    def SetTargetReduction(self, value):
+        '''Sets the fraction of triangles removed by decimation, 0 means no decimation'''
+        if value < 0 or value >= 1:
+            raise ValueError("Target reduction must be in [0, 1), got {}".format(value))
+        self._TargetReduction = value
+
+    def GetTargetReduction(self):
+        return self._TargetReduction
+
+    def SetSmoothingIterations(self, value):
+        '''Sets the number of iterations of windowed sinc smoothing, 0 means no smoothing'''
+        if value < 0:
+            raise ValueError("Number of smoothing iterations must be non negative, got {}".format(value))
+        self._SmoothingIterations = int(value)
+
+    def GetSmoothingIterations(self):
+        return self._SmoothingIterations
+
+    def SetCoarseTargetSize(self, value):
+        '''Sets the approximate size in bytes of the downsampled image used for the coarse level'''
+        if value != self._CoarseTargetSize:
+            self._CoarseTargetSize = int(value)
+            self._coarse_resampler = None
+
+    def GetCoarseTargetSize(self):
+        return self._CoarseTargetSize
+
+    def SetCacheSize(self, value):
+        '''Sets the maximum number of meshes kept in the cache'''
+        if value < 1:
+            raise ValueError("Cache size must be at least 1, got {}".format(value))
+        self._CacheSize = int(value)
+        self._trimCache()
+
+    def GetCacheSize(self):
+        return self._CacheSize
+
+    @staticmethod
+    def SetNumberOfThreads(value):
+        '''Sets the number of threads used by vtkSMPTools, this affects all of VTK'''
+        if vtk.vtkSMPTools.GetBackend() == "Sequential":
+            vtk.vtkSMPTools.SetBackend("STDThread")
+        vtk.vtkSMPTools.Initialize(int(value))
+
+    def ClearCache(self):
+        self._cache.clear()
+        cilMemoryManager.GetInstance().Unregister(self, 'meshes')
+
+    def IsCached(self, isovalue, coarse=False):
+        '''Returns whether the mesh for this isovalue is in the cache'''
+        return self._getKey(isovalue, coarse) in self._cache
+
+    def GetOutput(self, isovalue, coarse=False):
+        '''Returns the vtkPolyData of the isosurface at isovalue
+
+        Parameters
+        ----------
+        isovalue: float
+            value of the isosurface
+        coarse: bool, default False
+            whether to extract the surface from the downsampled image
+        '''
+        if self._InputData is None:
+            raise ValueError("Input data must be set.")
+        key = self._getKey(isovalue, coarse)
+        try:
+            mesh = self._cache[key]
+            self._cache.move_to_end(key)
+            cilMemoryManager.GetInstance().Touch(self, 'meshes')
+            return mesh
+        except KeyError:
+            pass
+
+        if coarse:
+            image = self._getCoarseImage()
+        else:
+            image = self._InputData
+        mesh = self._extract(image, isovalue)
+
+        self._cache[key] = mesh
+        self._trimCache()
+        return mesh
+
+    def _getKey(self, isovalue, coarse):
+        return (float(isovalue), bool(coarse), self._InputData.GetMTime(), self._TargetReduction,
+                self._SmoothingIterations)
+
+    def _trimCache(self):
+        while len(self._cache) > self._CacheSize:
+            self._cache.popitem(last=False)
+        if self._cache:
+            cilMemoryManager.GetInstance().Register(self,
+                                                    'meshes',
+                                                    sum(mesh.GetActualMemorySize() * 1024
+                                                        for mesh in self._cache.values()),
+                                                    evict=self.ClearCache)
+
+    def _getCoarseImage(self):
+        if self._coarse_resampler is None:
+            self._coarse_resampler = vtkImageResampler()
+            self._coarse_resampler.SetInputDataObject(self._InputData)
+            self._coarse_resampler.SetTargetSize(self._CoarseTargetSize)
+        # only runs again if the input was modified
+        self._coarse_resampler.Update()
+        return self._coarse_resampler.GetOutput()
+
+    def _extract(self, image, isovalue):
+        if hasattr(vtk, "vtkFlyingEdges3D"):
+            contour = vtk.vtkFlyingEdges3D()
+        else:
+            contour = vtk.vtkMarchingCubes()
+        contour.SetInputData(image)
+        contour.SetValue(0, isovalue)
+        contour.ComputeNormalsOff()
+        contour.ComputeScalarsOff()
+        last = contour
+
+        if self._TargetReduction > 0:
+            decimate = vtk.vtkQuadricDecimation()
+            decimate.SetInputConnection(last.GetOutputPort())
+            decimate.SetTargetReduction(self._TargetReduction)
+            last = decimate
+
+        if self._SmoothingIterations > 0:
+            smoother = vtk.vtkWindowedSincPolyDataFilter()
+            smoother.SetInputConnection(last.GetOutputPort())
+            smoother.SetNumberOfIterations(self._SmoothingIterations)
+            smoother.NormalizeCoordinatesOn()
+            last = smoother
+
+        normals = vtk.vtkPolyDataNormals()
+        normals.SetInputConnection(last.GetOutputPort())
+        normals.SplittingOff()
+        normals.Update()
+
+        # detach the mesh from the pipeline so the filters can be released
+        mesh = vtk.vtkPolyData()
+        mesh.ShallowCopy(normals.GetOutput())
+        return mesh
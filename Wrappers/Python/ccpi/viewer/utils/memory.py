@@ -0,0 +1,344 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import functools
+import inspect
+import itertools
+import logging
+import os
+import threading
+import weakref
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+def get_data_size(data):
+    '''Returns the size in bytes of a vtkDataObject, a numpy array or a number of bytes'''
+    if data is None:
+        return 0
+    if isinstance(data, (int, numpy.integer)):
+        return int(data)
+    if isinstance(data, numpy.ndarray):
+        return int(data.nbytes)
+    # vtkDataObject, in kibibytes
+    return int(data.GetActualMemorySize()) * 1024
+
+
+def get_physical_memory_size():
+    '''Returns the size in bytes of the physical memory, or None if it is not known'''
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def make_weak_callback(function):
+    '''Returns a function calling function, which does not keep alive the object of a bound method, or of a
+    functools.partial of a bound method. It does nothing once the object has been garbage collected.'''
+    method, args, keywords = function, (), {}
+    if isinstance(function, functools.partial):
+        method, args, keywords = function.func, function.args, function.keywords
+    if not inspect.ismethod(method):
+        return function
+    method = weakref.WeakMethod(method)
+
+    def callback():
+        bound_method = method()
+        if bound_method is not None:
+            bound_method(*args, **keywords)
+
+    return callback
+
+
+def format_size(size):
+    '''Formats a number of bytes for display, e.g. 1.5 GB'''
+    for unit in ['B', 'KB', 'MB']:
+        if abs(size) < 1024:
+            return '{:.0f} {}'.format(size, unit) if unit == 'B' else '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} GB'.format(size)
+
+
+class cilMemoryManager(object):
+    '''Accounts for the large buffers held by the viewers and the products of their images,
+    and keeps them within a memory budget.
+
+    Each buffer is registered with its owner, e.g. a viewer or a cilDatasetContext, a name and
+    its size. Buffers which can be computed again, i.e. caches, are registered with a function
+    which evicts them. When the registered buffers exceed the budget, the caches are evicted,
+    least recently used first, until the buffers fit. A cache which is in use, e.g. the input of
+    a mapper, is pinned by its users with Pin, and is not evicted until they unpin it or are
+    garbage collected. The buffers of an owner are unregistered
+    when it is garbage collected: the functions evicting them may be bound methods of the owner,
+    which the manager holds weakly.
+
+    Code which is about to allocate a large buffer, e.g. read an image, asks with Reserve how much
+    of it fits in the budget, and reads a coarser, downsampled, image if it does not fit.
+
+    There is one manager per process, returned by GetInstance, with a budget of half the
+    physical memory by default.
+
+    Example:
+    --------
+
+    >>> manager = cilMemoryManager.GetInstance()
+    >>> manager.SetBudget(8 * 1024**3)
+    >>> manager.Register(viewer, 'img3D', image)
+    >>> manager.Register(context, 'gradient', gradient, evict=context.ReleaseGradient)
+    >>> target_size = manager.Reserve(2 * 1024**3)
+    >>> print(manager.GetUsage(), manager.GetBuffers())
+    '''
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, budget=None):
+        '''
+        Parameters
+        ----------
+        budget: int, optional
+            maximum number of bytes of the registered buffers, unlimited if None
+        '''
+        self._Budget = None if budget is None else int(budget)
+        self._buffers = {}
+        self._owner_refs = {}
+        self._clock = itertools.count()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def GetInstance(cls):
+        '''Returns the manager shared by the viewers, with a budget of half the physical memory'''
+        with cls._instance_lock:
+            if cls._instance is None:
+                physical_memory = get_physical_memory_size()
+                cls._instance = cls(None if physical_memory is None else physical_memory // 2)
+            return cls._instance
+
+    def SetBudget(self, value):
+        '''Sets the maximum number of bytes of the registered buffers, or None for no limit,
+        and evicts the caches which do not fit'''
+        with self._lock:
+            self._Budget = None if value is None else int(value)
+        self.Enforce()
+
+    def GetBudget(self):
+        return self._Budget
+
+    def Register(self, owner, name, data, evict=None):
+        '''
+        Registers a buffer of owner, or updates its size if it is already registered,
+        then evicts the caches of the other buffers if they no longer fit in the budget.
+
+        Parameters
+        ----------
+        owner: object
+            the object holding the buffer, which must support weak references
+        name: str
+            the name of the buffer, unique for the owner
+        data: vtkDataObject, numpy.ndarray or int
+            the buffer, or its size in bytes
+        evict: callable, optional
+            function releasing the buffer when it does not fit in the budget, only for the
+            buffers which can be computed again. The buffer is unregistered when it is evicted.
+
+        Returns
+        -------
+        bool: whether the buffers fit in the budget
+        '''
+        key = (id(owner), name)
+        size = get_data_size(data)
+        with self._lock:
+            if id(owner) not in self._owner_refs:
+                self._owner_refs[id(owner)] = (weakref.ref(owner, self._makeOwnerCallback(id(owner))),
+                                               '{}@{:x}'.format(type(owner).__name__, id(owner)))
+            previous = self._buffers.get(key)
+            self._buffers[key] = {
+                'size': size,
+                'evict': None if evict is None else make_weak_callback(evict),
+                'last_used': next(self._clock),
+                # the users pinning the buffer, kept when it is registered again
+                'pinned_by': weakref.WeakSet() if previous is None else previous['pinned_by']
+            }
+        return self.Enforce(exclude=key)
+
+    def Unregister(self, owner, name=None):
+        '''Unregisters a buffer of owner, or all of its buffers if name is None'''
+        self._unregister(id(owner), name)
+
+    def IsRegistered(self, owner, name):
+        return (id(owner), name) in self._buffers
+
+    def Pin(self, owner, name, user):
+        '''
+        Pins a registered buffer of owner, so that it is not evicted while user uses it, e.g. the image
+        rendered by a viewer. The buffer is pinned until each of its users unpins it or is garbage collected.
+
+        Parameters
+        ----------
+        owner: object
+            the owner of the buffer
+        name: str
+            the name of the buffer
+        user: object
+            the object using the buffer, which must support weak references
+        '''
+        with self._lock:
+            buffer = self._buffers.get((id(owner), name))
+            if buffer is None:
+                raise KeyError("{} of {} is not registered".format(name, type(owner).__name__))
+            buffer['pinned_by'].add(user)
+
+    def Unpin(self, owner, name, user):
+        '''Unpins a buffer of owner pinned by user, see Pin. Does nothing if it is not pinned, or not registered.'''
+        with self._lock:
+            buffer = self._buffers.get((id(owner), name))
+            if buffer is not None:
+                buffer['pinned_by'].discard(user)
+
+    def IsPinned(self, owner, name):
+        with self._lock:
+            buffer = self._buffers.get((id(owner), name))
+            return buffer is not None and len(buffer['pinned_by']) > 0
+
+    def Touch(self, owner, name):
+        '''Marks a buffer as used, so that it is evicted after the caches used less recently'''
+        with self._lock:
+            buffer = self._buffers.get((id(owner), name))
+            if buffer is not None:
+                buffer['last_used'] = next(self._clock)
+
+    def GetUsage(self):
+        '''Returns the number of bytes of the registered buffers'''
+        with self._lock:
+            return sum(buffer['size'] for buffer in self._buffers.values())
+
+    def GetAvailable(self):
+        '''Returns the number of bytes left in the budget, or None if there is no budget'''
+        if self._Budget is None:
+            return None
+        return self._Budget - self.GetUsage()
+
+    def GetUsageByOwner(self):
+        '''Returns a dictionary of the number of bytes of the registered buffers, by owner description'''
+        usage = {}
+        for buffer in self.GetBuffers():
+            usage[buffer['owner']] = usage.get(buffer['owner'], 0) + buffer['size']
+        return usage
+
+    def GetBuffers(self, owner=None):
+        '''
+        Returns the registered buffers, of owner if it is given, largest first, as a list of dictionaries
+        with the keys 'owner' (a description of the owner), 'name', 'size' and 'evictable', which is
+        False for a pinned cache.
+        '''
+        with self._lock:
+            buffers = [{
+                'owner': self._owner_refs[owner_id][1],
+                'name': name,
+                'size': buffer['size'],
+                'evictable': buffer['evict'] is not None and not buffer['pinned_by']
+            } for (owner_id, name), buffer in self._buffers.items() if owner is None or owner_id == id(owner)]
+        return sorted(buffers, key=lambda buffer: -buffer['size'])
+
+    def GetUsageDescription(self):
+        '''Returns the usage and the budget for display, e.g. 1.5 GB of 8.0 GB'''
+        usage = format_size(self.GetUsage())
+        if self._Budget is None:
+            return usage
+        return '{} of {}'.format(usage, format_size(self._Budget))
+
+    def Enforce(self, required=0, exclude=None):
+        '''
+        Evicts caches, least recently used first, until the registered buffers and required more
+        bytes fit in the budget, or there is no cache left to evict.
+
+        Parameters
+        ----------
+        required: int
+            number of bytes about to be allocated
+        exclude: tuple, optional
+            (id(owner), name) of a buffer not to evict
+
+        Returns
+        -------
+        bool: whether the buffers and the required bytes fit in the budget
+        '''
+        if self._Budget is None:
+            return True
+        while True:
+            with self._lock:
+                if self.GetUsage() + required <= self._Budget:
+                    return True
+                caches = [(buffer['last_used'], key) for key, buffer in self._buffers.items()
+                          if buffer['evict'] is not None and not buffer['pinned_by'] and key != exclude]
+                if not caches:
+                    logger.warning("The buffers of the viewers use {}, more than the budget of {}".format(
+                        format_size(self.GetUsage() + required), format_size(self._Budget)))
+                    return False
+                _, key = min(caches)
+                evict = self._buffers.pop(key)['evict']
+            # the buffer is unregistered before it is evicted, in case evicting it unregisters other buffers
+            try:
+                evict()
+            except Exception:
+                logger.exception("Could not evict {} of {}".format(key[1], self._owner_refs[key[0]][1]))
+
+    def Reserve(self, size, minimum_size=0, replaced=()):
+        '''
+        Returns how many of size bytes can be allocated, after evicting the caches which do not fit.
+        If it is less than size, the caller is expected to allocate a coarser version of its buffer,
+        e.g. to read a downsampled image.
+
+        Parameters
+        ----------
+        size: int
+            number of bytes to allocate
+        minimum_size: int
+            number of bytes returned even if they do not fit in the budget
+        replaced: list of (owner, name)
+            the registered buffers which the allocation replaces, counted as free
+
+        Returns
+        -------
+        int: the number of bytes to allocate, between minimum_size and size
+        '''
+        if self._Budget is None:
+            return size
+        with self._lock:
+            freed = sum(self._buffers[(id(owner), name)]['size'] for owner, name in replaced
+                        if (id(owner), name) in self._buffers)
+        self.Enforce(required=max(0, size - freed))
+        available = self._Budget - self.GetUsage() + freed
+        return int(max(minimum_size, min(size, available)))
+
+    def _unregister(self, owner_id, name=None):
+        with self._lock:
+            if name is None:
+                keys = [key for key in self._buffers if key[0] == owner_id]
+            else:
+                keys = [(owner_id, name)]
+            for key in keys:
+                self._buffers.pop(key, None)
+            if not any(key[0] == owner_id for key in self._buffers):
+                self._owner_refs.pop(owner_id, None)
+
+    def _makeOwnerCallback(self, owner_id):
+        manager = weakref.ref(self)
+
+        def callback(_):
+            if manager() is not None:
+                manager()._unregister(owner_id)
+
+        return callback
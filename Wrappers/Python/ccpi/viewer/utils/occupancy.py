@@ -0,0 +1,203 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import weakref
+
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+
+def get_opacity_support(opacity):
+    '''Returns the interval of values outside of which a vtkPiecewiseFunction is zero
+
+    The function is linearly interpolated between its nodes and clamped outside
+    of them, so it is non zero from the node before the first non zero node to the
+    node after the last non zero node.
+
+    :param opacity: vtkPiecewiseFunction
+    :return: (lower, upper), (None, None) if the function is zero everywhere.
+    '''
+    n = opacity.GetSize()
+    if n == 0:
+        return None, None
+    nodes = numpy.empty((n, 4), dtype=numpy.float64)
+    node = [0.0] * 4
+    for i in range(n):
+        # node is x, y, midpoint, sharpness
+        opacity.GetNodeValue(i, node)
+        nodes[i] = node
+    nonzero = numpy.flatnonzero(nodes[:, 1] > 0)
+    if len(nonzero) == 0:
+        return None, None
+    first, last = nonzero[0], nonzero[-1]
+    lower = -numpy.inf if first == 0 else nodes[first - 1, 0]
+    upper = numpy.inf if last == n - 1 else nodes[last + 1, 0]
+    return lower, upper
+
+
+class cilVolumeOccupancyGrid(object):
+    '''Divides an image in blocks and finds which blocks are visible in a volume render
+
+    The minimum and maximum of the image (or of its gradient magnitude) are computed
+    once per block, and stored until the image is modified. Finding the visible
+    blocks for a new opacity transfer function then only compares the opacity
+    support against these few values, so it can be done each time the opacity
+    limits change.
+
+    The gradient magnitude is taken from the cilDatasetContext of the image if one
+    is set, so it is computed once for the volume render and the occupancy.
+
+    Example:
+    --------
+
+    >>> grid = cilVolumeOccupancyGrid()
+    >>> grid.SetInputData(image)
+    >>> grid.SetMethod('scalar')
+    >>> bounds = grid.GetCroppingBounds(opacity_function)
+    '''
+
+    def __init__(self):
+        self._InputData = None
+        self._BlockSize = 16
+        self._Method = 'scalar'
+        self._DatasetContext = None
+        self._block_range = None
+        self._block_range_key = None
+
+    def SetInputData(self, image):
+        '''Sets the vtkImageData to compute the occupancy of'''
+        self._InputData = image
+
+    def GetInputData(self):
+        return self._InputData
+
+    def SetDatasetContext(self, context):
+        '''Sets the cilDatasetContext of the input image, whose gradient magnitude is used by the 'gradient' method
+
+        The context is held with a weak reference, it is ignored once it is released or if it
+        holds another image than the input.
+        '''
+        self._DatasetContext = None if context is None else weakref.ref(context)
+
+    def GetDatasetContext(self):
+        return None if self._DatasetContext is None else self._DatasetContext()
+
+    def SetBlockSize(self, value):
+        '''Sets the size of the side of the blocks, in voxels'''
+        if value < 1:
+            raise ValueError("Block size must be at least 1, got {}".format(value))
+        self._BlockSize = int(value)
+
+    def GetBlockSize(self):
+        return self._BlockSize
+
+    def SetMethod(self, method):
+        '''Sets whether the opacity maps the image values ('scalar') or its gradient magnitude ('gradient')'''
+        if method not in ['scalar', 'gradient']:
+            raise ValueError("Method must be 'scalar' or 'gradient', got {}".format(method))
+        self._Method = method
+
+    def GetMethod(self):
+        return self._Method
+
+    def GetBlockRange(self):
+        '''Returns the minimum and maximum per block, as 2 arrays ordered as z, y, x blocks'''
+        if self._InputData is None:
+            raise ValueError("Input data must be set.")
+        key = (id(self._InputData), self._InputData.GetMTime(), self._BlockSize, self._Method)
+        if key != self._block_range_key:
+            self._block_range = self._computeBlockRange()
+            self._block_range_key = key
+        return self._block_range
+
+    def GetOccupancy(self, lower, upper):
+        '''Returns a boolean array of the blocks with values in the open interval (lower, upper)
+
+        Each block is dilated by one block, so that interpolation and gradient
+        computation across block borders is accounted for.
+        '''
+        bmin, bmax = self.GetBlockRange()
+        if lower is None or upper is None:
+            return numpy.zeros(bmin.shape, dtype=bool)
+        occupied = (bmax > lower) & (bmin < upper)
+        dilated = occupied.copy()
+        for axis in range(3):
+            n = occupied.shape[axis]
+            if n < 2:
+                continue
+            lead = [slice(None)] * 3
+            trail = [slice(None)] * 3
+            lead[axis] = slice(1, None)
+            trail[axis] = slice(0, n - 1)
+            dilated[tuple(trail)] |= occupied[tuple(lead)]
+            dilated[tuple(lead)] |= occupied[tuple(trail)]
+        return dilated
+
+    def GetCroppingExtent(self, opacity):
+        '''Returns the voxel extent containing all the blocks visible with the opacity function
+
+        :param opacity: vtkPiecewiseFunction
+        :return: extent as (xmin, xmax, ymin, ymax, zmin, zmax) or None if no block is visible
+        '''
+        occupied = self.GetOccupancy(*get_opacity_support(opacity))
+        if not occupied.any():
+            return None
+        whole_extent = self._InputData.GetExtent()
+        bs = self._BlockSize
+        extent = []
+        # occupied is ordered z, y, x
+        for i, axis in enumerate((2, 1, 0)):
+            other = tuple(a for a in range(3) if a != axis)
+            indices = numpy.flatnonzero(occupied.any(axis=other))
+            start = whole_extent[2 * i]
+            extent.append(start + indices[0] * bs)
+            extent.append(min(start + (indices[-1] + 1) * bs - 1, whole_extent[2 * i + 1]))
+        return tuple(extent)
+
+    def GetCroppingBounds(self, opacity):
+        '''Returns the world bounds containing all the blocks visible with the opacity function
+
+        :param opacity: vtkPiecewiseFunction
+        :return: bounds as (xmin, xmax, ymin, ymax, zmin, zmax) or None if no block is visible
+        '''
+        extent = self.GetCroppingExtent(opacity)
+        if extent is None:
+            return None
+        origin = self._InputData.GetOrigin()
+        spacing = self._InputData.GetSpacing()
+        return tuple(origin[i // 2] + spacing[i // 2] * extent[i] for i in range(6))
+
+    def _computeBlockRange(self):
+        image = self._InputData
+        context = self.GetDatasetContext()
+        if self._Method == 'gradient' and context is not None and context.GetImage() is image:
+            image = context.GetGradientMagnitude()
+        elif self._Method == 'gradient':
+            grad = vtk.vtkImageGradientMagnitude()
+            grad.SetInputData(image)
+            grad.SetDimensionality(3)
+            grad.Update()
+            image = grad.GetOutput()
+
+        dims = image.GetDimensions()
+        array = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+        # VTK is x fastest, so this is ordered z, y, x
+        array = array.reshape(dims[::-1])
+
+        bmin, bmax = array, array
+        for axis in range(3):
+            starts = numpy.arange(0, array.shape[axis], self._BlockSize)
+            bmin = numpy.minimum.reduceat(bmin, starts, axis=axis)
+            bmax = numpy.maximum.reduceat(bmax, starts, axis=axis)
+        return bmin, bmax
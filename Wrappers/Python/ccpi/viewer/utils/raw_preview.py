@@ -0,0 +1,314 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import os
+
+import numpy
+from ccpi.viewer.utils.conversion import Converter
+
+
+class cilRawPreview(object):
+    '''Reads slices of a raw file through a memory map, for previewing the file
+    while its shape, data type and byte ordering are being guessed.
+
+    The parameters are the same as those of cilRawCroppedReader. Changing them only
+    changes how the memory map is decoded, so each slice is read from the file
+    when it is requested, without writing any temporary file.
+
+    InferParameters ranks the combinations of data type, byte ordering and dimensions
+    which could describe the file, see its docstring.
+
+    Example:
+    --------
+
+    >>> preview = cilRawPreview('scan.raw')
+    >>> preview.SetStoredArrayShape((512, 512, 100))
+    >>> preview.SetTypeCodeName('uint16')
+    >>> preview.SetBigEndian(False)
+    >>> image = preview.GetSliceImage(50)
+    >>> candidates = preview.InferParameters()
+    '''
+
+    # the score of a candidate is lowered by this much per decade of its aspect ratio,
+    # as a stack of slices also reads as a single wide slice with well correlated rows
+    aspect_ratio_penalty = 0.05
+
+    def __init__(self, file_name=None):
+        self._FileName = file_name
+        self._StoredArrayShape = None
+        self._TypeCodeName = 'uint8'
+        self._BigEndian = False
+        self._IsFortran = True
+        self._MemoryMap = None
+
+    def SetFileName(self, value):
+        self._FileName = value
+        self._MemoryMap = None
+
+    def GetFileName(self):
+        return self._FileName
+
+    def SetStoredArrayShape(self, value):
+        '''Sets the shape of the 2D or 3D array stored in the file, in the order given by IsFortran'''
+        if not isinstance(value, (list, tuple)) or len(value) not in (2, 3):
+            raise ValueError('Shape must be a list or tuple of 2 or 3 dimensions. Got {}'.format(value))
+        value = tuple(int(dim) for dim in value)
+        if value != self._StoredArrayShape:
+            self._StoredArrayShape = value
+            self._MemoryMap = None
+
+    def GetStoredArrayShape(self):
+        return self._StoredArrayShape
+
+    def SetTypeCodeName(self, value):
+        value = numpy.dtype(value).name
+        if value != self._TypeCodeName:
+            self._TypeCodeName = value
+            self._MemoryMap = None
+
+    def GetTypeCodeName(self):
+        return self._TypeCodeName
+
+    def SetBigEndian(self, value):
+        value = bool(value)
+        if value != self._BigEndian:
+            self._BigEndian = value
+            self._MemoryMap = None
+
+    def GetBigEndian(self):
+        return self._BigEndian
+
+    def SetIsFortran(self, value):
+        '''Whether the first dimension of the shape varies fastest in the file, i.e. Width-Height-Images'''
+        value = bool(value)
+        if value != self._IsFortran:
+            self._IsFortran = value
+            self._MemoryMap = None
+
+    def GetIsFortran(self):
+        return self._IsFortran
+
+    def GetDataType(self):
+        '''Returns the numpy dtype of the elements in the file, with its byte ordering'''
+        return numpy.dtype(self._TypeCodeName).newbyteorder('>' if self._BigEndian else '<')
+
+    def GetFileSize(self):
+        return os.stat(self._FileName).st_size
+
+    def GetExpectedFileSize(self):
+        '''Returns the size in bytes of an array with the current shape and data type'''
+        return int(numpy.prod(self._StoredArrayShape)) * self.GetDataType().itemsize
+
+    def GetNumberOfSlices(self):
+        '''Returns the number of slices, along the dimension which varies slowest in the file'''
+        if len(self._StoredArrayShape) == 2:
+            return 1
+        return self._StoredArrayShape[2] if self._IsFortran else self._StoredArrayShape[0]
+
+    def GetSlice(self, slice_number=0):
+        '''Returns a slice as a 2D array in the native byte ordering, with the dimension
+        which varies fastest in the file as its columns.
+
+        Raises a ValueError if the file is smaller than the current parameters describe
+        and an IndexError if the slice number is out of range.'''
+        if not 0 <= slice_number < self.GetNumberOfSlices():
+            raise IndexError('Slice {} is out of range, the image has {} slices'.format(
+                slice_number, self.GetNumberOfSlices()))
+        array = self._GetMemoryMap()
+        if array.ndim == 2:
+            image = array
+        elif self._IsFortran:
+            image = array[:, :, slice_number]
+        else:
+            image = array[slice_number]
+        if self._IsFortran:
+            image = image.T
+        return numpy.ascontiguousarray(image, dtype=image.dtype.newbyteorder('='))
+
+    def GetSliceImage(self, slice_number=0):
+        '''Returns a slice as a vtkImageData, see GetSlice'''
+        return Converter.numpy2vtkImage(self.GetSlice(slice_number), deep=1)
+
+    def _GetMemoryMap(self):
+        if self._StoredArrayShape is None:
+            raise ValueError('StoredArrayShape must be set.')
+        if self._MemoryMap is None:
+            file_size = self.GetFileSize()
+            expected_size = self.GetExpectedFileSize()
+            if file_size < expected_size:
+                raise ValueError(
+                    'The file size is smaller than expected.\nThe file size is {} bytes, while the expected size is {} bytes'
+                    .format(file_size, expected_size))
+            if expected_size == 0:
+                raise ValueError('The shape {} has no elements'.format(self._StoredArrayShape))
+            self._MemoryMap = numpy.memmap(self._FileName,
+                                           dtype=self.GetDataType(),
+                                           mode='r',
+                                           shape=self._StoredArrayShape,
+                                           order='F' if self._IsFortran else 'C')
+        return self._MemoryMap
+
+    def InferParameters(self,
+                        typecodes=None,
+                        number_of_candidates=10,
+                        min_dimension=8,
+                        number_of_samples=32,
+                        sample_length=256):
+        '''Ranks the data types, byte orderings and dimensions which could describe the file.
+
+        Only the combinations whose size is exactly the size of the file are considered.
+        Each one is scored on values sampled from the file, number_of_samples runs of
+        sample_length values, by the correlation of neighbouring values:
+
+        - along the rows, which is low for the wrong data type or byte ordering,
+        - between rows, which is high when the width is right,
+        - between slices, which is high when the height is right,
+
+        and by the aspect ratio of the slices, which favours stacks of slices over single wide slices.
+
+        The candidates are described in the Width-Height-Images ordering.
+
+        Parameters
+        ----------
+        typecodes: list, optional
+            names of the numpy data types to consider, those of Converter.dtype_name_to_vtkType if None
+        number_of_candidates: int
+            maximum number of candidates to return
+        min_dimension: int
+            minimum size of the width and the height
+
+        Returns
+        -------
+        list of dict
+            The candidates, best first, with the keys 'shape', 'typecode', 'is_big_endian', 'is_fortran'
+            and 'score', between -1 and 1.
+        '''
+        if typecodes is None:
+            typecodes = list(Converter.dtype_name_to_vtkType.keys())
+        file_size = self.GetFileSize()
+        candidates = []
+        # the typical magnitude of the values breaks the ties between byte orderings, e.g. small integers
+        # read in the wrong byte ordering are the same values times 256, as well correlated
+        magnitudes = []
+        for typecode in typecodes:
+            dtype = numpy.dtype(typecode)
+            if file_size % dtype.itemsize != 0:
+                continue
+            length = file_size // dtype.itemsize
+            # the byte ordering of single bytes does not matter
+            byte_orders = [False] if dtype.itemsize == 1 else [True, False]
+            for is_big_endian in byte_orders:
+                values = numpy.memmap(self._FileName,
+                                      dtype=dtype.newbyteorder('>' if is_big_endian else '<'),
+                                      mode='r',
+                                      shape=(length, ))
+                shapes = self._RankShapes(values, dtype.name, is_big_endian, min_dimension, number_of_samples,
+                                          sample_length)
+                candidates.extend(shapes)
+                magnitudes.extend([_sampled_magnitude(values, number_of_samples, sample_length)] * len(shapes))
+                del values
+        # signed and unsigned integers read the same non negative values, the unsigned ones are more common
+        order = sorted(
+            range(len(candidates)),
+            key=lambda i:
+            (-round(candidates[i]['score'], 6), magnitudes[i], numpy.dtype(candidates[i]['typecode']).kind == 'i'))
+        return [candidates[i] for i in order[:number_of_candidates]]
+
+    def _RankShapes(self, values, typecode, is_big_endian, min_dimension, number_of_samples, sample_length):
+        length = len(values)
+        row_score = _sampled_correlation(values, 1, number_of_samples, sample_length)
+        widths = [width for width in _divisors(length) if min_dimension <= width <= length // min_dimension]
+        width_scores = {
+            width: _sampled_correlation(values, width, number_of_samples, sample_length)
+            for width in widths
+        }
+        # the heights are only searched for the most likely widths
+        best_widths = sorted(widths, key=lambda width: -width_scores[width])[:3]
+        candidates = []
+        for width in best_widths:
+            rows = length // width
+            for height in _divisors(rows):
+                if height < min_dimension:
+                    continue
+                images = rows // height
+                if images == 1:
+                    shape = [width, height]
+                    # there is no neighbouring slice to compare to
+                    slice_score = width_scores[width]
+                else:
+                    shape = [width, height, images]
+                    slice_score = _sampled_correlation(values, width * height, number_of_samples, sample_length)
+                candidates.append({
+                    'shape':
+                    shape,
+                    'typecode':
+                    typecode,
+                    'is_big_endian':
+                    is_big_endian,
+                    'is_fortran':
+                    True,
+                    'score':
+                    float((row_score + width_scores[width] + slice_score) / 3 -
+                          self.aspect_ratio_penalty * abs(numpy.log10(width / height)))
+                })
+        return candidates
+
+
+def _divisors(number):
+    '''Returns the divisors of number in increasing order'''
+    small, large = [], []
+    divisor = 1
+    while divisor * divisor <= number:
+        if number % divisor == 0:
+            small.append(divisor)
+            if divisor * divisor != number:
+                large.append(number // divisor)
+        divisor += 1
+    return small + large[::-1]
+
+
+def _sampled_magnitude(values, number_of_samples, sample_length):
+    '''Median of the absolute values in runs of sample_length values spread over the array'''
+    sample_length = min(sample_length, len(values))
+    starts = numpy.linspace(0, len(values) - sample_length, number_of_samples).astype(numpy.int64)
+    indices = (starts[:, None] + numpy.arange(sample_length)[None, :]).ravel()
+    with numpy.errstate(invalid='ignore', over='ignore'):
+        magnitude = numpy.abs(numpy.asarray(values[indices], dtype=numpy.float64))
+    magnitude[~numpy.isfinite(magnitude)] = numpy.inf
+    return float(numpy.median(magnitude))
+
+
+def _sampled_correlation(values, lag, number_of_samples, sample_length):
+    '''Correlation between the values and those lag elements further, in runs of sample_length values
+    spread over the array. Values which are not finite or implausibly large, as read with the wrong
+    data type or byte ordering, lower the correlation.'''
+    length = len(values)
+    sample_length = min(sample_length, length - lag)
+    if sample_length <= 0:
+        return 0.
+    starts = numpy.linspace(0, length - lag - sample_length, number_of_samples).astype(numpy.int64)
+    indices = (starts[:, None] + numpy.arange(sample_length)[None, :]).ravel()
+    with numpy.errstate(invalid='ignore', over='ignore'):
+        first = numpy.asarray(values[indices], dtype=numpy.float64)
+        second = numpy.asarray(values[indices + lag], dtype=numpy.float64)
+        valid = numpy.isfinite(first) & numpy.isfinite(second) & (numpy.abs(first) < 1e30) & (numpy.abs(second) < 1e30)
+    if not numpy.any(valid):
+        return 0.
+    first, second = first[valid], second[valid]
+    first = first - first.mean()
+    second = second - second.mean()
+    norm = numpy.sqrt(numpy.dot(first, first) * numpy.dot(second, second))
+    if norm == 0:
+        # constant values, e.g. padding, say nothing about the parameters
+        return 0.
+    return float(numpy.dot(first, second) / norm) * numpy.count_nonzero(valid) / len(valid)
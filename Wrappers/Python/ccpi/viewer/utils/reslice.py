@@ -0,0 +1,186 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import math
+from collections import OrderedDict
+
+import vtk
+from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+
+def same_sampling(image1, image2, tolerance=1e-6):
+    '''Returns whether 2 vtkImageData have the same extent, spacing and origin'''
+    if image1.GetExtent() != image2.GetExtent():
+        return False
+    for a, b in zip(image1.GetSpacing() + image1.GetOrigin(), image2.GetSpacing() + image2.GetOrigin()):
+        if abs(a - b) > tolerance * max(1., abs(a), abs(b)):
+            return False
+    return True
+
+
+class cilResampleToReference(VTKPythonAlgorithmBase):
+    '''vtkAlgorithm to resample an image on the grid of a reference image
+
+    The image on input port 0 is resampled on the extent, spacing and origin of
+    the reference image on input port 1, using only the spacing and origin of the
+    images (no registration). Voxels of the output outside of the image are set
+    to 0.
+
+    Only the update extent of the output is computed, and only the part of the
+    image covering it is requested upstream, so a vtkExtractVOI of a slice
+    downstream only resamples that slice. The resampled extents are kept in a
+    least recently used cache, which is cleared when either input is modified.
+
+    Example:
+    --------
+
+    >>> resample = cilResampleToReference()
+    >>> resample.SetInputDataObject(0, image2)
+    >>> resample.SetInputDataObject(1, image1)
+    >>> voi = vtk.vtkExtractVOI()
+    >>> voi.SetInputConnection(resample.GetOutputPort())
+    '''
+
+    def __init__(self):
+        VTKPythonAlgorithmBase.__init__(self,
+                                        nInputPorts=2,
+                                        inputType="vtkImageData",
+                                        nOutputPorts=1,
+                                        outputType="vtkImageData")
+        self._InterpolationMode = 'nearest'
+        self._CacheSize = 16
+        self._cache = OrderedDict()
+        self._cache_key = None
+
+    def SetInterpolationMode(self, value):
+        '''Sets the interpolation of the image, 'nearest' or 'linear' '''
+        if value not in ['nearest', 'linear']:
+            raise ValueError("Interpolation mode must be 'nearest' or 'linear', got {}".format(value))
+        if value != self._InterpolationMode:
+            self._InterpolationMode = value
+            self.Modified()
+
+    def GetInterpolationMode(self):
+        return self._InterpolationMode
+
+    def SetCacheSize(self, value):
+        '''Sets the maximum number of resampled extents kept in the cache'''
+        if value < 1:
+            raise ValueError("Cache size must be at least 1, got {}".format(value))
+        self._CacheSize = int(value)
+        self._trimCache()
+
+    def GetCacheSize(self):
+        return self._CacheSize
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        sddp = vtk.vtkStreamingDemandDrivenPipeline
+        image_info = inInfo[0].GetInformationObject(0)
+        reference_info = inInfo[1].GetInformationObject(0)
+        out_info = outInfo.GetInformationObject(0)
+        out_info.Set(sddp.WHOLE_EXTENT(), reference_info.Get(sddp.WHOLE_EXTENT()), 6)
+        out_info.Set(vtk.vtkDataObject.SPACING(), reference_info.Get(vtk.vtkDataObject.SPACING()), 3)
+        out_info.Set(vtk.vtkDataObject.ORIGIN(), reference_info.Get(vtk.vtkDataObject.ORIGIN()), 3)
+        scalar_info = vtk.vtkDataObject.GetActiveFieldInformation(image_info,
+                                                                  vtk.vtkDataObject.FIELD_ASSOCIATION_POINTS,
+                                                                  vtk.vtkDataSetAttributes.SCALARS)
+        if scalar_info is not None:
+            vtk.vtkDataObject.SetPointDataActiveScalarInfo(
+                out_info, scalar_info.Get(vtk.vtkDataObject.FIELD_ARRAY_TYPE()),
+                scalar_info.Get(vtk.vtkDataObject.FIELD_NUMBER_OF_COMPONENTS()))
+        return 1
+
+    def RequestUpdateExtent(self, request, inInfo, outInfo):
+        sddp = vtk.vtkStreamingDemandDrivenPipeline
+        image_info = inInfo[0].GetInformationObject(0)
+        reference_info = inInfo[1].GetInformationObject(0)
+        out_info = outInfo.GetInformationObject(0)
+        update_extent = out_info.Get(sddp.UPDATE_EXTENT())
+        reference_whole_extent = reference_info.Get(sddp.WHOLE_EXTENT())
+        # the reference is only needed for its geometry
+        reference_info.Set(sddp.UPDATE_EXTENT(), reference_whole_extent, 6)
+        image_info.Set(
+            sddp.UPDATE_EXTENT(),
+            self.GetImageExtent(update_extent, reference_info.Get(vtk.vtkDataObject.SPACING()),
+                                reference_info.Get(vtk.vtkDataObject.ORIGIN()), image_info.Get(sddp.WHOLE_EXTENT()),
+                                image_info.Get(vtk.vtkDataObject.SPACING()),
+                                image_info.Get(vtk.vtkDataObject.ORIGIN())), 6)
+        return 1
+
+    @staticmethod
+    def GetImageExtent(extent, spacing, origin, image_whole_extent, image_spacing, image_origin):
+        '''Returns the extent of the image covering the extent of the reference grid
+
+        The extent is padded by one voxel for interpolation and clamped to the
+        whole extent of the image.
+        '''
+        image_extent = []
+        for i in range(3):
+            lower = (origin[i] + spacing[i] * extent[2 * i] - image_origin[i]) / image_spacing[i]
+            upper = (origin[i] + spacing[i] * extent[2 * i + 1] - image_origin[i]) / image_spacing[i]
+            lower, upper = min(lower, upper), max(lower, upper)
+            lower = min(max(math.floor(lower) - 1, image_whole_extent[2 * i]), image_whole_extent[2 * i + 1])
+            upper = max(min(math.ceil(upper) + 1, image_whole_extent[2 * i + 1]), lower)
+            image_extent += [lower, upper]
+        return image_extent
+
+    def RequestData(self, request, inInfo, outInfo):
+        image = vtk.vtkImageData.GetData(inInfo[0])
+        reference = vtk.vtkImageData.GetData(inInfo[1])
+        outData = vtk.vtkImageData.GetData(outInfo)
+        out_info = outInfo.GetInformationObject(0)
+        update_extent = tuple(out_info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT()))
+
+        self._checkCache(reference)
+        try:
+            self._cache.move_to_end(update_extent)
+        except KeyError:
+            self._cache[update_extent] = self._resample(image, reference, update_extent)
+            self._trimCache()
+        outData.ShallowCopy(self._cache[update_extent])
+        return 1
+
+    def _resample(self, image, reference, extent):
+        reslice = vtk.vtkImageReslice()
+        reslice.SetInputData(image)
+        reslice.SetOutputExtent(extent)
+        reslice.SetOutputSpacing(reference.GetSpacing())
+        reslice.SetOutputOrigin(reference.GetOrigin())
+        if self._InterpolationMode == 'linear':
+            reslice.SetInterpolationModeToLinear()
+        else:
+            reslice.SetInterpolationModeToNearestNeighbor()
+        reslice.SetBackgroundLevel(0)
+        reslice.Update()
+        resampled = vtk.vtkImageData()
+        resampled.DeepCopy(reslice.GetOutput())
+        scalars = image.GetPointData().GetScalars()
+        if scalars is not None and scalars.GetName() is not None:
+            resampled.GetPointData().GetScalars().SetName(scalars.GetName())
+        return resampled
+
+    def _checkCache(self, reference):
+        # the pipeline modified time of the image accounts for the filters upstream,
+        # i.e. a slab projection, while the output data of a filter is new at each execution
+        key = (self.GetInputAlgorithm(0, 0).GetExecutive().GetPipelineMTime(), id(reference), reference.GetMTime(),
+               self._InterpolationMode)
+        if key != self._cache_key:
+            self._cache.clear()
+            self._cache_key = key
+
+    def _trimCache(self):
+        while len(self._cache) > self._CacheSize:
+            self._cache.popitem(last=False)
@@ -1,6 +1,8 @@
 TOOLTIPS_3D_TOOLBAR = {
     "viewer_menu_button": "Access the viewer's slice and volume render settings",
-    "camera_menu_button": "Access the viewer's camera settings"
+    "camera_menu_button": "Access the viewer's camera settings",
+    "isosurface_checkbox": "Toggle the visibility of the isosurface",
+    "isosurface_slider": "Adjust the isovalue as a percentage of the image's intensity range"
 }
 
 TOOLTIPS_IMAGE_SETTINGS = {
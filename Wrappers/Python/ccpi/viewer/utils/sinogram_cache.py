@@ -0,0 +1,334 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+import h5py
+import numpy
+from vtkmodules.vtkCommonDataModel import vtkDataObject, vtkImageData
+from vtkmodules.vtkCommonExecutionModel import vtkStreamingDemandDrivenPipeline
+from vtkmodules.vtkImagingCore import vtkExtractVOI
+from ccpi.viewer.utils.conversion import Converter
+from vtkmodules.util import numpy_support
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+logger = logging.getLogger(__name__)
+
+SINOGRAM_DATASET_NAME = 'sinograms'
+
+
+def get_projections_info(file_name, dataset_name=None):
+    '''Returns the shape and dtype of the projections stored in a .npy or HDF5 file'''
+    if os.path.splitext(file_name)[1] == '.npy':
+        array = numpy.load(file_name, mmap_mode='r')
+        return array.shape, array.dtype
+    with h5py.File(file_name, 'r') as f:
+        return f[dataset_name].shape, f[dataset_name].dtype
+
+
+def read_projections(file_name, dataset_name, index):
+    '''Reads the index, a tuple of slices ordered as (projection, row, column), from a .npy or HDF5 file'''
+    if os.path.splitext(file_name)[1] == '.npy':
+        return numpy.array(numpy.load(file_name, mmap_mode='r')[index])
+    with h5py.File(file_name, 'r') as f:
+        return f[dataset_name][index]
+
+
+class cilSinogramCache(object):
+    '''Transposed copy of acquisition data, stored sinogram by sinogram in a HDF5 file
+
+    Acquisition data is stored as one projection per z, so reading a sinogram
+    (all the projections of one detector row) from the file reads a short piece
+    of every projection. The cache stores the data as (row, projection, column),
+    chunked by row, so that reading sinograms reads contiguous data.
+
+    The cache is built once, by blocks of rows using at most MemoryLimit bytes,
+    and reused as long as the source file is not modified. It can be built in a
+    background thread.
+
+    Example:
+    --------
+
+    >>> cache = cilSinogramCache('projections.h5', 'entry1/tomo_entry/data/data')
+    >>> cache.BuildInBackground()
+    >>> cache.Wait()
+    >>> sinogram = cache.GetSinograms(slice(10, 11))[0]
+    '''
+
+    def __init__(self, file_name, dataset_name=None, cache_file_name=None, memory_limit=256 * 1024**2):
+        self._FileName = os.path.abspath(file_name)
+        self._DatasetName = dataset_name
+        if cache_file_name is None:
+            cache_file_name = self.GetDefaultCacheFileName(self._FileName, dataset_name)
+        self._CacheFileName = cache_file_name
+        self._MemoryLimit = int(memory_limit)
+        self._ElementSpacing = (1., 1., 1.)
+        self._Origin = (0., 0., 0.)
+        self._Shape, self._Dtype = get_projections_info(self._FileName, dataset_name)
+        if len(self._Shape) != 3:
+            raise ValueError("Expected 3D acquisition data, got shape {}".format(self._Shape))
+        self._progress = 0.
+        self._error = None
+        # whether the cache is ready, None until the files are checked
+        self._ready = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def GetDefaultCacheFileName(file_name, dataset_name=None):
+        '''Returns the cache file name in the temporary directory, unique to the file and dataset'''
+        key = "{}:{}".format(os.path.abspath(file_name), dataset_name).encode('utf-8')
+        return os.path.join(tempfile.gettempdir(), 'cilviewer', 'sinograms_{}.h5'.format(hashlib.sha1(key).hexdigest()))
+
+    def GetFileName(self):
+        return self._FileName
+
+    def GetDatasetName(self):
+        return self._DatasetName
+
+    def GetCacheFileName(self):
+        return self._CacheFileName
+
+    def GetShape(self):
+        '''Returns the shape of the acquisition data, as (projection, row, column)'''
+        return self._Shape
+
+    def GetDtype(self):
+        return self._Dtype
+
+    def SetMemoryLimit(self, value):
+        '''Sets the maximum number of bytes read at once while building the cache'''
+        self._MemoryLimit = int(value)
+
+    def GetMemoryLimit(self):
+        return self._MemoryLimit
+
+    def SetElementSpacing(self, value):
+        '''Sets the spacing of the acquisition data, ordered x, y, z'''
+        self._ElementSpacing = tuple(value)
+
+    def GetElementSpacing(self):
+        return self._ElementSpacing
+
+    def SetOrigin(self, value):
+        '''Sets the origin of the acquisition data, ordered x, y, z'''
+        self._Origin = tuple(value)
+
+    def GetOrigin(self):
+        return self._Origin
+
+    def GetProgress(self):
+        '''Returns the fraction of the cache built, between 0 and 1'''
+        return self._progress
+
+    def GetError(self):
+        '''Returns the exception raised while building the cache in the background, if any'''
+        return self._error
+
+    def IsReady(self):
+        '''Returns whether the cache is complete and up to date with the source file
+
+        The files are checked the first time and after Refresh only, then the cache is ready once
+        Build has replaced the cache file, so the viewers can call this on every update.
+        '''
+        if self._ready is None:
+            self._ready = self._checkReady()
+            if self._ready:
+                self._progress = 1.
+        return self._ready
+
+    def Refresh(self):
+        '''Checks the files again on the next call to IsReady, e.g. when the cache is attached to a viewer'''
+        self._ready = None
+
+    def Build(self, progress_callback=None):
+        '''Builds the cache, if it is not ready
+
+        The projections are read by blocks of rows, each block fitting in
+        MemoryLimit bytes, transposed and written to a temporary file, which
+        replaces the cache file when it is complete.
+
+        :param progress_callback: called with the fraction of the cache built, optional
+        '''
+        self.Refresh()
+        if self.IsReady():
+            return
+        n_projections, n_rows, n_columns = self._Shape
+        row_size = n_projections * n_columns * self._Dtype.itemsize
+        rows_per_block = max(1, self._MemoryLimit // row_size)
+        # HDF5 chunks must be smaller than 4 GB
+        chunk_projections = min(n_projections, max(1, 2**31 // (n_columns * self._Dtype.itemsize)))
+        source_key = self._getSourceKey()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self._CacheFileName)), exist_ok=True)
+        partial_file_name = self._CacheFileName + '.part'
+        self._progress = 0.
+        try:
+            with h5py.File(partial_file_name, 'w') as f:
+                dset = f.create_dataset(SINOGRAM_DATASET_NAME, (n_rows, n_projections, n_columns),
+                                        dtype=self._Dtype,
+                                        chunks=(1, chunk_projections, n_columns))
+                for start in range(0, n_rows, rows_per_block):
+                    if self._stop.is_set():
+                        raise InterruptedError("Building the sinogram cache was stopped.")
+                    stop = min(start + rows_per_block, n_rows)
+                    block = read_projections(self._FileName, self._DatasetName,
+                                             (slice(None), slice(start, stop), slice(None)))
+                    dset[start:stop] = block.transpose(1, 0, 2)
+                    self._progress = stop / n_rows
+                    if progress_callback is not None:
+                        progress_callback(self._progress)
+                dset.attrs['source_file'] = self._FileName
+                dset.attrs['source_dataset'] = str(self._DatasetName)
+                dset.attrs['source_key'] = source_key
+            os.replace(partial_file_name, self._CacheFileName)
+            self._ready = True
+        except BaseException:
+            if os.path.exists(partial_file_name):
+                os.remove(partial_file_name)
+            raise
+        logger.info("Built sinogram cache {}".format(self._CacheFileName))
+
+    def BuildInBackground(self, progress_callback=None):
+        '''Builds the cache in a background thread, returns the thread'''
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._error = None
+        self._thread = threading.Thread(target=self._buildInBackground, args=(progress_callback, ), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def Wait(self, timeout=None):
+        '''Waits for the background build to finish, returns whether the cache is ready'''
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.IsReady()
+
+    def Stop(self):
+        '''Stops the background build'''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def GetSinograms(self, rows, projections=slice(None), columns=slice(None)):
+        '''Reads from the cache, returns an array ordered as (row, projection, column)'''
+        with h5py.File(self._CacheFileName, 'r') as f:
+            return f[SINOGRAM_DATASET_NAME][rows, projections, columns]
+
+    def _buildInBackground(self, progress_callback):
+        try:
+            self.Build(progress_callback)
+        except Exception as e:
+            self._error = e
+            if not isinstance(e, InterruptedError):
+                logger.error("Building sinogram cache failed: {}".format(e))
+
+    def _checkReady(self):
+        if not os.path.exists(self._CacheFileName):
+            return False
+        try:
+            with h5py.File(self._CacheFileName, 'r') as f:
+                attrs = f[SINOGRAM_DATASET_NAME].attrs
+                return (attrs['source_file'] == self._FileName and attrs['source_dataset'] == str(self._DatasetName)
+                        and tuple(attrs['source_key']) == self._getSourceKey())
+        except (OSError, KeyError):
+            return False
+
+    def _getSourceKey(self):
+        stat = os.stat(self._FileName)
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+class cilAcquisitionDataReader(VTKPythonAlgorithmBase):
+    '''vtkAlgorithm to read the update extent of acquisition data, using a sinogram cache if ready
+
+    The data is read from the source file of the cilSinogramCache, and its
+    output is the whole acquisition data, one projection per z. Only the update
+    extent is read. If the cache is ready and the update extent has fewer rows (y)
+    than projections (z), i.e. it is a stack of sinograms, it is read from the
+    cache, otherwise from the source file.
+
+    Example:
+    --------
+
+    >>> reader = cilAcquisitionDataReader()
+    >>> reader.SetSinogramCache(cache)
+    >>> voi = vtkExtractVOI()
+    >>> voi.SetInputConnection(reader.GetOutputPort())
+    >>> voi.SetVOI(0, 99, 10, 10, 0, 179)
+    '''
+
+    def __init__(self):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType='vtkImageData')
+        self._SinogramCache = None
+        self._last_read_from_cache = False
+
+    def SetSinogramCache(self, cache):
+        if cache is not self._SinogramCache:
+            self._SinogramCache = cache
+            if cache is not None:
+                cache.Refresh()
+            self.Modified()
+
+    def GetSinogramCache(self):
+        return self._SinogramCache
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def GetLastReadFromCache(self):
+        '''Returns whether the last update read from the sinogram cache'''
+        return self._last_read_from_cache
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        cache = self._getCache()
+        n_projections, n_rows, n_columns = cache.GetShape()
+        info = outInfo.GetInformationObject(0)
+        info.Set(vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(),
+                 (0, n_columns - 1, 0, n_rows - 1, 0, n_projections - 1), 6)
+        info.Set(vtkDataObject.SPACING(), cache.GetElementSpacing(), 3)
+        info.Set(vtkDataObject.ORIGIN(), cache.GetOrigin(), 3)
+        vtkDataObject.SetPointDataActiveScalarInfo(info, Converter.dtype_name_to_vtkType[cache.GetDtype().name], 1)
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        cache = self._getCache()
+        info = outInfo.GetInformationObject(0)
+        ue = info.Get(vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT())
+        columns = slice(ue[0], ue[1] + 1)
+        rows = slice(ue[2], ue[3] + 1)
+        projections = slice(ue[4], ue[5] + 1)
+        self._last_read_from_cache = (ue[3] - ue[2]) < (ue[5] - ue[4]) and cache.IsReady()
+        if self._last_read_from_cache:
+            data = cache.GetSinograms(rows, projections, columns).transpose(1, 0, 2)
+        else:
+            data = read_projections(cache.GetFileName(), cache.GetDatasetName(), (projections, rows, columns))
+        # VTK is x fastest, i.e. the C order of (projection, row, column)
+        data = numpy.ascontiguousarray(data)
+
+        output = vtkImageData.GetData(outInfo)
+        output.SetExtent(ue)
+        output.SetSpacing(cache.GetElementSpacing())
+        output.SetOrigin(cache.GetOrigin())
+        output.GetPointData().SetScalars(numpy_support.numpy_to_vtk(data.ravel(), deep=0))
+        return 1
+
+    def _getCache(self):
+        if self._SinogramCache is None:
+            raise ValueError("SinogramCache must be set.")
+        return self._SinogramCache
@@ -0,0 +1,249 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import math
+from collections import OrderedDict
+
+import numpy
+import vtk
+from vtk.util import numpy_support
+from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+SLAB_PROJECTIONS = ['max', 'min', 'mean']
+
+
+class cilSlabProjection(VTKPythonAlgorithmBase):
+    '''vtkAlgorithm to project a slab of slices of a vtkImageData onto a slice
+
+    The output has the same whole extent as the input, and each slice of the
+    output along the orientation axis is the maximum ('max'), minimum ('min') or
+    mean ('mean') of the slab of Thickness slices of the input centred on it.
+    The maximum and minimum have the type of the input, the mean is float32, or
+    float64 if float32 cannot hold the values of the input exactly.
+    Only the slices in the update extent are computed, so a vtkExtractVOI of a
+    single slice downstream only computes the projection for that slice.
+
+    Moving the slab by a few slices does not reduce all of its slices again:
+    - the mean keeps the running sum of the slab, adding the slices entering it
+      and subtracting the ones leaving it,
+    - the maximum and minimum reduce the slab in blocks of about sqrt(Thickness)
+      slices, which are cached, so only the partial blocks at the ends of the slab
+      are reduced again.
+
+    The projected slices are also kept in a least recently used cache.
+    '''
+
+    def __init__(self):
+        VTKPythonAlgorithmBase.__init__(self,
+                                        nInputPorts=1,
+                                        inputType="vtkImageData",
+                                        nOutputPorts=1,
+                                        outputType="vtkImageData")
+        self._Orientation = 2
+        self._Thickness = 1
+        self._Projection = 'max'
+        self._CacheSize = 32
+        self._cache = OrderedDict()
+        self._cache_key = None
+        self._block_cache = OrderedDict()
+        self._running_sum = None
+        self._running_window = None
+
+    def SetOrientation(self, value):
+        '''Sets the axis along which the slab is projected, 0, 1 or 2 for x, y or z'''
+        if value not in [0, 1, 2]:
+            raise ValueError("Orientation must be 0, 1 or 2, got {}".format(value))
+        if value != self._Orientation:
+            self._Orientation = value
+            self.Modified()
+
+    def GetOrientation(self):
+        return self._Orientation
+
+    def SetThickness(self, value):
+        '''Sets the number of slices in the slab'''
+        if not isinstance(value, int) or value < 1:
+            raise ValueError("Thickness must be a positive integer, got {}".format(value))
+        if value != self._Thickness:
+            self._Thickness = value
+            self.Modified()
+
+    def GetThickness(self):
+        return self._Thickness
+
+    def SetProjection(self, value):
+        '''Sets the projection of the slab: 'max', 'min' or 'mean' '''
+        if value not in SLAB_PROJECTIONS:
+            raise ValueError("Projection must be one of {}, got {}".format(SLAB_PROJECTIONS, value))
+        if value != self._Projection:
+            self._Projection = value
+            self.Modified()
+
+    def GetProjection(self):
+        return self._Projection
+
+    def SetCacheSize(self, value):
+        '''Sets the maximum number of projected slices kept in the cache'''
+        if value < 1:
+            raise ValueError("Cache size must be at least 1, got {}".format(value))
+        self._CacheSize = int(value)
+        self._trimCache(self._cache, self._CacheSize)
+
+    def GetCacheSize(self):
+        return self._CacheSize
+
+    def GetSlabRange(self, sliceno, extent=None):
+        '''Returns the first and last slice of the slab centred on sliceno, within the extent'''
+        lower = sliceno - (self._Thickness - 1) // 2
+        upper = lower + self._Thickness - 1
+        if extent is not None:
+            lower = max(lower, extent[self._Orientation * 2])
+            upper = min(upper, extent[self._Orientation * 2 + 1])
+        return lower, upper
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def RequestUpdateExtent(self, request, inInfo, outInfo):
+        # the slab needs the slices around the requested ones, the input is in memory
+        # so the whole extent is requested
+        info = inInfo[0].GetInformationObject(0)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT(),
+                 info.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT()), 6)
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        inData = vtk.vtkImageData.GetData(inInfo[0])
+        outData = vtk.vtkImageData.GetData(outInfo)
+        out_info = outInfo.GetInformationObject(0)
+        update_extent = list(out_info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT()))
+
+        in_extent = inData.GetExtent()
+        scalars = inData.GetPointData().GetScalars()
+        dims = inData.GetDimensions()
+        array = numpy_support.vtk_to_numpy(scalars)
+        # VTK is x fastest, so this is ordered z, y, x, components
+        array = array.reshape(dims[::-1] + (-1, ))
+
+        self._checkCache(inData)
+
+        orientation = self._Orientation
+        axis = 2 - orientation
+        slices = []
+        for sliceno in range(update_extent[orientation * 2], update_extent[orientation * 2 + 1] + 1):
+            slices.append(self._getProjectedSlice(array, axis, sliceno, in_extent))
+        projected = numpy.stack(slices, axis=axis)
+
+        # crop to the update extent on the other axes
+        crop = [slice(None)] * 4
+        for i in range(3):
+            if i != orientation:
+                start = update_extent[i * 2] - in_extent[i * 2]
+                crop[2 - i] = slice(start, start + update_extent[i * 2 + 1] - update_extent[i * 2] + 1)
+        projected = numpy.ascontiguousarray(projected[tuple(crop)])
+
+        outData.SetExtent(update_extent)
+        outData.SetSpacing(inData.GetSpacing())
+        outData.SetOrigin(inData.GetOrigin())
+        out_scalars = numpy_support.numpy_to_vtk(projected.reshape(-1, projected.shape[-1]), deep=1)
+        out_scalars.SetName(scalars.GetName())
+        outData.GetPointData().SetScalars(out_scalars)
+        return 1
+
+    def _checkCache(self, inData):
+        key = (id(inData), inData.GetMTime(), self._Orientation, self._Projection)
+        if key != self._cache_key:
+            self._cache.clear()
+            self._block_cache.clear()
+            self._running_sum = None
+            self._running_window = None
+            self._cache_key = key
+
+    @staticmethod
+    def _trimCache(cache, size):
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+    def _getProjectedSlice(self, array, axis, sliceno, extent):
+        lower, upper = self.GetSlabRange(sliceno, extent)
+        key = (lower, upper)
+        try:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        except KeyError:
+            pass
+        # indices in the array
+        start = lower - extent[self._Orientation * 2]
+        stop = upper - extent[self._Orientation * 2] + 1
+        if self._Projection == 'mean':
+            projected = self._slidingMean(array, axis, start, stop)
+        else:
+            ufunc = numpy.maximum if self._Projection == 'max' else numpy.minimum
+            projected = self._blockReduce(ufunc, array, axis, start, stop)
+        self._cache[key] = projected
+        self._trimCache(self._cache, self._CacheSize)
+        return projected
+
+    @staticmethod
+    def _take(array, axis, start, stop):
+        index = [slice(None)] * array.ndim
+        index[axis] = slice(start, stop)
+        return array[tuple(index)]
+
+    def _slidingMean(self, array, axis, start, stop):
+        window = self._running_window
+        if window is not None and start < window[1] and stop > window[0]:
+            # overlapping slab: add the slices entering, subtract the ones leaving
+            running_sum = self._running_sum
+            if start > window[0]:
+                running_sum -= self._take(array, axis, window[0], start).sum(axis=axis, dtype=numpy.float64)
+            elif start < window[0]:
+                running_sum += self._take(array, axis, start, window[0]).sum(axis=axis, dtype=numpy.float64)
+            if stop > window[1]:
+                running_sum += self._take(array, axis, window[1], stop).sum(axis=axis, dtype=numpy.float64)
+            elif stop < window[1]:
+                running_sum -= self._take(array, axis, stop, window[1]).sum(axis=axis, dtype=numpy.float64)
+        else:
+            running_sum = self._take(array, axis, start, stop).sum(axis=axis, dtype=numpy.float64)
+        self._running_sum = running_sum
+        self._running_window = (start, stop)
+        return (running_sum / (stop - start)).astype(numpy.result_type(array.dtype, numpy.float32))
+
+    def _blockReduce(self, ufunc, array, axis, start, stop):
+        block_size = max(1, int(math.sqrt(self._Thickness)))
+        first_block = -(-start // block_size)
+        last_block = stop // block_size
+        if first_block >= last_block:
+            return ufunc.reduce(self._take(array, axis, start, stop), axis=axis)
+
+        parts = []
+        if start < first_block * block_size:
+            parts.append(ufunc.reduce(self._take(array, axis, start, first_block * block_size), axis=axis))
+        for block in range(first_block, last_block):
+            key = (block_size, block)
+            try:
+                self._block_cache.move_to_end(key)
+            except KeyError:
+                self._block_cache[key] = ufunc.reduce(self._take(array, axis, block * block_size,
+                                                                 (block + 1) * block_size),
+                                                      axis=axis)
+            parts.append(self._block_cache[key])
+        if last_block * block_size < stop:
+            parts.append(ufunc.reduce(self._take(array, axis, last_block * block_size, stop), axis=axis))
+        # keep the blocks of a couple of slabs
+        self._trimCache(self._block_cache, 2 * (last_block - first_block) + 4)
+
+        projected = parts[0].copy()
+        for part in parts[1:]:
+            ufunc(projected, part, out=projected)
+        return projected
@@ -0,0 +1,367 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import vtk
+from ccpi.viewer.utils.conversion import vtkImageResampler
+from ccpi.viewer.utils.hdf5_io import HDF5Reader
+
+
+def get_image_size(image):
+    '''Returns the size of the scalars of a vtkImageData in bytes'''
+    scalars = image.GetPointData().GetScalars()
+    if scalars is None:
+        return 0
+    return scalars.GetNumberOfValues() * scalars.GetDataTypeSize()
+
+
+class cilTimeSeriesFrameCache(object):
+    '''Reads the frames of a 4D HDF5 dataset, i.e. a time series of 3D images, and caches them
+
+    Each frame is the 3D image at an index along the 4th dimension of the
+    dataset, see HDF5Reader.Set4DIndex, resampled to TargetSize bytes. The frames
+    are kept in a least recently used cache holding at most MemoryBudget bytes.
+    Frames can be prefetched on worker threads, so that they are in the cache
+    when they are displayed.
+
+    Example:
+    --------
+
+    >>> frames = cilTimeSeriesFrameCache('series.h5', 'ImageData', time_index=0)
+    >>> frames.Prefetch([1, 2, 3])
+    >>> image = frames.GetFrame(1)
+    '''
+
+    def __init__(self,
+                 file_name,
+                 dataset_name,
+                 time_index=0,
+                 target_size=256**3,
+                 memory_budget=2 * 1024**3,
+                 max_workers=2):
+        self._FileName = file_name
+        self._DatasetName = dataset_name
+        self._TimeIndex = time_index
+        self._TargetSize = int(target_size)
+        self._MemoryBudget = int(memory_budget)
+        with h5py.File(file_name, 'r') as f:
+            shape = f[dataset_name].shape
+        if len(shape) != 4:
+            raise ValueError("Expected a 4D dataset, got shape {}".format(shape))
+        if time_index not in range(4):
+            raise ValueError("Time index must be between 0 and 3, got {}".format(time_index))
+        self._NumberOfFrames = shape[time_index]
+        self._frames = OrderedDict()
+        self._size = 0
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cilTimeSeriesFrameCache')
+
+    def GetFileName(self):
+        return self._FileName
+
+    def GetDatasetName(self):
+        return self._DatasetName
+
+    def GetNumberOfFrames(self):
+        return self._NumberOfFrames
+
+    def GetTargetSize(self):
+        return self._TargetSize
+
+    def SetMemoryBudget(self, value):
+        '''Sets the maximum number of bytes of the frames kept in the cache'''
+        with self._lock:
+            self._MemoryBudget = int(value)
+            self._trimCache()
+
+    def GetMemoryBudget(self):
+        return self._MemoryBudget
+
+    def GetCacheSize(self):
+        '''Returns the number of bytes of the frames in the cache'''
+        return self._size
+
+    def GetCachedFrames(self):
+        '''Returns the indices of the frames in the cache, least recently used first'''
+        with self._lock:
+            return list(self._frames.keys())
+
+    def IsCached(self, index):
+        with self._lock:
+            return index in self._frames
+
+    def GetFrame(self, index):
+        '''Returns the frame at index as a vtkImageData, reading it if it is not in the cache
+
+        The frame is shared with the cache and must not be modified.
+        '''
+        self._checkIndex(index)
+        with self._lock:
+            if index in self._frames:
+                self._frames.move_to_end(index)
+                return self._frames[index]
+            future = self._pending.get(index)
+        if future is not None:
+            return future.result()
+        return self._addFrame(index, self.ReadFrame(index))
+
+    def Prefetch(self, indices):
+        '''Reads the frames at indices on worker threads, if they are not in the cache or being read'''
+        for index in indices:
+            self._checkIndex(index)
+            with self._lock:
+                if index in self._frames or index in self._pending:
+                    continue
+                self._pending[index] = self._executor.submit(self._prefetchFrame, index)
+
+    def WaitForPrefetch(self, timeout=None):
+        '''Waits for the frames being prefetched'''
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.result(timeout)
+
+    def ReadFrame(self, index):
+        '''Reads and resamples the frame at index, without caching it'''
+        reader = HDF5Reader()
+        reader.SetFileName(self._FileName)
+        reader.SetDatasetName(self._DatasetName)
+        reader.Set4DIndex(self._TimeIndex)
+        reader.Set4DSliceIndex(index)
+        resampler = vtkImageResampler()
+        resampler.SetInputConnection(reader.GetOutputPort())
+        resampler.SetTargetSize(self._TargetSize)
+        resampler.Update()
+        frame = vtk.vtkImageData()
+        frame.ShallowCopy(resampler.GetOutput())
+        return frame
+
+    def Shutdown(self):
+        '''Stops the worker threads, the frames being prefetched are discarded'''
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _prefetchFrame(self, index):
+        try:
+            return self._addFrame(index, self.ReadFrame(index))
+        finally:
+            with self._lock:
+                self._pending.pop(index, None)
+
+    def _addFrame(self, index, frame):
+        with self._lock:
+            if index not in self._frames:
+                self._frames[index] = frame
+                self._size += get_image_size(frame)
+            self._frames.move_to_end(index)
+            self._trimCache()
+            return self._frames.get(index, frame)
+
+    def _trimCache(self):
+        # the most recently used frame is kept even if it is larger than the budget
+        while self._size > self._MemoryBudget and len(self._frames) > 1:
+            _, frame = self._frames.popitem(last=False)
+            self._size -= get_image_size(frame)
+
+    def _checkIndex(self, index):
+        if index not in range(self._NumberOfFrames):
+            raise IndexError("Frame {} is out of range, the series has {} frames".format(index, self._NumberOfFrames))
+
+
+class cilTimeSeriesPlayer(object):
+    '''Plays a time series in a viewer at a target frame rate
+
+    The first frame displayed sets the input of the viewer to a copy of the frame.
+    The following frames are swapped in place in that image with
+    CILViewerBase.swapInputData, so the pipeline of the viewer is updated rather than
+    installed again. The next Prefetch frames are read in the background after
+    each frame is displayed.
+
+    While playing, the frame due at the current time is displayed on each tick.
+    If it is not read yet, the latest frame due which is read is displayed, or the
+    displayed frame is kept. The frames that are never displayed because the
+    player is late are counted as dropped.
+
+    Ticks are driven by a repeating timer of the interactor of the viewer, or by
+    calling Tick, i.e. from a Qt timer.
+
+    Example:
+    --------
+
+    >>> player = cilTimeSeriesPlayer(viewer, cilTimeSeriesFrameCache('series.h5', 'ImageData'))
+    >>> player.SetFrameRate(10)
+    >>> player.Play()
+    '''
+
+    def __init__(self, viewer, frames, frame_rate=10., prefetch=4):
+        self._Viewer = viewer
+        self._Frames = frames
+        self._FrameRate = float(frame_rate)
+        self._Prefetch = int(prefetch)
+        self._Loop = True
+        self._display_image = None
+        self._current_frame = None
+        self._playing = False
+        self._start_time = None
+        self._start_frame = 0
+        self._last_due = 0
+        self._displayed_frames = 0
+        self._dropped_frames = 0
+        self._timer_id = None
+        self._observer = None
+
+    def GetViewer(self):
+        return self._Viewer
+
+    def GetFrames(self):
+        return self._Frames
+
+    def SetFrameRate(self, value):
+        '''Sets the number of frames displayed per second while playing'''
+        if value <= 0:
+            raise ValueError("Frame rate must be positive, got {}".format(value))
+        self._FrameRate = float(value)
+        if self._playing:
+            self._restartClock()
+
+    def GetFrameRate(self):
+        return self._FrameRate
+
+    def SetPrefetch(self, value):
+        '''Sets the number of frames read in the background ahead of the displayed frame'''
+        self._Prefetch = int(value)
+
+    def GetPrefetch(self):
+        return self._Prefetch
+
+    def SetLoop(self, value):
+        '''Sets whether playing restarts from the first frame after the last'''
+        self._Loop = bool(value)
+
+    def GetLoop(self):
+        return self._Loop
+
+    def GetCurrentFrame(self):
+        return self._current_frame
+
+    def GetDisplayedFrames(self):
+        '''Returns the number of frames displayed while playing'''
+        return self._displayed_frames
+
+    def GetDroppedFrames(self):
+        '''Returns the number of frames skipped while playing because they were late'''
+        return self._dropped_frames
+
+    def IsPlaying(self):
+        return self._playing
+
+    def SetFrame(self, index):
+        '''Displays the frame at index, reading it if needed'''
+        frame = self._Frames.GetFrame(index)
+        if self._display_image is None:
+            # the viewer displays a copy, so that swapping frames does not modify the cached frames
+            self._display_image = vtk.vtkImageData()
+            self._display_image.ShallowCopy(frame)
+            self._Viewer.setInputData(self._display_image)
+        else:
+            self._Viewer.swapInputData(frame)
+        self._current_frame = index
+        self._prefetchNext(index)
+
+    def Step(self, step=1):
+        '''Displays the frame step frames after the current frame'''
+        current = 0 if self._current_frame is None else self._current_frame
+        self.SetFrame(self._wrap(current + step))
+
+    def Play(self, use_timer=True):
+        '''Starts playing from the current frame
+
+        :param use_timer: whether to tick on a repeating timer of the interactor of the viewer
+        '''
+        if self._current_frame is None:
+            self.SetFrame(0)
+        self._playing = True
+        self._displayed_frames = 0
+        self._dropped_frames = 0
+        self._restartClock()
+        if use_timer:
+            iren = self._Viewer.getInteractor()
+            self._observer = iren.AddObserver(vtk.vtkCommand.TimerEvent, self._onTimer)
+            self._timer_id = iren.CreateRepeatingTimer(max(1, int(1000 / self._FrameRate / 2)))
+
+    def Stop(self):
+        '''Stops playing, the current frame stays displayed'''
+        self._playing = False
+        iren = self._Viewer.getInteractor()
+        if self._timer_id is not None:
+            iren.DestroyTimer(self._timer_id)
+            self._timer_id = None
+        if self._observer is not None:
+            iren.RemoveObserver(self._observer)
+            self._observer = None
+
+    def Tick(self, now=None):
+        '''Displays the frame due at now, returns whether a new frame was displayed
+
+        :param now: time in seconds, as time.perf_counter, default the current time
+        '''
+        if not self._playing:
+            return False
+        if now is None:
+            now = time.perf_counter()
+        due = self._start_frame + int(math.floor((now - self._start_time) * self._FrameRate))
+        if due <= self._last_due:
+            return False
+        last_frame = self._Frames.GetNumberOfFrames() - 1
+        if not self._Loop and due > last_frame:
+            due = last_frame
+            if self._current_frame == last_frame:
+                self.Stop()
+                return False
+        # display the latest frame due which is read
+        for candidate in range(due, self._last_due, -1):
+            if self._Frames.IsCached(self._wrap(candidate)):
+                break
+        else:
+            # keep the current frame until one of the frames due is read
+            self._prefetchNext(self._last_due)
+            return False
+        self._dropped_frames += candidate - self._last_due - 1
+        self._last_due = candidate
+        self.SetFrame(self._wrap(candidate))
+        self._displayed_frames += 1
+        return True
+
+    def _onTimer(self, caller, event):
+        self.Tick()
+
+    def _restartClock(self):
+        self._start_time = time.perf_counter()
+        self._start_frame = self._current_frame
+        self._last_due = self._current_frame
+
+    def _prefetchNext(self, index):
+        self._Frames.Prefetch(
+            [self._wrap(index + i) for i in range(1, self._Prefetch + 1) if self._isPlayable(index + i)])
+
+    def _isPlayable(self, index):
+        return self._Loop or index < self._Frames.GetNumberOfFrames()
+
+    def _wrap(self, index):
+        return index % self._Frames.GetNumberOfFrames()
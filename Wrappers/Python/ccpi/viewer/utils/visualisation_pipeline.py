@@ -1,10 +1,32 @@
-import vtk
-from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
-from vtk import vtkPolyData, vtkAlgorithmOutput, vtkImageData
+import numpy
+from vtkmodules.vtkCommonCore import VTK_ID_TYPE, vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkDataObject, vtkDataSet, vtkDataSetAttributes, vtkImageData, vtkPlane, vtkPolyData
+from vtkmodules.vtkCommonExecutionModel import vtkAlgorithm, vtkAlgorithmOutput
+from vtkmodules.vtkFiltersCore import vtkClipPolyData
+from vtkmodules.util import numpy_support
+from vtkmodules.util.vtkAlgorithm import VTKPythonAlgorithmBase
 
 from numbers import Integral, Number
 
 
+def copy_arrays(in_data, out_data, ids):
+    '''Copies the tuples at ids of all the arrays of a vtkDataSetAttributes to another one
+
+    The active attributes, i.e. scalars or vectors, are kept active in the output.
+    '''
+    for i in range(in_data.GetNumberOfArrays()):
+        in_array = in_data.GetArray(i)
+        if in_array is None:
+            continue
+        out_array = numpy_support.numpy_to_vtk(numpy_support.vtk_to_numpy(in_array)[ids], deep=1)
+        out_array.SetName(in_array.GetName())
+        out_data.AddArray(out_array)
+    for attribute in range(vtkDataSetAttributes.NUM_ATTRIBUTES):
+        active = in_data.GetAbstractAttribute(attribute)
+        if active is not None and active.GetName() is not None:
+            out_data.SetActiveAttribute(active.GetName(), attribute)
+
+
 class cilClipPolyDataBetweenPlanes(VTKPythonAlgorithmBase):
     '''A vtkAlgorithm to clip a polydata between two planes
     
@@ -17,6 +39,13 @@ class cilClipPolyDataBetweenPlanes(VTKPythonAlgorithmBase):
     Input: polydata
            origin and normal of Plane Above displayed slice
            origin and normal of Plane Below displayed slice
+
+    If the input is a point cloud, i.e. all its cells are single point vertices,
+    and the two planes are parallel with opposite normals, the clipping can use
+    a spatial index instead: the points are sorted once by their distance along
+    the normal, and the points between the planes are found with a binary search.
+    The index is built once per normal direction and rebuilt only when the input
+    is modified, so changing slice does not go through all the points again.
     '''
 
     def __init__(self):
@@ -25,9 +54,13 @@ class cilClipPolyDataBetweenPlanes(VTKPythonAlgorithmBase):
         self.__PlaneNormalAbove = None
         self.__PlaneOriginBelow = None
         self.__PlaneNormalBelow = None
+        self.__UseSpatialIndex = True
+        # spatial index per normal direction, valid for the input with key __index_key
+        self.__index = {}
+        self.__index_key = None
 
-        self.visPlane = [vtk.vtkPlane(), vtk.vtkPlane()]
-        self.planeClipper = [vtk.vtkClipPolyData(), vtk.vtkClipPolyData()]
+        self.visPlane = [vtkPlane(), vtkPlane()]
+        self.planeClipper = [vtkClipPolyData(), vtkClipPolyData()]
         self.planeClipper[1].SetInputConnection(self.planeClipper[0].GetOutputPort())
 
         self.planeClipper[0].SetClipFunction(self.visPlane[0])
@@ -78,22 +111,35 @@ class cilClipPolyDataBetweenPlanes(VTKPythonAlgorithmBase):
     def GetPlaneNormalBelow(self):
         return self.__PlaneNormalBelow
 
+    def SetUseSpatialIndex(self, value):
+        '''Sets whether point clouds are clipped with a spatial index rather than with vtkClipPolyData'''
+        if value != self.__UseSpatialIndex:
+            self.__UseSpatialIndex = value
+            self.Modified()
+
+    def GetUseSpatialIndex(self):
+        return self.__UseSpatialIndex
+
     def FillInputPortInformation(self, port, info):
         if port == 0:
-            info.Set(vtk.vtkAlgorithm.INPUT_REQUIRED_DATA_TYPE(), "vtkPolyData")
+            info.Set(vtkAlgorithm.INPUT_REQUIRED_DATA_TYPE(), "vtkPolyData")
         return 1
 
     def FillOutputPortInformation(self, port, info):
-        info.Set(vtk.vtkDataObject.DATA_TYPE_NAME(), "vtkPolyData")
+        info.Set(vtkDataObject.DATA_TYPE_NAME(), "vtkPolyData")
         return 1
 
     def RequestData(self, request, inInfo, outInfo):
         try:
             # print("requesting clipping data")
-            inp = vtk.vtkPolyData.GetData(inInfo[0])
-            out = vtk.vtkPolyData.GetData(outInfo)
+            inp = vtkPolyData.GetData(inInfo[0])
+            out = vtkPolyData.GetData(outInfo)
             # print ("input number of points" , inp.GetPoints().GetNumberOfPoints())
 
+            if self.GetUseSpatialIndex() and self.CanUseSpatialIndex(inp):
+                out.ShallowCopy(self.ClipWithSpatialIndex(inp))
+                return 1
+
             self.planeClipper[0].SetInputData(inp)
 
             #print("Above Plane {} {}".format(self.GetPlaneOriginAbove(), self.GetPlaneNormalAbove()))
@@ -120,10 +166,70 @@ class cilClipPolyDataBetweenPlanes(VTKPythonAlgorithmBase):
             print(e)
             print("Plane origin/s and/or normal/s not set.")
 
+    def CanUseSpatialIndex(self, polydata):
+        '''Returns whether the polydata can be clipped between the current planes with the spatial index'''
+        normal = numpy.asarray(self.GetPlaneNormalAbove(), dtype=numpy.float64)
+        if not numpy.allclose(normal, -numpy.asarray(self.GetPlaneNormalBelow(), dtype=numpy.float64)):
+            return False
+        if polydata.GetNumberOfLines() > 0 or polydata.GetNumberOfPolys() > 0 or polydata.GetNumberOfStrips() > 0:
+            return False
+        verts = polydata.GetVerts()
+        return verts.GetNumberOfCells() > 0 and verts.GetNumberOfConnectivityIds() == verts.GetNumberOfCells()
+
+    def GetSpatialIndex(self, polydata, normal):
+        '''Returns the point ids sorted by distance along the normal, and the sorted distances
+
+        The index is cached per normal direction until the polydata is modified.
+        '''
+        key = (id(polydata), polydata.GetMTime())
+        if key != self.__index_key:
+            self.__index = {}
+            self.__index_key = key
+        normal = tuple(float(n) for n in normal)
+        if normal not in self.__index:
+            points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+            distance = points @ numpy.asarray(normal)
+            order = numpy.argsort(distance, kind='stable')
+            self.__index[normal] = (order, distance[order])
+        return self.__index[normal]
+
+    def ClipWithSpatialIndex(self, polydata):
+        '''Returns a vtkPolyData with the vertices of the point cloud which lie between the planes'''
+        normal = self.GetPlaneNormalAbove()
+        order, distance = self.GetSpatialIndex(polydata, normal)
+        upper = numpy.dot(normal, self.GetPlaneOriginAbove())
+        lower = numpy.dot(normal, self.GetPlaneOriginBelow())
+        start = numpy.searchsorted(distance, lower, side='left')
+        stop = numpy.searchsorted(distance, upper, side='right')
+        # keep the points in their original order
+        point_ids = numpy.sort(order[start:stop])
+
+        num_points = polydata.GetNumberOfPoints()
+        new_ids = numpy.full(num_points, -1, dtype=numpy.int64)
+        new_ids[point_ids] = numpy.arange(len(point_ids))
+        connectivity = numpy_support.vtk_to_numpy(polydata.GetVerts().GetConnectivityArray())
+        cell_ids = numpy.flatnonzero(new_ids[connectivity] >= 0)
+
+        clipped = vtkPolyData()
+        points = vtkPoints()
+        in_points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+        points.SetData(numpy_support.numpy_to_vtk(in_points[point_ids], deep=1))
+        clipped.SetPoints(points)
+
+        vertices = vtkCellArray()
+        vertices.SetData(numpy_support.numpy_to_vtk(numpy.arange(len(cell_ids) + 1), deep=1, array_type=VTK_ID_TYPE),
+                         numpy_support.numpy_to_vtk(new_ids[connectivity[cell_ids]], deep=1, array_type=VTK_ID_TYPE))
+        clipped.SetVerts(vertices)
+
+        copy_arrays(polydata.GetPointData(), clipped.GetPointData(), point_ids)
+        copy_arrays(polydata.GetCellData(), clipped.GetCellData(), cell_ids)
+        return clipped
+
 
 class cilPlaneClipper(object):
 
     def __init__(self):
+        self.UseSpatialIndex = True
         # initilise with an empty dictionary of polydata to clip
         list2clip = {}
         self.SetDataListToClip(list2clip)
@@ -141,8 +247,18 @@ class cilPlaneClipper(object):
         if key in self.DataListToClip.keys():
             self.DataListToClip.pop(key)
 
+    def SetUseSpatialIndex(self, value):
+        '''Sets whether the point clouds to clip use a spatial index, see cilClipPolyDataBetweenPlanes'''
+        self.UseSpatialIndex = value
+        for data_to_clip in self.DataListToClip.values():
+            data_to_clip.SetUseSpatialIndex(value)
+
+    def GetUseSpatialIndex(self):
+        return self.UseSpatialIndex
+
     def MakeClippableData(self, data_to_clip):
         clippable_data = cilClipPolyDataBetweenPlanes()
+        clippable_data.SetUseSpatialIndex(self.UseSpatialIndex)
         if isinstance(data_to_clip, vtkPolyData):
             #print("Polydata")
             clippable_data.SetInputDataObject(data_to_clip)
@@ -224,74 +340,90 @@ class cilMaskPolyData(VTKPythonAlgorithmBase):
     '''vtkAlgorithm to crop a vtkPolyData with a Mask
 
     This is really only meant for point clouds: see points2vertices function
+
+    The points are kept if the value of the mask at their nearest voxel is one of
+    the mask values. All points are looked up at once with NumPy, and the point
+    data of the kept points is passed to the output.
     '''
 
     def __init__(self):
         VTKPythonAlgorithmBase.__init__(self, nInputPorts=2, nOutputPorts=1)
-        self.__MaskValue = 1
+        self.__MaskValues = (1, )
 
     def SetMaskValue(self, mask_value):
         '''Sets the value at which the mask is active'''
-        if not isinstance(mask_value, Integral):
-            raise ValueError('Mask value must be an integer. Got', mask_value)
+        self.SetMaskValues((mask_value, ))
 
-        if mask_value != self.__MaskValue:
-            self.__MaskValue = mask_value
+    def GetMaskValue(self):
+        '''Returns the value at which the mask is active, the first one if there are several'''
+        return self.__MaskValues[0]
+
+    def SetMaskValues(self, mask_values):
+        '''Sets the values, i.e. a set of labels, at which the mask is active'''
+        mask_values = tuple(mask_values)
+        if len(mask_values) == 0:
+            raise ValueError('At least one mask value is required.')
+        for mask_value in mask_values:
+            if not isinstance(mask_value, Integral):
+                raise ValueError('Mask value must be an integer. Got', mask_value)
+
+        if mask_values != self.__MaskValues:
+            self.__MaskValues = mask_values
             self.Modified()
 
-    def GetMaskValue(self):
-        return self.__MaskValue
+    def GetMaskValues(self):
+        return self.__MaskValues
 
     def FillInputPortInformation(self, port, info):
         if port == 0:
-            info.Set(vtk.vtkAlgorithm.INPUT_REQUIRED_DATA_TYPE(), "vtkPolyData")
+            info.Set(vtkAlgorithm.INPUT_REQUIRED_DATA_TYPE(), "vtkPolyData")
         elif port == 1:
-            info.Set(vtk.vtkAlgorithm.INPUT_REQUIRED_DATA_TYPE(), "vtkImageData")
+            info.Set(vtkAlgorithm.INPUT_REQUIRED_DATA_TYPE(), "vtkImageData")
         return 1
 
     def FillOutputPortInformation(self, port, info):
-        info.Set(vtk.vtkDataObject.DATA_TYPE_NAME(), "vtkPolyData")
+        info.Set(vtkDataObject.DATA_TYPE_NAME(), "vtkPolyData")
         return 1
 
     def RequestData(self, request, inInfo, outInfo):
-        self.point_in_mask = 0
-        in_points = vtk.vtkDataSet.GetData(inInfo[0])
-        mask = vtk.vtkDataSet.GetData(inInfo[1])
-        out_points = vtk.vtkPoints()
-
-        # this implementation is slightly more efficient
-        spac = mask.GetSpacing()
-        orig = mask.GetOrigin()
-        for i in range(in_points.GetNumberOfPoints()):
-            pp = in_points.GetPoint(i)
-
-            # get the point in image coordinate
-
-            # ic = self.world2imageCoordinate(pp, mask)
-            ic = [round((pp[i] + orig[i]) / spac[i]) for i in range(3)]
-            i = 0
-            outside = False
-            while i < len(ic):
-                outside = ic[i] < 0 or ic[i] >= mask.GetDimensions()[i]
-                if outside:
-                    break
-                i += 1
-
-            if not outside:
-                mm = mask.GetScalarComponentAsDouble(int(ic[0]), int(ic[1]), int(ic[2]), 0)
-
-                if int(mm) == int(self.GetMaskValue()):
-                    # print ("value of point {} {}".format(mm, ic))
-                    out_points.InsertNextPoint(*pp)
-                    self.point_in_mask += 1
+        in_points = vtkDataSet.GetData(inInfo[0])
+        mask = vtkDataSet.GetData(inInfo[1])
+        pointPolyData = vtkPolyData.GetData(outInfo)
 
+        point_ids = self.GetPointsInMask(in_points, mask)
+        self.point_in_mask = len(point_ids)
+
+        out_points = vtkPoints()
+        if self.point_in_mask > 0:
+            pp = numpy_support.vtk_to_numpy(in_points.GetPoints().GetData())
+            out_points.SetData(numpy_support.numpy_to_vtk(pp[point_ids], deep=1))
         vertices = self.points2vertices(out_points)
-        pointPolyData = vtk.vtkPolyData.GetData(outInfo)
         pointPolyData.SetPoints(out_points)
         pointPolyData.SetVerts(vertices)
-        print("points in mask", self.point_in_mask)
+        copy_arrays(in_points.GetPointData(), pointPolyData.GetPointData(), point_ids)
         return 1
 
+    def GetPointsInMask(self, points, mask):
+        '''Returns the ids of the points whose nearest voxel in the mask has one of the mask values'''
+        if points.GetNumberOfPoints() == 0 or points.GetPoints() is None:
+            return numpy.empty((0, ), dtype=numpy.int64)
+        pp = numpy_support.vtk_to_numpy(points.GetPoints().GetData())
+
+        # get the points in image coordinates
+        spac = numpy.asarray(mask.GetSpacing())
+        orig = numpy.asarray(mask.GetOrigin())
+        dims = mask.GetDimensions()
+        ic = numpy.round((pp + orig) / spac).astype(numpy.int64)
+        inside = numpy.all((ic >= 0) & (ic < numpy.asarray(dims)), axis=1)
+        ids = numpy.flatnonzero(inside)
+        ic = ic[ids]
+
+        # the scalars are x fastest, so the array is indexed z, y, x
+        values = numpy_support.vtk_to_numpy(mask.GetPointData().GetScalars())
+        values = values.reshape(dims[::-1] + (-1, ))[..., 0]
+        mm = values[ic[:, 2], ic[:, 1], ic[:, 0]].astype(numpy.int64)
+        return ids[numpy.isin(mm, self.GetMaskValues())]
+
     def world2imageCoordinate(self, world_coordinates, imagedata):
         """
         Convert from the world or global coordinates to image coordinates
@@ -307,9 +439,8 @@ class cilMaskPolyData(VTKPythonAlgorithmBase):
     def points2vertices(self, points):
         '''returns a vtkCellArray from a vtkPoints'''
 
-        vertices = vtk.vtkCellArray()
-        for i in range(points.GetNumberOfPoints()):
-            vertices.InsertNextCell(1)
-            vertices.InsertCellPoint(i)
-            # print (points.GetPoint(i))
+        num_points = points.GetNumberOfPoints()
+        vertices = vtkCellArray()
+        vertices.SetData(numpy_support.numpy_to_vtk(numpy.arange(num_points + 1), deep=1, array_type=VTK_ID_TYPE),
+                         numpy_support.numpy_to_vtk(numpy.arange(num_points), deep=1, array_type=VTK_ID_TYPE))
         return vertices
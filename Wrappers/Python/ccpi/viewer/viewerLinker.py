@@ -1,5 +1,7 @@
 # code largely copied from https://sourceforge.net/p/pyve/code/ci/master/tree/PyVE/components/viewer.py
 # MIT licensed
+import time
+
 from ccpi.viewer.CILViewer import CILInteractorStyle as CIL3DInteractorStyle
 from ccpi.viewer.CILViewer2D import CILInteractorStyle as CIL2DInteractorStyle
 
@@ -66,15 +68,14 @@ class ViewerLinker():
     for enabling and disabling the link, and setting up which events
     should be listened to.
 
-    It makes use of the ViewerLinkObserver to establish a 'to' and 'from'
-    connection.
+    It makes use of a ViewerSyncHub with the two viewers, see ViewerSyncHub
+    to link more than two viewers together.
     """
 
     def __init__(self, viewer1, viewer2):
         self._viewer1 = viewer1
         self._viewer2 = viewer2
-        self._to = ViewerLinkObserver(viewer1, viewer2)
-        self._from = ViewerLinkObserver(viewer2, viewer1)
+        self._hub = ViewerSyncHub([viewer1, viewer2])
 
     def __del__(self):
         self.disable()
@@ -83,86 +84,366 @@ class ViewerLinker():
         """
         Enable the viewer link
         """
+        self._hub.enable()
+
+    def disable(self):
+        """
+        Disable the viewer link
+        """
+        self._hub.disable()
+
+    def setLinkZoom(self, linkZoom):
+        """
+        Boolean flag to set zoom linkage
+        :param linkZoom: (boolean)
+        """
+        self._hub.setLinkZoom(linkZoom)
+
+    def setLinkPan(self, linkPan):
+        """
+        Boolean flag to set pan linkage
+        :param linkPan: (boolean)
+        """
+        self._hub.setLinkPan(linkPan)
+
+    def setLinkPick(self, linkPick):
+        """
+        Boolean flag to set pick linkage
+        :param linkPick: (boolean)
+        """
+        self._hub.setLinkPick(linkPick)
+
+    def setLinkWindowLevel(self, linkWindowLevel):
+        """
+        Boolean flag to set window level linkage
+        :param linkWindowLevel: (boolean)
+        """
+        self._hub.setLinkWindowLevel(linkWindowLevel)
+
+    def setLinkSlice(self, linkSlice):
+        """
+        Boolean flag to set slice linkage
+        :param linkSlice: (boolean)
+        """
+        self._hub.setLinkSlice(linkSlice)
+
+    def setLinkOrientation(self, linkOrientation):
+        """
+        Boolean flag to set slice orientation linkage
+        :param linkOrientation: (boolean)
+        """
+        self._hub.setLinkOrientation(linkOrientation)
+
+    def setLinkInterpolation(self, linkInterpolation):
+        """
+        Boolean flag to set linkage of interpolation of slice actor
+        :param linkInterpolation: (boolean)
+        """
+        self._hub.setLinkInterpolation(linkInterpolation)
+
+    def setLinkCamera(self, linkCamera):
+        """
+        Boolean flag to set linkage of the perspective camera of the 3D viewers
+        :param linkCamera: (boolean)
+        """
+        self._hub.setLinkCamera(linkCamera)
 
-        # Make sure the observers aren't added twice
+
+#################################
+# ViewerSyncHub
+#################################
+class ViewerSyncHub():
+    """
+    This class keeps the state of any number of viewers synchronised.
+
+    Rather than passing every interactor event from one viewer to the others,
+    the hub only observes the EndEvent of the render window of each viewer, i.e.
+    once per rendered frame. At the end of a frame it compares the linked state of
+    the viewer (slice, orientation, window/level, camera zoom and pan, slice
+    interpolation, picked voxel and, for the perspective cameras of the 3D viewers,
+    the position, focal point, view up and view angle of the camera) with the state it last saw, and publishes only
+    what changed to the other viewers. All the changes of a frame are applied to
+    each target at once and followed by a single render.
+
+    While a change is being applied, the renders of the targets are not published,
+    and the state of the targets is recorded after the update, so a change never
+    echoes back to the viewer it came from.
+
+    Example:
+    --------
+
+    >>> hub = ViewerSyncHub([viewer1, viewer2, viewer3])
+    >>> hub.setLinkZoom(False)
+    >>> hub.enable()
+    >>> hub.addViewer(viewer4)
+    """
+
+    def __init__(self, viewers=None):
+        self._viewers = []
+        self._observers = {}
+        self._states = {}
+        self._enabled = False
+        self._propagating = False
+        self.linkZoom = True
+        self.linkPan = True
+        self.linkPick = True
+        self.linkWindowLevel = True
+        self.linkSlice = True
+        self.linkOrientation = True
+        self.linkInterpolation = True
+        self.linkCamera = True
+        # time in seconds taken by the last propagation to all the viewers
+        self.last_propagation_time = None
+        if viewers is not None:
+            for viewer in viewers:
+                self.addViewer(viewer)
+
+    def __del__(self):
         self.disable()
 
-        self._observerToId = self._viewer1.getInteractor().AddObserver("AnyEvent", self._to)
-        self._observerFromId = self._viewer2.getInteractor().AddObserver("AnyEvent", self._from)
+    def addViewer(self, viewer):
+        """
+        Adds a viewer to the hub, it is synchronised from its next render on.
+        """
+        if viewer in self._viewers:
+            return
+        self._viewers.append(viewer)
+        self._states[id(viewer)] = self.getState(viewer)
+        if self._enabled:
+            self._addObserver(viewer)
+
+    def removeViewer(self, viewer):
+        """
+        Removes a viewer from the hub.
+        """
+        if viewer not in self._viewers:
+            return
+        self._removeObserver(viewer)
+        self._viewers.remove(viewer)
+        self._states.pop(id(viewer), None)
+
+    def getViewers(self):
+        return list(self._viewers)
+
+    def enable(self):
+        """
+        Enable the synchronisation of the viewers
+        """
+        self._enabled = True
+        for viewer in self._viewers:
+            self._states[id(viewer)] = self.getState(viewer)
+            self._addObserver(viewer)
 
     def disable(self):
         """
-        Disable the viewer link
+        Disable the synchronisation of the viewers
         """
-        try:
-            self._viewer1.getInteractor().RemoveObserver(self._observerToId)
-            self._viewer2.getInteractor().RemoveObserver(self._observerFromId)
-        except:
-            # Already removed from observer list
-            pass
+        self._enabled = False
+        for viewer in self._viewers:
+            self._removeObserver(viewer)
+
+    def isEnabled(self):
+        return self._enabled
 
     def setLinkZoom(self, linkZoom):
         """
         Boolean flag to set zoom linkage
         :param linkZoom: (boolean)
         """
-
-        self._to.linkZoom = linkZoom
-        self._from.linkZoom = linkZoom
+        self.linkZoom = linkZoom
 
     def setLinkPan(self, linkPan):
         """
         Boolean flag to set pan linkage
         :param linkPan: (boolean)
         """
-
-        self._to.linkPan = linkPan
-        self._from.linkPan = linkPan
+        self.linkPan = linkPan
 
     def setLinkPick(self, linkPick):
         """
         Boolean flag to set pick linkage
         :param linkPick: (boolean)
         """
-
-        self._to.linkPick = linkPick
-        self._from.linkPick = linkPick
+        self.linkPick = linkPick
 
     def setLinkWindowLevel(self, linkWindowLevel):
         """
         Boolean flag to set window level linkage
         :param linkWindowLevel: (boolean)
         """
-
-        self._to.linkWindowLevel = linkWindowLevel
-        self._from.linkWindowLevel = linkWindowLevel
+        self.linkWindowLevel = linkWindowLevel
 
     def setLinkSlice(self, linkSlice):
         """
         Boolean flag to set slice linkage
         :param linkSlice: (boolean)
         """
-
-        self._to.linkSlice = linkSlice
-        self._from.linkSlice = linkSlice
+        self.linkSlice = linkSlice
 
     def setLinkOrientation(self, linkOrientation):
         """
         Boolean flag to set slice orientation linkage
         :param linkOrientation: (boolean)
         """
-
-        self._to.linkOrientation = linkOrientation
-        self._from.linkOrientation = linkOrientation
+        self.linkOrientation = linkOrientation
 
     def setLinkInterpolation(self, linkInterpolation):
         """
         Boolean flag to set linkage of interpolation of slice actor
         :param linkInterpolation: (boolean)
         """
+        self.linkInterpolation = linkInterpolation
 
-        self._to.linkInterpolation = linkInterpolation
-        self._from.linkInterpolation = linkInterpolation
+    def setLinkCamera(self, linkCamera):
+        """
+        Boolean flag to set linkage of the perspective camera of the 3D viewers,
+        i.e. their rotation, zoom and pan
+        :param linkCamera: (boolean)
+        """
+        self.linkCamera = linkCamera
+
+    def getState(self, viewer):
+        """
+        Returns a dictionary with the state of the viewer which can be linked.
+        """
+        state = {}
+        try:
+            state['orientation'] = viewer.getSliceOrientation()
+            state['slice'] = viewer.getActiveSlice()
+        except (AttributeError, TypeError):
+            pass
+        image_slice = getattr(viewer, 'imageSlice', None)
+        if image_slice is not None:
+            image_property = image_slice.GetProperty()
+            state['window_level'] = (image_property.GetColorWindow(), image_property.GetColorLevel())
+            state['interpolation'] = image_property.GetInterpolationType()
+        camera = viewer.getRenderer().GetActiveCamera()
+        if camera.GetParallelProjection():
+            state['zoom'] = camera.GetParallelScale()
+            if 'orientation' in state:
+                # the camera follows the slice along the normal, only the in-plane
+                # coordinates of the focal point are panned
+                focal_point = camera.GetFocalPoint()
+                state['pan'] = tuple(focal_point[i] for i in range(3) if i != state['orientation'])
+        else:
+            state['camera'] = (camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp(), camera.GetViewAngle())
+        pick = getattr(viewer.style, 'last_picked_voxel', None)
+        if pick is not None:
+            state['pick'] = tuple(pick)
+        return state
+
+    def publish(self, viewer):
+        """
+        Publishes the changes in the state of the viewer since the last time it was seen to the other viewers.
+        """
+        if self._propagating:
+            return
+        state = self.getState(viewer)
+        previous = self._states.get(id(viewer), {})
+        changes = {key: value for key, value in state.items() if previous.get(key) != value}
+        self._states[id(viewer)] = state
+        changes = self._filterLinkedChanges(changes)
+        if not changes:
+            return
+
+        start = time.perf_counter()
+        self._propagating = True
+        try:
+            for target in self._viewers:
+                if target is viewer:
+                    continue
+                self.applyChanges(target, state, changes)
+                self._states[id(target)] = self.getState(target)
+        finally:
+            self._propagating = False
+        self.last_propagation_time = time.perf_counter() - start
+
+    def applyChanges(self, target, source_state, changes):
+        """
+        Applies the changes in the state of a source viewer to a target viewer, and renders it once.
+        """
+        if target.img3D is None:
+            return
+        style = target.style
+        update_pipeline = False
+
+        if 'orientation' in changes and target.getSliceOrientation() != changes['orientation']:
+            # same as pressing x, y or z in the target viewer
+            interactor = target.getInteractor()
+            interactor.SetKeyCode(['x', 'y', 'z'][changes['orientation']])
+            style.OnKeyPress(interactor, "KeyPressEvent")
+
+        same_orientation = source_state.get('orientation') == target.getSliceOrientation()
+
+        if 'window_level' in changes and getattr(target, 'imageSlice', None) is not None:
+            window, level = changes['window_level']
+            target.imageSlice.GetProperty().SetColorWindow(window)
+            target.imageSlice.GetProperty().SetColorLevel(level)
+            target.imageSlice.Update()
+
+        if 'interpolation' in changes and getattr(target, 'imageSlice', None) is not None:
+            target.imageSlice.GetProperty().SetInterpolationType(changes['interpolation'])
+
+        camera = target.getRenderer().GetActiveCamera()
+        if camera.GetParallelProjection():
+            if 'zoom' in changes:
+                camera.SetParallelScale(changes['zoom'])
+            if 'pan' in changes and same_orientation:
+                focal_point = list(camera.GetFocalPoint())
+                in_plane = [i for i in range(3) if i != target.getSliceOrientation()]
+                shift = [0, 0, 0]
+                for i, value in zip(in_plane, changes['pan']):
+                    shift[i] = value - focal_point[i]
+                camera.SetFocalPoint(*[f + d for f, d in zip(focal_point, shift)])
+                camera.SetPosition(*[p + d for p, d in zip(camera.GetPosition(), shift)])
+        elif 'camera' in changes:
+            position, focal_point, view_up, view_angle = changes['camera']
+            camera.SetPosition(*position)
+            camera.SetFocalPoint(*focal_point)
+            camera.SetViewUp(*view_up)
+            camera.SetViewAngle(view_angle)
+            target.getRenderer().ResetCameraClippingRange()
+
+        if 'slice' in changes and same_orientation and target.getActiveSlice() != changes['slice']:
+            style.SetActiveSlice(changes['slice'])
+            update_pipeline = True
+
+        if 'pick' in changes:
+            # set the current slice to the picked voxel
+            sliceno = changes['pick'][target.getSliceOrientation()]
+            if hasattr(style, 'last_picked_voxel'):
+                style.last_picked_voxel = list(changes['pick'])
+            if target.getActiveSlice() != sliceno:
+                style.SetActiveSlice(sliceno)
+                update_pipeline = True
+
+        if update_pipeline:
+            style.UpdatePipeline()
+        else:
+            target.getRenderWindow().Render()
+
+    def _filterLinkedChanges(self, changes):
+        linked = {
+            'orientation': self.linkOrientation,
+            'slice': self.linkSlice,
+            'window_level': self.linkWindowLevel,
+            'interpolation': self.linkInterpolation,
+            'zoom': self.linkZoom,
+            'pan': self.linkPan,
+            'pick': self.linkPick,
+            'camera': self.linkCamera
+        }
+        return {key: value for key, value in changes.items() if linked.get(key, False)}
+
+    def _addObserver(self, viewer):
+        if id(viewer) not in self._observers:
+            self._observers[id(viewer)] = viewer.getRenderWindow().AddObserver(
+                "EndEvent", lambda caller, event: self.publish(viewer))
+
+    def _removeObserver(self, viewer):
+        observer = self._observers.pop(id(viewer), None)
+        if observer is not None:
+            viewer.getRenderWindow().RemoveObserver(observer)
 
 
 #################################
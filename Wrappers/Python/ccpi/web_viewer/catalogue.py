@@ -0,0 +1,428 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from vtkmodules.util import numpy_support
+
+from ccpi.viewer.utils.conversion import (Converter, cilHDF5ReaderInterface, cilMetaImageReaderInterface,
+                                          cilNumpyReaderInterface, cilTIFFImageReaderInterface)
+from ccpi.viewer.utils.io import ImageReader
+from ccpi.web_viewer.tiles import downsample, encode_png
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 64
+PREVIEW_SIZE = 256
+
+# the header readers of the formats the web viewers can load, raw files have no header to read
+HEADER_READERS = {
+    ".npy": cilNumpyReaderInterface,
+    ".mha": cilMetaImageReaderInterface,
+    ".mhd": cilMetaImageReaderInterface,
+    ".nxs": cilHDF5ReaderInterface,
+    ".h5": cilHDF5ReaderInterface,
+    ".hdf5": cilHDF5ReaderInterface,
+    ".tif": cilTIFFImageReaderInterface,
+    ".tiff": cilTIFFImageReaderInterface
+}
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    readable INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    depth INTEGER,
+    dtype TEXT,
+    nbytes INTEGER,
+    error TEXT,
+    thumbnail BLOB,
+    preview BLOB
+);
+CREATE INDEX IF NOT EXISTS datasets_name ON datasets (name);
+"""
+_ENTRY_COLUMNS = ("id", "path", "name", "mtime_ns", "file_size", "readable", "width", "height", "depth", "dtype",
+                  "nbytes", "error")
+
+
+def is_readable_file(file_name):
+    """Returns whether the extension of the file is one of a format the web viewers can load"""
+    return os.path.splitext(file_name)[1].lower() in HEADER_READERS
+
+
+def _natural_key(text):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", text)]
+
+
+def get_tiff_files(directory):
+    """Returns the TIFF files of the directory, in the order ImageReader reads them as a stack"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    files = [os.path.join(directory, name) for name in names if os.path.splitext(name)[1].lower() in TIFF_EXTENSIONS]
+    return sorted(files, key=_natural_key)
+
+
+def read_dataset_info(file_name, hdf5_dataset_name="entry1/tomo_entry/data/data"):
+    """
+    Reads the shape and type of the dataset from the header of the file, with the ReadDataSetInfo of the
+    cilReaderInterface of its format, without reading the data. A directory is read as a stack of TIFF files.
+
+    :return: dict, with the shape of the dataset as (width, height, depth), its dtype and its size in bytes
+    """
+    if os.path.isdir(file_name):
+        tiff_files = get_tiff_files(file_name)
+        if not tiff_files:
+            raise ValueError(f"No TIFF files in {file_name}")
+        reader = cilTIFFImageReaderInterface()
+        reader.SetFileName(tiff_files)
+    else:
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension not in HEADER_READERS:
+            raise ValueError(f"Cannot read the header of {file_name}")
+        reader = HEADER_READERS[extension]()
+        if extension in (".nxs", ".h5", ".hdf5"):
+            reader.SetDatasetName(hdf5_dataset_name)
+        reader.SetFileName(file_name)
+    reader.ReadDataSetInfo()
+    shape = list(reader.GetStoredArrayShape())
+    if not reader.GetIsFortran():
+        shape = shape[::-1]
+    shape = (shape + [1, 1, 1])[:3]
+    dtype = reader.GetTypeCodeName()
+    return {
+        "width": int(shape[0]),
+        "height": int(shape[1]),
+        "depth": int(shape[2]),
+        "dtype": dtype,
+        "nbytes": int(np.prod(shape)) * Converter.vtkType_to_bytes[reader.GetOutputVTKType()]
+    }
+
+
+def describe_entry(entry):
+    """Returns the name of the dataset of the catalogue entry, with its shape, type and size"""
+    if not entry["readable"]:
+        return f"{entry['name']} (unreadable)"
+    return (f"{entry['name']} ({entry['width']}×{entry['height']}×{entry['depth']}, {entry['dtype']}, "
+            f"{entry['nbytes'] / 1024**2:.1f} MB)")
+
+
+class DataCatalogue:
+    """
+    Index of the datasets of data directories, stored in a SQLite database.
+
+    The directories are scanned with scan, or start_scan on a background thread. Only the headers of
+    the files are read, with read_dataset_info, and the files already indexed are read again only if
+    their modification time or size changed, so scanning a directory again is fast. The entries of
+    the files removed from a scanned directory are removed.
+
+    The thumbnail and the preview of the central slice of a dataset are read the first time they are
+    requested, and stored in the database with its entry. The catalogue is searched by name, type and
+    size without reading the datasets.
+    """
+
+    def __init__(self,
+                 index_file: str = ":memory:",
+                 hdf5_dataset_name: str = "entry1/tomo_entry/data/data",
+                 batch_size: int = 50):
+        self.index_file = index_file
+        self.hdf5_dataset_name = hdf5_dataset_name
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(index_file, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+        self._scan_thread = None
+        self._stop_scan = threading.Event()
+
+    def close(self):
+        self.stop_scan()
+        with self._lock:
+            self._connection.close()
+
+    def scan(self, paths, stop_event: threading.Event = None):
+        """
+        Indexes the datasets of the files and directories, and of their subdirectories.
+        A directory holding TIFF files is indexed as one stack.
+
+        :return: dict, the number of entries added or updated, unchanged and removed
+        """
+        stats = {"updated": 0, "unchanged": 0, "removed": 0}
+        found = set()
+        pending = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            if not os.path.exists(path):
+                stats["removed"] += self._remove_entries(path, prefix=False)
+                continue
+            for candidate in self._find_candidates(path):
+                if stop_event is not None and stop_event.is_set():
+                    self._commit()
+                    return stats
+                found.add(candidate)
+                if self._update_entry(candidate):
+                    stats["updated"] += 1
+                    pending += 1
+                else:
+                    stats["unchanged"] += 1
+                if pending >= self.batch_size:
+                    self._commit()
+                    pending = 0
+            if os.path.isdir(path):
+                stats["removed"] += self._remove_entries(path, keep=found)
+        self._commit()
+        return stats
+
+    def start_scan(self, paths):
+        """Scans the paths on a background thread"""
+        self.stop_scan()
+        self._stop_scan.clear()
+        self._scan_thread = threading.Thread(target=self._run_scan, args=(list(paths), ), daemon=True)
+        self._scan_thread.start()
+
+    def stop_scan(self):
+        if self._scan_thread is not None:
+            self._stop_scan.set()
+            self._scan_thread.join()
+            self._scan_thread = None
+
+    def wait_for_scan(self, timeout: float = None):
+        if self._scan_thread is not None:
+            self._scan_thread.join(timeout)
+
+    def is_scanning(self):
+        return self._scan_thread is not None and self._scan_thread.is_alive()
+
+    def get_number_of_entries(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM datasets").fetchone()[0]
+
+    def get_entry(self, entry_id):
+        """Returns the entry of the id, or of the path, None if it is not in the catalogue"""
+        column = "path" if isinstance(entry_id, str) else "id"
+        if column == "path":
+            entry_id = os.path.abspath(entry_id)
+        with self._lock:
+            row = self._connection.execute(f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM datasets WHERE {column} = ?",
+                                           (entry_id, )).fetchone()
+        return None if row is None else dict(row)
+
+    def get_dtypes(self):
+        """Returns the types of the readable datasets of the catalogue"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT dtype FROM datasets WHERE readable = 1 ORDER BY dtype").fetchall()
+        return [row[0] for row in rows]
+
+    def search(self,
+               text: str = None,
+               dtype: str = None,
+               min_nbytes: int = None,
+               max_nbytes: int = None,
+               readable: bool = True,
+               limit: int = None,
+               offset: int = 0):
+        """
+        Returns the entries whose name contains text, ignoring the case, of type dtype and of size in bytes
+        between min_nbytes and max_nbytes, ordered by name. Only the readable datasets are returned if readable
+        is True, all the entries if it is None.
+        """
+        conditions, parameters = [], []
+        if text:
+            escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("name LIKE ? ESCAPE '\\'")
+            parameters.append(f"%{escaped}%")
+        if dtype:
+            conditions.append("dtype = ?")
+            parameters.append(dtype)
+        if min_nbytes is not None:
+            conditions.append("nbytes >= ?")
+            parameters.append(int(min_nbytes))
+        if max_nbytes is not None:
+            conditions.append("nbytes <= ?")
+            parameters.append(int(max_nbytes))
+        if readable is not None:
+            conditions.append("readable = ?")
+            parameters.append(int(readable))
+        query = f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM datasets"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY name, path LIMIT ? OFFSET ?"
+        parameters += [-1 if limit is None else int(limit), int(offset)]
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(query, parameters)]
+
+    def get_thumbnail(self, entry_id):
+        """Returns the PNG thumbnail of the central slice of the dataset, None if the dataset cannot be read"""
+        return self._get_image(entry_id, "thumbnail")
+
+    def get_preview(self, entry_id):
+        """Returns the PNG preview of the central slice of the dataset, None if the dataset cannot be read"""
+        return self._get_image(entry_id, "preview")
+
+    def add_routes(self, wslink_server):
+        """
+        Serves the thumbnails and previews of the entries on the routes catalogue/<id>/thumbnail.png and
+        catalogue/<id>/preview.png of the server
+        """
+        from aiohttp import web
+
+        def add_route(name, get_image):
+
+            async def get(request):
+                entry_id = int(request.match_info["entry_id"])
+                image = await asyncio.get_running_loop().run_in_executor(None, get_image, entry_id)
+                if image is None:
+                    raise web.HTTPNotFound()
+                return web.Response(body=image, content_type="image/png")
+
+            wslink_server.app.router.add_get(rf"/catalogue/{{entry_id:\d+}}/{name}.png", get)
+
+        add_route("thumbnail", self.get_thumbnail)
+        add_route("preview", self.get_preview)
+
+    def _run_scan(self, paths):
+        try:
+            stats = self.scan(paths, self._stop_scan)
+            logger.info("Catalogue scan of %s: %s", paths, stats)
+        except Exception:
+            logger.exception("Catalogue scan of %s failed", paths)
+
+    def _commit(self):
+        with self._lock:
+            self._connection.commit()
+
+    def _find_candidates(self, path):
+        if os.path.isfile(path):
+            if is_readable_file(path) or os.path.splitext(path)[1].lower() == ".raw":
+                yield path
+            return
+        for directory, subdirectories, file_names in os.walk(path):
+            subdirectories.sort(key=_natural_key)
+            if any(os.path.splitext(name)[1].lower() in TIFF_EXTENSIONS for name in file_names):
+                yield directory
+            for name in sorted(file_names, key=_natural_key):
+                extension = os.path.splitext(name)[1].lower()
+                if extension not in TIFF_EXTENSIONS and (extension in HEADER_READERS or extension == ".raw"):
+                    yield os.path.join(directory, name)
+
+    def _stat(self, path):
+        if os.path.isdir(path):
+            stats = [os.stat(file_name) for file_name in get_tiff_files(path)]
+            return max((stat.st_mtime_ns for stat in stats), default=0), sum(stat.st_size for stat in stats)
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _update_entry(self, path):
+        """Indexes the dataset of the path if it is new or modified, returns whether it was"""
+        try:
+            mtime_ns, file_size = self._stat(path)
+        except OSError:
+            return False
+        with self._lock:
+            row = self._connection.execute("SELECT mtime_ns, file_size FROM datasets WHERE path = ?",
+                                           (path, )).fetchone()
+        if row is not None and (row["mtime_ns"], row["file_size"]) == (mtime_ns, file_size):
+            return False
+        entry = {"width": None, "height": None, "depth": None, "dtype": None, "nbytes": None, "error": None}
+        if os.path.splitext(path)[1].lower() == ".raw":
+            entry["error"] = "Raw files have no header, their shape and type are needed to read them"
+        else:
+            try:
+                entry.update(read_dataset_info(path, self.hdf5_dataset_name))
+            except Exception as e:
+                entry["error"] = str(e) or e.__class__.__name__
+        with self._lock:
+            # the previews of a modified dataset are read again
+            self._connection.execute(
+                "INSERT INTO datasets (path, name, mtime_ns, file_size, readable, width, height, depth, dtype, nbytes,"
+                " error, thumbnail, preview) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL)"
+                " ON CONFLICT (path) DO UPDATE SET mtime_ns = excluded.mtime_ns, file_size = excluded.file_size,"
+                " readable = excluded.readable, width = excluded.width, height = excluded.height,"
+                " depth = excluded.depth, dtype = excluded.dtype, nbytes = excluded.nbytes, error = excluded.error,"
+                " thumbnail = NULL, preview = NULL",
+                (path, os.path.basename(path), mtime_ns, file_size, int(entry["error"] is None), entry["width"],
+                 entry["height"], entry["depth"], entry["dtype"], entry["nbytes"], entry["error"]))
+        return True
+
+    def _remove_entries(self, path, prefix=True, keep=()):
+        """Removes the entries of the path, or of the paths in the directory path if prefix, except the ones in keep"""
+        with self._lock:
+            if prefix:
+                directory = os.path.join(path, "")
+                escaped = directory.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                rows = self._connection.execute("SELECT path FROM datasets WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                                                (path, f"{escaped}%")).fetchall()
+            else:
+                rows = self._connection.execute("SELECT path FROM datasets WHERE path = ?", (path, )).fetchall()
+            removed = [(row[0], ) for row in rows if row[0] not in keep]
+            self._connection.executemany("DELETE FROM datasets WHERE path = ?", removed)
+        return len(removed)
+
+    def _get_image(self, entry_id, column):
+        entry = self.get_entry(entry_id)
+        if entry is None or not entry["readable"]:
+            return None
+        with self._lock:
+            image = self._connection.execute(f"SELECT {column} FROM datasets WHERE id = ?",
+                                             (entry["id"], )).fetchone()[0]
+        if image is not None:
+            return image
+        try:
+            values = self._read_central_slice(entry)
+        except Exception as e:
+            logger.error("Could not read the central slice of %s: %s", entry["path"], e)
+            return None
+        thumbnail = self._encode_preview(values, THUMBNAIL_SIZE)
+        preview = self._encode_preview(values, PREVIEW_SIZE)
+        with self._lock, self._connection:
+            # the previews are kept only if the dataset was not modified while they were read
+            self._connection.execute("UPDATE datasets SET thumbnail = ?, preview = ? WHERE id = ? AND mtime_ns = ?",
+                                     (thumbnail, preview, entry["id"], entry["mtime_ns"]))
+        return thumbnail if column == "thumbnail" else preview
+
+    def _read_central_slice(self, entry):
+        z = entry["depth"] // 2
+        reader = ImageReader(file_name=entry["path"],
+                             resample=False,
+                             crop=True,
+                             target_z_extent=(z, z),
+                             hdf5_dataset_name=self.hdf5_dataset_name)
+        image = reader.Read()
+        width, height = image.GetDimensions()[:2]
+        return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(height, width)
+
+    @staticmethod
+    def _encode_preview(values, size):
+        values = values.astype(np.float64)
+        while max(values.shape) > size:
+            values = downsample(values)
+        low, high = np.percentile(values, (1, 99))
+        grey = np.clip((values - low) * 255 / max(high - low, 1e-12), 0, 255).astype(np.uint8)
+        # the y axis goes up in the viewers
+        return encode_png(grey[::-1])
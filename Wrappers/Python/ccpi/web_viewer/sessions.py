@@ -0,0 +1,333 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import json
+import logging
+import socket
+import subprocess
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLimitError(RuntimeError):
+    """Raised when a session is requested while the maximum number of sessions are open, or they use too much memory."""
+
+
+class SessionManager:
+    """
+    Creates the sessions of the clients of the web viewer, up to max_sessions at once, see ProcessSessionManager.
+
+    The sessions are created by session_factory, called with a new session id and session_kwargs. No session
+    is created while the sessions use memory_limit bytes or more. The sessions idle for more than idle_timeout
+    seconds, or no longer running, are closed by reap_idle_sessions, which runs periodically after start_reaper.
+    """
+
+    def __init__(self,
+                 session_factory,
+                 max_sessions: int = 8,
+                 memory_limit: int = None,
+                 idle_timeout: float = 30 * 60,
+                 **session_kwargs):
+        if max_sessions < 1:
+            raise ValueError(f"Maximum number of sessions must be at least 1, got {max_sessions}")
+        self.max_sessions = int(max_sessions)
+        self.memory_limit = None if memory_limit is None else int(memory_limit)
+        self.idle_timeout = float(idle_timeout)
+        self.session_factory = session_factory
+        self.session_kwargs = session_kwargs
+        self._sessions = OrderedDict()
+        self._opening = 0
+        self._lock = threading.RLock()
+        self._reaper = None
+        self._stop_reaper = threading.Event()
+
+    def create_session(self):
+        """
+        Returns a new session, raises SessionLimitError if max_sessions sessions are open, or they use
+        memory_limit bytes or more, after reaping the idle ones
+        """
+        with self._lock:
+            if len(self._sessions) + self._opening >= self.max_sessions or self._is_over_memory_limit():
+                self.reap_idle_sessions()
+            if len(self._sessions) + self._opening >= self.max_sessions:
+                raise SessionLimitError(f"The maximum number of sessions, {self.max_sessions}, are open.")
+            if self._is_over_memory_limit():
+                raise SessionLimitError(f"The sessions use more than the memory limit of {self.memory_limit} bytes.")
+            self._opening += 1
+        # the session is created out of the lock, so that the sessions are used while it starts
+        session_id = uuid.uuid4().hex
+        try:
+            session = self._new_session(session_id)
+        except Exception:
+            with self._lock:
+                self._opening -= 1
+            raise
+        with self._lock:
+            self._opening -= 1
+            self._sessions[session_id] = session
+        logger.info("Opened session %s, %d sessions open", session_id, len(self._sessions))
+        return session
+
+    def _new_session(self, session_id):
+        return self.session_factory(session_id, **self.session_kwargs)
+
+    def _is_over_memory_limit(self):
+        return self.memory_limit is not None and self.get_memory_usage() >= self.memory_limit
+
+    def get_session(self, session_id: str):
+        """Returns the session, recording activity. Raises KeyError if it does not exist or was closed."""
+        with self._lock:
+            session = self._sessions[session_id]
+        session.touch()
+        return session
+
+    def get_session_ids(self):
+        with self._lock:
+            return list(self._sessions.keys())
+
+    def get_number_of_sessions(self):
+        return len(self._sessions)
+
+    def get_memory_usage(self):
+        """Returns the bytes used by the sessions, as reported by their get_memory_usage"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return sum(session.get_memory_usage() for session in sessions)
+
+    def close_session(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+            logger.info("Closed session %s, %d sessions open", session_id, len(self._sessions))
+
+    def close_all_sessions(self):
+        for session_id in self.get_session_ids():
+            self.close_session(session_id)
+
+    def reap_idle_sessions(self, now: float = None):
+        """Closes the sessions idle for more than idle_timeout seconds, or no longer running, returns their ids"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [
+                session_id for session_id, session in self._sessions.items()
+                if session.get_idle_time(now) > self.idle_timeout or not session.is_running()
+            ]
+        for session_id in idle:
+            self.close_session(session_id)
+        return idle
+
+    def start_reaper(self, interval: float = 60.):
+        """Reaps the idle sessions every interval seconds on a background thread"""
+        if self._reaper is not None:
+            return
+        self._stop_reaper.clear()
+
+        def reap():
+            while not self._stop_reaper.wait(interval):
+                self.reap_idle_sessions()
+
+        self._reaper = threading.Thread(target=reap, name="SessionReaper", daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        if self._reaper is None:
+            return
+        self._stop_reaper.set()
+        self._reaper.join()
+        self._reaper = None
+
+
+def _find_free_port(host: str):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class ProcessSession:
+    """
+    A session of one client served by its own web viewer process, with its own trame server, state and viewer.
+
+    command is the command line of the web viewer, e.g. python -m ccpi.web_viewer.web_app <data_files>, which is
+    started serving on a free port of host. The process exits once no client has been connected to it for
+    timeout seconds, so the session ends when its client disconnects.
+    """
+
+    def __init__(self,
+                 session_id: str,
+                 command,
+                 host: str = "localhost",
+                 timeout: float = 60,
+                 start_timeout: float = 60):
+        self.session_id = session_id
+        self.host = host
+        self.port = _find_free_port(host)
+        self.closed = False
+        self._memory_usage = 0
+        self.process = subprocess.Popen(
+            [*command, "--server", f"--host={host}", f"--port={self.port}", f"--timeout={int(timeout)}"])
+        self.created = time.monotonic()
+        self.last_activity = self.created
+        self._wait_for_server(start_timeout)
+
+    def _wait_for_server(self, start_timeout):
+        deadline = time.monotonic() + start_timeout
+        while True:
+            if not self.is_running():
+                self.close()
+                raise RuntimeError(f"The web viewer of session {self.session_id} exited with "
+                                   f"code {self.process.returncode} on starting.")
+            try:
+                with socket.create_connection((self.host, self.port), timeout=1):
+                    return
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError(f"The web viewer of session {self.session_id} did not start "
+                                       f"in {start_timeout} s.")
+                time.sleep(0.1)
+
+    def get_url(self, host: str = None):
+        """Returns the URL of the web viewer of the session, on host if given, e.g. the host the client connected to"""
+        return f"http://{self.host if host is None else host}:{self.port}/"
+
+    def touch(self, now: float = None):
+        self.last_activity = time.monotonic() if now is None else now
+
+    def get_idle_time(self, now: float = None):
+        # the process exits when its client disconnects, a connected client is not idle
+        return 0.
+
+    def get_status(self, timeout: float = 5):
+        """Returns the status of the view served by the process on its /session route, see TrameViewer"""
+        with urllib.request.urlopen(f"http://{self.host}:{self.port}/session", timeout=timeout) as response:
+            return json.loads(response.read())
+
+    def get_memory_usage(self):
+        """
+        Returns the bytes of the buffers registered with the cilMemoryManager of the process, as last reported
+        by the process
+        """
+        if self.is_running():
+            try:
+                self._memory_usage = self.get_status()["memory_usage"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Could not get the memory usage of session %s: %s", self.session_id, e)
+        return self._memory_usage
+
+    def is_running(self):
+        return not self.closed and self.process.poll() is None
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class ProcessSessionManager(SessionManager):
+    """
+    Starts a web viewer process for each client, up to max_sessions at once, see ProcessSession.
+
+    Each process has its own cilMemoryManager and VolumeCache, whose budget is set with the --memory_budget option
+    of the command. The processes share the volumes they load through the --shared_volumes option of the command,
+    see VolumeCache.set_shared_directory, so a file opened by several clients is read once. No process is
+    started while the processes use memory_limit bytes or more. The sessions whose client disconnected for
+    timeout seconds are closed by reap_idle_sessions.
+    """
+
+    def __init__(self,
+                 command,
+                 max_sessions: int = 8,
+                 memory_limit: int = None,
+                 host: str = "localhost",
+                 timeout: float = 60,
+                 start_timeout: float = 60):
+        super().__init__(ProcessSession,
+                         max_sessions=max_sessions,
+                         memory_limit=memory_limit,
+                         command=list(command),
+                         host=host,
+                         timeout=timeout,
+                         start_timeout=start_timeout)
+
+
+def create_launcher_app(manager: ProcessSessionManager, reap_interval: float = 5.):
+    """
+    Returns the aiohttp application of the launcher of the web viewers: a client opening / is redirected to the
+    web viewer of a new session, or answered 503 if no session can be created, see SessionManager.create_session.
+    The sessions and their memory usage are listed as JSON on /sessions.
+    """
+    # deferred, the sessions are also used without a web server
+    import asyncio
+    from aiohttp import web
+
+    async def open_session(request):
+        loop = asyncio.get_running_loop()
+        try:
+            # starting the process takes seconds, the other clients are served meanwhile
+            session = await loop.run_in_executor(None, manager.create_session)
+        except SessionLimitError as e:
+            raise web.HTTPServiceUnavailable(text=str(e))
+        except RuntimeError as e:
+            logger.error("Could not open a session: %s", e)
+            raise web.HTTPInternalServerError(text=str(e))
+        raise web.HTTPFound(session.get_url(request.url.host))
+
+    async def list_sessions(_request):
+        loop = asyncio.get_running_loop()
+        return web.json_response(await loop.run_in_executor(None, _describe_sessions, manager))
+
+    async def start_reaper(_app):
+        manager.start_reaper(reap_interval)
+
+    async def close_sessions(_app):
+        manager.stop_reaper()
+        manager.close_all_sessions()
+
+    app = web.Application()
+    app.router.add_get("/", open_session)
+    app.router.add_get("/sessions", list_sessions)
+    app.on_startup.append(start_reaper)
+    app.on_cleanup.append(close_sessions)
+    return app
+
+
+def _describe_sessions(manager):
+    sessions = []
+    for session_id in manager.get_session_ids():
+        try:
+            session = manager.get_session(session_id)
+        except KeyError:
+            continue
+        sessions.append({"id": session_id, "port": session.port, "memory_usage": session.get_memory_usage()})
+    return {"sessions": sessions, "max_sessions": manager.max_sessions, "memory_limit": manager.memory_limit}
+
+
+def run_launcher(manager: ProcessSessionManager, host: str = "localhost", port: int = 8080):
+    """Serves the launcher of the web viewers on host:port until interrupted, see create_launcher_app"""
+    from aiohttp import web
+    print(f"Launching a web viewer for each client at http://{host}:{port}/, up to {manager.max_sessions} at once")
+    web.run_app(create_launcher_app(manager), host=host, port=port, print=None)
@@ -0,0 +1,261 @@
+/*
+ *   Copyright 2024 STFC, United Kingdom Research and Innovation
+ *
+ *   Licensed under the Apache License, Version 2.0 (the "License");
+ *   you may not use this file except in compliance with the License.
+ *   You may obtain a copy of the License at
+ *
+ *       http://www.apache.org/licenses/LICENSE-2.0
+ *
+ *   Unless required by applicable law or agreed to in writing, software
+ *   distributed under the License is distributed on an "AS IS" BASIS,
+ *   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ *   See the License for the specific language governing permissions and
+ *   limitations under the License.
+ *
+ * ccpi-tile-view: displays the slices of a SliceTilePyramid served by a TileServer,
+ * see ccpi/web_viewer/tiles.py. Panning and zooming are done in the browser, which
+ * requests the tiles of the level matching the zoom. The tiles hold the values of the
+ * slice packed in 16 bits, so the window and level are applied in the browser.
+ */
+(function () {
+  const MAX_TILES = 1024;
+
+  function decodeTile(image) {
+    const canvas = document.createElement("canvas");
+    canvas.width = image.width;
+    canvas.height = image.height;
+    const context = canvas.getContext("2d", { willReadFrequently: true });
+    context.drawImage(image, 0, 0);
+    const rgba = context.getImageData(0, 0, image.width, image.height);
+    const values = new Uint16Array(image.width * image.height);
+    for (let i = 0; i < values.length; i++) {
+      values[i] = (rgba.data[4 * i] << 8) | rgba.data[4 * i + 1];
+    }
+    return { values, canvas, context, rgba, windowLevel: null };
+  }
+
+  function colorTile(tile, low, high) {
+    const data = tile.rgba.data;
+    const scale = 255 / Math.max(high - low, 1e-12);
+    for (let i = 0; i < tile.values.length; i++) {
+      const grey = Math.min(255, Math.max(0, (tile.values[i] - low) * scale));
+      data[4 * i] = grey;
+      data[4 * i + 1] = grey;
+      data[4 * i + 2] = grey;
+      data[4 * i + 3] = 255;
+    }
+    tile.context.putImageData(tile.rgba, 0, 0);
+  }
+
+  const TileView = {
+    name: "ccpi-tile-view",
+    props: {
+      src: { type: String, default: "" },
+      orientation: { type: [String, Number], default: 2 },
+      slice: { type: [String, Number], default: 0 },
+      windowLevel: { type: Array, default: null },
+    },
+    template:
+      '<div style="position: relative; width: 100%; height: 100%; overflow: hidden;">' +
+      '<canvas ref="canvas" style="position: absolute; cursor: grab;" ' +
+      '@mousedown="onMouseDown" @wheel.prevent="onWheel" @dblclick="fit"></canvas></div>',
+    data() {
+      return { info: null };
+    },
+    created() {
+      this.tiles = new Map();
+      this.scale = 1;
+      this.offset = [0, 0];
+      this.drag = null;
+    },
+    mounted() {
+      this.resizeObserver = new ResizeObserver(() => this.resize());
+      this.resizeObserver.observe(this.$el);
+      this.loadInfo();
+    },
+    beforeDestroy() {
+      this.resizeObserver.disconnect();
+    },
+    beforeUnmount() {
+      this.resizeObserver.disconnect();
+    },
+    watch: {
+      src() {
+        this.tiles.clear();
+        this.loadInfo();
+      },
+      orientation() {
+        this.fit();
+      },
+      slice() {
+        this.draw();
+      },
+      windowLevel() {
+        this.draw();
+      },
+    },
+    methods: {
+      loadInfo() {
+        if (!this.src) {
+          return;
+        }
+        const src = this.src;
+        fetch(`${src}/info`)
+          .then((response) => response.json())
+          .then((info) => {
+            if (src === this.src) {
+              this.info = info;
+              this.fit();
+            }
+          });
+      },
+      geometry() {
+        return this.info && this.info.orientations[String(Number(this.orientation))];
+      },
+      resize() {
+        const canvas = this.$refs.canvas;
+        canvas.width = this.$el.clientWidth;
+        canvas.height = this.$el.clientHeight;
+        this.draw();
+      },
+      fit() {
+        const geometry = this.geometry();
+        const canvas = this.$refs.canvas;
+        if (!geometry || !canvas) {
+          return;
+        }
+        this.scale = Math.min(canvas.width / geometry.width, canvas.height / geometry.height) || 1;
+        this.offset = [
+          (canvas.width - geometry.width * this.scale) / 2,
+          (canvas.height - geometry.height * this.scale) / 2,
+        ];
+        this.draw();
+      },
+      valueRange() {
+        // the window and level are in the units of the volume, the tiles in 16 bits values
+        if (!this.windowLevel) {
+          return [0, 65535];
+        }
+        const [window, level] = this.windowLevel;
+        const { value_offset: offset, value_scale: scale } = this.info;
+        return [(level - window / 2 - offset) * scale, (level + window / 2 - offset) * scale];
+      },
+      tileUrl(level, column, row) {
+        return `${this.src}/${Number(this.orientation)}/${Number(this.slice)}/${level}/${column}_${row}.png`;
+      },
+      getTile(level, column, row, request) {
+        const url = this.tileUrl(level, column, row);
+        let tile = this.tiles.get(url);
+        if (tile !== undefined) {
+          // most recently used last
+          this.tiles.delete(url);
+          this.tiles.set(url, tile);
+          return tile.values ? tile : null;
+        }
+        if (!request) {
+          return null;
+        }
+        tile = { loading: true };
+        this.tiles.set(url, tile);
+        const image = new Image();
+        image.onload = () => {
+          if (this.tiles.get(url) === tile) {
+            this.tiles.set(url, decodeTile(image));
+            this.draw();
+          }
+        };
+        image.onerror = () => this.tiles.delete(url);
+        image.src = url;
+        while (this.tiles.size > MAX_TILES) {
+          this.tiles.delete(this.tiles.keys().next().value);
+        }
+        return null;
+      },
+      drawLevel(context, geometry, level, request) {
+        const tileSize = this.info.tile_size;
+        const factor = 2 ** level;
+        const footprint = tileSize * factor * this.scale;
+        const canvas = this.$refs.canvas;
+        const columns = Math.ceil(geometry.width / factor / tileSize);
+        const rows = Math.ceil(geometry.height / factor / tileSize);
+        const [low, high] = this.valueRange();
+        let complete = true;
+        for (let row = 0; row < rows; row++) {
+          const y = this.offset[1] + row * footprint;
+          if (y > canvas.height || y + footprint < 0) {
+            continue;
+          }
+          for (let column = 0; column < columns; column++) {
+            const x = this.offset[0] + column * footprint;
+            if (x > canvas.width || x + footprint < 0) {
+              continue;
+            }
+            const tile = this.getTile(level, column, row, request);
+            if (!tile) {
+              complete = false;
+              continue;
+            }
+            if (!tile.windowLevel || tile.windowLevel[0] !== low || tile.windowLevel[1] !== high) {
+              colorTile(tile, low, high);
+              tile.windowLevel = [low, high];
+            }
+            context.drawImage(tile.canvas, x, y, tile.canvas.width * factor * this.scale,
+                              tile.canvas.height * factor * this.scale);
+          }
+        }
+        return complete;
+      },
+      draw() {
+        const geometry = this.geometry();
+        const canvas = this.$refs.canvas;
+        if (!geometry || !canvas) {
+          return;
+        }
+        const context = canvas.getContext("2d");
+        context.clearRect(0, 0, canvas.width, canvas.height);
+        context.imageSmoothingEnabled = this.scale < 1;
+        // the level with about one value of the tiles per pixel of the screen
+        const level = Math.min(geometry.levels - 1, Math.max(0, Math.floor(Math.log2(1 / this.scale))));
+        // the coarser levels already loaded are drawn while the tiles of the level are loading
+        for (let coarser = geometry.levels - 1; coarser > level; coarser--) {
+          this.drawLevel(context, geometry, coarser, coarser === geometry.levels - 1);
+        }
+        this.drawLevel(context, geometry, level, true);
+      },
+      onMouseDown(event) {
+        this.drag = [event.clientX, event.clientY, this.offset[0], this.offset[1]];
+        const move = (moveEvent) => {
+          this.offset = [
+            this.drag[2] + moveEvent.clientX - this.drag[0],
+            this.drag[3] + moveEvent.clientY - this.drag[1],
+          ];
+          this.draw();
+        };
+        const up = () => {
+          window.removeEventListener("mousemove", move);
+          window.removeEventListener("mouseup", up);
+          this.drag = null;
+        };
+        window.addEventListener("mousemove", move);
+        window.addEventListener("mouseup", up);
+      },
+      onWheel(event) {
+        const zoom = event.deltaY < 0 ? 1.2 : 1 / 1.2;
+        const rect = this.$refs.canvas.getBoundingClientRect();
+        const x = event.clientX - rect.left;
+        const y = event.clientY - rect.top;
+        // zoom around the position of the mouse
+        this.offset = [x - (x - this.offset[0]) * zoom, y - (y - this.offset[1]) * zoom];
+        this.scale *= zoom;
+        this.draw();
+      },
+    },
+  };
+
+  window.CCPiTileView = {
+    install(app) {
+      app.component("ccpi-tile-view", TileView);
+    },
+  };
+})();
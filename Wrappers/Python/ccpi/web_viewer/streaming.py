@@ -0,0 +1,301 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# seconds during which the repeated calls of a state change callback are coalesced into one
+DEFAULT_COALESCE_INTERVAL = 1. / 30
+
+
+def _get_running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class CoalescedCallback:
+    """
+    Wraps a state change callback so that it runs at most once per interval seconds.
+
+    The first call runs immediately, the calls during the following interval are coalesced into
+    one call with the arguments of the latest call, at the end of the interval. Dragging a slider
+    then applies the position of the slider when the server is ready for it, rather than queuing
+    a callback for every position the slider went through.
+
+    Without a running event loop, i.e. before the server starts, the callback is called directly.
+    """
+
+    def __init__(self, callback, interval: float = DEFAULT_COALESCE_INTERVAL):
+        functools.update_wrapper(self, callback)
+        self.callback = callback
+        self.interval = interval
+        self.coalesced_calls = 0
+        self._last_call = None
+        self._pending_kwargs = None
+        self._handle = None
+
+    def __call__(self, **kwargs):
+        loop = _get_running_loop()
+        if loop is None:
+            return self.callback(**kwargs)
+        now = loop.time()
+        if self._handle is None and (self._last_call is None or now - self._last_call >= self.interval):
+            self._last_call = now
+            return self.callback(**kwargs)
+        if self._pending_kwargs is not None:
+            self.coalesced_calls += 1
+        self._pending_kwargs = kwargs
+        if self._handle is None:
+            self._handle = loop.call_later(max(0., self._last_call + self.interval - now), self._flush, loop)
+
+    def _flush(self, loop):
+        self._handle = None
+        kwargs, self._pending_kwargs = self._pending_kwargs, None
+        self._last_call = loop.time()
+        try:
+            self.callback(**kwargs)
+        except Exception:
+            logger.exception("Error in coalesced callback %s", getattr(self.callback, "__name__", self.callback))
+
+
+def coalesce(interval: float = DEFAULT_COALESCE_INTERVAL):
+    """Decorator of the state change callbacks called repeatedly while a slider is dragged, see CoalescedCallback"""
+
+    def decorator(callback):
+        return CoalescedCallback(callback, interval)
+
+    return decorator
+
+
+class StreamingMetrics:
+    """
+    Records the time to render and encode the frames streamed to the client, and their size.
+
+    The last max_frames frames are kept to compute the rates and means of get_summary.
+    """
+
+    def __init__(self, max_frames: int = 100):
+        self._frames = deque(maxlen=max_frames)
+        self.total_frames = 0
+        self.total_bytes = 0
+        self.coalesced_updates = 0
+
+    def record_frame(self,
+                     render_time: float,
+                     encode_time: float,
+                     bytes_sent: int,
+                     interactive: bool = False,
+                     timestamp: float = None):
+        """Records a frame, with the times in seconds"""
+        self._frames.append({
+            "timestamp": time.monotonic() if timestamp is None else timestamp,
+            "render_time": render_time,
+            "encode_time": encode_time,
+            "bytes": int(bytes_sent),
+            "interactive": bool(interactive)
+        })
+        self.total_frames += 1
+        self.total_bytes += int(bytes_sent)
+
+    def record_coalesced_update(self):
+        """Records an update of the view which was not streamed, because a later update replaced it"""
+        self.coalesced_updates += 1
+
+    def get_frames(self):
+        return list(self._frames)
+
+    def get_summary(self):
+        """Returns a dict of the totals, and of the frame rate and means over the last frames"""
+        frames = self._frames
+        summary = {
+            "frames": self.total_frames,
+            "bytes_sent": self.total_bytes,
+            "coalesced_updates": self.coalesced_updates,
+            "interactive_frames": sum(frame["interactive"] for frame in frames),
+            "frame_rate": 0.,
+            "bandwidth": 0.,
+            "mean_render_time": 0.,
+            "mean_encode_time": 0.,
+            "mean_frame_size": 0.
+        }
+        if not frames:
+            return summary
+        summary["mean_render_time"] = sum(frame["render_time"] for frame in frames) / len(frames)
+        summary["mean_encode_time"] = sum(frame["encode_time"] for frame in frames) / len(frames)
+        summary["mean_frame_size"] = sum(frame["bytes"] for frame in frames) / len(frames)
+        duration = frames[-1]["timestamp"] - frames[0]["timestamp"]
+        if duration > 0:
+            summary["frame_rate"] = (len(frames) - 1) / duration
+            summary["bandwidth"] = sum(frame["bytes"] for frame in list(frames)[1:]) / duration
+        return summary
+
+    def format_summary(self):
+        summary = self.get_summary()
+        return (
+            f"{summary['frame_rate']:.1f} fps, render {summary['mean_render_time'] * 1000:.1f} ms, "
+            f"encode {summary['mean_encode_time'] * 1000:.1f} ms, {summary['mean_frame_size'] / 1024:.1f} kB/frame, "
+            f"{summary['bandwidth'] / 1024:.0f} kB/s")
+
+
+class AdaptiveStreaming:
+    """
+    Streams the images of a VtkRemoteView at a quality adapted to the interaction.
+
+    The viewers call request_update in place of pushing an image. While the updates keep coming,
+    i.e. while a slider is dragged, the images are encoded at interactive_quality and scaled by
+    interactive_ratio, and pushed at most max_frame_rate times per second: the updates in between
+    are coalesced. When no update is requested for settle_delay seconds, one image is pushed at
+    still_quality and still_ratio.
+
+    The time to render and encode the images, and their size, are recorded in metrics once attach
+    hooks into the image delivery of the server. The summary is shown in the state key
+    metrics_state_key, and served as JSON on the /metrics route of the server.
+
+    Without a running event loop, i.e. before the server starts, the images are pushed directly.
+    """
+
+    def __init__(self,
+                 server,
+                 push_image,
+                 view_id_key: str = "viewId",
+                 interactive_quality: int = 50,
+                 interactive_ratio: float = 0.5,
+                 still_quality: int = 95,
+                 still_ratio: float = 1.,
+                 settle_delay: float = 0.3,
+                 max_frame_rate: float = 30.,
+                 metrics: StreamingMetrics = None,
+                 metrics_state_key: str = "streaming_metrics"):
+        self.server = server
+        self.push_image = push_image
+        self.view_id_key = view_id_key
+        self.interactive_quality = interactive_quality
+        self.interactive_ratio = interactive_ratio
+        self.still_quality = still_quality
+        self.still_ratio = still_ratio
+        self.settle_delay = settle_delay
+        self.max_frame_rate = max_frame_rate
+        self.metrics = StreamingMetrics() if metrics is None else metrics
+        self.metrics_state_key = metrics_state_key
+        self.server.state[metrics_state_key] = ""
+        self._interacting = False
+        self._last_push = None
+        self._push_handle = None
+        self._settle_handle = None
+
+    def get_view_options(self):
+        """Returns the keyword arguments of the VtkRemoteView, for the interaction in the view itself"""
+        return {
+            "interactive_quality": self.interactive_quality,
+            "interactive_ratio": self.interactive_ratio,
+            "still_quality": self.still_quality,
+            "still_ratio": self.still_ratio
+        }
+
+    def is_interacting(self):
+        return self._interacting
+
+    def request_update(self):
+        """Requests an image of the view to be pushed to the client"""
+        loop = _get_running_loop()
+        if loop is None:
+            self.push_image()
+            return
+        if not self._interacting:
+            self._interacting = True
+            self._set_quality(self.interactive_quality, self.interactive_ratio)
+        if self._settle_handle is not None:
+            self._settle_handle.cancel()
+        self._settle_handle = loop.call_later(self.settle_delay, self._settle)
+        if self._push_handle is not None:
+            self.metrics.record_coalesced_update()
+            return
+        wait = 0. if self._last_push is None else self._last_push + 1. / self.max_frame_rate - loop.time()
+        if wait <= 0:
+            self._push(loop)
+        else:
+            self._push_handle = loop.call_later(wait, self._push, loop)
+
+    def attach(self, **_kwargs):
+        """Records the frames rendered by the image delivery of the server in the metrics"""
+        protocol = self.server.protocol
+        method = protocol.getRPCMethod("viewport.image.push") if protocol is not None else None
+        if not method:
+            logger.warning("No image delivery to record the streaming metrics of")
+            return False
+        image_delivery = method[0]
+        if getattr(image_delivery, "_streaming_metrics", None) is not None:
+            return True
+        # the image delivery of trame-vtk names its methods in snake case, the one of vtkmodules.web in camel case
+        if hasattr(image_delivery, "still_render"):
+            still_render_name, get_view = "still_render", image_delivery.get_view
+        else:
+            still_render_name, get_view = "stillRender", image_delivery.getView
+        still_render = getattr(image_delivery, still_render_name)
+
+        def record_still_render(options):
+            start = time.perf_counter()
+            reply = still_render(options)
+            work_time = time.perf_counter() - start
+            if reply.get("image"):
+                view = get_view(options["view"])
+                render_time = 0.
+                renderers = view.GetRenderers()
+                renderers.InitTraversal()
+                for _ in range(renderers.GetNumberOfItems()):
+                    render_time += renderers.GetNextItem().GetLastRenderTimeInSeconds()
+                self.metrics.record_frame(min(render_time, work_time), max(0., work_time - render_time),
+                                          reply["memsize"], self._interacting)
+            return reply
+
+        setattr(image_delivery, still_render_name, record_still_render)
+        image_delivery._streaming_metrics = self.metrics
+        return True
+
+    def add_metrics_route(self, wslink_server):
+        """Serves the summary and the last frames of the metrics as JSON on the /metrics route of the server"""
+        from aiohttp import web
+
+        async def get_metrics(_request):
+            return web.json_response({"summary": self.metrics.get_summary(), "frames": self.metrics.get_frames()})
+
+        wslink_server.app.router.add_get("/metrics", get_metrics)
+
+    def _push(self, loop):
+        self._push_handle = None
+        self._last_push = loop.time()
+        self.push_image()
+
+    def _settle(self):
+        self._settle_handle = None
+        if self._push_handle is not None:
+            self._push_handle.cancel()
+            self._push_handle = None
+        self._interacting = False
+        self._set_quality(self.still_quality, self.still_ratio)
+        self.push_image()
+        with self.server.state as state:
+            state[self.metrics_state_key] = self.metrics.format_summary()
+
+    def _set_quality(self, quality, ratio):
+        if self.server.protocol is None:
+            return
+        self.server.protocol_call("viewport.image.push.quality", self.server.state[self.view_id_key], quality, ratio)
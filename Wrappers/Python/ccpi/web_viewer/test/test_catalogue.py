@@ -0,0 +1,158 @@
+#
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import h5py
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from vtkmodules.vtkIOImage import vtkMetaImageWriter, vtkTIFFWriter
+
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.web_viewer import catalogue as catalogue_module
+from ccpi.web_viewer.catalogue import DataCatalogue, describe_entry, read_dataset_info
+
+
+class DataCatalogueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = np.random.randint(0, 1000, size=(6, 20, 30)).astype(np.uint16)
+        np.save(os.path.join(self.tmpdir, "scan_1.npy"), self.data)
+        os.makedirs(os.path.join(self.tmpdir, "night", "stack"))
+        np.save(os.path.join(self.tmpdir, "night", "scan_2.npy"), self.data.astype(np.float32))
+        with h5py.File(os.path.join(self.tmpdir, "scan_3.nxs"), "w") as f:
+            f["entry1/tomo_entry/data/data"] = self.data.astype(np.int16)
+        writer = vtkMetaImageWriter()
+        writer.SetFileName(os.path.join(self.tmpdir, "head.mha"))
+        writer.SetInputData(Converter.numpy2vtkImage(self.data))
+        writer.SetCompression(False)
+        writer.Write()
+        for z in range(4):
+            writer = vtkTIFFWriter()
+            writer.SetFileName(os.path.join(self.tmpdir, "night", "stack", f"slice_{z}.tif"))
+            writer.SetInputData(Converter.numpy2vtkImage(self.data[z:z + 1].copy()))
+            writer.Write()
+        self.data.tofile(os.path.join(self.tmpdir, "blob.raw"))
+        with open(os.path.join(self.tmpdir, "notes.txt"), "w") as f:
+            f.write("not a dataset")
+        self.catalogue = DataCatalogue(os.path.join(self.tmpdir, "index.sqlite"))
+
+    def tearDown(self):
+        self.catalogue.close()
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, *names):
+        return os.path.join(self.tmpdir, *names)
+
+    def test_read_dataset_info(self):
+        info = {"width": 30, "height": 20, "depth": 6}
+        self.assertEqual(read_dataset_info(self.path("scan_1.npy")), dict(info, dtype="uint16", nbytes=7200))
+        self.assertEqual(read_dataset_info(self.path("scan_3.nxs")), dict(info, dtype="int16", nbytes=7200))
+        self.assertEqual(read_dataset_info(self.path("head.mha")), dict(info, dtype="uint16", nbytes=7200))
+        stack_info = dict(info, depth=4, dtype="uint16", nbytes=4800)
+        self.assertEqual(read_dataset_info(self.path("night", "stack")), stack_info)
+        with self.assertRaises(ValueError):
+            read_dataset_info(self.path("notes.txt"))
+
+    def test_scan_indexes_the_datasets(self):
+        stats = self.catalogue.scan([self.tmpdir])
+
+        self.assertEqual(stats, {"updated": 6, "unchanged": 0, "removed": 0})
+        entries = {entry["name"]: entry for entry in self.catalogue.search(readable=None)}
+        self.assertEqual(sorted(entries), ["blob.raw", "head.mha", "scan_1.npy", "scan_2.npy", "scan_3.nxs", "stack"])
+        self.assertFalse(entries["blob.raw"]["readable"])
+        self.assertEqual(entries["stack"]["path"], self.path("night", "stack"))
+        self.assertEqual(describe_entry(entries["scan_2.npy"]), "scan_2.npy (30×20×6, float32, 0.0 MB)")
+        self.assertEqual(describe_entry(entries["blob.raw"]), "blob.raw (unreadable)")
+
+    def test_scan_again_reads_only_the_modified_files(self):
+        self.catalogue.scan([self.tmpdir])
+        np.save(self.path("scan_1.npy"), self.data[:3])
+        os.utime(self.path("scan_1.npy"), ns=(0, 0))
+        os.remove(self.path("head.mha"))
+
+        with mock.patch.object(catalogue_module, "read_dataset_info", wraps=read_dataset_info) as read_info:
+            stats = self.catalogue.scan([self.tmpdir])
+
+        read_info.assert_called_once_with(self.path("scan_1.npy"), self.catalogue.hdf5_dataset_name)
+        self.assertEqual(stats, {"updated": 1, "unchanged": 4, "removed": 1})
+        self.assertEqual(self.catalogue.get_entry(self.path("scan_1.npy"))["depth"], 3)
+        self.assertIsNone(self.catalogue.get_entry(self.path("head.mha")))
+
+    def test_index_is_kept_in_the_file(self):
+        self.catalogue.scan([self.tmpdir])
+        self.catalogue.close()
+        self.catalogue = DataCatalogue(self.path("index.sqlite"))
+
+        self.assertEqual(self.catalogue.get_number_of_entries(), 6)
+        self.assertEqual(self.catalogue.scan([self.tmpdir])["unchanged"], 6)
+
+    def test_search(self):
+        self.catalogue.scan([self.tmpdir])
+
+        self.assertEqual([entry["name"] for entry in self.catalogue.search("SCAN")],
+                         ["scan_1.npy", "scan_2.npy", "scan_3.nxs"])
+        self.assertEqual([entry["name"] for entry in self.catalogue.search(dtype="uint16")],
+                         ["head.mha", "scan_1.npy", "stack"])
+        self.assertEqual([entry["name"] for entry in self.catalogue.search(max_nbytes=5000)], ["stack"])
+        self.assertEqual([entry["name"] for entry in self.catalogue.search(limit=2, offset=1)],
+                         ["scan_1.npy", "scan_2.npy"])
+        self.assertEqual(self.catalogue.search("%"), [])
+        self.assertEqual(self.catalogue.get_dtypes(), ["float32", "int16", "uint16"])
+
+    def test_previews_are_read_once(self):
+        self.catalogue.scan([self.tmpdir])
+        entry = self.catalogue.get_entry(self.path("scan_1.npy"))
+
+        with mock.patch.object(DataCatalogue,
+                               "_read_central_slice",
+                               autospec=True,
+                               side_effect=DataCatalogue._read_central_slice) as read_slice:
+            thumbnail = self.catalogue.get_thumbnail(entry["id"])
+            preview = self.catalogue.get_preview(entry["id"])
+            self.assertEqual(self.catalogue.get_thumbnail(entry["id"]), thumbnail)
+
+        read_slice.assert_called_once()
+        self.assertEqual(thumbnail[:4], b"\x89PNG")
+        self.assertEqual(preview[:4], b"\x89PNG")
+        self.assertIsNone(self.catalogue.get_thumbnail(self.catalogue.get_entry(self.path("blob.raw"))["id"]))
+
+    def test_background_scan_and_routes(self):
+        self.catalogue.start_scan([self.tmpdir])
+        self.catalogue.wait_for_scan(30)
+        self.assertFalse(self.catalogue.is_scanning())
+        entry = self.catalogue.get_entry(self.path("night", "stack"))
+        wslink_server = mock.MagicMock()
+        wslink_server.app = web.Application()
+        self.catalogue.add_routes(wslink_server)
+
+        async def get():
+            async with TestClient(TestServer(wslink_server.app)) as client:
+                thumbnail = await client.get(f"/catalogue/{entry['id']}/thumbnail.png")
+                missing = await client.get("/catalogue/1000/preview.png")
+                return thumbnail.status, thumbnail.headers["Content-Type"], missing.status
+
+        self.assertEqual(asyncio.run(get()), (200, "image/png", 404))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+#
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import aiohttp
+import msgpack
+import numpy as np
+from aiohttp import web
+from wslink.chunking import UnChunker, generate_chunks
+
+import ccpi.web_viewer
+from ccpi.web_viewer.sessions import (ProcessSessionManager, SessionLimitError, SessionManager, create_launcher_app)
+
+
+class FakeSession:
+
+    def __init__(self, session_id, memory_usage=0):
+        self.session_id = session_id
+        self.memory_usage = memory_usage
+        self.last_activity = time.monotonic()
+        self.closed = False
+
+    def touch(self, now=None):
+        self.last_activity = time.monotonic() if now is None else now
+
+    def get_idle_time(self, now=None):
+        return (time.monotonic() if now is None else now) - self.last_activity
+
+    def get_memory_usage(self):
+        return self.memory_usage
+
+    def is_running(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class SessionManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = SessionManager(FakeSession, max_sessions=4, idle_timeout=60, memory_usage=100)
+
+    def tearDown(self):
+        self.manager.stop_reaper()
+        self.manager.close_all_sessions()
+
+    def test_session_limit(self):
+        sessions = [self.manager.create_session() for _ in range(4)]
+        self.assertEqual(len(set(session.session_id for session in sessions)), 4)
+        with self.assertRaises(SessionLimitError):
+            self.manager.create_session()
+        self.manager.close_session(sessions[0].session_id)
+        self.assertTrue(sessions[0].closed)
+        self.manager.create_session()
+        self.assertEqual(self.manager.get_number_of_sessions(), 4)
+
+    def test_memory_limit(self):
+        self.manager.memory_limit = 200
+        self.manager.create_session()
+        self.manager.create_session()
+        self.assertEqual(self.manager.get_memory_usage(), 200)
+        with self.assertRaises(SessionLimitError):
+            self.manager.create_session()
+        self.manager.memory_limit += 1
+        self.manager.create_session()
+
+    def test_idle_sessions_are_reaped(self):
+        idle = self.manager.create_session()
+        active = self.manager.create_session()
+        now = time.monotonic()
+        idle.touch(now - 120)
+        active.touch(now - 10)
+        self.assertEqual(self.manager.reap_idle_sessions(now), [idle.session_id])
+        self.assertTrue(idle.closed)
+        self.assertEqual(self.manager.get_session_ids(), [active.session_id])
+        with self.assertRaises(KeyError):
+            self.manager.get_session(idle.session_id)
+
+    def test_sessions_no_longer_running_are_reaped(self):
+        exited = self.manager.create_session()
+        exited.closed = True
+        self.assertEqual(self.manager.reap_idle_sessions(), [exited.session_id])
+
+    def test_create_session_reaps_idle_sessions_when_full(self):
+        sessions = [self.manager.create_session() for _ in range(4)]
+        sessions[1].touch(time.monotonic() - 120)
+        self.manager.create_session()
+        self.assertTrue(sessions[1].closed)
+        self.assertNotIn(sessions[1].session_id, self.manager.get_session_ids())
+
+    def test_reaper_thread(self):
+        self.manager.idle_timeout = 0.05
+        session = self.manager.create_session()
+        self.manager.start_reaper(interval=0.02)
+        deadline = time.monotonic() + 5
+        while not session.closed and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertTrue(session.closed)
+        self.assertEqual(self.manager.get_number_of_sessions(), 0)
+
+
+class WslinkClient:
+    """Client of the trame server of a web viewer, sending state changes over its websocket like the browser does"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.unchunker = UnChunker()
+        self.request_id = 0
+
+    async def call(self, method, *args):
+        self.request_id += 1
+        request_id = "system:c0:0" if method == "wslink.hello" else f"rpc:c0:{self.request_id}"
+        message = {"wslink": "1.0", "id": request_id, "method": method, "args": list(args), "kwargs": {}}
+        for chunk in generate_chunks(msgpack.packb(message), 0):
+            await self.websocket.send_bytes(chunk)
+        while True:
+            response = self.unchunker.process_chunk((await self.websocket.receive()).data)
+            if response is not None and response.get("id") == request_id:
+                if "error" in response:
+                    raise RuntimeError(response["error"])
+                return response.get("result")
+
+    async def set_state(self, key, value):
+        return await self.call("trame.state.update", [{"key": key, "value": value}])
+
+
+class LauncherTest(unittest.TestCase):
+    """Clients of the web app with --sessions, each served its own web viewer process by the launcher"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = np.random.randint(0, 1000, size=(16, 20, 24)).astype(np.uint16)
+        self.file_name = os.path.join(self.tmpdir, "volume.npy")
+        np.save(self.file_name, self.data)
+        # the viewer processes import ccpi from the same tree as the tests
+        python_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(ccpi.web_viewer.__file__))))
+        self.environ = mock.patch.dict(os.environ, {"PYTHONPATH": python_path})
+        self.environ.start()
+        self.manager = ProcessSessionManager([sys.executable, "-m", "ccpi.web_viewer.web_app", "-d", self.file_name],
+                                             max_sessions=3,
+                                             host="127.0.0.1",
+                                             timeout=1)
+
+    def tearDown(self):
+        self.manager.stop_reaper()
+        self.manager.close_all_sessions()
+        self.environ.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_clients_scrolling_slices(self):
+        number_of_clients = 3
+        number_of_slices = self.data.shape[0]
+
+        async def client(http, launcher_url, last_slice):
+            response = await http.get(launcher_url, allow_redirects=False)
+            self.assertEqual(response.status, 302)
+            url = response.headers["Location"]
+            frame_times = []
+            async with http.ws_connect(url + "ws") as websocket:
+                wslink = WslinkClient(websocket)
+                await wslink.call("wslink.hello", {"secret": "wslink-secret"})
+                for slice_number in range(last_slice + 1):
+                    start = time.perf_counter()
+                    await wslink.set_state("slice", slice_number)
+                    frame_times.append(time.perf_counter() - start)
+                # the last update may be coalesced with the previous ones, and applied after the interval
+                deadline = time.monotonic() + 5
+                while True:
+                    status = await (await http.get(url + "session")).json()
+                    if status["slice"] == last_slice or time.monotonic() > deadline:
+                        break
+                    await asyncio.sleep(0.05)
+                self.assertEqual(status["slice"], last_slice)
+                self.assertEqual(status["file_name"], self.file_name)
+                self.assertGreaterEqual(status["memory_usage"], self.data.nbytes)
+                # all the sessions are open, the next client is turned away
+                await clients_connected.wait()
+                self.assertEqual((await http.get(launcher_url, allow_redirects=False)).status, 503)
+                sessions = await (await http.get(launcher_url + "sessions")).json()
+                self.assertEqual(len(sessions["sessions"]), number_of_clients)
+            return frame_times
+
+        async def run():
+            runner = web.AppRunner(create_launcher_app(self.manager, reap_interval=0.2))
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            launcher_url = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+            try:
+                async with aiohttp.ClientSession() as http:
+                    start = time.perf_counter()
+                    tasks = [
+                        asyncio.create_task(client(http, launcher_url, number_of_slices - 1 - i))
+                        for i in range(number_of_clients)
+                    ]
+                    while self.manager.get_number_of_sessions() < number_of_clients:
+                        await asyncio.sleep(0.05)
+                    clients_connected.set()
+                    results = await asyncio.gather(*tasks)
+                    elapsed = time.perf_counter() - start
+                    # the processes exit once their client disconnected, and the launcher closes their sessions
+                    deadline = time.monotonic() + 20
+                    while self.manager.get_number_of_sessions() and time.monotonic() < deadline:
+                        await asyncio.sleep(0.2)
+                    self.assertEqual(self.manager.get_number_of_sessions(), 0)
+            finally:
+                await runner.cleanup()
+            return results, elapsed
+
+        clients_connected = asyncio.Event()
+        results, elapsed = asyncio.run(run())
+        updates = sum(len(frame_times) for frame_times in results)
+        print(f"\n{number_of_clients} clients of their own viewer processes sent {updates} slice updates "
+              f"in {elapsed:.2f} s, worst update {max(max(frame_times) for frame_times in results) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    unittest.main()
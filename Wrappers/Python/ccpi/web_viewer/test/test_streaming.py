@@ -0,0 +1,145 @@
+#
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import asyncio
+import unittest
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from ccpi.web_viewer.streaming import AdaptiveStreaming, StreamingMetrics, coalesce
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def test_calls_directly_without_event_loop(self):
+        callback = mock.MagicMock(__name__="callback")
+        coalesced = coalesce()(callback)
+        coalesced(slice=1)
+        coalesced(slice=2)
+        self.assertEqual(callback.call_args_list, [mock.call(slice=1), mock.call(slice=2)])
+
+    def test_coalesces_calls_to_the_latest(self):
+        callback = mock.MagicMock(__name__="callback")
+        coalesced = coalesce(0.05)(callback)
+
+        async def drag_slider():
+            for slice_number in range(10):
+                coalesced(slice=slice_number)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(drag_slider())
+        self.assertEqual(callback.call_args_list, [mock.call(slice=0), mock.call(slice=9)])
+        self.assertEqual(coalesced.coalesced_calls, 8)
+
+
+class StreamingMetricsTest(unittest.TestCase):
+
+    def test_summary(self):
+        metrics = StreamingMetrics(max_frames=3)
+        self.assertEqual(metrics.get_summary()["frame_rate"], 0.)
+        for i in range(4):
+            metrics.record_frame(0.01 * i, 0.002, 1000 * (i + 1), interactive=i < 2, timestamp=i * 0.1)
+        metrics.record_coalesced_update()
+        summary = metrics.get_summary()
+        self.assertEqual(summary["frames"], 4)
+        self.assertEqual(summary["bytes_sent"], 10000)
+        self.assertEqual(summary["coalesced_updates"], 1)
+        # the means are over the last 3 frames
+        self.assertEqual(summary["interactive_frames"], 1)
+        self.assertAlmostEqual(summary["mean_render_time"], 0.02)
+        self.assertAlmostEqual(summary["mean_frame_size"], 3000)
+        self.assertAlmostEqual(summary["frame_rate"], 10)
+        self.assertAlmostEqual(summary["bandwidth"], 35000)
+        self.assertIn("fps", metrics.format_summary())
+
+
+class AdaptiveStreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mock.MagicMock()
+        self.server.state = mock.MagicMock()
+        self.server.state.__getitem__.return_value = "1"
+        self.server.state.__enter__.return_value = self.server.state
+        self.push_image = mock.MagicMock()
+        self.streaming = AdaptiveStreaming(self.server,
+                                           self.push_image,
+                                           interactive_quality=40,
+                                           interactive_ratio=0.5,
+                                           still_quality=90,
+                                           settle_delay=0.05,
+                                           max_frame_rate=100)
+
+    def test_pushes_directly_without_event_loop(self):
+        self.streaming.request_update()
+        self.push_image.assert_called_once_with()
+        self.server.protocol_call.assert_not_called()
+
+    def test_lowers_quality_while_interacting_and_sends_a_full_quality_frame(self):
+
+        async def drag_slider():
+            for _ in range(10):
+                self.streaming.request_update()
+                self.assertTrue(self.streaming.is_interacting())
+            await asyncio.sleep(0.1)
+
+        asyncio.run(drag_slider())
+        self.assertFalse(self.streaming.is_interacting())
+        self.assertEqual(self.server.protocol_call.call_args_list, [
+            mock.call("viewport.image.push.quality", "1", 40, 0.5),
+            mock.call("viewport.image.push.quality", "1", 90, 1.)
+        ])
+        # one interactive frame, one coalesced frame at the maximum frame rate and the full quality frame
+        self.assertEqual(self.push_image.call_count, 3)
+        self.assertEqual(self.streaming.metrics.coalesced_updates, 8)
+        self.server.state.__setitem__.assert_called_with("streaming_metrics", self.streaming.metrics.format_summary())
+
+    def test_attach_records_frames(self):
+        image_delivery = mock.MagicMock(spec=["still_render", "get_view"])
+        image_delivery.still_render.return_value = {"image": b"jpeg", "memsize": 4}
+        renderer = mock.MagicMock()
+        renderer.GetLastRenderTimeInSeconds.return_value = 0.
+        renderers = image_delivery.get_view.return_value.GetRenderers.return_value
+        renderers.GetNumberOfItems.return_value = 1
+        renderers.GetNextItem.return_value = renderer
+        self.server.protocol.getRPCMethod.return_value = (image_delivery, mock.MagicMock())
+
+        self.assertTrue(self.streaming.attach())
+        reply = image_delivery.still_render({"view": "1"})
+
+        self.assertEqual(reply["memsize"], 4)
+        self.assertEqual(len(self.streaming.metrics.get_frames()), 1)
+        self.assertEqual(self.streaming.metrics.get_frames()[0]["bytes"], 4)
+
+    def test_metrics_route(self):
+        wslink_server = mock.MagicMock()
+        wslink_server.app = web.Application()
+        self.streaming.add_metrics_route(wslink_server)
+        self.streaming.metrics.record_frame(0.01, 0.002, 1000)
+
+        async def get_metrics():
+            async with TestClient(TestServer(wslink_server.app)) as client:
+                response = await client.get("/metrics")
+                return response.status, await response.json()
+
+        status, metrics = asyncio.run(get_metrics())
+        self.assertEqual(status, 200)
+        self.assertEqual(metrics["summary"]["frames"], 1)
+        self.assertEqual(metrics["frames"][0]["bytes"], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+#
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkIOImage import vtkPNGReader
+
+from ccpi.viewer.CILViewer2D import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.io import ImageReader
+from ccpi.web_viewer.tiles import SliceTilePyramid, TileServer
+
+
+class SliceTilePyramidTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = np.random.randint(0, 4000, size=(8, 300, 520)).astype(np.uint16)
+        self.image = Converter.numpy2vtkImage(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_png(self, png):
+        file_name = os.path.join(self.tmpdir, "tile.png")
+        with open(file_name, "wb") as f:
+            f.write(png)
+        reader = vtkPNGReader()
+        reader.SetFileName(file_name)
+        reader.Update()
+        image = reader.GetOutput()
+        width, height, _ = image.GetDimensions()
+        components = image.GetNumberOfScalarComponents()
+        # rows top first
+        return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(height, width, components)[::-1]
+
+    def unpack(self, png):
+        rgb = self.read_png(png).astype(np.uint16)
+        return (rgb[..., 0] << 8) | rgb[..., 1]
+
+    def test_info(self):
+        pyramid = SliceTilePyramid(self.image, tile_size=128)
+        info = pyramid.get_info()
+        self.assertEqual(info["tile_size"], 128)
+        self.assertEqual(info["orientations"][str(SLICE_ORIENTATION_XY)], {"width": 520, "height": 300, "levels": 4})
+        self.assertEqual(info["orientations"][str(SLICE_ORIENTATION_XZ)], {"width": 520, "height": 8, "levels": 4})
+        self.assertEqual(info["orientations"][str(SLICE_ORIENTATION_YZ)], {"width": 300, "height": 8, "levels": 3})
+        self.assertEqual((info["value_offset"], info["value_scale"]), (0., 1.))
+
+    def test_tiles_hold_the_values_of_the_slice(self):
+        pyramid = SliceTilePyramid(self.image, tile_size=128)
+        # the rows of the slice go down from the top, i.e. from the last y
+        np.testing.assert_array_equal(self.unpack(pyramid.get_tile(SLICE_ORIENTATION_XY, 3, 0, 0, 0)),
+                                      self.data[3, ::-1][:128, :128])
+        edge = self.unpack(pyramid.get_tile(SLICE_ORIENTATION_XY, 3, 0, 4, 2))
+        np.testing.assert_array_equal(edge, self.data[3, ::-1][256:, 512:])
+        np.testing.assert_array_equal(self.unpack(pyramid.get_tile(SLICE_ORIENTATION_YZ, 5, 0, 1, 0)),
+                                      self.data[::-1, :, 5][:, 128:256])
+
+    def test_levels_are_downsampled(self):
+        pyramid = SliceTilePyramid(self.image, tile_size=128)
+        level = pyramid.get_level(SLICE_ORIENTATION_XY, 0, 1)
+        self.assertEqual(level.shape, (150, 260))
+        self.assertAlmostEqual(level[0, 0], self.data[0, ::-1][:2, :2].mean(), places=3)
+        top = self.unpack(pyramid.get_tile(SLICE_ORIENTATION_XY, 0, 3, 0, 0))
+        self.assertEqual(top.shape, (38, 65))
+
+    def test_window_level_tiles(self):
+        pyramid = SliceTilePyramid(self.image, tile_size=128)
+        tile = self.read_png(pyramid.get_tile(SLICE_ORIENTATION_XY, 0, 0, 0, 0, window_level=(2000, 2000)))
+        self.assertEqual(tile.shape[2], 1)
+        expected = np.clip((self.data[0, ::-1][:128, :128] - 1000.) * 255 / 2000, 0, 255).astype(np.uint8)
+        np.testing.assert_array_equal(tile[..., 0], expected)
+
+    def test_float_values_are_mapped_to_16_bits(self):
+        data = np.linspace(-1, 1, 8 * 16 * 16, dtype=np.float32).reshape(8, 16, 16)
+        pyramid = SliceTilePyramid(Converter.numpy2vtkImage(data))
+        self.assertEqual(pyramid.value_offset, -1.)
+        values = pyramid.get_slice(SLICE_ORIENTATION_XY, 7)
+        self.assertEqual(values.dtype, np.uint16)
+        self.assertEqual(values.max(), 65535)
+
+    def test_tiles_are_cached_within_the_budget(self):
+        pyramid = SliceTilePyramid(self.image, tile_size=128, memory_budget=1024**2)
+        tile = pyramid.get_tile(SLICE_ORIENTATION_XY, 0, 0, 0, 0)
+        self.assertIs(pyramid.get_tile(SLICE_ORIENTATION_XY, 0, 0, 0, 0), tile)
+        for slice_number in range(8):
+            pyramid.get_tile(SLICE_ORIENTATION_XY, slice_number, 0, 0, 0)
+        self.assertLessEqual(pyramid.get_cache_size(), 1024**2)
+
+    def test_out_of_range(self):
+        pyramid = SliceTilePyramid(self.image, tile_size=128)
+        with self.assertRaises(IndexError):
+            pyramid.get_tile(SLICE_ORIENTATION_XY, 8, 0, 0, 0)
+        with self.assertRaises(IndexError):
+            pyramid.get_tile(SLICE_ORIENTATION_XY, 0, 4, 0, 0)
+        with self.assertRaises(IndexError):
+            pyramid.get_tile(SLICE_ORIENTATION_XY, 0, 0, 5, 0)
+
+    def test_xy_slices_are_read_from_the_file_at_full_resolution(self):
+        file_name = os.path.join(self.tmpdir, "volume.npy")
+        np.save(file_name, self.data)
+        resampled = ImageReader(file_name=file_name, resample=True, target_size=self.data.nbytes // 8).Read()
+        self.assertLess(resampled.GetDimensions()[0], 520)
+        pyramid = SliceTilePyramid(resampled, file_name=file_name, tile_size=128)
+        self.assertEqual(pyramid.get_slice_shape(SLICE_ORIENTATION_XY), (300, 520))
+        np.testing.assert_array_equal(pyramid.get_slice(SLICE_ORIENTATION_XY, 7), self.data[7, ::-1])
+        self.assertEqual(pyramid.get_slice_shape(SLICE_ORIENTATION_XZ)[1], resampled.GetDimensions()[0])
+
+
+class TileServerTest(unittest.TestCase):
+
+    def test_routes(self):
+        tile_server = TileServer(max_pyramids=1)
+        data = np.random.randint(0, 255, size=(4, 20, 30)).astype(np.uint8)
+        src = tile_server.add_pyramid(SliceTilePyramid(Converter.numpy2vtkImage(data)))
+        key = src.split("/")[1]
+        self.assertEqual(src, f"tiles/{key}")
+        # the keys are unique, the tiles of a key never change
+        self.assertNotEqual(TileServer().add_pyramid(tile_server.get_pyramid(key)), src)
+        wslink_server = mock.MagicMock()
+        wslink_server.app = web.Application()
+        tile_server.add_routes(wslink_server)
+
+        async def get():
+            async with TestClient(TestServer(wslink_server.app)) as client:
+                info = await (await client.get(f"/{src}/info")).json()
+                tile = await client.get(f"/{src}/2/1/0/0_0.png")
+                windowed = await client.get(f"/{src}/2/1/0/0_0.png?window=100&level=50")
+                missing = await client.get(f"/{src}/2/9/0/0_0.png")
+                return info, tile.status, tile.headers, await tile.read(), windowed.status, missing.status
+
+        info, status, headers, tile, windowed_status, missing_status = asyncio.run(get())
+        self.assertEqual(info["orientations"]["2"]["width"], 30)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "image/png")
+        self.assertIn("immutable", headers["Cache-Control"])
+        self.assertEqual(tile[:4], b"\x89PNG")
+        self.assertEqual(windowed_status, 200)
+        self.assertEqual(missing_status, 404)
+
+        # only the last pyramid is kept
+        tile_server.add_pyramid(SliceTilePyramid(Converter.numpy2vtkImage(data)))
+        self.assertIsNone(tile_server.get_pyramid(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
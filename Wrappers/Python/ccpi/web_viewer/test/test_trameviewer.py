@@ -46,7 +46,10 @@ class TrameViewerTest(unittest.TestCase):
         self.trame_viewer = TrameViewer(self.cil_viewer, self.file_list)
 
         # Assert on the mocks/patched objects after __init__
-        vtk_module.VtkRemoteView.assert_called_once_with(self.cil_viewer.renWin, trame_server=server, ref="view")
+        vtk_module.VtkRemoteView.assert_called_once_with(self.cil_viewer.renWin,
+                                                         trame_server=server,
+                                                         ref="view",
+                                                         **self.trame_viewer.streaming.get_view_options())
 
     def test_trame_viewer_init_throws_when_list_of_files_is_none(self):
         with self.assertRaises(ValueError) as cm:
@@ -56,7 +59,7 @@ class TrameViewerTest(unittest.TestCase):
     def test_trame_viewer_default_file_selects_head_by_default(self):
         self.assertEqual(self.trame_viewer.default_file, self.head_path)
 
-    @mock.patch("ccpi.web_viewer.trame_viewer.vtkMetaImageReader")  # for the loading
+    @mock.patch("ccpi.web_viewer.trame_viewer.VolumeCache")  # for the loading
     @mock.patch("ccpi.web_viewer.trame_viewer.vtk")
     @mock.patch("ccpi.web_viewer.trame_viewer.TrameViewer.update_slice_data")
     def test_trame_viewer_default_file_select_first_in_list_if_no_head(self, _, __, ___):
@@ -97,6 +100,39 @@ class TrameViewerTest(unittest.TestCase):
         self.assertEqual(model_list[0], {'text': 'head.mha', 'value': self.file_list[0]})
         self.assertEqual(model_list[1], {'text': 'other_file', 'value': self.file_list[1]})
 
+    @mock.patch("ccpi.web_viewer.trame_viewer.VolumeCache")  # for the loading
+    @mock.patch("ccpi.web_viewer.trame_viewer.vtk")
+    @mock.patch("ccpi.web_viewer.trame_viewer.TrameViewer.update_slice_data")
+    def test_model_selector_lists_the_datasets_of_the_catalogue_matching_the_search(self, _, __, ___):
+        catalogue = mock.MagicMock()
+        catalogue.get_number_of_entries.return_value = 1
+        catalogue.get_dtypes.return_value = ["uint16"]
+        catalogue.get_entry.return_value = {"id": 3}
+        catalogue.search.return_value = [{
+            "name": "head.mha",
+            "path": self.head_path,
+            "readable": 1,
+            "width": 64,
+            "height": 64,
+            "depth": 93,
+            "dtype": "uint16",
+            "nbytes": 64 * 64 * 93 * 2
+        }]
+        self.trame_viewer = TrameViewer(self.cil_viewer, self.file_list, catalogue=catalogue)
+        self.assertEqual(state["catalogue_preview"], "catalogue/3/preview.png")
+
+        self.trame_viewer.update_catalogue_options("head", "uint16")
+
+        catalogue.search.assert_called_with(text="head", dtype="uint16")
+        self.assertEqual(state["file_name_options"], [{
+            "text": "head.mha (64×64×93, uint16, 0.7 MB)",
+            "value": self.head_path
+        }])
+        self.assertEqual(state["catalogue_dtype_options"], ["All types", "uint16"])
+
+        self.trame_viewer.update_catalogue_options("", "All types")
+        catalogue.search.assert_called_with(text="", dtype=None)
+
     def test_model_create_model_selector_starts_with_default_file(self):
         model_selector = self.trame_viewer.create_model_selector()
 
@@ -370,3 +370,20 @@ class TrameViewer2DTest(unittest.TestCase):
         self.trame_viewer.cil_viewer.setActiveSlice.assert_called_once_with(slice_number)
         self.assertEqual(self.trame_viewer.cil_viewer.updatePipeline.call_count, 2)
         self.trame_viewer.html_view.update.assert_called_once_with()
+
+    @mock.patch("ccpi.web_viewer.trame_viewer2D.CILViewer2D")
+    @mock.patch("ccpi.web_viewer.trame_viewer.vtk")
+    def test_tile_mode_updates_the_window_level_of_the_tiles(self, vtk_module, cil_viewer):
+        cil_viewer.getSliceMapRange.return_value = self.map_range
+        cil_viewer.img3D.GetExtent().__getitem__ = mock.MagicMock(return_value=0)
+        cil_viewer.getImageMapRange.return_value = self.map_range
+        cil_viewer.getSliceWindowLevelFromRange.return_value = [20, 10]
+        cil_viewer.getSliceColorWindow.return_value = 200
+        cil_viewer.getSliceColorLevel.return_value = 100
+        trame_viewer = TrameViewer2D(self.file_list, tile_mode=True)
+        trame_viewer.html_view = mock.MagicMock()
+
+        trame_viewer.request_view_update()
+
+        self.assertEqual(state["tile_window_level"], [200, 100])
+        trame_viewer.html_view.update.assert_not_called()
@@ -0,0 +1,147 @@
+#
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import h5py
+import numpy as np
+
+from ccpi.viewer.utils import Converter
+from ccpi.viewer.utils.dataset_context import cilDatasetContext
+from ccpi.viewer.utils.io import ImageReader, cilviewerHDF5Reader
+from ccpi.web_viewer.trame_viewer import TrameViewer
+from ccpi.web_viewer.volume_cache import VolumeCache
+
+
+class VolumeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = np.random.randint(0, 1000, size=(10, 12, 14)).astype(np.uint16)
+        self.size = self.data.nbytes
+        self.npy_files = []
+        for i in range(3):
+            file_name = os.path.join(self.tmpdir, f"volume_{i}.npy")
+            np.save(file_name, self.data + i)
+            self.npy_files.append(file_name)
+        self.nxs_file = os.path.join(self.tmpdir, "volume.nxs")
+        with h5py.File(self.nxs_file, "w") as f:
+            f.create_dataset("entry1/tomo_entry/data/data", data=self.data)
+        self.cache = VolumeCache(memory_budget=2 * self.size, max_volume_size=self.size)
+        self.cache.read = mock.MagicMock(wraps=self.cache.read)
+
+    def tearDown(self):
+        self.cache.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_volume_is_read_once(self):
+        volume = self.cache.get_volume(self.npy_files[0])
+        self.assertEqual(volume.image.GetDimensions(), (14, 12, 10))
+        self.assertIs(self.cache.get_volume(self.npy_files[0]), volume)
+        self.cache.read.assert_called_once_with(self.npy_files[0])
+        self.assertIn(self.npy_files[0], self.cache)
+
+    def test_reads_hdf5(self):
+        volume = self.cache.get_volume(self.nxs_file)
+        self.assertEqual(volume.image.GetDimensions(), (14, 12, 10))
+
+    def test_volumes_are_resampled(self):
+        self.cache.set_max_volume_size(self.size // 8)
+        volume = self.cache.get_volume(self.npy_files[0])
+        self.assertLess(volume.get_size(), self.size)
+
+    def test_window_level_defaults_are_precomputed(self):
+        volume = self.cache.get_volume(self.npy_files[1])
+        context = cilDatasetContext.GetContext(volume.image)
+        self.assertIs(context, volume.context)
+        with mock.patch.object(context, "_computeStatistics") as compute:
+            self.assertEqual(volume.get_map_range((0., 100.)), (1., 1000.))
+            context.GetMapRange((5., 95.), "scalar")
+            compute.assert_not_called()
+
+    def test_least_recently_used_volume_is_evicted(self):
+        first = self.cache.get_volume(self.npy_files[0])
+        self.cache.get_volume(self.npy_files[1])
+        self.cache.get_volume(self.npy_files[0])
+        self.cache.get_volume(self.npy_files[2])
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get_size(), 2 * self.size)
+        self.assertIn(self.npy_files[0], self.cache)
+        self.assertNotIn(self.npy_files[1], self.cache)
+        self.assertEqual(first.context.GetReferenceCount(), 1)
+
+        self.cache.set_memory_budget(self.size)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(first.context.GetReferenceCount(), 0)
+
+    def test_modified_file_is_read_again(self):
+        self.cache.get_volume(self.npy_files[0])
+        np.save(self.npy_files[0], self.data[:5])
+        os.utime(self.npy_files[0], ns=(0, 0))
+        volume = self.cache.get_volume(self.npy_files[0])
+        self.assertEqual(volume.image.GetDimensions(), (14, 12, 5))
+        self.assertEqual(self.cache.read.call_count, 2)
+
+    def test_shared_volume_is_read_once_and_memory_mapped(self):
+        shared_directory = os.path.join(self.tmpdir, "shared")
+        other_cache = VolumeCache(memory_budget=2 * self.size, max_volume_size=self.size)
+        for cache in (self.cache, other_cache):
+            cache.set_shared_directory(shared_directory)
+        with mock.patch("ccpi.web_viewer.volume_cache.ImageReader", wraps=ImageReader) as image_reader, \
+                mock.patch("ccpi.web_viewer.volume_cache.cilviewerHDF5Reader", wraps=cilviewerHDF5Reader) as hdf5_reader:
+            volume = self.cache.get_volume(self.npy_files[1])
+            other_volume = other_cache.get_volume(self.npy_files[1])
+            # the file is read by the first cache, then both memory map the volume it wrote
+            image_reader.assert_called_once()
+            self.assertEqual(hdf5_reader.call_count, 2)
+        try:
+            self.cache.read.assert_not_called()
+            self.assertEqual(other_volume.image.GetDimensions(), (14, 12, 10))
+            np.testing.assert_array_equal(Converter.vtk2numpy(other_volume.image), Converter.vtk2numpy(volume.image))
+            # the statistics are read with the volume
+            with mock.patch.object(other_volume.context, "_computeStatistics") as compute:
+                self.assertEqual(other_volume.get_map_range((0., 100.)), volume.get_map_range((0., 100.)))
+                compute.assert_not_called()
+        finally:
+            other_cache.clear()
+
+    def test_get_instance_is_shared(self):
+        self.assertIs(VolumeCache.get_instance(), VolumeCache.get_instance())
+
+    @mock.patch("ccpi.web_viewer.trame_viewer.VolumeCache")
+    def test_trame_viewer_loads_through_the_cache(self, volume_cache):
+        volume_cache.get_instance.return_value = self.cache
+        trame_viewer = mock.MagicMock()
+        self.assertTrue(TrameViewer.load_volume(trame_viewer, self.npy_files[0]))
+        self.assertTrue(TrameViewer.load_volume(trame_viewer, self.npy_files[0]))
+        self.cache.read.assert_called_once_with(self.npy_files[0])
+        image = self.cache.get_volume(self.npy_files[0]).image
+        trame_viewer.cil_viewer.setInput3DData.assert_called_with(image)
+
+    @mock.patch("ccpi.web_viewer.trame_viewer.VolumeCache")
+    def test_trame_viewer_keeps_volume_if_file_cannot_be_read(self, volume_cache):
+        volume_cache.get_instance.return_value = self.cache
+        trame_viewer = mock.MagicMock()
+        self.assertFalse(TrameViewer.load_volume(trame_viewer, os.path.join(self.tmpdir, "missing.mha")))
+        trame_viewer.cil_viewer.setInput3DData.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
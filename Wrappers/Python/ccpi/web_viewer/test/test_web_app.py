@@ -15,10 +15,13 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 #
+import os
 import unittest
 from unittest import mock
 
-from ccpi.web_viewer.web_app import arg_parser, reset_viewer2d, data_finder, set_viewer2d, main, change_orientation, change_opacity_mapping
+from ccpi.web_viewer.web_app import (arg_parser, reset_viewer2d, data_finder, set_viewer2d, main, change_orientation,
+                                     change_opacity_mapping, change_catalogue_search)
+from ccpi.web_viewer.volume_cache import VolumeCache
 
 
 class WebAppTest(unittest.TestCase):
@@ -32,7 +35,14 @@ class WebAppTest(unittest.TestCase):
         help_string = "web_app.py [optional args: -h, -d] <data_files>\n" \
                       "Args:\n" \
                       "-h: Show this help and exit the program\n" \
-                      "-d, --2D: Use the 2D viewer instead of the 3D viewer, the default is to just use the 3D viewer."
+                      "-d, --2D: Use the 2D viewer instead of the 3D viewer, the default is to just use the 3D viewer.\n" \
+                      "--memory_budget=<MB>: Memory the server uses to cache the loaded datasets, in MB.\n" \
+                      "--tiles: Use the 2D viewer, panning and zooming the slices in the browser.\n" \
+                      "--catalogue=<file>: Index the datasets in this SQLite file, to search them in the viewer.\n" \
+                      "--shared_volumes=<dir>: Share the loaded datasets with the other viewer processes using this directory.\n" \
+                      "--sessions=<N>: Serve each client its own viewer process, up to N at once.\n" \
+                      "--memory_limit=<MB>: With --sessions, refuse new clients while the processes use more memory, in MB.\n" \
+                      "--session_timeout=<s>: With --sessions, stop the process of a client disconnected for this long."
         sys.argv = ["python_file.py", "-h"]
         arg_parser()
 
@@ -62,6 +72,16 @@ class WebAppTest(unittest.TestCase):
         self.assertEqual(VIEWER_2D, True)
         print_output.assert_not_called()
 
+    @mock.patch("ccpi.web_viewer.web_app.VolumeCache")
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.sys")
+    def test_arg_parser_handles_memory_budget(self, sys, print_output, volume_cache):
+        sys.argv = ["python_file.py", "--memory_budget=512"]
+        arg_parser()
+
+        volume_cache.get_instance().set_memory_budget.assert_called_once_with(512 * 1024**2)
+        print_output.assert_not_called()
+
     @mock.patch("ccpi.web_viewer.web_app.print")
     @mock.patch("ccpi.web_viewer.web_app.sys")
     def test_arg_parser_does_not_do_anything_with_unused_args(self, sys, print_output):
@@ -87,6 +107,21 @@ class WebAppTest(unittest.TestCase):
         print_output.assert_not_called()
         self.assertEqual(return_value, ["path/to/file1.txt", "path/to/file1.txt"])
 
+    @mock.patch("ccpi.web_viewer.web_app.os")
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.sys")
+    def test_data_finder_skips_files_of_the_directory_that_cannot_be_read(self, sys, print_output, os):
+        sys.argv = ["python_file.py", "dir"]
+        os.listdir.return_value = ["notes.txt", "head.mha", "scan.nxs", "tiff_stack"]
+        os.path.isfile.return_value = False
+        os.path.isdir.side_effect = lambda path: path in ("dir", "dir/tiff_stack")
+        os.path.join.side_effect = lambda *paths: "/".join(paths)
+
+        return_value = data_finder()
+
+        print_output.assert_not_called()
+        self.assertEqual(return_value, ["dir/head.mha", "dir/scan.nxs", "dir/tiff_stack"])
+
     @mock.patch("ccpi.web_viewer.web_app.os")
     @mock.patch("ccpi.web_viewer.web_app.print")
     @mock.patch("ccpi.web_viewer.web_app.sys")
@@ -126,9 +161,43 @@ class WebAppTest(unittest.TestCase):
         main()
 
         viewer3d.assert_not_called()
-        viewer2d.assert_called_once_with(data_files)
+        viewer2d.assert_called_once_with(data_files, tile_mode=False, catalogue=None)
         viewer2d.return_value.start.assert_called_once()
 
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.sys")
+    @mock.patch("ccpi.web_viewer.web_app.TrameViewer2D")
+    def test_arg_parser_handles_tiles(self, viewer2d, sys, print_output):
+        sys.argv = ["python_file.py", "--tiles"]
+        data_files = arg_parser()
+
+        from ccpi.web_viewer.web_app import VIEWER_2D, TILE_MODE
+        self.assertEqual(VIEWER_2D, True)
+        self.assertEqual(TILE_MODE, True)
+        print_output.assert_not_called()
+
+        with mock.patch("ccpi.web_viewer.web_app.arg_parser", return_value=data_files):
+            main()
+        viewer2d.assert_called_once_with(data_files, tile_mode=True, catalogue=None)
+
+    @mock.patch("ccpi.web_viewer.web_app.DataCatalogue")
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.sys")
+    @mock.patch("ccpi.web_viewer.web_app.TrameViewer3D")
+    def test_arg_parser_handles_catalogue(self, viewer3d, sys, print_output, data_catalogue):
+        sys.argv = ["python_file.py", "--catalogue=index.sqlite"]
+        data_files = arg_parser()
+
+        from ccpi.web_viewer.web_app import CATALOGUE_FILE
+        self.assertEqual(CATALOGUE_FILE, "index.sqlite")
+        print_output.assert_not_called()
+
+        with mock.patch("ccpi.web_viewer.web_app.arg_parser", return_value=data_files):
+            main()
+        self.assertEqual(data_catalogue.call_args[0], ("index.sqlite", ))
+        data_catalogue.return_value.start_scan.assert_called_once_with(data_files)
+        viewer3d.assert_called_once_with(data_files, catalogue=data_catalogue.return_value)
+
     @mock.patch("ccpi.web_viewer.web_app.arg_parser")
     @mock.patch("ccpi.web_viewer.web_app.TrameViewer2D")
     @mock.patch("ccpi.web_viewer.web_app.TrameViewer3D")
@@ -139,10 +208,60 @@ class WebAppTest(unittest.TestCase):
 
         main()
 
-        viewer3d.assert_called_once_with(data_files)
+        viewer3d.assert_called_once_with(data_files, catalogue=None)
         viewer3d.return_value.start.assert_called_once()
         viewer2d.assert_not_called()
 
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.sys")
+    def test_arg_parser_handles_sessions(self, sys, print_output):
+        sys.argv = [
+            "python_file.py", "--2D", "--sessions=4", "--memory_limit=1024", "--session_timeout=30", "--catalogue=c.db"
+        ]
+        arg_parser()
+
+        from ccpi.web_viewer.web_app import MAX_SESSIONS, MEMORY_LIMIT, SESSION_TIMEOUT, VIEWER_OPTIONS
+        self.assertEqual(MAX_SESSIONS, 4)
+        self.assertEqual(MEMORY_LIMIT, 1024**3)
+        self.assertEqual(SESSION_TIMEOUT, 30)
+        self.assertEqual(VIEWER_OPTIONS, ["--2D", "--catalogue=c.db"])
+
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.sys")
+    def test_arg_parser_handles_shared_volumes(self, sys, print_output):
+        sys.argv = ["python_file.py", "--shared_volumes=volumes"]
+        cache = VolumeCache.get_instance()
+        with mock.patch.object(cache, "set_shared_directory") as set_shared_directory:
+            arg_parser()
+
+        set_shared_directory.assert_called_once_with("volumes")
+
+    @mock.patch("ccpi.web_viewer.sessions.run_launcher")
+    @mock.patch("ccpi.web_viewer.sessions.ProcessSessionManager")
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.sys")
+    @mock.patch("ccpi.web_viewer.web_app.TrameViewer2D")
+    @mock.patch("ccpi.web_viewer.web_app.TrameViewer3D")
+    def test_main_launches_a_viewer_process_per_client_with_sessions(self, viewer3d, viewer2d, sys, print_output,
+                                                                     manager, run_launcher):
+        # the trame options follow the data files
+        sys.argv = ["python_file.py", "-d", "--sessions=2", "data", "--port=9000"]
+        sys.executable = "python"
+
+        main()
+
+        viewer3d.assert_not_called()
+        viewer2d.assert_not_called()
+        command = manager.call_args.args[0]
+        self.assertEqual(command[:4], ["python", "-m", "ccpi.web_viewer.web_app", "-d"])
+        # the processes share the volumes in a directory removed with the launcher
+        self.assertEqual(len(command), 5)
+        self.assertTrue(command[4].startswith("--shared_volumes="))
+        self.assertFalse(os.path.exists(command[4].split("=", 1)[1]))
+        self.assertEqual(manager.call_args.kwargs, dict(max_sessions=2, memory_limit=None, host="localhost",
+                                                        timeout=60))
+        run_launcher.assert_called_once_with(manager.return_value, host="localhost", port=9000)
+
     @mock.patch("ccpi.web_viewer.web_app.TRAME_VIEWER")
     def test_change_orientation_orientation_not_kwargs_calls_nothing(self, trame_viewer):
         change_orientation()
@@ -155,6 +274,12 @@ class WebAppTest(unittest.TestCase):
 
         trame_viewer.switch_to_orientation.assert_called_once_with(0)
 
+    @mock.patch("ccpi.web_viewer.web_app.TRAME_VIEWER")
+    def test_change_catalogue_search_updates_the_model_selector(self, trame_viewer):
+        change_catalogue_search(catalogue_search=None, catalogue_dtype="uint16")
+
+        trame_viewer.update_catalogue_options.assert_called_once_with("", "uint16")
+
     @mock.patch("ccpi.web_viewer.web_app.TRAME_VIEWER")
     def test_change_opacity_mapping_not_kwargs_calls_nothing(self, trame_viewer):
         change_opacity_mapping()
@@ -0,0 +1,353 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import asyncio
+import logging
+import math
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from trame_client.widgets.core import AbstractElement
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkIOImage import vtkPNGWriter
+
+from ccpi.viewer.CILViewer2D import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ
+from ccpi.viewer.utils.io import ImageReader
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+
+# Serves the tile-view.js client of the TileView widget
+tile_view_module = {
+    "serve": {
+        "__ccpi_web_viewer": os.path.join(os.path.dirname(__file__), "static")
+    },
+    "scripts": ["__ccpi_web_viewer/tile-view.js"],
+    "vue_use": ["CCPiTileView"],
+}
+
+
+def encode_png(array):
+    """
+    Encodes a 2D array of uint8 as a grey PNG, or a 3D array of uint8 of shape (height, width, 3) as a RGB PNG.
+    The first row of the array is the top row of the image.
+    """
+    height, width = array.shape[:2]
+    components = 1 if array.ndim == 2 else array.shape[2]
+    image = vtkImageData()
+    image.SetDimensions(width, height, 1)
+    # the rows of vtkImageData go from the bottom up
+    scalars = numpy_support.numpy_to_vtk(np.ascontiguousarray(array[::-1]).reshape(-1, components), deep=True)
+    image.GetPointData().SetScalars(scalars)
+    writer = vtkPNGWriter()
+    writer.SetInputData(image)
+    writer.WriteToMemoryOn()
+    writer.Write()
+    return bytes(memoryview(writer.GetResult()))
+
+
+def pack_uint16(values):
+    """Packs an array of uint16 in the red (high byte) and green (low byte) channels of an array of RGB uint8"""
+    rgb = np.zeros(values.shape + (3, ), dtype=np.uint8)
+    rgb[..., 0] = values >> 8
+    rgb[..., 1] = values & 0xff
+    return rgb
+
+
+def downsample(values):
+    """Returns the mean of the 2x2 blocks of a 2D array, the last row and column are repeated if their number is odd"""
+    height, width = values.shape
+    values = np.pad(values.astype(np.float32), ((0, height % 2), (0, width % 2)), mode="edge")
+    return (values[0::2, 0::2] + values[1::2, 0::2] + values[0::2, 1::2] + values[1::2, 1::2]) / 4
+
+
+class SliceTilePyramid:
+    """
+    Deep zoom pyramid of PNG tiles of the slices of a volume, generated lazily and cached.
+
+    Level 0 of a slice is the slice at full resolution, each following level halves its width
+    and height, down to the level fitting in one tile. The slices are taken from image, the
+    volume displayed by the viewer, apart from the XY slices when file_name is given: they are
+    read at full resolution from the file with ImageReader, cropping the file to the slice.
+
+    The tiles hold the values of the slice packed in 16 bits (see pack_uint16), so the client can
+    set the window and level of the tiles without requesting them again. The values are mapped
+    to 16 bits by tile_value = (value - value_offset) * value_scale, which is exact for 8 and 16
+    bits integer volumes. Tiles can also be requested with a window and level applied by the
+    server, as 8 bits grey PNG.
+
+    The slices, and the tiles encoded, are kept in caches of memory_budget bytes in total.
+    """
+
+    def __init__(self,
+                 image,
+                 file_name: str = None,
+                 hdf5_dataset_name: str = "entry1/tomo_entry/data/data",
+                 tile_size: int = TILE_SIZE,
+                 memory_budget: int = 256 * 1024**2):
+        self.image = image
+        self.file_name = file_name
+        self.hdf5_dataset_name = hdf5_dataset_name
+        self.tile_size = int(tile_size)
+        self.memory_budget = int(memory_budget)
+        self.volume = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(image.GetDimensions()[::-1])
+        self.value_offset, self.value_scale = self._get_value_mapping()
+        self._file_shape = None
+        self._lock = threading.RLock()
+        self._slices = OrderedDict()
+        self._slices_size = 0
+        self._tiles = OrderedDict()
+        self._tiles_size = 0
+
+    def _get_value_mapping(self):
+        dtype = self.volume.dtype
+        if dtype in (np.uint8, np.uint16):
+            return 0., 1.
+        if dtype == np.int16:
+            return -32768., 1.
+        low, high = self.image.GetScalarRange()
+        return float(low), (65535. / (high - low) if high > low else 1.)
+
+    def get_slice_shape(self, orientation: int):
+        """Returns the (height, width) of the slices of the orientation at full resolution"""
+        depth, height, width = self.volume.shape
+        if orientation == SLICE_ORIENTATION_XY:
+            if self.file_name is not None:
+                return self._get_file_shape()[1:]
+            return height, width
+        if orientation == SLICE_ORIENTATION_XZ:
+            return depth, width
+        if orientation == SLICE_ORIENTATION_YZ:
+            return depth, height
+        raise ValueError(f"Unknown orientation {orientation}")
+
+    def get_number_of_levels(self, orientation: int):
+        height, width = self.get_slice_shape(orientation)
+        return max(1, math.ceil(math.log2(max(height, width) / self.tile_size)) + 1)
+
+    def get_info(self):
+        """Returns the description of the pyramid used by the client"""
+        orientations = {}
+        for orientation in (SLICE_ORIENTATION_YZ, SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_XY):
+            height, width = self.get_slice_shape(orientation)
+            orientations[str(orientation)] = {
+                "width": width,
+                "height": height,
+                "levels": self.get_number_of_levels(orientation),
+            }
+        return {
+            "tile_size": self.tile_size,
+            "value_offset": self.value_offset,
+            "value_scale": self.value_scale,
+            "orientations": orientations
+        }
+
+    def get_slice(self, orientation: int, slice_number: int):
+        """
+        Returns the slice as a 2D array of the 16 bits tile values, first row at the top.
+        The slice numbers are the ones of image in all orientations.
+        """
+        depth, height, width = self.volume.shape
+        number_of_slices = {SLICE_ORIENTATION_XY: depth, SLICE_ORIENTATION_XZ: height, SLICE_ORIENTATION_YZ: width}
+        if slice_number not in range(number_of_slices.get(orientation, 0)):
+            raise IndexError(f"Slice {slice_number} is out of range in orientation {orientation}")
+        if orientation == SLICE_ORIENTATION_XY:
+            if self.file_name is not None:
+                values = self._read_file_slice(slice_number)
+            else:
+                values = self.volume[slice_number]
+        elif orientation == SLICE_ORIENTATION_XZ:
+            values = self.volume[:, slice_number, :]
+        elif orientation == SLICE_ORIENTATION_YZ:
+            values = self.volume[:, :, slice_number]
+        else:
+            raise ValueError(f"Unknown orientation {orientation}")
+        if self.value_offset != 0. or self.value_scale != 1.:
+            values = np.clip((values.astype(np.float64) - self.value_offset) * self.value_scale, 0, 65535)
+        # the y and z axes go up in the viewer
+        return values.astype(np.uint16)[::-1]
+
+    def get_level(self, orientation: int, slice_number: int, level: int):
+        """Returns the slice at the level of the pyramid"""
+        with self._lock:
+            levels = self._get_levels(orientation, slice_number)
+            while len(levels) <= level:
+                levels.append(downsample(levels[-1]))
+                self._slices_size += levels[-1].nbytes
+            self._trim()
+            return levels[level]
+
+    def get_tile(self, orientation: int, slice_number: int, level: int, column: int, row: int, window_level=None):
+        """
+        Returns the PNG of the tile at column and row of the level of the slice. The values of the tile are packed
+        in 16 bits, unless window_level is given: then it is a grey PNG of the values mapped by the window and level.
+        """
+        if level not in range(self.get_number_of_levels(orientation)):
+            raise IndexError(f"Level {level} is out of range")
+        key = (orientation, slice_number, level, column, row, None if window_level is None else tuple(window_level))
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+            values = self.get_level(orientation, slice_number, level)
+            size = self.tile_size
+            values = values[row * size:(row + 1) * size, column * size:(column + 1) * size]
+            if values.size == 0:
+                raise IndexError(f"Tile {column}, {row} is out of range")
+            if window_level is None:
+                tile = encode_png(pack_uint16(np.rint(values).astype(np.uint16)))
+            else:
+                tile = encode_png(self.apply_window_level(values, *window_level))
+            self._tiles[key] = tile
+            self._tiles_size += len(tile)
+            self._trim()
+            return tile
+
+    def apply_window_level(self, values, window: float, level: float):
+        """Maps the tile values to 8 bits with the window and level, given in the units of the volume"""
+        low = (level - window / 2 - self.value_offset) * self.value_scale
+        high = (level + window / 2 - self.value_offset) * self.value_scale
+        scaled = (values - low) * (255. / max(high - low, 1e-12))
+        return np.clip(scaled, 0, 255).astype(np.uint8)
+
+    def get_cache_size(self):
+        return self._slices_size + self._tiles_size
+
+    def _get_levels(self, orientation, slice_number):
+        key = (orientation, slice_number)
+        levels = self._slices.get(key)
+        if levels is None:
+            levels = [self.get_slice(orientation, slice_number)]
+            self._slices[key] = levels
+            self._slices_size += levels[0].nbytes
+        self._slices.move_to_end(key)
+        return levels
+
+    def _trim(self):
+        # the most recently used slice and tile are kept even if they are larger than the budget
+        while self.get_cache_size() > self.memory_budget and len(self._tiles) > 1:
+            _, tile = self._tiles.popitem(last=False)
+            self._tiles_size -= len(tile)
+        while self.get_cache_size() > self.memory_budget and len(self._slices) > 1:
+            _, levels = self._slices.popitem(last=False)
+            self._slices_size -= sum(level.nbytes for level in levels)
+
+    def _get_file_shape(self):
+        # (depth, height, width) of the file, known once a slice is read
+        if self._file_shape is None:
+            self._read_file_z(0)
+        return self._file_shape
+
+    def _read_file_slice(self, slice_number):
+        depth = self._get_file_shape()[0]
+        # the slice numbers of image are mapped to the slices of the file, which are more if image is resampled
+        z = round(slice_number * (depth - 1) / max(1, self.volume.shape[0] - 1))
+        return self._read_file_z(z)
+
+    def _read_file_z(self, z):
+        reader = ImageReader(file_name=self.file_name,
+                             resample=False,
+                             crop=True,
+                             target_z_extent=(z, z),
+                             hdf5_dataset_name=self.hdf5_dataset_name)
+        data = reader.Read()
+        width, height = data.GetDimensions()[:2]
+        if self._file_shape is None:
+            depth = int(np.prod(reader.GetOriginalImageAttrs()["shape"])) // (width * height)
+            self._file_shape = (depth, height, width)
+        return numpy_support.vtk_to_numpy(data.GetPointData().GetScalars()).reshape(height, width)
+
+
+class TileServer:
+    """
+    Serves the tiles of SliceTilePyramid on the routes tiles/<key>/info and
+    tiles/<key>/<orientation>/<slice>/<level>/<column>_<row>.png of the server, with the window and
+    level applied by the server if the window and level query parameters are given.
+
+    The pyramids are added with add_pyramid, which returns their key. The keys are random, so they are
+    never reused, even by another run of the server, and the browsers can cache the tiles for good.
+    The last max_pyramids pyramids added are kept.
+    """
+
+    def __init__(self, max_pyramids: int = 4):
+        self.max_pyramids = int(max_pyramids)
+        self._pyramids = OrderedDict()
+
+    def add_pyramid(self, pyramid: SliceTilePyramid):
+        """Adds the pyramid, returns the path of its tiles"""
+        key = uuid.uuid4().hex
+        self._pyramids[key] = pyramid
+        while len(self._pyramids) > self.max_pyramids:
+            self._pyramids.popitem(last=False)
+        return f"tiles/{key}"
+
+    def get_pyramid(self, key: str):
+        return self._pyramids.get(key)
+
+    def add_routes(self, wslink_server):
+        """Adds the routes of the tiles to the aiohttp application of the server"""
+        from aiohttp import web
+
+        def get_pyramid(request):
+            pyramid = self.get_pyramid(request.match_info["key"])
+            if pyramid is None:
+                raise web.HTTPNotFound()
+            return pyramid
+
+        async def get_info(request):
+            pyramid = get_pyramid(request)
+            info = await asyncio.get_running_loop().run_in_executor(None, pyramid.get_info)
+            return web.json_response(info)
+
+        async def get_tile(request):
+            pyramid = get_pyramid(request)
+            try:
+                args = [int(request.match_info[name]) for name in ("orientation", "slice", "level", "column", "row")]
+                window_level = None
+                if "window" in request.query and "level" in request.query:
+                    window_level = (float(request.query["window"]), float(request.query["level"]))
+                tile = await asyncio.get_running_loop().run_in_executor(None, pyramid.get_tile, *args, window_level)
+            except (ValueError, IndexError) as e:
+                raise web.HTTPNotFound(reason=str(e))
+            # the keys of the pyramids are not reused, so the tiles never change
+            return web.Response(body=tile,
+                                content_type="image/png",
+                                headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+        wslink_server.app.router.add_get("/tiles/{key}/info", get_info)
+        wslink_server.app.router.add_get(
+            r"/tiles/{key}/{orientation:\d+}/{slice:\d+}/{level:\d+}/{column:\d+}_{row:\d+}.png", get_tile)
+
+
+class TileView(AbstractElement):
+    """
+    Displays the slices of a SliceTilePyramid served by a TileServer, panned and zoomed in the browser.
+
+    :param src: path of the tiles returned by TileServer.add_pyramid
+    :param orientation: orientation of the slices
+    :param slice: number of the slice
+    :param window_level: [window, level] of the slice, applied in the browser
+    """
+
+    def __init__(self, children=None, **kwargs):
+        super().__init__("ccpi-tile-view", children, **kwargs)
+        if self.server:
+            self.server.enable_module(tile_view_module)
+        self._attr_names += ["src", "orientation", "slice", ("window_level", "windowLevel")]
@@ -15,32 +15,45 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 #
+import asyncio
 import inspect
+import logging
 import os
 
-from trame.app import get_server
+from trame.app import asynchronous, get_server
 from trame.widgets import vtk, vuetify
 from trame.ui.vuetify import SinglePageWithDrawerLayout
 from vtkmodules.util import colors
-from vtkmodules.vtkIOImage import vtkMetaImageReader
 
 from ccpi.viewer.CILViewer2D import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ
-from ccpi.viewer.utils.conversion import cilHDF5ResampleReader
+from ccpi.viewer.utils.memory import cilMemoryManager
+from ccpi.web_viewer.catalogue import describe_entry
+from ccpi.web_viewer.streaming import AdaptiveStreaming
+from ccpi.web_viewer.volume_cache import VolumeCache
 
 server = get_server()
 state, ctrl = server.state, server.controller
 
+logger = logging.getLogger(__name__)
+
 
 class TrameViewer:
     """
     This class is intended as a base class and not to be used outside of one of the TrameViewer2D and TrameViewer3D classes.
     """
 
-    def __init__(self, viewer, list_of_files: list = None):
+    def __init__(self, viewer, list_of_files: list = None, catalogue=None):
+        """
+        :param catalogue: DataCatalogue, optional, index of the datasets to choose from, searched in the model selector
+        """
         # Load files and setup the CILViewer
         if list_of_files is None:
             raise ValueError("list_of_files cannot be None as we need data to load in the viewer!")
         self.list_of_files = list_of_files
+        self.catalogue = catalogue
+        self.catalogue_search = ""
+        self.catalogue_dtype = None
+        self.file_name = None
 
         self.default_file = None
         for file_path in self.list_of_files:
@@ -75,10 +88,21 @@ class TrameViewer:
 
         # VtkLocalView would allow the user to use their own GPU locally, but requires serialisation of various VTK actors that the
         # framework is not capable of serialisation, hence using RemoteView and being dependent on a web server with a GPU available to it.
-        self.html_view = vtk.VtkRemoteView(self.cil_viewer.renWin, trame_server=server, ref="view")
+        # The quality of the images streamed to the client is lowered while the sliders are dragged
+        self.streaming = AdaptiveStreaming(server, self.push_view_image)
+        self.html_view = vtk.VtkRemoteView(self.cil_viewer.renWin,
+                                           trame_server=server,
+                                           ref="view",
+                                           **self.streaming.get_view_options())
         ctrl.view_update = self.html_view.update
         ctrl.view_reset_camera = self.html_view.reset_camera
         ctrl.on_server_ready.add(self.html_view.update)
+        ctrl.on_server_ready.add(self.streaming.attach)
+        ctrl.on_server_bind.add(self.streaming.add_metrics_route)
+        ctrl.on_server_bind.add(self.add_session_route)
+        if self.catalogue is not None:
+            ctrl.on_server_bind.add(self.catalogue.add_routes)
+            ctrl.on_server_ready.add(self.start_catalogue_refresh)
 
         # Create page title using the class name of the viewer so it changes based on whatever is passed to this class
         if inspect.isclass(viewer):
@@ -87,33 +111,79 @@ class TrameViewer:
             page_title = f"{viewer.__class__.__name__} on web"
         self.layout = SinglePageWithDrawerLayout(server, on_ready=self.html_view.update, width=300)
         self.layout.title.set_text(page_title)
+        self.layout.toolbar.add_children([vuetify.VSpacer(), self.create_streaming_metrics_text()])
 
     def start(self):
         # Could be static but we don't want it to start from just the class, so must be called on a constructed object where __init__
         # has ran.
         server.start()
 
+    def push_view_image(self):
+        self.html_view.update()
+
+    def request_view_update(self):
+        """
+        Pushes an image of the view to the client, at a lower quality while the updates keep coming from a slider
+        being dragged, see AdaptiveStreaming.
+        """
+        if hasattr(self, "html_view"):
+            self.streaming.request_update()
+
+    def create_streaming_metrics_text(self):
+        return vuetify.VChip("{{ streaming_metrics }}", small=True, outlined=True, v_show="streaming_metrics")
+
     def load_file(self, file_name: str, windowing_method: str = "scalar"):
         if ".nxs" in file_name:
-            self.load_nexus_file(file_name)
+            return self.load_nexus_file(file_name)
         else:
-            self.load_image(file_name)
+            return self.load_image(file_name)
 
     def load_image(self, image_file: str):
-        reader = vtkMetaImageReader()
-        reader.SetFileName(image_file)
-        reader.Update()
-        self.cil_viewer.setInput3DData(reader.GetOutput())
+        return self.load_volume(image_file)
 
     def load_nexus_file(self, file_name: str):
-        reader = cilHDF5ResampleReader()
-        reader.SetFileName(file_name)
-        reader.SetDatasetName('entry1/tomo_entry/data/data')
-        reader.SetTargetSize(256 * 256 * 256)
-        reader.Update()
-        self.cil_viewer.setInput3DData(reader.GetOutput())
+        return self.load_volume(file_name)
+
+    def load_volume(self, file_name: str):
+        """
+        Displays the file in the viewer, reading it with ImageReader through the VolumeCache of the process,
+        so switching back to a file loaded before does not read it again.
+        :return: bool, whether the file was loaded, the displayed volume is kept if it could not be read
+        """
+        try:
+            volume = VolumeCache.get_instance().get_volume(file_name)
+        except Exception as e:
+            logger.error("Could not load %s: %s", file_name, e)
+            return False
+        self.cil_viewer.setInput3DData(volume.image)
+        self.file_name = file_name
+        self.update_catalogue_preview(file_name)
+        return True
+
+    def get_session_status(self):
+        """
+        Returns the displayed file, the active slice and the bytes of the buffers of the viewers of the process,
+        served on the /session route, e.g. to the launcher of the sessions, see ProcessSession.
+        """
+        return {
+            "file_name": self.file_name,
+            "slice": int(self.cil_viewer.getActiveSlice()),
+            "memory_usage": cilMemoryManager.GetInstance().GetUsage()
+        }
+
+    def add_session_route(self, wslink_server):
+        """Serves get_session_status as JSON on the /session route of the server"""
+        from aiohttp import web
+
+        async def get_session(_request):
+            return web.json_response(self.get_session_status())
+
+        wslink_server.app.router.add_get("/session", get_session)
 
     def _create_model_selector_list(self):
+        if self.catalogue is not None and self.catalogue.get_number_of_entries() > 0:
+            entries = self.catalogue.search(text=self.catalogue_search, dtype=self.catalogue_dtype)
+            return [{"text": describe_entry(entry), "value": entry["path"]} for entry in entries]
         useful_file_list = []
         for file_path in self.list_of_files:
             file_name = os.path.basename(file_path)
@@ -122,12 +192,77 @@ class TrameViewer:
 
     def create_model_selector(self):
         useful_file_list = self._create_model_selector_list()
-        return vuetify.VSelect(
+        model_selector = vuetify.VSelect(
             v_model=("file_name", self.default_file),
             items=("file_name_options", useful_file_list),
             hide_details=True,
             solo=True,
         )
+        if self.catalogue is None:
+            return model_selector
+        return vuetify.VCol([
+            self.create_catalogue_search_field(),
+            self.create_catalogue_dtype_selector(), model_selector,
+            self.create_catalogue_preview()
+        ])
+
+    def create_catalogue_search_field(self):
+        return vuetify.VTextField(
+            v_model=("catalogue_search", ""),
+            label="Search",
+            prepend_inner_icon="mdi-magnify",
+            clearable=True,
+            hide_details=True,
+            dense=True,
+        )
+
+    def create_catalogue_dtype_selector(self):
+        return vuetify.VSelect(
+            v_model=("catalogue_dtype", "All types"),
+            items=("catalogue_dtype_options", ["All types"] + self.catalogue.get_dtypes()),
+            hide_details=True,
+            dense=True,
+        )
+
+    def create_catalogue_preview(self):
+        # the thumbnail is shown while the preview of the central slice loads
+        return vuetify.VImg(src=("catalogue_preview", ""),
+                            lazy_src=("catalogue_thumbnail", ""),
+                            v_show="catalogue_preview",
+                            max_height=256,
+                            contain=True)
+
+    def update_catalogue_options(self, search: str = None, dtype: str = None):
+        """Lists the datasets of the catalogue matching the search and type in the model selector"""
+        if self.catalogue is None:
+            return
+        if search is not None:
+            self.catalogue_search = search
+        if dtype is not None:
+            self.catalogue_dtype = None if dtype == "All types" else dtype
+        state["catalogue_dtype_options"] = ["All types"] + self.catalogue.get_dtypes()
+        state["file_name_options"] = self._create_model_selector_list()
+
+    def update_catalogue_preview(self, file_name: str):
+        if self.catalogue is None:
+            return
+        entry = self.catalogue.get_entry(file_name)
+        state["catalogue_thumbnail"] = f"catalogue/{entry['id']}/thumbnail.png" if entry is not None else ""
+        state["catalogue_preview"] = f"catalogue/{entry['id']}/preview.png" if entry is not None else ""
+
+    def start_catalogue_refresh(self, **_kwargs):
+        asynchronous.create_task(self._refresh_catalogue_while_scanning())
+
+    async def _refresh_catalogue_while_scanning(self, interval: float = 1.):
+        # the datasets are listed in the model selector as the catalogue indexes them
+        while True:
+            scanning = self.catalogue.is_scanning()
+            with state:
+                self.update_catalogue_options()
+                self.update_catalogue_preview(state["file_name"])
+            if not scanning:
+                break
+            await asyncio.sleep(interval)
 
     @staticmethod
     def _create_background_color_list():
@@ -366,22 +501,22 @@ class TrameViewer:
     def change_slice_window_level(self, window: float, level: float):
         self.cil_viewer.setSliceColorWindowLevel(window, level)
         self.cil_viewer.updatePipeline()
-        self.html_view.update()
+        self.request_view_update()
 
     def change_slice_window_level_range(self, min: float, max: float):
         self.cil_viewer.setSliceMapRange(min, max)
         self.cil_viewer.updatePipeline()
-        self.html_view.update()
+        self.request_view_update()
 
     def change_slice_window_level_percentiles(self, min: float, max: float):
         self.cil_viewer.setSliceColorPercentiles(min, max)
         self.cil_viewer.updatePipeline()
-        self.html_view.update()
+        self.request_view_update()
 
     def change_slice_window(self, new_window: float):
         self.cil_viewer.setSliceColorWindow(new_window)
         self.cil_viewer.updatePipeline()
-        self.html_view.update()
+        self.request_view_update()
 
     def change_slice_window_as_percentage(self, new_window_as_percentage: float):
         window = self.convert_percentage_to_value(new_window_as_percentage)
@@ -390,7 +525,7 @@ class TrameViewer:
     def change_slice_level(self, new_level: float):
         self.cil_viewer.setSliceColorLevel(new_level)
         self.cil_viewer.updatePipeline()
-        self.html_view.update()
+        self.request_view_update()
 
     def change_slice_level_as_percentage(self, new_level_as_percentage: float):
         level = self.convert_percentage_to_value(new_level_as_percentage)
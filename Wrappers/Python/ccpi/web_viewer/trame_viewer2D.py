@@ -15,11 +15,15 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 #
+import os
+
 from trame.app import get_server
 from trame.widgets import vuetify
 
 from ccpi.viewer.CILViewer2D import CILViewer2D, SLICE_ORIENTATION_XY
+from ccpi.web_viewer.tiles import SliceTilePyramid, TileServer, TileView
 from ccpi.web_viewer.trame_viewer import TrameViewer
+from ccpi.web_viewer.volume_cache import VolumeCache
 
 server = get_server()
 state, ctrl = server.state, server.controller
@@ -27,9 +31,20 @@ state, ctrl = server.state, server.controller
 
 class TrameViewer2D(TrameViewer):
 
-    def __init__(self, list_of_files: list = None):
+    def __init__(self, list_of_files: list = None, tile_mode: bool = False, catalogue=None):
+        """
+        :param tile_mode: bool, whether to display the slices as tiles panned and zoomed in the browser, see
+        SliceTilePyramid, rather than rendered by the server
+        :param catalogue: DataCatalogue, optional, index of the datasets to choose from
+        """
         self.first_load = True
-        super().__init__(list_of_files=list_of_files, viewer=CILViewer2D)
+        self.tile_mode = tile_mode
+        self.tile_server = None
+        self.tile_view = None
+        if self.tile_mode:
+            self.tile_server = TileServer()
+            ctrl.on_server_bind.add(self.tile_server.add_routes)
+        super().__init__(list_of_files=list_of_files, viewer=CILViewer2D, catalogue=catalogue)
 
         self.model_choice = None
         self.background_choice = None
@@ -53,9 +68,15 @@ class TrameViewer2D(TrameViewer):
 
         self.construct_drawer_layout()
 
-        self.layout.content.children = [
-            vuetify.VContainer(fluid=True, classes="pa-0 fill-height", children=[self.html_view])
-        ]
+        if self.tile_mode:
+            self.tile_view = TileView(src=("tile_source", ),
+                                      orientation=("orientation", ),
+                                      slice=("slice", ),
+                                      window_level=("tile_window_level", ))
+            view = self.tile_view
+        else:
+            view = self.html_view
+        self.layout.content.children = [vuetify.VContainer(fluid=True, classes="pa-0 fill-height", children=[view])]
         self.reset_defaults()
         self.layout.flush_content()
 
@@ -95,7 +116,9 @@ class TrameViewer2D(TrameViewer):
         ]
 
     def load_file(self, file_name, _="scalar"):
-        super().load_file(file_name, windowing_method="scalar")
+        loaded = super().load_file(file_name, windowing_method="scalar")
+        if self.tile_mode and loaded:
+            self.update_tile_source(file_name)
         if not self.first_load:
             self.update_slice_slider_data()
             self.update_slice_windowing_defaults()
@@ -105,6 +128,24 @@ class TrameViewer2D(TrameViewer):
         else:
             self.first_load = False
 
+    def update_tile_source(self, file_name):
+        """Serves the tiles of the slices of the displayed volume, the XY slices are read at full resolution"""
+        pyramid = SliceTilePyramid(self.cil_viewer.img3D,
+                                   file_name=file_name if os.path.isfile(file_name) else None,
+                                   hdf5_dataset_name=VolumeCache.get_instance().hdf5_dataset_name)
+        state["tile_source"] = self.tile_server.add_pyramid(pyramid)
+        self.update_tile_window_level()
+
+    def update_tile_window_level(self):
+        state["tile_window_level"] = [self.cil_viewer.getSliceColorWindow(), self.cil_viewer.getSliceColorLevel()]
+
+    def request_view_update(self):
+        # in tile mode the window and level are applied by the browser to the tiles it has already
+        if self.tile_mode:
+            self.update_tile_window_level()
+        else:
+            super().request_view_update()
+
     def update_slice_windowing_defaults(self):
         self.update_slice_data()
 
@@ -191,4 +232,4 @@ class TrameViewer2D(TrameViewer):
     def change_slice_number(self, slice_number):
         self.cil_viewer.setActiveSlice(slice_number)
         self.cil_viewer.updatePipeline()
-        self.html_view.update()
+        self.request_view_update()
@@ -19,24 +19,11 @@ from trame.app import get_server
 
 from ccpi.web_viewer.trame_viewer import TrameViewer
 
-try:
-    import matplotlib.pyplot as plt
-except ImportError:
-    # Add optional overload to allow plt.colormaps to be called without matplotlib
-    from ccpi.viewer.utils import CILColorMaps
-
-    class BackupColorMaps:
-
-        @staticmethod
-        def colormaps():
-            return ['viridis', 'plasma', 'inferno', 'magma']
-
-    plt = BackupColorMaps()
-
 from trame.widgets import vuetify
 
 from ccpi.viewer.CILViewer import CILViewer
 from ccpi.viewer.CILViewer2D import SLICE_ORIENTATION_XY
+from ccpi.viewer.utils.colormaps import CILColorMaps
 
 server = get_server()
 state, ctrl = server.state, server.controller
@@ -47,8 +34,8 @@ INITIAL_IMAGE = "head.mha"
 
 class TrameViewer3D(TrameViewer):
 
-    def __init__(self, list_of_files=None):
-        super().__init__(list_of_files=list_of_files, viewer=CILViewer)
+    def __init__(self, list_of_files=None, catalogue=None):
+        super().__init__(list_of_files=list_of_files, viewer=CILViewer, catalogue=catalogue)
 
         # Define attributes that will be constructed in methods outside of __init__
 
@@ -201,7 +188,7 @@ class TrameViewer3D(TrameViewer):
     def create_color_choice_selector(self):
         return vuetify.VSelect(
             v_model=("color_map", "viridis"),
-            items=("color_map_options", plt.colormaps()),
+            items=("color_map_options", CILColorMaps.get_color_map_names()),
             hide_details=True,
             solo=True,
             disabled=self.disable_3d,
@@ -361,8 +348,7 @@ class TrameViewer3D(TrameViewer):
                 self.cil_viewer.setScalarOpacityRange(min_value, max_value)
             else:
                 self.cil_viewer.setGradientOpacityRange(min_value, max_value)
-        if hasattr(self, "html_view"):
-            self.html_view.update()
+        self.request_view_update()
 
     def reset_cam(self):
         self.cil_viewer.resetCameraToDefault()
@@ -422,8 +408,7 @@ class TrameViewer3D(TrameViewer):
             self.cil_viewer.setVolumeColorPercentiles(min_value, max_value)
         else:
             self.cil_viewer.setVolumeColorRange(min_value, max_value)
-        if hasattr(self, "html_view"):
-            self.html_view.update()
+        self.request_view_update()
 
     def change_window_level_detail_sliders(self, show_detailed):
         super().change_window_level_detail_sliders(show_detailed)
@@ -487,4 +472,4 @@ class TrameViewer3D(TrameViewer):
         self.cil_viewer.updateSliceHistogram()
         self.cil_viewer.setActiveSlice(slice_number)
         self.cil_viewer.updatePipeline()
-        self.html_view.update()
+        self.request_view_update()
@@ -0,0 +1,256 @@
+#   Copyright 2024 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ccpi.viewer.utils.dataset_context import cilDatasetContext
+from ccpi.viewer.utils.io import ImageReader, WriteMemoryMappableImage, cilviewerHDF5Reader
+
+try:
+    import fcntl
+except ImportError:
+    # not on Windows, where the processes sharing volumes may each write them
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# percentiles of the scalar values precomputed for the window/level defaults of the web viewers
+DEFAULT_PERCENTILES = ((0., 100.), (5., 95.), (80., 99.))
+
+
+class CachedVolume:
+    """
+    A volume loaded by the VolumeCache: the image and the cilDatasetContext holding its statistics,
+    which are computed unless they are given, as returned by cilDatasetContext.GetStatisticsCache.
+    """
+
+    def __init__(self, key, image, statistics=None):
+        self.key = key
+        self.image = image
+        self.context = cilDatasetContext.GetContext(image)
+        # the cache holds a reference to the context, so the statistics are kept while the volume is cached,
+        # even when no viewer displays it
+        self.context.Register(self)
+        if statistics is not None:
+            self.context.SetStatisticsCache(statistics)
+        for percentiles in DEFAULT_PERCENTILES:
+            self.context.GetMapRange(percentiles, "scalar")
+
+    def get_size(self):
+        """Returns the size of the image in bytes"""
+        scalars = self.image.GetPointData().GetScalars()
+        if scalars is None:
+            return 0
+        return scalars.GetNumberOfValues() * scalars.GetDataTypeSize()
+
+    def get_map_range(self, percentiles, method="scalar"):
+        return self.context.GetMapRange(percentiles, method)
+
+    def release(self):
+        self.context.UnRegister(self)
+
+
+class VolumeCache:
+    """
+    Process-wide least recently used cache of the volumes loaded by the web viewers.
+
+    The volumes are read with ImageReader, so all the formats it supports can be loaded, and
+    resampled to at most max_volume_size bytes. The cache holds at most memory_budget bytes
+    of volumes, so switching between the files in the model selector only reads a file the
+    first time. The window/level defaults of the volumes are computed on loading, and kept
+    with the volumes.
+
+    Use get_instance for the cache shared by all the viewers of the process.
+
+    The volumes can also be shared by several processes, e.g. the web viewers started by the launcher of the
+    sessions, through a directory set with set_shared_directory. The first process loading a file writes the
+    resampled volume, in the cilviewerHDF5Writer layout, and its statistics in the directory. The processes
+    then memory map the volume, so the file is read and resampled once, and its pages are held in memory once.
+    """
+
+    _instance = None
+
+    def __init__(self,
+                 memory_budget: int = 1024**3,
+                 max_volume_size: int = 256**3 * 4,
+                 hdf5_dataset_name: str = "entry1/tomo_entry/data/data"):
+        self._lock = threading.RLock()
+        self._volumes = OrderedDict()
+        self._loading = {}
+        self._size = 0
+        self.hdf5_dataset_name = hdf5_dataset_name
+        self.shared_directory = None
+        self.max_volume_size = int(max_volume_size)
+        self.memory_budget = None
+        self.set_memory_budget(memory_budget)
+
+    @classmethod
+    def get_instance(cls):
+        """Returns the cache shared by the process, creating it if needed"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def set_memory_budget(self, memory_budget: int):
+        """Sets the maximum number of bytes of the cached volumes, evicting the least recently used ones"""
+        if memory_budget <= 0:
+            raise ValueError(f"Memory budget must be positive, got {memory_budget}")
+        with self._lock:
+            self.memory_budget = int(memory_budget)
+            self._trim()
+
+    def get_memory_budget(self):
+        return self.memory_budget
+
+    def set_max_volume_size(self, max_volume_size: int):
+        """Sets the size in bytes the volumes are resampled to, the volumes already cached are kept"""
+        if max_volume_size <= 0:
+            raise ValueError(f"Maximum volume size must be positive, got {max_volume_size}")
+        self.max_volume_size = int(max_volume_size)
+
+    def set_shared_directory(self, directory: str):
+        """Shares the volumes with the other processes using directory, or with none if it is None"""
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.shared_directory = directory
+
+    def get_target_size(self):
+        """Returns the size in bytes the volumes are resampled to"""
+        return min(self.max_volume_size, self.memory_budget)
+
+    def get_size(self):
+        """Returns the number of bytes of the cached volumes"""
+        return self._size
+
+    def __len__(self):
+        return len(self._volumes)
+
+    def __contains__(self, file_name):
+        return self._get_key(file_name) in self._volumes
+
+    def get_volume(self, file_name: str):
+        """Returns the CachedVolume of the file, reading it if it is not in the cache"""
+        key = self._get_key(file_name)
+        with self._lock:
+            volume = self._volumes.get(key)
+            if volume is not None:
+                self._volumes.move_to_end(key)
+                logger.debug("Volume cache hit: %s", file_name)
+                return volume
+            # the sessions requesting a file being read wait for it, rather than reading it again
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            with self._lock:
+                volume = self._volumes.get(key)
+                if volume is not None:
+                    self._volumes.move_to_end(key)
+                    return volume
+            try:
+                if self.shared_directory is None:
+                    image, statistics = self.read(file_name), None
+                else:
+                    image, statistics = self.read_shared(key, file_name)
+                with self._lock:
+                    volume = CachedVolume(key, image, statistics)
+                    self._volumes[key] = volume
+                    self._size += volume.get_size()
+                    self._trim()
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return volume
+
+    def read(self, file_name: str):
+        """Reads and resamples the file with ImageReader, without caching it"""
+        logger.info("Loading %s", file_name)
+        reader = ImageReader(file_name=file_name,
+                             resample=True,
+                             target_size=self.get_target_size(),
+                             hdf5_dataset_name=self.hdf5_dataset_name)
+        return reader.Read()
+
+    def read_shared(self, key, file_name: str):
+        """
+        Returns the volume of the file memory mapped from the shared directory, and its statistics, writing
+        them if no process has yet
+        """
+        name = os.path.join(self.shared_directory, hashlib.sha1(repr(key).encode()).hexdigest())
+        with _locked(name + ".lock"):
+            if not os.path.isfile(name + ".hdf5"):
+                self._write_shared(file_name, name)
+        reader = cilviewerHDF5Reader()
+        reader.SetFileName(name + ".hdf5")
+        with open(name + ".json") as statistics_file:
+            statistics = json.load(statistics_file)
+        logger.info("Memory mapped the shared volume of %s", file_name)
+        return reader.GetMemoryMappedOutput(), statistics
+
+    def _write_shared(self, file_name, name):
+        logger.info("Loading %s into the shared volumes", file_name)
+        reader = ImageReader(file_name=file_name,
+                             resample=True,
+                             target_size=self.get_target_size(),
+                             hdf5_dataset_name=self.hdf5_dataset_name)
+        image = reader.Read()
+        context = cilDatasetContext.GetContext(image)
+        for percentiles in DEFAULT_PERCENTILES:
+            context.GetMapRange(percentiles, "scalar")
+        # the statistics are written first, the volume is shared once it is written
+        with open(name + ".json.tmp", "w") as statistics_file:
+            json.dump(context.GetStatisticsCache(), statistics_file)
+        os.replace(name + ".json.tmp", name + ".json")
+        WriteMemoryMappableImage(name + ".hdf5", reader, image)
+
+    def clear(self):
+        with self._lock:
+            for volume in self._volumes.values():
+                volume.release()
+            self._volumes.clear()
+            self._size = 0
+
+    def _get_key(self, file_name):
+        # the file is read again if it is modified, or if the volumes are resampled to another size
+        file_name = os.path.abspath(file_name)
+        try:
+            stat = os.stat(file_name)
+            file_key = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            file_key = None
+        return (file_name, file_key, self.get_target_size(), self.hdf5_dataset_name)
+
+    def _trim(self):
+        # the most recently used volume is kept even if it is larger than the budget
+        while self._size > self.memory_budget and len(self._volumes) > 1:
+            _, volume = self._volumes.popitem(last=False)
+            self._size -= volume.get_size()
+            volume.release()
+
+
+@contextmanager
+def _locked(file_name):
+    # locks the file against the other processes, the lock is released if the process exits
+    with open(file_name, "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -15,24 +15,48 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 #
+import argparse
 import getopt
 import os
+import shutil
 import sys
+import tempfile
 
 from trame.app import get_server
 
+from ccpi.web_viewer.catalogue import DataCatalogue, is_readable_file
+from ccpi.web_viewer.streaming import coalesce
 from ccpi.web_viewer.trame_viewer2D import TrameViewer2D
 from ccpi.web_viewer.trame_viewer3D import TrameViewer3D
+from ccpi.web_viewer.volume_cache import VolumeCache
 
 server = get_server()
 state, ctrl = server.state, server.controller
 
 TRAME_VIEWER = None
 VIEWER_2D = False
+TILE_MODE = False
+CATALOGUE_FILE = None
+# with --sessions, each client is served its own web viewer process, started with the VIEWER_OPTIONS
+MAX_SESSIONS = None
+MEMORY_LIMIT = None
+SESSION_TIMEOUT = 60
+VIEWER_OPTIONS = []
 
 
 def reset_viewer2d():
     set_viewer2d(False)
+    set_tile_mode(False)
+    set_catalogue_file(None)
+    set_sessions(None)
+
+
+def set_sessions(max_sessions, memory_limit=None, session_timeout=60):
+    global MAX_SESSIONS, MEMORY_LIMIT, SESSION_TIMEOUT
+    MAX_SESSIONS = max_sessions
+    MEMORY_LIMIT = memory_limit
+    SESSION_TIMEOUT = session_timeout
+    VIEWER_OPTIONS.clear()
 
 
 def set_viewer2d(new_value):
@@ -40,6 +64,16 @@ def set_viewer2d(new_value):
     VIEWER_2D = new_value
 
 
+def set_tile_mode(new_value):
+    global TILE_MODE
+    TILE_MODE = new_value
+
+
+def set_catalogue_file(new_value):
+    global CATALOGUE_FILE
+    CATALOGUE_FILE = new_value
+
+
 def arg_parser():
     """
     Parse the passed arguments to the current
@@ -48,18 +82,49 @@ def arg_parser():
     help_string = "web_app.py [optional args: -h, -d] <data_files>\n" \
                   "Args:\n" \
                   "-h: Show this help and exit the program\n" \
-                  "-d, --2D: Use the 2D viewer instead of the 3D viewer, the default is to just use the 3D viewer."
+                  "-d, --2D: Use the 2D viewer instead of the 3D viewer, the default is to just use the 3D viewer.\n" \
+                  "--memory_budget=<MB>: Memory the server uses to cache the loaded datasets, in MB.\n" \
+                  "--tiles: Use the 2D viewer, panning and zooming the slices in the browser.\n" \
+                  "--catalogue=<file>: Index the datasets in this SQLite file, to search them in the viewer.\n" \
+                  "--shared_volumes=<dir>: Share the loaded datasets with the other viewer processes using this directory.\n" \
+                  "--sessions=<N>: Serve each client its own viewer process, up to N at once.\n" \
+                  "--memory_limit=<MB>: With --sessions, refuse new clients while the processes use more memory, in MB.\n" \
+                  "--session_timeout=<s>: With --sessions, stop the process of a client disconnected for this long."
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hd", ["2D"])
+        opts, args = getopt.getopt(sys.argv[1:], "hd", [
+            "2D", "memory_budget=", "tiles", "catalogue=", "shared_volumes=", "sessions=", "memory_limit=",
+            "session_timeout="
+        ])
     except getopt.GetoptError:
         print(help_string)
         sys.exit(2)
     for opt, arg in opts:
+        if opt in ("-d", "--2D", "--tiles", "--memory_budget", "--catalogue"):
+            # the options of the viewer processes started with --sessions
+            VIEWER_OPTIONS.append(f"{opt}={arg}" if arg else opt)
         if opt == '-h':
             print(help_string)
         elif opt in ("-d", "--2D"):
             global VIEWER_2D
             VIEWER_2D = True
+        elif opt == "--tiles":
+            set_viewer2d(True)
+            set_tile_mode(True)
+        elif opt == "--memory_budget":
+            VolumeCache.get_instance().set_memory_budget(int(float(arg) * 1024**2))
+        elif opt == "--catalogue":
+            set_catalogue_file(arg)
+        elif opt == "--shared_volumes":
+            VolumeCache.get_instance().set_shared_directory(arg)
+        elif opt == "--sessions":
+            global MAX_SESSIONS
+            MAX_SESSIONS = int(arg)
+        elif opt == "--memory_limit":
+            global MEMORY_LIMIT
+            MEMORY_LIMIT = int(float(arg) * 1024**2)
+        elif opt == "--session_timeout":
+            global SESSION_TIMEOUT
+            SESSION_TIMEOUT = float(arg)
     return data_finder()
 
 
@@ -78,7 +143,10 @@ def data_finder():
         elif os.path.isdir(arg):
             files_in_dir = os.listdir(arg)
             for file in files_in_dir:
-                data_files.append(os.path.join(arg, file))
+                file_path = os.path.join(arg, file)
+                # the directories may be stacks of TIFF files, the other files are skipped if they cannot be read
+                if os.path.isdir(file_path) or is_readable_file(file_path):
+                    data_files.append(file_path)
         else:
             print(f"This arg: {arg} is not a valid file or directory. Assuming it is for trame.")
     return data_files
@@ -90,17 +158,54 @@ def main() -> int:
     :return: int, exit code for the program
     """
     data_files = arg_parser()
+    if MAX_SESSIONS is not None:
+        return launch_sessions(data_files)
+    catalogue = None
+    if CATALOGUE_FILE is not None:
+        catalogue = DataCatalogue(CATALOGUE_FILE, hdf5_dataset_name=VolumeCache.get_instance().hdf5_dataset_name)
+        catalogue.start_scan(data_files)
     global TRAME_VIEWER
     if not VIEWER_2D:
-        TRAME_VIEWER = TrameViewer3D(data_files)
+        TRAME_VIEWER = TrameViewer3D(data_files, catalogue=catalogue)
         TRAME_VIEWER.start()
     else:
-        TRAME_VIEWER = TrameViewer2D(data_files)
+        TRAME_VIEWER = TrameViewer2D(data_files, tile_mode=TILE_MODE, catalogue=catalogue)
         TRAME_VIEWER.start()
     return 0
 
 
+def launch_sessions(data_files) -> int:
+    """
+    Serves each client its own web viewer process, with its own state and viewer, from a launcher on the host and port
+    of the trame options, see ProcessSessionManager. The processes share the volumes they load, in a temporary
+    directory removed when the launcher exits.
+    :return: int, exit code for the program
+    """
+    # deferred, only the launcher uses them
+    from ccpi.web_viewer.sessions import ProcessSessionManager, run_launcher
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    options, _ = parser.parse_known_args(sys.argv[1:])
+    shared_directory = tempfile.mkdtemp(prefix="cilviewer_volumes_")
+    try:
+        command = [
+            sys.executable, "-m", "ccpi.web_viewer.web_app", *VIEWER_OPTIONS, f"--shared_volumes={shared_directory}",
+            *data_files
+        ]
+        manager = ProcessSessionManager(command,
+                                        max_sessions=MAX_SESSIONS,
+                                        memory_limit=MEMORY_LIMIT,
+                                        host=options.host,
+                                        timeout=SESSION_TIMEOUT)
+        run_launcher(manager, host=options.host, port=options.port)
+    finally:
+        shutil.rmtree(shared_directory, ignore_errors=True)
+    return 0
+
+
 @state.change("slice")
+@coalesce()
 def update_slice(**kwargs):
     TRAME_VIEWER.change_slice_number(kwargs["slice"])
 
@@ -125,42 +230,54 @@ def change_model(**kwargs):
     TRAME_VIEWER.load_file(kwargs['file_name'], kwargs.get('opacity', "scalar"))
 
 
+@state.change("catalogue_search", "catalogue_dtype")
+def change_catalogue_search(**kwargs):
+    TRAME_VIEWER.update_catalogue_options(kwargs.get("catalogue_search") or "", kwargs.get("catalogue_dtype"))
+
+
 @state.change("color_map")
 def change_color_map(**kwargs):
     TRAME_VIEWER.change_color_map(kwargs['color_map'])
 
 
 @state.change("windowing")
+@coalesce()
 def change_windowing(**kwargs):
     TRAME_VIEWER.change_windowing(kwargs["windowing"][0], kwargs["windowing"][1], windowing_method=kwargs["opacity"])
 
 
 @state.change("coloring")
+@coalesce()
 def change_coloring(**kwargs):
     TRAME_VIEWER.change_coloring(kwargs["coloring"][0], kwargs["coloring"][1])
 
 
 @state.change("slice_window")
+@coalesce()
 def change_slice_window(**kwargs):
     TRAME_VIEWER.change_slice_window(kwargs["slice_window"])
 
 
 @state.change("slice_window_as_percentage")
+@coalesce()
 def change_slice_window_as_percentage(**kwargs):
     TRAME_VIEWER.change_slice_window_as_percentage(kwargs["slice_window_as_percentage"])
 
 
 @state.change("slice_level")
+@coalesce()
 def change_slice_level(**kwargs):
     TRAME_VIEWER.change_slice_level(kwargs["slice_level"])
 
 
 @state.change("slice_level_as_percentage")
+@coalesce()
 def change_slice_level_as_percentage(**kwargs):
     TRAME_VIEWER.change_slice_level_as_percentage(kwargs["slice_level_as_percentage"])
 
 
 @state.change("slice_window_range")
+@coalesce()
 def change_slice_window_level_range(**kwargs):
     min_window = kwargs["slice_window_range"][0]
     max_window = kwargs["slice_window_range"][1]
@@ -168,6 +285,7 @@ def change_slice_window_level_range(**kwargs):
 
 
 @state.change("slice_window_percentiles")
+@coalesce()
 def change_slice_window_level_percentiles(**kwargs):
     min_window = kwargs["slice_window_percentiles"][0]
     max_window = kwargs["slice_window_percentiles"][1]
@@ -36,13 +36,9 @@ class FourLinkedViewersDockableWidget(QtWidgets.QMainWindow):
                                       title="3D",
                                       interactorStyle=vlink.Linked3DInteractorStyle)
 
-        # Create the viewer linkers
-        viewerLinkers = self.linkedViewersSetup(self.v00, self.v01, self.v10, self.v11)
-
-        for linker in viewerLinkers:
-            linker.enable()
-
-        self.viewerLinkers = viewerLinkers
+        # Link all the viewers together
+        self.viewerHub = self.linkedViewersSetup(self.v00, self.v01, self.v10, self.v11)
+        self.viewerHub.enable()
 
         head = example_data.HEAD.get()
 
@@ -68,26 +64,14 @@ class FourLinkedViewersDockableWidget(QtWidgets.QMainWindow):
         self.show()
 
     def linkedViewersSetup(self, *args):
-        linked = [viewer for viewer in args]
-        # link all combination of viewers
-        #pairs = [(linked[0],linked[i]) for i in range(1, len(linked))]
-        pairs = []
-        for i in range(len(linked)):
-            for j in range(len(linked)):
-                if not i == j:
-                    pairs.append((linked[i], linked[j]))
-
-        linkers = []
-        for pair in pairs:
-            v2d = pair[0].viewer
-            v3d = pair[1].viewer
-            link2D3D = vlink.ViewerLinker(v2d, v3d)
-            link2D3D.setLinkPan(False)
-            link2D3D.setLinkZoom(False)
-            link2D3D.setLinkWindowLevel(True)
-            link2D3D.setLinkSlice(False)
-            linkers.append(link2D3D)
-        return linkers
+        hub = vlink.ViewerSyncHub([dock.viewer for dock in args])
+        hub.setLinkPan(False)
+        hub.setLinkZoom(False)
+        hub.setLinkWindowLevel(True)
+        hub.setLinkSlice(False)
+        # each 2D viewer shows a different orientation
+        hub.setLinkOrientation(False)
+        return hub
 
 
 if __name__ == "__main__":
@@ -62,6 +62,7 @@ setup(
         "ccpi", "ccpi.viewer", "ccpi.viewer.utils", "ccpi.web_viewer", "ccpi.viewer.widgets", "ccpi.viewer.cli",
         "ccpi.viewer.ui"
     ],
+    package_data={"ccpi.web_viewer": ["static/*.js"]},
     install_requires=requires,
     zip_safe=False,
     # metadata for upload to PyPI
@@ -5,8 +5,11 @@ import sys
 from unittest import mock
 from unittest.mock import patch
 
+import numpy as np
+
 from ccpi.viewer.QCILViewer3DToolBar import QCILViewer3DToolBar
 from ccpi.viewer.CILViewer import CILViewer
+from ccpi.viewer.utils.conversion import Converter
 
 from qtpy.QtWidgets import QMainWindow
 from qtpy.QtWidgets import QApplication, QLabel, QFrame, QDoubleSpinBox, QCheckBox, QPushButton, QLineEdit, QComboBox, QWidget
@@ -38,3 +41,34 @@ class TestQCILViewer3DToolBar(TestCaseQt):
     def test_init(self):
         toolbar = QCILViewer3DToolBar(self.parent, self.viewer)
         assert toolbar is not None
+
+    def test_isosurface_slider_sets_isosurface_on_viewer(self):
+        self.viewer.img3D = mock.MagicMock()
+        self.viewer.img3D.GetScalarRange.return_value = (0, 200)
+        self.viewer.setIsoSurface = mock.MagicMock()
+        self.viewer.removeIsoSurface = mock.MagicMock()
+        toolbar = QCILViewer3DToolBar(self.parent, self.viewer)
+
+        toolbar.isosurface_checkbox.setChecked(True)
+        self.viewer.setIsoSurface.assert_called_once_with(100, coarse=False)
+
+        toolbar.isosurface_slider.setValue(25)
+        self.viewer.setIsoSurface.assert_called_with(50, coarse=False)
+
+        toolbar.isosurface_checkbox.setChecked(False)
+        self.viewer.removeIsoSurface.assert_called_once()
+
+    def test_isosurface_controls_are_reset_when_input_changes(self):
+        data = np.random.randint(0, 100, size=(10, 12, 14)).astype(np.uint8)
+        self.viewer.setInputData(Converter.numpy2vtkImage(data))
+        toolbar = QCILViewer3DToolBar(self.parent, self.viewer)
+        toolbar.isosurface_checkbox.setChecked(True)
+        toolbar.isosurface_slider.setValue(20)
+        self.assertIsNotNone(self.viewer.getIsoSurfaceValue())
+
+        self.viewer.setInputData(Converter.numpy2vtkImage(data * 2))
+
+        self.assertIsNone(self.viewer.getIsoSurfaceValue())
+        self.assertFalse(toolbar.isosurface_checkbox.isChecked())
+        self.assertEqual(toolbar.isosurface_slider.value(), 50)
+        self.assertFalse(toolbar.isosurface_slider.isEnabled())
@@ -18,7 +18,13 @@ import os
 import unittest
 from unittest import mock
 
+import numpy as np
+import vtk
+
 from ccpi.viewer.CILViewer import CILViewer
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.dataset_context import cilDatasetContext
+from ccpi.viewer.utils.memory import cilMemoryManager
 
 # skip the tests on GitHub actions
 if os.environ.get('CONDA_BUILD', '0') == '1':
@@ -80,3 +86,127 @@ class CILViewer3DTest(unittest.TestCase):
 
 if __name__ == '__main__':
     unittest.main()
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewer3DLODTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cil_viewer = CILViewer()
+        np.random.seed(1)
+        data = np.random.randint(0, 100, size=(40, 30, 20), dtype=np.uint16)
+        self.image = Converter.numpy2vtkImage(data)
+        self.cil_viewer.img3D = self.image
+        self.cil_viewer.installVolumeRenderActorPipeline()
+
+    def test_setVolumeRenderLOD_creates_downsampled_mapper(self):
+        self.cil_viewer.setVolumeRenderLOD(True, target_size=1000)
+        lod_mapper = self.cil_viewer.volume_lod_mapper
+        self.assertIsNotNone(lod_mapper)
+        lod_mapper.GetInputAlgorithm().Update()
+        lod_dims = lod_mapper.GetInput().GetDimensions()
+        full_dims = self.image.GetDimensions()
+        self.assertTrue(all(lod <= full for lod, full in zip(lod_dims, full_dims)))
+        self.assertLess(np.prod(lod_dims), np.prod(full_dims))
+
+    def test_volume_is_rendered_downsampled_over_the_memory_budget(self):
+        self.assertFalse(self.cil_viewer.getVolumeRenderDownsampled())
+        manager = cilMemoryManager.GetInstance()
+        budget = manager.GetBudget()
+        try:
+            self.cil_viewer.setDatasetContext(cilDatasetContext.GetContext(self.image))
+            self.cil_viewer.setVolumeRenderLOD(True, target_size=1000)
+            # half of the buffers of the mapper fit in the budget
+            manager.SetBudget(
+                sum(buffer['size'] for buffer in manager.GetBuffers() if not buffer['evictable']) -
+                manager.GetBuffers(self.cil_viewer)[0]['size'] // 2)
+            self.cil_viewer.installVolumeRenderActorPipeline()
+            self.assertTrue(self.cil_viewer.getVolumeRenderDownsampled())
+            self.cil_viewer.volume_mapper.GetInputAlgorithm().Update()
+            self.assertLess(self.cil_viewer.volume_mapper.GetInput().GetNumberOfPoints(),
+                            self.image.GetNumberOfPoints())
+        finally:
+            manager.SetBudget(budget)
+
+    def test_downsampled_volume_is_counted_once_and_pinned(self):
+        manager = cilMemoryManager.GetInstance()
+        budget = manager.GetBudget()
+        context = cilDatasetContext.GetContext(self.image)
+        try:
+            self.cil_viewer.setDatasetContext(context)
+            # the volume is not downsampled below the size of the LOD copy
+            self.cil_viewer.setVolumeRenderLOD(False, target_size=1000)
+            manager.SetBudget(
+                sum(buffer['size'] for buffer in manager.GetBuffers() if not buffer['evictable']) -
+                manager.GetBuffers(self.cil_viewer)[0]['size'] // 2)
+            self.cil_viewer.installVolumeRenderActorPipeline()
+            self.assertTrue(self.cil_viewer.getVolumeRenderDownsampled())
+            # the downsampled copy is counted by the context only
+            self.assertFalse(manager.IsRegistered(self.cil_viewer, "volume_mapper"))
+            levels = [buffer for buffer in manager.GetBuffers(context) if buffer['name'].startswith('pyramid_')]
+            self.assertEqual(len(levels), 1)
+            self.assertFalse(levels[0]['evictable'])
+            self.assertTrue(manager.IsPinned(context, levels[0]['name']))
+            # and is not evicted while the mapper renders it
+            manager.SetBudget(0)
+            self.assertTrue(manager.IsRegistered(context, levels[0]['name']))
+            self.assertGreater(self.cil_viewer.volume_mapper.GetInput().GetNumberOfPoints(), 0)
+            # the copy is unpinned once the mapper renders the image
+            manager.SetBudget(None)
+            self.cil_viewer.installVolumeRenderActorPipeline()
+            self.assertFalse(self.cil_viewer.getVolumeRenderDownsampled())
+            self.assertFalse(manager.IsPinned(context, levels[0]['name']))
+            self.assertTrue(manager.IsRegistered(self.cil_viewer, "volume_mapper"))
+        finally:
+            manager.SetBudget(budget)
+            self.cil_viewer.setDatasetContext(None)
+
+    def test_setVolumeRenderInteractive_swaps_mapper(self):
+        self.cil_viewer.setVolumeRenderLOD(True, target_size=1000)
+        self.cil_viewer.setVolumeRenderInteractive(True)
+        self.assertIs(self.cil_viewer.volume.GetMapper(), self.cil_viewer.volume_lod_mapper)
+        self.cil_viewer.setVolumeRenderInteractive(False)
+        self.assertIs(self.cil_viewer.volume.GetMapper(), self.cil_viewer.volume_mapper)
+
+    def test_setVolumeRenderInteractive_does_nothing_when_LOD_disabled(self):
+        self.cil_viewer.setVolumeRenderInteractive(True)
+        self.assertIs(self.cil_viewer.volume.GetMapper(), self.cil_viewer.volume_mapper)
+
+    def test_LOD_levels_share_clipping_planes(self):
+        self.cil_viewer.setVolumeRenderLOD(True, target_size=1000)
+        self.cil_viewer.setVolumeRenderInteractive(True)
+        plane = vtk.vtkPlane()
+        self.cil_viewer.volume.GetMapper().AddClippingPlane(plane)
+        self.assertEqual(self.cil_viewer.volume_mapper.GetClippingPlanes().GetNumberOfItems(), 1)
+        self.cil_viewer.volume.GetMapper().RemoveAllClippingPlanes()
+        self.assertEqual(self.cil_viewer.volume_lod_mapper.GetClippingPlanes().GetNumberOfItems(), 0)
+
+    def test_setVolumeRenderTargetFrameTime(self):
+        self.cil_viewer.setVolumeRenderTargetFrameTime(0.1)
+        self.assertAlmostEqual(self.cil_viewer.getInteractor().GetDesiredUpdateRate(), 10)
+        with self.assertRaises(ValueError):
+            self.cil_viewer.setVolumeRenderTargetFrameTime(0)
+
+    def test_setIsoSurface_displays_and_removes_actor(self):
+        self.cil_viewer.renWin.SetOffScreenRendering(1)
+        self.cil_viewer.setIsoSurface(50)
+        self.assertEqual(self.cil_viewer.getIsoSurfaceValue(), 50)
+        actor = self.cil_viewer.isosurface_actor
+        self.assertTrue(self.cil_viewer.getRenderer().HasViewProp(actor))
+        self.cil_viewer.removeIsoSurface()
+        self.assertIsNone(self.cil_viewer.getIsoSurfaceValue())
+        self.assertFalse(self.cil_viewer.getRenderer().HasViewProp(actor))
+
+    def test_setVolumeRenderEmptySpaceSkipping_crops_mappers(self):
+        # the default opacity method is gradient
+        self.cil_viewer.setVolumeRenderLOD(True, target_size=1000)
+        self.cil_viewer.setGradientOpacityRange(1e6, 2e6, update_pipeline=False)
+        self.cil_viewer.setVolumeRenderEmptySpaceSkipping(True, block_size=8)
+        # the gradient is never that large in the image
+        self.assertFalse(self.cil_viewer.volume_mapper.GetCropping())
+        self.cil_viewer.setGradientOpacityRange(50, 60, update_pipeline=False)
+        self.cil_viewer.setVolumeRenderEmptySpaceSkipping(True)
+        for mapper in (self.cil_viewer.volume_mapper, self.cil_viewer.volume_lod_mapper):
+            self.assertTrue(mapper.GetCropping())
+        self.cil_viewer.setVolumeRenderEmptySpaceSkipping(False)
+        self.assertFalse(self.cil_viewer.volume_mapper.GetCropping())
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+import vtk
+
+from ccpi.viewer.utils.colormaps import CILColorMaps, relu
+
+
+class TestColorMaps(unittest.TestCase):
+
+    def setUp(self):
+        CILColorMaps.clear_cache()
+
+    def test_relu(self):
+        x = np.linspace(-1, 3, num=9)
+        expected = []
+        for val in x:
+            if val < 0:
+                expected.append(0)
+            elif val > 2:
+                expected.append(0.5)
+            else:
+                expected.append(0.5 * val / 2)
+        np.testing.assert_allclose(relu(x, 0, 2, 0.5), expected)
+
+    def test_relu_with_equal_limits(self):
+        np.testing.assert_allclose(relu(np.array([0., 1., 2.]), 1, 1), [0, 1, 1])
+
+    def test_get_color_transfer_function(self):
+        colors = CILColorMaps.get_color_map('viridis')
+        tf = CILColorMaps.get_color_transfer_function('viridis', (10, 20))
+        self.assertIsInstance(tf, vtk.vtkColorTransferFunction)
+        self.assertEqual(tf.GetSize(), len(colors))
+        self.assertEqual(tf.GetRange(), (10, 20))
+        np.testing.assert_allclose(tf.GetColor(10), colors[0])
+        np.testing.assert_allclose(tf.GetColor(20), colors[-1])
+
+    def test_get_color_transfer_function_is_memoised(self):
+        tf = CILColorMaps.get_color_transfer_function('viridis', (10, 20))
+        self.assertIs(tf, CILColorMaps.get_color_transfer_function('viridis', [10., 20.]))
+        self.assertIsNot(tf, CILColorMaps.get_color_transfer_function('viridis', (10, 21)))
+        self.assertIsNot(tf, CILColorMaps.get_color_transfer_function('magma', (10, 20)))
+
+    def test_get_opacity_transfer_function(self):
+        x = np.linspace(0, 100, num=255)
+        opacity = CILColorMaps.get_opacity_transfer_function(x, relu, 20, 80, 0.5)
+        self.assertIsInstance(opacity, vtk.vtkPiecewiseFunction)
+        self.assertEqual(opacity.GetSize(), len(x))
+        expected = relu(x, 20, 80, 0.5)
+        for _x, _y in zip(x[::17], expected[::17]):
+            self.assertAlmostEqual(opacity.GetValue(_x), _y)
+
+    def test_get_opacity_transfer_function_is_memoised(self):
+        x = np.linspace(0, 100, num=255)
+        opacity = CILColorMaps.get_opacity_transfer_function(x, relu, 20, 80, 0.5)
+        self.assertIs(opacity, CILColorMaps.get_opacity_transfer_function(x.copy(), relu, 20, 80, 0.5))
+        self.assertIsNot(opacity, CILColorMaps.get_opacity_transfer_function(x, relu, 20, 81, 0.5))
+        self.assertIsNot(opacity, CILColorMaps.get_opacity_transfer_function(x + 1, relu, 20, 80, 0.5))
+
+    def test_cache_is_bounded(self):
+        for i in range(CILColorMaps.cache_size + 5):
+            CILColorMaps.get_color_transfer_function('viridis', (0, i + 1))
+        self.assertEqual(len(CILColorMaps._color_tf_cache), CILColorMaps.cache_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
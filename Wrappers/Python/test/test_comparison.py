@@ -0,0 +1,123 @@
+import unittest
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.comparison import cilImageComparison
+from ccpi.viewer.utils.conversion import Converter
+
+
+def get_scalars(image):
+    return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+
+
+class TestImageComparison(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        # ordered z, y, x
+        self.data = np.random.randint(0, 1000, size=(20, 30, 40)).astype(np.uint16)
+        self.data2 = np.random.randint(0, 1000, size=(20, 30, 40)).astype(np.uint16)
+        self.data2[:, 0, :] = 0
+        self.image = Converter.numpy2vtkImage(self.data)
+        self.image2 = Converter.numpy2vtkImage(self.data2)
+        self.comparison = cilImageComparison()
+        self.comparison.SetInputDataObject(0, self.image)
+        self.comparison.SetInputDataObject(1, self.image2)
+        self.voi = vtk.vtkExtractVOI()
+        self.voi.SetInputConnection(self.comparison.GetOutputPort())
+
+    def compare(self, orientation, sliceno):
+        extent = list(self.image.GetExtent())
+        extent[orientation * 2] = sliceno
+        extent[orientation * 2 + 1] = sliceno
+        self.voi.SetVOI(*extent)
+        self.voi.Update()
+        return get_scalars(self.voi.GetOutput())
+
+    def test_operations(self):
+        a = self.data[:, 4, :].astype(np.float64)
+        b = self.data2[:, 4, :].astype(np.float64)
+        self.comparison.SetThreshold(500)
+        expected = {
+            'difference': a - b,
+            'absolute_difference': np.abs(a - b),
+            'ratio': np.divide(a, b, out=np.zeros_like(a), where=b != 0),
+            'threshold': np.abs(a - b) > 500
+        }
+        for operation, values in expected.items():
+            self.comparison.SetOperation(operation)
+            np.testing.assert_allclose(self.compare(1, 4), values.ravel(), rtol=1e-6)
+        self.assertEqual(self.voi.GetOutput().GetScalarType(), vtk.VTK_UNSIGNED_CHAR)
+
+    def test_ratio_is_0_where_image2_is_0(self):
+        self.comparison.SetOperation('ratio')
+        np.testing.assert_array_equal(self.compare(1, 0), 0)
+
+    def test_only_displayed_slice_is_computed_and_cached(self):
+        self.compare(2, 5)
+        self.compare(2, 6)
+        self.assertEqual(list(self.comparison._cache.keys()), [(0, 39, 0, 29, 5, 5), (0, 39, 0, 29, 6, 6)])
+        stats = self.comparison.GetStatistics((0, 39, 0, 29, 5, 5))
+        difference = self.data[5].astype(np.float64) - self.data2[5]
+        self.assertAlmostEqual(stats['mean'], difference.mean(), places=3)
+        self.assertAlmostEqual(stats['std'], difference.std(), places=3)
+        np.testing.assert_allclose(stats['percentiles'], np.percentile(difference, (1, 99)), rtol=1e-5)
+        self.assertIs(self.comparison.GetLastStatistics(), self.comparison.GetStatistics((0, 39, 0, 29, 6, 6)))
+
+    def test_cache_is_cleared_when_input_is_modified(self):
+        self.compare(2, 5)
+        self.data2[5] = self.data[5]
+        self.image2.Modified()
+        np.testing.assert_array_equal(self.compare(2, 5), 0)
+
+
+class TestCILViewer2DComparison(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.data = np.random.randint(0, 1000, size=(20, 30, 40)).astype(np.uint16)
+        self.data2 = np.random.randint(0, 1000, size=(20, 30, 40)).astype(np.uint16)
+        self.viewer = CILViewer2D()
+        self.viewer.getRenderWindow().SetOffScreenRendering(1)
+        self.viewer.setInputData(Converter.numpy2vtkImage(self.data))
+
+    def test_comparison_requires_image2(self):
+        with self.assertRaises(ValueError):
+            self.viewer.setVisualisationToImageComparison()
+
+    def test_comparison_of_displayed_slice(self):
+        self.viewer.setInputData2(Converter.numpy2vtkImage(self.data2))
+        self.viewer.setVisualisationToImageComparison()
+        self.assertEqual(self.viewer.vis_mode, CILViewer2D.IMAGE_COMPARISON)
+        sliceno = self.viewer.getActiveSlice()
+        difference = self.data[sliceno].astype(np.float32) - self.data2[sliceno]
+        np.testing.assert_array_equal(get_scalars(self.viewer.comparisonVOI.GetOutput()), difference.ravel())
+        # the difference is displayed symmetrically around 0
+        self.assertEqual(self.viewer.comparisonActor.GetProperty().GetColorLevel(), 0)
+
+        self.viewer.setSliceOrientation('x')
+        self.viewer.style.SetActiveSlice(3)
+        self.viewer.style.UpdatePipeline()
+        self.viewer.setComparisonOperation('threshold', threshold=100)
+        np.testing.assert_array_equal(get_scalars(self.viewer.comparisonVOI.GetOutput()),
+                                      (np.abs(self.data[:, :, 3].astype(np.float32) - self.data2[:, :, 3])
+                                       > 100).ravel())
+        self.assertEqual(self.viewer.comparisonActor.GetProperty().GetColorWindow(), 1)
+
+        self.viewer.setVisualisationToImageWithOverlay()
+        self.assertNotIn('comparison_actor', self.viewer.GetActorsDict())
+
+    def test_comparison_with_resampled_image2(self):
+        self.viewer.setInputData2(
+            Converter.numpy2vtkImage(np.ascontiguousarray(self.data2[::2, ::2, ::2]), spacing=(2, 2, 2)))
+        self.viewer.setVisualisationToImageComparison()
+        self.viewer.setComparisonOperation('absolute_difference')
+        self.assertEqual(self.viewer.comparisonVOI.GetOutput().GetExtent(), self.viewer.voi.GetOutput().GetExtent())
+        self.assertIsNotNone(self.viewer.getComparisonStatistics())
+
+
+if __name__ == '__main__':
+    unittest.main()
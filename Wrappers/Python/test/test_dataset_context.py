@@ -0,0 +1,228 @@
+import gc
+import threading
+import unittest
+import weakref
+from unittest import mock
+
+import numpy as np
+import vtk
+
+from ccpi.viewer.CILViewer import CILViewer
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.dataset_context import cilDatasetContext
+from ccpi.viewer.utils.memory import cilMemoryManager, get_data_size
+
+
+class Owner(object):
+    pass
+
+
+class TestDatasetContext(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        data = np.random.randint(0, 100, size=(20, 30, 40), dtype=np.uint16)
+        self.image = Converter.numpy2vtkImage(data)
+        self.context = cilDatasetContext.GetContext(self.image)
+
+    def tearDown(self):
+        if self.context.GetImage() is not None:
+            self.context.Release()
+
+    def test_GetContext_returns_one_context_per_image(self):
+        self.assertIs(cilDatasetContext.GetContext(self.image), self.context)
+        other = Converter.numpy2vtkImage(np.zeros((4, 4, 4), dtype=np.uint8))
+        other_context = cilDatasetContext.GetContext(other)
+        self.assertIsNot(other_context, self.context)
+        other_context.Release()
+
+    def test_context_is_released_with_last_reference(self):
+        owner1, owner2 = Owner(), Owner()
+        self.context.Register(owner1)
+        self.context.Register(owner2)
+        self.assertEqual(self.context.GetReferenceCount(), 2)
+        self.context.UnRegister(owner1)
+        self.assertIs(self.context.GetImage(), self.image)
+        self.context.UnRegister(owner2)
+        self.assertIsNone(self.context.GetImage())
+        self.assertIsNot(cilDatasetContext.GetContext(self.image), self.context)
+        cilDatasetContext.GetContext(self.image).Release()
+
+    def test_context_is_freed_with_its_owners(self):
+        owner = Owner()
+        self.context.Register(owner)
+        del owner
+        gc.collect()
+        self.assertEqual(self.context.GetReferenceCount(), 0)
+        context = weakref.ref(self.context)
+        del self.context
+        gc.collect()
+        self.assertIsNone(context())
+        self.context = cilDatasetContext.GetContext(self.image)
+
+    def test_GetMapRange_matches_histogram_statistics(self):
+        float_image = Converter.numpy2vtkImage(Converter.vtk2numpy(self.image).astype(np.float32) * 0.37)
+        for image in (self.image, float_image):
+            context = cilDatasetContext.GetContext(image)
+            ia = vtk.vtkImageHistogramStatistics()
+            ia.SetInputData(image)
+            for percentiles in ((5., 95.), (0., 100.), (80., 99.), (33.3, 66.7), (50., 50.)):
+                ia.SetAutoRangePercentiles(*percentiles)
+                ia.Update()
+                self.assertEqual(context.GetMapRange(percentiles, 'scalar'), tuple(ia.GetAutoRange()))
+            self.assertEqual(context.GetWholeRange('scalar'), (ia.GetMinimum(), ia.GetMaximum()))
+        cilDatasetContext.GetContext(float_image).Release()
+
+    def test_products_are_cached(self):
+        with mock.patch.object(self.context, '_computeStatistics', wraps=self.context._computeStatistics) as compute:
+            self.context.GetMapRange((5., 95.), 'gradient')
+            self.context.GetMapRange((5., 95.), 'gradient')
+            # the percentiles are found in the same histogram
+            self.context.GetMapRange((1., 99.), 'gradient')
+            self.assertEqual(compute.call_count, 1)
+        gradient = self.context.GetGradientMagnitude()
+        self.assertIs(self.context.GetGradientMagnitude(), gradient)
+        self.assertIs(self.context.GetPyramidLevel(1000), self.context.GetPyramidLevel(1000))
+
+    def test_cache_is_cleared_when_image_is_modified(self):
+        gradient = self.context.GetGradientMagnitude()
+        self.image.Modified()
+        self.assertIsNot(self.context.GetGradientMagnitude(), gradient)
+
+    def test_Precompute(self):
+        progress = mock.MagicMock()
+        map_ranges = [((5., 95.), 'scalar'), ((1., 99.), 'gradient')]
+        self.assertTrue(self.context.Precompute(map_ranges, progress_callback=progress))
+        self.assertEqual(progress.emit.call_args_list[-1], mock.call(100))
+        with mock.patch.object(self.context, '_computeStatistics') as compute:
+            for percentiles, method in map_ranges:
+                self.context.GetMapRange(percentiles, method)
+            compute.assert_not_called()
+
+    def test_Precompute_stops_when_cancelled(self):
+        stop_event = threading.Event()
+        stop_event.set()
+        with mock.patch.object(self.context, '_computeStatistics') as compute:
+            self.assertFalse(self.context.Precompute([((5., 95.), 'scalar')], stop_event=stop_event))
+            compute.assert_not_called()
+
+    def test_statistics_cache(self):
+        self.context.GetMapRange((5., 95.), 'scalar')
+        self.context.GetWholeRange('scalar')
+        cache = self.context.GetStatisticsCache()
+
+        image = Converter.numpy2vtkImage(Converter.vtk2numpy(self.image).copy())
+        context = cilDatasetContext.GetContext(image)
+        context.SetStatisticsCache(cache)
+        with mock.patch.object(context, '_computeStatistics') as compute:
+            self.assertEqual(context.GetMapRange((5., 95.), 'scalar'), self.context.GetMapRange((5., 95.), 'scalar'))
+            self.assertEqual(context.GetWholeRange('scalar'), self.context.GetWholeRange('scalar'))
+            compute.assert_not_called()
+        image.Modified()
+        self.assertEqual(context.GetStatisticsCache(), {'map_ranges': [], 'whole_ranges': {}})
+        context.Release()
+
+    def test_GetPyramidLevel(self):
+        level = self.context.GetPyramidLevel(1000)
+        self.assertLess(level.GetNumberOfPoints(), self.image.GetNumberOfPoints())
+
+    def test_buffers_are_registered_with_the_memory_manager(self):
+        manager = cilMemoryManager.GetInstance()
+        self.assertTrue(manager.IsRegistered(self.context, 'image'))
+        self.context.GetGradientMagnitude()
+        self.context.GetPyramidLevel(1000)
+        self.assertEqual(sorted(buffer['name'] for buffer in manager.GetBuffers(self.context) if buffer['evictable']),
+                         ['gradient', 'pyramid_1000'])
+        self.context.ClearCache()
+        self.assertEqual([buffer['name'] for buffer in manager.GetBuffers(self.context)], ['image'])
+        self.context.Release()
+        self.assertEqual(manager.GetBuffers(self.context), [])
+
+    def test_caches_are_evicted_over_the_memory_budget(self):
+        manager = cilMemoryManager.GetInstance()
+        budget = manager.GetBudget()
+        try:
+            gradient = self.context.GetGradientMagnitude()
+            self.context.GetPyramidLevel(1000)
+            pyramid_size = get_data_size(self.context.GetPyramidLevel(1000))
+            # the caches used before the pyramid level, including the gradient, do not fit
+            manager.SetBudget(
+                sum(buffer['size'] for buffer in manager.GetBuffers() if not buffer['evictable']) + pyramid_size)
+            self.assertFalse(manager.IsRegistered(self.context, 'gradient'))
+            self.assertTrue(manager.IsRegistered(self.context, 'pyramid_1000'))
+            self.assertIsNot(self.context.GetGradientMagnitude(), gradient)
+        finally:
+            manager.SetBudget(budget)
+
+
+class TestViewersShareDatasetContext(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        data = np.random.randint(0, 100, size=(20, 30, 40), dtype=np.uint16)
+        self.image = Converter.numpy2vtkImage(data)
+        self.viewers = []
+        for viewer_class in (CILViewer2D, CILViewer):
+            viewer = viewer_class()
+            viewer.getRenderWindow().SetOffScreenRendering(1)
+            viewer.setInputData(self.image)
+            self.viewers.append(viewer)
+
+    def test_viewers_share_context(self):
+        context = self.viewers[0].getDatasetContext()
+        self.assertIsNotNone(context)
+        self.assertIs(self.viewers[1].getDatasetContext(), context)
+        self.assertEqual(context.GetReferenceCount(), 2)
+        self.assertEqual(self.viewers[0].getImageMapRange((5., 95.), 'scalar'), self.viewers[1].getImageMapRange(
+            (5., 95.), 'scalar'))
+
+    def test_context_is_released_when_viewers_change_image(self):
+        context = self.viewers[0].getDatasetContext()
+        other = Converter.numpy2vtkImage(np.zeros((4, 5, 6), dtype=np.uint16))
+        self.viewers[0].setInputData(other)
+        self.assertIs(context.GetImage(), self.image)
+        self.viewers[1].setInputData(other)
+        self.assertIsNone(context.GetImage())
+        self.assertIs(self.viewers[0].getDatasetContext(), self.viewers[1].getDatasetContext())
+
+    def test_context_is_freed_with_the_viewers(self):
+        viewers = [CILViewer() for _ in range(2)]
+        for viewer in viewers:
+            viewer.getRenderWindow().SetOffScreenRendering(1)
+            viewer.setInputData(self.image)
+        number_of_contexts = cilDatasetContext.GetNumberOfContexts()
+        context = weakref.ref(viewers[0].getDatasetContext())
+        self.assertEqual(context().GetReferenceCount(), 4)
+        # the viewers are deleted without unregistering from the context
+        del viewer, viewers
+        gc.collect()
+        self.assertEqual(context().GetReferenceCount(), 2)
+        del self.viewers
+        gc.collect()
+        self.assertIsNone(context())
+        self.assertEqual(cilDatasetContext.GetNumberOfContexts(), number_of_contexts - 1)
+
+    def test_memory_usage_goes_down_when_a_viewer_is_dropped(self):
+        manager = cilMemoryManager.GetInstance()
+        usage = manager.GetUsage()
+        image = Converter.numpy2vtkImage(np.random.randint(0, 100, size=(30, 30, 30), dtype=np.uint16))
+        viewer = CILViewer()
+        viewer.getRenderWindow().SetOffScreenRendering(1)
+        viewer.setInputData(image)
+        # caches of the context, evicted by bound methods of the context
+        viewer.getDatasetContext().GetGradientMagnitude()
+        viewer.getDatasetContext().GetPyramidResampler(1000)
+        self.assertGreater(manager.GetUsage(), usage + get_data_size(image))
+        del viewer, image
+        gc.collect()
+        self.assertEqual(manager.GetUsage(), usage)
+
+    def test_getDatasetProducts(self):
+        self.assertEqual(self.viewers[0].getDatasetProducts(), [((5., 95.), 'scalar')])
+        self.viewers[1].installVolumeRenderActorPipeline()
+        self.assertIn('gradient', [method for _, method in self.viewers[1].getDatasetProducts()])
+
+
+if __name__ == '__main__':
+    unittest.main()
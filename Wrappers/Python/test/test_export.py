@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from ccpi.viewer import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_YZ
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils import Converter
+from ccpi.viewer.utils.export import cilOffscreenExporter, render_to_image, split_frames
+
+
+def read_png(file_name):
+    reader = vtk.vtkPNGReader()
+    reader.SetFileName(file_name)
+    reader.Update()
+    image = reader.GetOutput()
+    width, height, _ = image.GetDimensions()
+    # top row first
+    return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(height, width, -1)[::-1]
+
+
+class TestOffscreenExport(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.tmpdir = tempfile.mkdtemp()
+        # z, y, x
+        self.data = np.random.randint(0, 255, size=(6, 10, 12)).astype(np.uint8)
+        self.image = Converter.numpy2vtkImage(self.data)
+        self.npy_file = os.path.join(self.tmpdir, 'image.npy')
+        np.save(self.npy_file, self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_split_frames(self):
+        ranges = split_frames(10, 3)
+        self.assertEqual([list(r) for r in ranges], [[0, 1, 2], [3, 4, 5], [6, 7, 8, 9]])
+        self.assertEqual(len(split_frames(2, 4)), 2)
+
+    def test_render_to_image_larger_than_window(self):
+        viewer = CILViewer2D(dimx=100, dimy=80, enableSliderWidget=False)
+        viewer.getRenderWindow().SetOffScreenRendering(1)
+        viewer.setInputData(self.image)
+        image = render_to_image(viewer.getRenderer(), (250, 130))
+        self.assertEqual(image.GetDimensions()[:2], (250, 130))
+
+    def test_ExportSlices(self):
+        exporter = cilOffscreenExporter(vtk_image=self.image, resolution=(64, 48), processes=1)
+        file_names = exporter.ExportSlices(os.path.join(self.tmpdir, 'slices'))
+        self.assertEqual(len(file_names), 6)
+        self.assertEqual(os.path.basename(file_names[-1]), 'slice_0005.png')
+        for file_name in file_names:
+            self.assertEqual(read_png(file_name).shape[:2], (48, 64))
+        self.assertFalse(np.array_equal(read_png(file_names[0]), read_png(file_names[-1])))
+        statistics = exporter.GetLastStatistics()
+        self.assertEqual(statistics['frames'], 6)
+        self.assertEqual(statistics['processes'], 1)
+        self.assertGreater(statistics['fps'], 0)
+
+        file_names = exporter.ExportSlices(os.path.join(self.tmpdir, 'yz'), orientation=SLICE_ORIENTATION_YZ)
+        self.assertEqual(len(file_names), 12)
+
+    def test_ExportSlices_in_parallel(self):
+        serial = cilOffscreenExporter(file_name=self.npy_file,
+                                      reader_kwargs={'resample': False},
+                                      resolution=(64, 48),
+                                      processes=1)
+        parallel = cilOffscreenExporter(file_name=self.npy_file,
+                                        reader_kwargs={'resample': False},
+                                        resolution=(64, 48),
+                                        processes=2)
+        serial_files = serial.ExportSlices(os.path.join(self.tmpdir, 'serial'), slices=[0, 2, 4, 5])
+        parallel_files = parallel.ExportSlices(os.path.join(self.tmpdir, 'parallel'), slices=[0, 2, 4, 5])
+        self.assertEqual(parallel.GetLastStatistics()['processes'], 2)
+        for serial_file, parallel_file in zip(serial_files, parallel_files):
+            np.testing.assert_array_equal(read_png(serial_file), read_png(parallel_file))
+
+    def test_ExportOrbit(self):
+        exporter = cilOffscreenExporter(vtk_image=self.image, resolution=(40, 40), processes=1)
+        file_names = exporter.ExportOrbit(os.path.join(self.tmpdir, 'orbit'), number_of_frames=4)
+        self.assertEqual(len(file_names), 4)
+        self.assertTrue(all(os.path.exists(f) for f in file_names))
+
+    def test_ExportMontage(self):
+        exporter = cilOffscreenExporter(vtk_image=self.image, resolution=(32, 24), processes=1)
+        file_name = os.path.join(self.tmpdir, 'montage.png')
+        montage = exporter.ExportMontage(file_name, orientation=SLICE_ORIENTATION_XY, slices=[0, 1, 2, 3, 4], columns=3)
+        self.assertEqual(montage.shape[:2], (48, 96))
+        np.testing.assert_array_equal(read_png(file_name), montage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,14 @@
 import os
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 
 import h5py
 import numpy as np
 import vtk
 from ccpi.viewer.utils.conversion import Converter, calculate_target_downsample_shape, cilHDF5CroppedReader, cilHDF5ResampleReader
-from ccpi.viewer.utils.hdf5_io import (HDF5Reader, HDF5SubsetReader, write_image_data_to_hdf5)
+from ccpi.viewer.utils.hdf5_io import (HDF5FileBrowser, HDF5Reader, HDF5SubsetReader, write_image_data_to_hdf5)
 
 
 class TestHDF5IO(unittest.TestCase):
@@ -186,5 +189,59 @@ class TestHDF5IO(unittest.TestCase):
             os.remove(f)
 
 
+class TestHDF5FileBrowser(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmpdir, "scan.nxs")
+        with h5py.File(self.file_name, 'w') as f:
+            for i in range(25):
+                f.create_dataset('entry1/scan/point_{:02d}'.format(i), data=np.zeros(3))
+            data = f.create_dataset('entry1/tomo_entry/data/data', data=np.zeros((2, 3, 4), dtype=np.float32))
+            for i in range(5):
+                data.attrs['attribute_{}'.format(i)] = i
+            data.attrs['long_attribute'] = 'x' * 1000
+            f['entry1/missing'] = h5py.SoftLink('/entry1/nowhere')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_ListChildren(self):
+        browser = HDF5FileBrowser(self.file_name)
+        total, children = browser.ListChildren('/')
+        self.assertEqual((total, children), (1, [('entry1', '/entry1', 'group', mock.ANY, 3)]))
+        total, children = browser.ListChildren('/entry1/scan', start=20, count=10)
+        self.assertEqual(total, 25)
+        self.assertEqual([child[0] for child in children], ['point_{:02d}'.format(i) for i in range(20, 25)])
+        self.assertEqual(children[0][1:3], ('/entry1/scan/point_20', 'dataset'))
+        self.assertEqual(dict((child[0], child[2]) for child in browser.ListChildren('/entry1')[1])['missing'], 'link')
+
+    def test_ListChildren_of_dataset_lists_attributes(self):
+        browser = HDF5FileBrowser(self.file_name)
+        total, children = browser.ListChildren('/entry1/tomo_entry/data/data')
+        self.assertEqual(total, 6)
+        self.assertEqual(children[0][2:4], ('attribute', '0'))
+        long_description = dict((child[0], child[3]) for child in children)['long_attribute']
+        self.assertEqual(len(long_description), 203)
+
+    def test_listings_are_cached_until_the_file_is_modified(self):
+        HDF5FileBrowser(self.file_name).ListChildren('/entry1/scan')
+        with mock.patch.object(HDF5FileBrowser, '_describeChild') as describe:
+            HDF5FileBrowser(self.file_name).ListChildren('/entry1/scan')
+            describe.assert_not_called()
+        with h5py.File(self.file_name, 'a') as f:
+            f.create_dataset('entry1/scan/point_25', data=np.zeros(3))
+        self.assertEqual(HDF5FileBrowser(self.file_name).ListChildren('/entry1/scan', count=1)[0], 26)
+
+    def test_Search(self):
+        browser = HDF5FileBrowser(self.file_name)
+        total, matches = browser.Search('Tomo')
+        self.assertEqual(total, 1)
+        self.assertEqual(matches[0][:3], ('/entry1/tomo_entry/data/data', '/entry1/tomo_entry/data/data', 'dataset'))
+        total, matches = browser.Search('*/point_1?', start=5, count=3)
+        self.assertEqual(total, 10)
+        self.assertEqual([match[0] for match in matches], ['/entry1/scan/point_{}'.format(i) for i in (15, 16, 17)])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -293,6 +293,54 @@ class TestImageReaderAndWriter(unittest.TestCase):
             else:
                 self.assertEqual(value, read_original_image_attrs[key])
 
+    def test_memory_map_hdf5(self):
+        reader = ImageReader(file_name=self.hdf5_filename_3D,
+                             target_size=100,
+                             resample_z=True,
+                             hdf5_dataset_name="ImageData")
+        resampled_image = reader.Read()
+        file_to_write = 'memory_mapped_image.hdf5'
+        writer = cilviewerHDF5Writer()
+        writer.SetFileName(file_to_write)
+        writer.SetOriginalDataset(None, reader.GetOriginalImageAttrs())
+        writer.AddChildDataset(resampled_image, reader.GetLoadedImageAttrs())
+        writer.SetChunking(False)
+        writer.Write()
+
+        reader = cilviewerHDF5Reader()
+        reader.SetFileName(file_to_write)
+        mapped_image = reader.GetMemoryMappedOutput()
+
+        np.testing.assert_array_equal(Converter.vtk2numpy(mapped_image), Converter.vtk2numpy(resampled_image))
+        self.assertEqual(mapped_image.GetSpacing(), resampled_image.GetSpacing())
+        self.assertEqual(mapped_image.GetOrigin(), resampled_image.GetOrigin())
+        del mapped_image
+        os.remove(file_to_write)
+
+    def test_memory_map_chunked_hdf5(self):
+        file_to_write = 'chunked_image.hdf5'
+        writer = cilviewerHDF5Writer()
+        writer.SetFileName(file_to_write)
+        writer.SetOriginalDataset(None, {
+            'file_name': 'image.npy',
+            'shape': [5, 10, 6],
+            'resampled': False,
+            'cropped': False
+        })
+        writer.AddChildDataset(Converter.numpy2vtkImage(self.input_3D_array), {
+            'resampled': False,
+            'cropped': False,
+            'spacing': [1, 1, 1],
+            'origin': [0, 0, 0]
+        })
+        writer.Write()
+
+        reader = cilviewerHDF5Reader()
+        reader.SetFileName(file_to_write)
+        with self.assertRaises(ValueError):
+            reader.GetMemoryMappedOutput()
+        os.remove(file_to_write)
+
     def tearDown(self):
         files = [self.hdf5_filename_3D, self.numpy_filename_3D, self.mha_filename_3D, self.raw_filename_3D
                  ] + self.tiff_fnames
@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+import vtk
+
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.isosurface import cilIsoSurfaceExtractor
+
+
+class TestIsoSurfaceExtractor(unittest.TestCase):
+
+    def setUp(self):
+        # a sphere of radius 12 in a 40^3 image
+        x = np.arange(40) - 19.5
+        xx, yy, zz = np.meshgrid(x, x, x, indexing='ij')
+        data = np.sqrt(xx**2 + yy**2 + zz**2).astype(np.float32)
+        self.image = Converter.numpy2vtkImage(data)
+        self.extractor = cilIsoSurfaceExtractor()
+        self.extractor.SetInputData(self.image)
+
+    def test_GetOutput_extracts_surface(self):
+        mesh = self.extractor.GetOutput(12)
+        self.assertIsInstance(mesh, vtk.vtkPolyData)
+        self.assertGreater(mesh.GetNumberOfCells(), 0)
+        bounds = mesh.GetBounds()
+        self.assertAlmostEqual(bounds[1] - bounds[0], 24, delta=1)
+
+    def test_GetOutput_without_input_raises(self):
+        with self.assertRaises(ValueError):
+            cilIsoSurfaceExtractor().GetOutput(12)
+
+    def test_meshes_are_cached(self):
+        mesh = self.extractor.GetOutput(12)
+        self.assertTrue(self.extractor.IsCached(12))
+        self.assertIs(mesh, self.extractor.GetOutput(12))
+        self.assertIsNot(mesh, self.extractor.GetOutput(10))
+
+    def test_cache_is_invalidated_when_input_is_modified(self):
+        mesh = self.extractor.GetOutput(12)
+        self.image.Modified()
+        self.assertFalse(self.extractor.IsCached(12))
+        self.assertIsNot(mesh, self.extractor.GetOutput(12))
+
+    def test_cache_is_bounded(self):
+        self.extractor.SetCacheSize(2)
+        for isovalue in (8, 10, 12):
+            self.extractor.GetOutput(isovalue)
+        self.assertFalse(self.extractor.IsCached(8))
+        self.assertTrue(self.extractor.IsCached(10))
+        self.assertTrue(self.extractor.IsCached(12))
+
+    def test_coarse_level_has_fewer_cells(self):
+        self.extractor.SetCoarseTargetSize(10**3 * 4)
+        coarse = self.extractor.GetOutput(12, coarse=True)
+        fine = self.extractor.GetOutput(12)
+        self.assertGreater(coarse.GetNumberOfCells(), 0)
+        self.assertLess(coarse.GetNumberOfCells(), fine.GetNumberOfCells())
+
+    def test_decimation_and_smoothing(self):
+        fine = self.extractor.GetOutput(12)
+        self.extractor.SetTargetReduction(0.5)
+        self.extractor.SetSmoothingIterations(10)
+        reduced = self.extractor.GetOutput(12)
+        self.assertLess(reduced.GetNumberOfCells(), fine.GetNumberOfCells())
+        with self.assertRaises(ValueError):
+            self.extractor.SetTargetReduction(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
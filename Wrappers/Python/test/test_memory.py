@@ -0,0 +1,142 @@
+import gc
+import unittest
+import weakref
+from functools import partial
+from unittest import mock
+
+import numpy as np
+
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.memory import cilMemoryManager, format_size, get_data_size
+
+
+class Owner(object):
+
+    def __init__(self):
+        self.released = []
+
+    def release(self, name=None):
+        self.released.append(name)
+
+
+class TestMemoryManager(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = cilMemoryManager(budget=1000)
+        self.owner = Owner()
+
+    def test_get_data_size(self):
+        self.assertEqual(get_data_size(None), 0)
+        self.assertEqual(get_data_size(100), 100)
+        self.assertEqual(get_data_size(np.zeros((10, 10), dtype=np.float32)), 400)
+        image = Converter.numpy2vtkImage(np.zeros((64, 64, 64), dtype=np.uint8))
+        self.assertGreaterEqual(get_data_size(image), 64**3)
+
+    def test_format_size(self):
+        self.assertEqual(format_size(100), '100 B')
+        self.assertEqual(format_size(1536), '1.5 KB')
+        self.assertEqual(format_size(3 * 1024**3), '3.0 GB')
+
+    def test_Register(self):
+        other = Owner()
+        self.assertTrue(self.manager.Register(self.owner, 'image', 300))
+        self.manager.Register(self.owner, 'cache', 100, evict=mock.Mock())
+        self.manager.Register(other, 'image', 200)
+        self.assertEqual(self.manager.GetUsage(), 600)
+        self.assertEqual(self.manager.GetAvailable(), 400)
+        self.assertEqual([(buffer['name'], buffer['size'], buffer['evictable'])
+                          for buffer in self.manager.GetBuffers(self.owner)], [('image', 300, False),
+                                                                               ('cache', 100, True)])
+        self.assertEqual(sorted(self.manager.GetUsageByOwner().values()), [200, 400])
+        self.assertEqual(self.manager.GetUsageDescription(), '600 B of 1000 B')
+        # registering a buffer again updates its size
+        self.manager.Register(self.owner, 'image', 500)
+        self.assertEqual(self.manager.GetUsage(), 800)
+        self.manager.Unregister(self.owner, 'cache')
+        self.assertFalse(self.manager.IsRegistered(self.owner, 'cache'))
+        self.manager.Unregister(self.owner)
+        self.assertEqual(self.manager.GetUsage(), 200)
+
+    def test_buffers_are_unregistered_with_their_owner(self):
+        self.manager.Register(self.owner, 'image', 300)
+        del self.owner
+        gc.collect()
+        self.assertEqual(self.manager.GetBuffers(), [])
+
+    def test_caches_do_not_keep_their_owner_alive(self):
+        self.manager.Register(self.owner, 'cache', 300, evict=self.owner.release)
+        self.manager.Register(self.owner, 'level', 300, evict=partial(self.owner.release, 'level'))
+        self.manager.SetBudget(400)
+        self.assertEqual(self.owner.released, [None])
+        self.manager.SetBudget(0)
+        self.assertEqual(self.owner.released, [None, 'level'])
+        self.manager.Register(self.owner, 'cache', 300, evict=self.owner.release)
+        owner = weakref.ref(self.owner)
+        del self.owner
+        gc.collect()
+        self.assertIsNone(owner())
+        self.assertEqual(self.manager.GetBuffers(), [])
+
+    def test_pinned_caches_are_not_evicted(self):
+        evict = mock.Mock()
+        user = Owner()
+        self.manager.Register(self.owner, 'cache', 600, evict=evict)
+        self.manager.Pin(self.owner, 'cache', user)
+        # registering the buffer again keeps it pinned
+        self.manager.Register(self.owner, 'cache', 600, evict=evict)
+        self.assertTrue(self.manager.IsPinned(self.owner, 'cache'))
+        self.assertFalse(self.manager.GetBuffers()[0]['evictable'])
+        self.assertFalse(self.manager.Register(self.owner, 'image', 500))
+        evict.assert_not_called()
+        self.manager.Unpin(self.owner, 'cache', user)
+        self.assertTrue(self.manager.Enforce())
+        evict.assert_called_once()
+        # a cache is unpinned when its user is garbage collected
+        self.manager.Register(self.owner, 'cache', 300, evict=evict)
+        self.manager.Pin(self.owner, 'cache', user)
+        del user
+        gc.collect()
+        self.assertFalse(self.manager.IsPinned(self.owner, 'cache'))
+        with self.assertRaises(KeyError):
+            self.manager.Pin(self.owner, 'other', Owner())
+
+    def test_least_recently_used_caches_are_evicted(self):
+        evict_first, evict_second = mock.Mock(), mock.Mock()
+        self.manager.Register(self.owner, 'image', 500)
+        self.manager.Register(self.owner, 'first', 200, evict=evict_first)
+        self.manager.Register(self.owner, 'second', 200, evict=evict_second)
+        self.manager.Touch(self.owner, 'first')
+        self.assertTrue(self.manager.Register(self.owner, 'third', 150, evict=mock.Mock()))
+        evict_first.assert_not_called()
+        evict_second.assert_called_once()
+        self.assertFalse(self.manager.IsRegistered(self.owner, 'second'))
+        # the buffers which cannot be evicted are kept, even over the budget
+        self.assertFalse(self.manager.Register(self.owner, 'image', 1200))
+        evict_first.assert_called_once()
+        self.assertEqual([buffer['name'] for buffer in self.manager.GetBuffers()], ['image'])
+
+    def test_SetBudget_evicts_caches(self):
+        evict = mock.Mock()
+        self.manager.Register(self.owner, 'cache', 600, evict=evict)
+        self.manager.SetBudget(None)
+        self.assertEqual(self.manager.GetAvailable(), None)
+        evict.assert_not_called()
+        self.manager.SetBudget(500)
+        evict.assert_called_once()
+        self.assertEqual(self.manager.GetUsage(), 0)
+
+    def test_Reserve(self):
+        self.manager.Register(self.owner, 'image', 600)
+        self.manager.Register(self.owner, 'cache', 200, evict=mock.Mock())
+        self.assertEqual(self.manager.Reserve(100), 100)
+        # the cache is evicted to make room
+        self.assertEqual(self.manager.Reserve(300), 300)
+        self.assertFalse(self.manager.IsRegistered(self.owner, 'cache'))
+        self.assertEqual(self.manager.Reserve(1000), 400)
+        self.assertEqual(self.manager.Reserve(1000, minimum_size=500), 500)
+        self.assertEqual(self.manager.Reserve(1000, replaced=[(self.owner, 'image')]), 1000)
+        self.assertEqual(cilMemoryManager().Reserve(10**12), 10**12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import vtk
+
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.dataset_context import cilDatasetContext
+from ccpi.viewer.utils.occupancy import cilVolumeOccupancyGrid, get_opacity_support
+
+
+def make_opacity(nodes):
+    opacity = vtk.vtkPiecewiseFunction()
+    for x, y in nodes:
+        opacity.AddPoint(x, y)
+    return opacity
+
+
+class TestOccupancyGrid(unittest.TestCase):
+
+    def setUp(self):
+        # numpy2vtkImage maps the array axes to z, y, x
+        data = np.zeros((64, 48, 32), dtype=np.uint8)
+        data[20:30, 10:15, 5:8] = 200
+        self.image = Converter.numpy2vtkImage(data)
+        self.grid = cilVolumeOccupancyGrid()
+        self.grid.SetInputData(self.image)
+        self.grid.SetBlockSize(8)
+
+    def test_get_opacity_support(self):
+        self.assertEqual(get_opacity_support(make_opacity([(0, 0), (10, 0), (20, 0.5), (30, 1)])), (10, np.inf))
+        self.assertEqual(get_opacity_support(make_opacity([(0, 0), (10, 1), (20, 0)])), (0, 20))
+        self.assertEqual(get_opacity_support(make_opacity([(0, 0), (10, 0)])), (None, None))
+
+    def test_GetBlockRange(self):
+        bmin, bmax = self.grid.GetBlockRange()
+        # blocks ordered z, y, x
+        self.assertEqual(bmin.shape, (8, 6, 4))
+        self.assertEqual(bmax.max(), 200)
+        self.assertEqual(np.count_nonzero(bmax), 2)
+
+    def test_GetCroppingExtent_contains_visible_region(self):
+        opacity = make_opacity([(0, 0), (100, 0), (200, 1)])
+        extent = self.grid.GetCroppingExtent(opacity)
+        # visible voxels are x 5-7, y 10-14, z 20-29, plus one block around them
+        self.assertEqual(extent, (0, 15, 0, 23, 8, 39))
+
+    def test_GetCroppingExtent_returns_None_when_nothing_is_visible(self):
+        opacity = make_opacity([(0, 0), (250, 0), (255, 1)])
+        self.assertIsNone(self.grid.GetCroppingExtent(opacity))
+
+    def test_GetCroppingBounds_uses_origin_and_spacing(self):
+        self.image.SetOrigin(1, 2, 3)
+        self.image.SetSpacing(2, 2, 2)
+        opacity = make_opacity([(0, 0), (100, 0), (200, 1)])
+        bounds = self.grid.GetCroppingBounds(opacity)
+        self.assertEqual(bounds, (1, 31, 2, 48, 19, 81))
+
+    def test_block_range_is_recomputed_when_image_is_modified(self):
+        bmin, bmax = self.grid.GetBlockRange()
+        self.assertIs(bmax, self.grid.GetBlockRange()[1])
+        self.image.Modified()
+        self.assertIsNot(bmax, self.grid.GetBlockRange()[1])
+
+    def test_gradient_method(self):
+        self.grid.SetMethod('gradient')
+        bmin, bmax = self.grid.GetBlockRange()
+        self.assertGreater(bmax.max(), 0)
+        with self.assertRaises(ValueError):
+            self.grid.SetMethod('other')
+
+    def test_gradient_method_uses_the_gradient_of_the_dataset_context(self):
+        context = cilDatasetContext.GetContext(self.image)
+        self.grid.SetDatasetContext(context)
+        self.grid.SetMethod('gradient')
+        gradient = context.GetGradientMagnitude()
+        with mock.patch.object(vtk, 'vtkImageGradientMagnitude') as gradient_filter:
+            bmin, bmax = self.grid.GetBlockRange()
+            gradient_filter.assert_not_called()
+        self.assertEqual(bmax.max(), gradient.GetScalarRange()[1])
+        self.assertIs(context.GetGradientMagnitude(), gradient)
+        context.Release()
+        # a released context is ignored
+        self.image.Modified()
+        self.assertEqual(self.grid.GetBlockRange()[1].max(), bmax.max())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from vtk.util import numpy_support
+
+from ccpi.viewer.utils.raw_preview import cilRawPreview
+
+
+def smooth_volume(shape, seed=1):
+    '''Random volume, smoothed so that neighbouring values are correlated as in an image'''
+    rng = np.random.RandomState(seed)
+    frequencies = np.meshgrid(*[np.fft.fftfreq(n)**2 for n in shape], indexing='ij')
+    volume = np.real(np.fft.ifftn(np.fft.fftn(rng.normal(size=shape)) * np.exp(-200 * sum(frequencies))))
+    return (volume - volume.min()) / (volume.max() - volume.min())
+
+
+class TestRawPreview(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # 6 images of 12 rows and 10 columns
+        self.data = (smooth_volume((6, 12, 10)) * 60000).astype('>u2')
+        self.file_name = os.path.join(self.tmpdir, 'volume.raw')
+        self.data.tofile(self.file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_preview(self, shape=(10, 12, 6), typecode='uint16', is_big_endian=True, is_fortran=True):
+        preview = cilRawPreview(self.file_name)
+        preview.SetStoredArrayShape(shape)
+        preview.SetTypeCodeName(typecode)
+        preview.SetBigEndian(is_big_endian)
+        preview.SetIsFortran(is_fortran)
+        return preview
+
+    def test_GetSlice(self):
+        preview = self.make_preview()
+        self.assertEqual(preview.GetNumberOfSlices(), 6)
+        np.testing.assert_array_equal(preview.GetSlice(4), self.data[4])
+        self.assertTrue(preview.GetSlice(4).dtype.isnative)
+        # the same file as an array ordered Images-Height-Width, sliced along its first dimension
+        preview = self.make_preview(shape=(6, 12, 10), is_fortran=False)
+        np.testing.assert_array_equal(preview.GetSlice(2), self.data[2])
+        # a 2D image
+        preview = self.make_preview(shape=(10, 12))
+        np.testing.assert_array_equal(preview.GetSlice(), self.data[0])
+
+    def test_GetSlice_with_new_parameters(self):
+        preview = self.make_preview()
+        preview.GetSlice(0)
+        preview.SetBigEndian(False)
+        np.testing.assert_array_equal(preview.GetSlice(1), self.data[1].byteswap())
+        preview.SetStoredArrayShape((20, 6, 6))
+        np.testing.assert_array_equal(preview.GetSlice(1), self.data[1].byteswap().reshape(6, 20))
+
+    def test_GetSliceImage(self):
+        image = self.make_preview().GetSliceImage(3)
+        self.assertEqual(image.GetDimensions(), (10, 12, 1))
+        np.testing.assert_array_equal(
+            numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(12, 10), self.data[3])
+
+    def test_GetSlice_raises_for_parameters_not_describing_the_file(self):
+        with self.assertRaises(ValueError):
+            self.make_preview(shape=(10, 12, 7)).GetSlice(0)
+        with self.assertRaises(IndexError):
+            self.make_preview().GetSlice(6)
+
+    def test_InferParameters(self):
+        candidates = self.make_preview().InferParameters(min_dimension=4)
+        self.assertEqual(
+            candidates[0], {
+                'shape': [10, 12, 6],
+                'typecode': 'uint16',
+                'is_big_endian': True,
+                'is_fortran': True,
+                'score': candidates[0]['score']
+            })
+        self.assertEqual([candidate['score'] for candidate in candidates],
+                         sorted([candidate['score'] for candidate in candidates], reverse=True))
+
+    def test_InferParameters_of_a_larger_file(self):
+        data = (smooth_volume((20, 64, 48)) * 1000 - 500).astype('<f4')
+        data.tofile(self.file_name)
+        best = cilRawPreview(self.file_name).InferParameters()[0]
+        self.assertEqual((best['shape'], best['typecode'], best['is_big_endian']), ([48, 64, 20], 'float32', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.reslice import cilResampleToReference, same_sampling
+
+
+def get_scalars(image):
+    return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+
+
+class TestResampleToReference(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        # the reference is a crop of the full resolution image, ordered z, y, x
+        self.full = np.random.randint(0, 1000, size=(24, 32, 40)).astype(np.uint16)
+        self.reference = Converter.numpy2vtkImage(self.full[4:20, 8:24, 10:30], origin=(10, 8, 4))
+        # the image is the whole volume downsampled by 2
+        self.downsampled = np.ascontiguousarray(self.full[::2, ::2, ::2])
+        self.image = Converter.numpy2vtkImage(self.downsampled, spacing=(2, 2, 2))
+        self.resample = cilResampleToReference()
+        self.resample.SetInputDataObject(0, self.image)
+        self.resample.SetInputDataObject(1, self.reference)
+        self.voi = vtk.vtkExtractVOI()
+        self.voi.SetInputConnection(self.resample.GetOutputPort())
+
+    def extract(self, orientation, sliceno):
+        extent = list(self.reference.GetExtent())
+        extent[orientation * 2] = sliceno
+        extent[orientation * 2 + 1] = sliceno
+        self.voi.SetVOI(*extent)
+        self.voi.Update()
+        return self.voi.GetOutput()
+
+    def expected(self, orientation, sliceno):
+        # world coordinates of the slice, x, y, z
+        coords = [np.arange(10, 30), np.arange(8, 24), np.arange(4, 20)]
+        coords[orientation] = coords[orientation][[sliceno]]
+        # nearest voxel of the downsampled image, rounding half up like vtkImageReslice
+        index = [np.minimum(np.floor(c / 2 + 0.5).astype(int), n - 1) for c, n in zip(coords, (20, 16, 12))]
+        return self.downsampled[np.ix_(index[2], index[1], index[0])].ravel()
+
+    def test_slice_is_resampled_on_reference_grid(self):
+        for orientation in range(3):
+            extent = self.reference.GetExtent()
+            for sliceno in range(extent[orientation * 2], extent[orientation * 2 + 1] + 1, 3):
+                output = self.extract(orientation, sliceno)
+                self.assertEqual(output.GetSpacing(), (1, 1, 1))
+                np.testing.assert_array_equal(get_scalars(output), self.expected(orientation, sliceno))
+
+    def test_only_visible_slice_is_resampled_and_cached(self):
+        self.extract(2, 10)
+        self.assertEqual(list(self.resample._cache.keys()), [(0, 19, 0, 15, 10, 10)])
+        # the image is only requested around the slice, at z = 14
+        extent = self.image.GetExtent()
+        self.assertEqual(
+            self.resample.GetImageExtent((0, 19, 0, 15, 10, 10), (1, 1, 1), (10, 8, 4), extent, (2, 2, 2), (0, 0, 0)),
+            [4, 16, 3, 13, 6, 8])
+        cached = self.resample._cache[(0, 19, 0, 15, 10, 10)]
+        self.extract(2, 11)
+        self.extract(2, 10)
+        self.assertIs(self.resample._cache[(0, 19, 0, 15, 10, 10)], cached)
+
+    def test_cache_is_cleared_when_input_is_modified(self):
+        self.extract(2, 10)
+        self.downsampled[7] = 7
+        self.image.GetPointData().GetScalars().Modified()
+        self.image.Modified()
+        np.testing.assert_array_equal(get_scalars(self.extract(2, 10)), 7)
+        self.reference.SetOrigin(10, 8, 40)
+        self.reference.Modified()
+        # outside of the image
+        np.testing.assert_array_equal(get_scalars(self.extract(2, 10)), 0)
+
+    def test_same_sampling(self):
+        self.assertFalse(same_sampling(self.image, self.reference))
+        self.assertTrue(same_sampling(self.image, Converter.numpy2vtkImage(self.downsampled, spacing=(2, 2, 2))))
+
+
+class TestCILViewer2DResampling(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.full = np.random.randint(0, 1000, size=(20, 30, 40)).astype(np.uint16)
+        self.viewer = CILViewer2D()
+        self.viewer.getRenderWindow().SetOffScreenRendering(1)
+        self.viewer.setInputData(Converter.numpy2vtkImage(self.full))
+        self.viewer.setInputData2(Converter.numpy2vtkImage(self.full[::2, ::2, ::2], spacing=(2, 2, 2)))
+
+    def test_overlay_is_resampled(self):
+        self.assertEqual(self.viewer.voi2.GetOutput().GetExtent(), self.viewer.voi.GetOutput().GetExtent())
+        sliceno = self.viewer.getActiveSlice()
+        overlay = get_scalars(self.viewer.voi2.GetOutput()).reshape(30, 40)
+        index = np.minimum(np.floor(np.arange(40) / 2 + 0.5).astype(int), 19)
+        np.testing.assert_array_equal(overlay[0], self.full[::2, ::2, ::2][(sliceno + 1) // 2, 0, index])
+
+    def test_wipe_inputs_have_the_same_extent(self):
+        self.viewer.setVisualisationToRectilinearWipe()
+        self.viewer.setSliceOrientation('x')
+        self.viewer.style.SetActiveSlice(3)
+        self.viewer.style.UpdatePipeline()
+        self.assertEqual(self.viewer.wipe.GetOutput().GetExtent(), (3, 3, 0, 29, 0, 19))
+        self.assertEqual(self.viewer.voi2.GetOutput().GetExtent(), self.viewer.voi.GetOutput().GetExtent())
+
+
+if __name__ == '__main__':
+    unittest.main()
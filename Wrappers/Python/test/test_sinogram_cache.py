@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import h5py
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from ccpi.viewer import SLICE_ORIENTATION_XY
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.io import ImageReader
+from ccpi.viewer.utils.sinogram_cache import cilAcquisitionDataReader, cilSinogramCache
+
+
+class TestSinogramCache(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.tmpdir = tempfile.mkdtemp()
+        # 18 projections of 12 rows and 10 columns
+        self.data = np.random.randint(0, 1000, size=(18, 12, 10)).astype(np.uint16)
+        self.hdf5_file = os.path.join(self.tmpdir, 'projections.h5')
+        with h5py.File(self.hdf5_file, 'w') as f:
+            f.create_dataset('entry1/tomo_entry/data/data', data=self.data)
+        self.npy_file = os.path.join(self.tmpdir, 'projections.npy')
+        np.save(self.npy_file, self.data)
+        self.cache_file = os.path.join(self.tmpdir, 'cache', 'sinograms.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_cache(self, file_name=None, dataset_name='entry1/tomo_entry/data/data'):
+        # less than 2 rows fit in the memory limit, so the cache is built by blocks of 1 row
+        return cilSinogramCache(self.hdf5_file if file_name is None else file_name,
+                                dataset_name,
+                                cache_file_name=self.cache_file,
+                                memory_limit=18 * 10 * 2 + 1)
+
+    def test_cache_is_transposed(self):
+        for file_name in [self.hdf5_file, self.npy_file]:
+            cache = self.make_cache(file_name)
+            self.assertFalse(cache.IsReady())
+            progress = []
+            cache.Build(progress_callback=progress.append)
+            self.assertTrue(cache.IsReady())
+            self.assertEqual(len(progress), 12)
+            self.assertEqual(progress[-1], 1)
+            np.testing.assert_array_equal(cache.GetSinograms(slice(None)), self.data.transpose(1, 0, 2))
+            with h5py.File(self.cache_file, 'r') as f:
+                self.assertEqual(f['sinograms'].chunks, (1, 18, 10))
+            os.remove(self.cache_file)
+
+    def test_cache_is_reused_until_source_is_modified(self):
+        self.make_cache().Build()
+        mtime = os.stat(self.cache_file).st_mtime_ns
+        cache = self.make_cache()
+        self.assertTrue(cache.IsReady())
+        cache.Build()
+        self.assertEqual(os.stat(self.cache_file).st_mtime_ns, mtime)
+
+        with h5py.File(self.hdf5_file, 'a') as f:
+            f['entry1/tomo_entry/data/data'][0] = 0
+        cache.Refresh()
+        self.assertFalse(cache.IsReady())
+
+    def test_IsReady_checks_the_files_once(self):
+        cache = self.make_cache()
+        with mock.patch('ccpi.viewer.utils.sinogram_cache.os.stat', wraps=os.stat) as stat:
+            self.assertFalse(cache.IsReady())
+            cache.Build()
+            stat.reset_mock()
+            for _ in range(3):
+                self.assertTrue(cache.IsReady())
+            stat.assert_not_called()
+            cache.Refresh()
+            self.assertTrue(cache.IsReady())
+            self.assertTrue(stat.called)
+
+    def test_build_in_background(self):
+        cache = self.make_cache()
+        cache.BuildInBackground()
+        self.assertTrue(cache.Wait(timeout=30))
+        self.assertIsNone(cache.GetError())
+        self.assertFalse(os.path.exists(self.cache_file + '.part'))
+
+    def test_reader_reads_sinograms_from_cache(self):
+        cache = self.make_cache()
+        reader = cilAcquisitionDataReader()
+        reader.SetSinogramCache(cache)
+        voi = vtk.vtkExtractVOI()
+        voi.SetInputConnection(reader.GetOutputPort())
+
+        def read(extent):
+            voi.SetVOI(*extent)
+            voi.Update()
+            return numpy_support.vtk_to_numpy(voi.GetOutput().GetPointData().GetScalars())
+
+        # before the cache is built the sinogram is read from the file
+        np.testing.assert_array_equal(read((0, 9, 4, 4, 0, 17)), self.data[:, 4, :].ravel())
+        self.assertFalse(reader.GetLastReadFromCache())
+        cache.Build()
+        reader.Modified()
+        np.testing.assert_array_equal(read((0, 9, 5, 5, 0, 17)), self.data[:, 5, :].ravel())
+        self.assertTrue(reader.GetLastReadFromCache())
+        # projections are read from the file
+        np.testing.assert_array_equal(read((0, 9, 0, 11, 3, 3)), self.data[3].ravel())
+        self.assertFalse(reader.GetLastReadFromCache())
+
+    def test_ImageReader_builds_cache_for_acquisition_data(self):
+        reader = ImageReader(self.hdf5_file, resample=False, resample_z=False, build_sinogram_cache=True)
+        reader.SetBuildSinogramCache(True, cache_file_name=self.cache_file)
+        image = reader.Read()
+        cache = reader.GetSinogramCache()
+        self.assertTrue(cache.Wait(timeout=30))
+
+        viewer = CILViewer2D()
+        viewer.getRenderWindow().SetOffScreenRendering(1)
+        viewer.setInputData(image)
+        viewer.setSinogramCache(cache)
+        self.assertFalse(viewer.isSinogramCacheInUse())
+        viewer.setSliceOrientation('y')
+        viewer.style.SetActiveSlice(7)
+        viewer.style.UpdatePipeline()
+        self.assertTrue(viewer.isSinogramCacheInUse())
+        self.assertTrue(viewer.sinogramReader.GetLastReadFromCache())
+        displayed = numpy_support.vtk_to_numpy(viewer.voi.GetOutput().GetPointData().GetScalars())
+        np.testing.assert_array_equal(displayed, self.data[:, 7, :].ravel())
+        viewer.setSliceOrientation('z')
+        self.assertEqual(viewer.getSliceOrientation(), SLICE_ORIENTATION_XY)
+        self.assertFalse(viewer.isSinogramCacheInUse())
+
+    def test_ImageReader_does_not_build_cache_for_volumes(self):
+        reader = ImageReader(self.hdf5_file, resample=False, resample_z=True, build_sinogram_cache=True)
+        reader.Read()
+        self.assertIsNone(reader.GetSinogramCache())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.slab import cilSlabProjection
+
+
+class TestSlabProjection(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        # ordered z, y, x
+        self.data = np.random.randint(0, 1000, size=(20, 30, 40)).astype(np.uint16)
+        self.image = Converter.numpy2vtkImage(self.data)
+        self.slab = cilSlabProjection()
+        self.slab.SetInputDataObject(self.image)
+        self.voi = vtk.vtkExtractVOI()
+        self.voi.SetInputConnection(self.slab.GetOutputPort())
+
+    def project(self, orientation, sliceno):
+        extent = list(self.image.GetExtent())
+        extent[orientation * 2] = sliceno
+        extent[orientation * 2 + 1] = sliceno
+        self.voi.SetVOI(*extent)
+        self.voi.Update()
+        return numpy_support.vtk_to_numpy(self.voi.GetOutput().GetPointData().GetScalars())
+
+    def expected(self, projection, orientation, sliceno, thickness):
+        lower = sliceno - (thickness - 1) // 2
+        upper = min(lower + thickness - 1, self.image.GetDimensions()[orientation] - 1)
+        index = [slice(None)] * 3
+        index[2 - orientation] = slice(max(lower, 0), upper + 1)
+        reduce = {'max': np.max, 'min': np.min, 'mean': np.mean}[projection]
+        return reduce(self.data[tuple(index)], axis=2 - orientation).ravel()
+
+    def test_projections_in_all_orientations(self):
+        for projection in ['max', 'min', 'mean']:
+            self.slab.SetProjection(projection)
+            for orientation in range(3):
+                self.slab.SetOrientation(orientation)
+                for thickness in [1, 4, 7]:
+                    self.slab.SetThickness(thickness)
+                    # move the slab forward and back, including over the edges
+                    num_slices = self.image.GetDimensions()[orientation]
+                    for sliceno in list(range(num_slices)) + [5, 4, 3, 12]:
+                        np.testing.assert_allclose(self.project(orientation, sliceno),
+                                                   self.expected(projection, orientation, sliceno, thickness),
+                                                   rtol=1e-5)
+
+    def test_projected_slices_are_cached(self):
+        self.slab.SetThickness(5)
+        self.project(2, 10)
+        self.assertIn(self.slab.GetSlabRange(10, self.image.GetExtent()), self.slab._cache)
+        self.image.Modified()
+        self.data[10, 0, 0] = 1001
+        self.image.GetPointData().GetScalars().SetValue(10 * 30 * 40, 1001)
+        self.assertEqual(self.project(2, 10)[0], 1001)
+
+    def test_projections_keep_the_type_of_the_input(self):
+        for projection, dtype in (('max', np.uint16), ('min', np.uint16), ('mean', np.float32)):
+            self.slab.SetProjection(projection)
+            self.assertEqual(self.project(2, 10).dtype, dtype)
+        self.slab.SetInputDataObject(Converter.numpy2vtkImage(self.data.astype(np.float64)))
+        self.assertEqual(self.project(2, 10).dtype, np.float64)
+
+    def test_SetThickness_rejects_invalid_values(self):
+        with self.assertRaises(ValueError):
+            self.slab.SetThickness(0)
+        with self.assertRaises(ValueError):
+            self.slab.SetProjection('median')
+
+
+class TestCILViewer2DSlabProjection(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.data = np.random.randint(0, 1000, size=(20, 30, 40)).astype(np.uint16)
+        self.viewer = CILViewer2D()
+        self.viewer.getRenderWindow().SetOffScreenRendering(1)
+        self.viewer.setInputData(Converter.numpy2vtkImage(self.data))
+
+    def displayed_slice(self):
+        return numpy_support.vtk_to_numpy(self.viewer.voi.GetOutput().GetPointData().GetScalars())
+
+    def test_setSlabProjection(self):
+        self.viewer.setSlabProjection('max', thickness=3)
+        sliceno = self.viewer.getActiveSlice()
+        np.testing.assert_array_equal(self.displayed_slice(), self.data[sliceno - 1:sliceno + 2].max(axis=0).ravel())
+        self.viewer.setSlabProjection(None)
+        np.testing.assert_array_equal(self.displayed_slice(), self.data[sliceno].ravel())
+
+    def test_slab_follows_slice_and_orientation(self):
+        self.viewer.setSlabProjection('mean', thickness=3)
+        self.viewer.setSliceOrientation('x')
+        self.viewer.style.SetActiveSlice(4)
+        self.viewer.style.UpdatePipeline()
+        np.testing.assert_allclose(self.displayed_slice(), self.data[:, :, 3:6].mean(axis=2).ravel(), rtol=1e-5)
+
+    def test_overlay_is_projected(self):
+        self.viewer.setInputData2(Converter.numpy2vtkImage(self.data))
+        self.viewer.setSlabProjection('min', thickness=3)
+        sliceno = self.viewer.getActiveSlice()
+        overlay = numpy_support.vtk_to_numpy(self.viewer.voi2.GetOutput().GetPointData().GetScalars())
+        np.testing.assert_array_equal(overlay, self.data[sliceno - 1:sliceno + 2].min(axis=0).ravel())
+
+    def test_overlay_slab_covers_the_same_depth(self):
+        # the overlay is sampled twice as finely along z
+        overlay_data = np.repeat(self.data, 2, axis=0)
+        overlay = Converter.numpy2vtkImage(overlay_data, spacing=(1., 1., 0.5))
+        self.viewer.setInputData2(overlay)
+        self.viewer.setSlabProjection('max', thickness=3)
+        self.assertEqual(self.viewer.slab2.GetThickness(), 6)
+        self.viewer.setSlabThickness(5)
+        self.assertEqual(self.viewer.slab2.GetThickness(), 10)
+        self.viewer.setSliceOrientation('x')
+        self.viewer.style.UpdatePipeline()
+        self.assertEqual(self.viewer.slab2.GetThickness(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
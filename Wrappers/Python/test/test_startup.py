@@ -0,0 +1,68 @@
+import importlib.util
+import json
+import subprocess
+import sys
+import unittest
+
+# console entry points, see setup.py, and their import time budgets in seconds
+ENTRY_POINTS = {
+    'resample': ('ccpi.viewer.cli.resample', 2.),
+    'cilviewer': ('ccpi.viewer.standalone_viewer', 6.),
+    'web_cilviewer': ('ccpi.web_viewer.web_app', 6.),
+}
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}}))
+'''
+
+
+def import_in_new_process(module):
+    '''Imports module in a new interpreter, returns the import time and the names of the modules loaded'''
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module)],
+                            check=True,
+                            capture_output=True,
+                            text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['modules']
+
+
+class TestStartup(unittest.TestCase):
+
+    def check_budget(self, entry_point):
+        module, budget = ENTRY_POINTS[entry_point]
+        seconds, modules = import_in_new_process(module)
+        print("{}: {} imported in {:.2f} s".format(entry_point, module, seconds))
+        self.assertLess(seconds, budget)
+        return modules
+
+    def test_resample(self):
+        modules = self.check_budget('resample')
+        for name in modules:
+            self.assertFalse(name.startswith(('vtkmodules.vtkRendering', 'vtkmodules.vtkInteraction', 'qtpy', 'PySide',
+                                              'PyQt', 'eqt', 'matplotlib')),
+                             msg="{} is loaded by the resample command line tool".format(name))
+        self.assertNotIn('vtk', modules)
+        self.assertNotIn('ccpi.viewer.CILViewer2D', modules)
+
+    def test_cilviewer(self):
+        modules = self.check_budget('cilviewer')
+        self.assertNotIn('matplotlib.pyplot', modules)
+
+    def test_viewer_submodules_are_attributes_of_the_package(self):
+        script = ("import ccpi.viewer\n"
+                  "assert ccpi.viewer.CILViewer2D.CILViewer2D is ccpi.viewer.viewer2D\n"
+                  "assert ccpi.viewer.utils.conversion.Converter is not None\n"
+                  "assert not hasattr(ccpi.viewer, 'NotASubmodule')\n")
+        subprocess.run([sys.executable, '-c', script], check=True)
+
+    @unittest.skipIf(importlib.util.find_spec('trame') is None, 'trame is not installed')
+    def test_web_cilviewer(self):
+        modules = self.check_budget('web_cilviewer')
+        self.assertNotIn('matplotlib.pyplot', modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from vtk.util import numpy_support
+
+from ccpi.viewer.CILViewer import CILViewer
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.timeseries import cilTimeSeriesFrameCache, cilTimeSeriesPlayer
+
+
+def get_scalars(image):
+    return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+
+
+class TimeSeriesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.tmpdir = tempfile.mkdtemp()
+        # 6 frames of 8 x 10 x 12 (z, y, x)
+        self.data = np.random.randint(0, 1000, size=(6, 8, 10, 12)).astype(np.uint16)
+        self.file_name = os.path.join(self.tmpdir, 'series.h5')
+        with h5py.File(self.file_name, 'w') as f:
+            f.create_dataset('ImageData', data=self.data)
+            f.create_dataset('TimeLast', data=np.moveaxis(self.data, 0, -1))
+        self.frame_size = self.data[0].nbytes
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+class TestTimeSeriesFrameCache(TimeSeriesTestCase):
+
+    def test_GetFrame(self):
+        frames = cilTimeSeriesFrameCache(self.file_name, 'ImageData')
+        self.assertEqual(frames.GetNumberOfFrames(), 6)
+        frame = frames.GetFrame(2)
+        self.assertEqual(frame.GetDimensions(), (12, 10, 8))
+        np.testing.assert_array_equal(get_scalars(frame), self.data[2].ravel())
+        self.assertIs(frames.GetFrame(2), frame)
+        with self.assertRaises(IndexError):
+            frames.GetFrame(6)
+
+    def test_time_on_last_axis(self):
+        frames = cilTimeSeriesFrameCache(self.file_name, 'TimeLast', time_index=3)
+        frame = frames.GetFrame(4)
+        self.assertEqual(frame.GetDimensions(), (12, 10, 8))
+        np.testing.assert_array_equal(get_scalars(frame), self.data[4].ravel())
+
+    def test_frames_are_resampled(self):
+        frames = cilTimeSeriesFrameCache(self.file_name, 'ImageData', target_size=self.frame_size // 4)
+        self.assertLess(frames.GetFrame(0).GetNumberOfPoints(), self.data[0].size)
+
+    def test_memory_budget(self):
+        frames = cilTimeSeriesFrameCache(self.file_name, 'ImageData', memory_budget=2 * self.frame_size)
+        frames.Prefetch([0, 1, 2, 3])
+        frames.WaitForPrefetch()
+        self.assertEqual(len(frames.GetCachedFrames()), 2)
+        self.assertLessEqual(frames.GetCacheSize(), 2 * self.frame_size)
+        frames.SetMemoryBudget(self.frame_size)
+        self.assertEqual(len(frames.GetCachedFrames()), 1)
+
+    def test_prefetch(self):
+        frames = cilTimeSeriesFrameCache(self.file_name, 'ImageData')
+        frames.Prefetch([1, 3])
+        frames.WaitForPrefetch()
+        self.assertEqual(sorted(frames.GetCachedFrames()), [1, 3])
+        np.testing.assert_array_equal(get_scalars(frames.GetFrame(3)), self.data[3].ravel())
+        frames.Shutdown()
+
+
+class TestTimeSeriesPlayer(TimeSeriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = CILViewer2D()
+        self.viewer.getRenderWindow().SetOffScreenRendering(1)
+        self.frames = cilTimeSeriesFrameCache(self.file_name, 'ImageData')
+        self.player = cilTimeSeriesPlayer(self.viewer, self.frames, frame_rate=10, prefetch=2)
+
+    def displayed_slice(self):
+        return get_scalars(self.viewer.voi.GetOutput())
+
+    def test_frames_are_swapped_in_place(self):
+        self.player.SetFrame(0)
+        image = self.viewer.img3D
+        sliceno = self.viewer.getActiveSlice()
+        installs = []
+        installPipeline = self.viewer.installPipeline
+        self.viewer.installPipeline = lambda: installs.append(1) or installPipeline()
+
+        self.player.Step()
+        self.assertEqual(self.player.GetCurrentFrame(), 1)
+        self.assertIs(self.viewer.img3D, image)
+        self.assertEqual(installs, [])
+        np.testing.assert_array_equal(self.displayed_slice(), self.data[1, sliceno].ravel())
+        # the cached frames are not modified
+        np.testing.assert_array_equal(get_scalars(self.frames.GetFrame(0)), self.data[0].ravel())
+        # the next frames are prefetched
+        self.frames.WaitForPrefetch()
+        self.assertTrue(self.frames.IsCached(2))
+        self.assertTrue(self.frames.IsCached(3))
+
+    def test_play_and_dropped_frames(self):
+        self.player.Play(use_timer=False)
+        start = self.player._start_time
+        self.frames.WaitForPrefetch()
+        self.assertFalse(self.player.Tick(start + 0.05))
+        self.assertTrue(self.player.Tick(start + 0.15))
+        self.assertEqual(self.player.GetCurrentFrame(), 1)
+        self.frames.Prefetch([2, 3, 4])
+        self.frames.WaitForPrefetch()
+        # frames 2 and 3 are late
+        self.assertTrue(self.player.Tick(start + 0.45))
+        self.assertEqual(self.player.GetCurrentFrame(), 4)
+        self.assertEqual(self.player.GetDroppedFrames(), 2)
+        self.assertEqual(self.player.GetDisplayedFrames(), 2)
+        # loops back to the first frame
+        self.frames.WaitForPrefetch()
+        self.assertTrue(self.player.Tick(start + 0.65))
+        self.assertEqual(self.player.GetCurrentFrame(), 0)
+        self.player.Stop()
+        self.assertFalse(self.player.IsPlaying())
+        self.assertFalse(self.player.Tick(start + 0.75))
+
+    def test_play_without_loop_stops_at_last_frame(self):
+        self.player.SetLoop(False)
+        self.player.SetFrame(4)
+        self.player.Play(use_timer=False)
+        start = self.player._start_time
+        self.frames.WaitForPrefetch()
+        self.assertTrue(self.player.Tick(start + 0.35))
+        self.assertEqual(self.player.GetCurrentFrame(), 5)
+        self.assertFalse(self.player.Tick(start + 0.45))
+        self.assertFalse(self.player.IsPlaying())
+
+    def test_swapInputData_in_3D_viewer(self):
+        viewer = CILViewer()
+        viewer.getRenderWindow().SetOffScreenRendering(1)
+        player = cilTimeSeriesPlayer(viewer, self.frames)
+        player.SetFrame(0)
+        player.SetFrame(5)
+        np.testing.assert_array_equal(get_scalars(viewer.img3D), self.data[5].ravel())
+        with self.assertRaises(ValueError):
+            viewer.swapInputData(self.viewer.voi.GetOutput())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,20 @@
 import unittest
 import os
+import shutil
 import sys
+import tempfile
+
+import h5py
 
 import numpy as np
+from vtk.util import numpy_support
 
 from unittest import mock
 from unittest.mock import patch
 
 from eqt.ui.SessionDialogs import AppSettingsDialog
-from ccpi.viewer.ui.dialogs import ViewerSettingsDialog, HDF5InputDialog, RawInputDialog, SaveableRawInputDialog
+from ccpi.viewer.ui.dialogs import (ViewerSettingsDialog, HDF5InputDialog, HDF5TreeModel, RawInputDialog,
+                                    SaveableRawInputDialog)
 from ccpi.viewer.ui.SettingsDialog import SettingsDialog
 from ccpi.viewer.ui.VolumeRenderSettingsDialog import VolumeRenderSettingsDialog
 from ccpi.viewer.ui.CaptureRenderDialog import CaptureRenderDialog
@@ -21,7 +27,7 @@ from unittest import mock
 from unittest.mock import patch
 from qtpy import QtWidgets
 from qtpy.QtWidgets import QApplication, QLabel, QFrame, QDoubleSpinBox, QCheckBox, QPushButton, QLineEdit, QComboBox, QWidget
-from qtpy.QtCore import QSettings
+from qtpy.QtCore import QModelIndex, QSettings
 from eqt.ui import FormDialog
 from functools import partial
 from .qt_utils import TestCaseQt
@@ -82,8 +88,13 @@ class TestHDF5InputDialog(TestCaseQt):
 
         self.parent = QMainWindow()
         self.fname = "test.h5"
+        # the tests replace methods of the class with mocks
+        self.methods = dict(HDF5InputDialog.__dict__)
 
     def tearDown(self) -> None:
+        for name, method in self.methods.items():
+            if HDF5InputDialog.__dict__.get(name) is not method:
+                setattr(HDF5InputDialog, name, method)
         TestCaseQt.get_QApplication(sys.argv).quit()
 
     def test_init(self):
@@ -169,6 +180,95 @@ class TestHDF5InputDialog(TestCaseQt):
         assert h5id.current_group == 'test'
 
 
+@unittest.skipIf(skip_as_conda_build, "On conda builds do not do any test with interfaces")
+class TestHDF5TreeModel(TestCaseQt):
+
+    def setUp(self):
+        self.app = TestCaseQt.get_QApplication(sys.argv)
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, "scan.nxs")
+        with h5py.File(self.fname, 'w') as f:
+            for i in range(25):
+                f.create_dataset('entry1/scan/point_{:02d}'.format(i), data=np.zeros(3))
+            f.create_dataset('entry1/tomo_entry/data/data', data=np.zeros((2, 3, 4)))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmpdir)
+        TestCaseQt.get_QApplication(sys.argv).quit()
+
+    def createModel(self):
+        model = HDF5TreeModel(self.fname, page_size=10)
+        # runs the workers in this thread
+        model.threadpool = mock.MagicMock()
+        model.threadpool.start.side_effect = lambda worker: worker.run()
+        return model
+
+    def names(self, model, parent=QModelIndex()):
+        return [model.index(row, 0, parent).data() for row in range(model.rowCount(parent))]
+
+    def test_children_are_listed_when_expanded(self):
+        model = self.createModel()
+        model.setRootPath('/entry1')
+        self.assertEqual(self.names(model), ['scan', 'tomo_entry'])
+        scan = model.index(0, 0)
+        self.assertTrue(model.hasChildren(scan))
+        self.assertEqual(model.rowCount(scan), 0)
+        self.assertTrue(model.canFetchMore(scan))
+
+        model.fetchMore(scan)
+        self.assertFalse(model.canFetchMore(scan))
+        names = self.names(model, scan)
+        self.assertEqual(names[:10], ['point_{:02d}'.format(i) for i in range(10)])
+        self.assertEqual(names[10], 'Show 10 more of 15...')
+
+    def test_loadMore(self):
+        model = self.createModel()
+        model.setRootPath('/entry1/scan')
+        for _ in range(2):
+            model.loadMore(model.index(model.rowCount() - 1, 0))
+        self.assertEqual(self.names(model), ['point_{:02d}'.format(i) for i in range(25)])
+
+    def test_setSearchPattern(self):
+        model = self.createModel()
+        model.setSearchPattern('data')
+        self.assertEqual(self.names(model), ['/entry1/tomo_entry/data/data'])
+        self.assertEqual(model.index(0, 0).data(HDF5TreeModel.KindRole), 'dataset')
+
+    def test_results_of_previous_listings_are_ignored(self):
+        model = self.createModel()
+        model.threadpool.start.side_effect = None
+        model.setRootPath('/entry1/scan')
+        worker = model.threadpool.start.call_args[0][0]
+        model.setRootPath('/entry1')
+        worker.run()
+        self.assertEqual(self.names(model), [])
+
+    def test_dialog_double_click_descends(self):
+        parent = QMainWindow()
+        h5id = HDF5InputDialog(parent, self.fname)
+        h5id.tree_model.threadpool = mock.MagicMock()
+        h5id.tree_model.threadpool.start.side_effect = lambda worker: worker.run()
+        h5id.line_edit.setText('/entry1')
+        h5id.descendHDF5AndFillTable()
+        h5id.onTreeItemDoubleClicked(h5id.tree_model.index(1, 1))
+        self.assertEqual(h5id.getCurrentGroup(), '/entry1/tomo_entry')
+        self.assertEqual(self.names(h5id.tree_model), ['data'])
+        self.assertEqual(h5id.getHDF5Attributes()['dataset_name'], '/entry1/tomo_entry')
+
+    def test_dialog_table_compatibility(self):
+        parent = QMainWindow()
+        h5id = HDF5InputDialog(parent, self.fname)
+        h5id.tree_model.threadpool = mock.MagicMock()
+        h5id.tree_model.threadpool.start.side_effect = lambda worker: worker.run()
+        self.assertIs(h5id.tableWidget, h5id.treeView)
+        h5id.current_group = '/entry1'
+        h5id.loadIntoTableWidget([('scan', 'group'), ('tomo_entry', 'group')])
+        self.assertEqual(self.names(h5id.tree_model), ['scan', 'tomo_entry'])
+        h5id.fillLineEditWithDoubleClickedTableItem(h5id.tree_model.item(1, 0))
+        self.assertEqual(h5id.getCurrentGroup(), '/entry1/tomo_entry')
+        self.assertEqual(self.names(h5id.tree_model), ['data'])
+
+
 @unittest.skipIf(skip_as_conda_build, "On conda builds do not do any test with interfaces")
 class TestRawInputDialog(TestCaseQt):
 
@@ -228,6 +328,67 @@ class TestRawInputDialog(TestCaseQt):
             'preview_slice': 0
         }
 
+    def write_raw_file(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        x, y, z = np.meshgrid(np.arange(20), np.arange(16), np.arange(10), indexing='ij')
+        # 10 images of 16 rows and 20 columns
+        data = (np.sin(x / 4.) * np.cos(y / 5.) * 100 + z * 10 + 200).astype('<u2').transpose()
+        file_name = os.path.join(self.tmpdir, 'volume.raw')
+        data.tofile(file_name)
+        return file_name, data
+
+    def set_parameters(self, rdi, shape, typecode, endianness, preview_slice):
+        for dim, value in zip(['Width', 'Height', 'Images'], shape):
+            rdi.getWidget('dim_{}'.format(dim)).setText(str(value))
+        rdi.getWidget('dtype').setCurrentText(typecode)
+        rdi.getWidget('endianness').setCurrentText(endianness)
+        rdi.getWidget('preview_slice').setText(str(preview_slice))
+
+    def preview_array(self, rdi):
+        image = rdi.preview_viewer_widget.viewer.img3D
+        return numpy_support.vtk_to_numpy(image.GetPointData().GetScalars()).reshape(image.GetDimensions()[1::-1])
+
+    @patch("qtpy.QtWidgets.QMessageBox.critical")
+    def test_preview_is_updated_in_place(self, critical):
+        file_name, data = self.write_raw_file()
+        rdi = RawInputDialog(self.parent, file_name)
+        self.set_parameters(rdi, (20, 16, 10), 'uint16', 'Little Endian', 3)
+        rdi.preview()
+
+        viewer_widget = rdi.preview_viewer_widget
+        self.assertTrue(rdi.preview_open)
+        np.testing.assert_array_equal(self.preview_array(rdi), data[3])
+        rdi.getWidget('preview_slice').setText('7')
+        self.assertIs(rdi.preview_viewer_widget, viewer_widget)
+        np.testing.assert_array_equal(self.preview_array(rdi), data[7])
+        self.assertEqual(rdi.preview_dialog.windowTitle(), "Preview: image = 7")
+
+        # parameters which do not describe the file keep the last slice
+        rdi.getWidget('dim_Images').setText('11')
+        self.assertFalse(rdi.updatePreview())
+        self.assertIn('smaller than expected', rdi.preview_status_label.text())
+        np.testing.assert_array_equal(self.preview_array(rdi), data[7])
+        rdi.preview()
+        critical.assert_called_once()
+
+    def test_inferParameters(self):
+        file_name, data = self.write_raw_file()
+        rdi = RawInputDialog(self.parent, file_name)
+        rdi.inferParameters()
+
+        self.assertTrue(rdi.getWidget('candidates').isEnabled())
+        self.assertEqual(rdi.getWidget('candidates').count(), len(rdi.candidates))
+        self.assertEqual(rdi.getRawAttrs(), {
+            'shape': [20, 16, 10],
+            'typecode': 'uint16',
+            'is_big_endian': False,
+            'is_fortran': True,
+            'preview_slice': 5
+        })
+        rdi.applyCandidate(1)
+        self.assertEqual(rdi.getRawAttrs()['shape'][:len(rdi.candidates[1]['shape'])], rdi.candidates[1]['shape'])
+
 
 @unittest.skipIf(skip_as_conda_build, "On conda builds do not do any test with interfaces")
 class TestSaveableRawInputDialog(TestCaseQt):
@@ -0,0 +1,152 @@
+import time
+import unittest
+
+import numpy as np
+
+from ccpi.viewer import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_XZ
+from ccpi.viewer.CILViewer import CILViewer
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.viewerLinker import ViewerLinker, ViewerSyncHub
+
+
+def make_viewer(viewer_class, image):
+    viewer = viewer_class()
+    viewer.getRenderWindow().SetOffScreenRendering(1)
+    viewer.setInputData(image)
+    viewer.getRenderWindow().Render()
+    return viewer
+
+
+class TestViewerSyncHub(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        data = np.random.randint(0, 100, size=(20, 30, 40), dtype=np.uint16)
+        self.image = Converter.numpy2vtkImage(data)
+        self.viewers = [make_viewer(CILViewer2D, self.image) for _ in range(3)]
+        self.hub = ViewerSyncHub(self.viewers)
+        self.hub.enable()
+
+    def tearDown(self):
+        self.hub.disable()
+
+    def change_slice(self, viewer, sliceno):
+        viewer.style.SetActiveSlice(sliceno)
+        viewer.style.UpdatePipeline()
+
+    def test_slice_is_propagated_to_all_viewers(self):
+        self.change_slice(self.viewers[0], 3)
+        for viewer in self.viewers:
+            self.assertEqual(viewer.getActiveSlice(), 3)
+        self.change_slice(self.viewers[2], 7)
+        for viewer in self.viewers:
+            self.assertEqual(viewer.getActiveSlice(), 7)
+
+    def test_window_level_is_propagated(self):
+        self.viewers[1].setSliceColorWindowLevel(40, 20)
+        for viewer in self.viewers:
+            self.assertEqual(viewer.getSliceColorWindow(), 40)
+            self.assertEqual(viewer.getSliceColorLevel(), 20)
+
+    def test_orientation_is_propagated(self):
+        self.viewers[0].setSliceOrientation('y')
+        for viewer in self.viewers:
+            self.assertEqual(viewer.getSliceOrientation(), SLICE_ORIENTATION_XZ)
+
+    def test_unlinked_state_is_not_propagated(self):
+        self.hub.setLinkSlice(False)
+        self.change_slice(self.viewers[0], 3)
+        self.assertEqual(self.viewers[0].getActiveSlice(), 3)
+        self.assertNotEqual(self.viewers[1].getActiveSlice(), 3)
+
+    def test_changes_do_not_echo_back(self):
+        applied = []
+        applyChanges = self.hub.applyChanges
+
+        def counting_applyChanges(target, source_state, changes):
+            applied.append(target)
+            applyChanges(target, source_state, changes)
+
+        self.hub.applyChanges = counting_applyChanges
+        self.change_slice(self.viewers[0], 3)
+        self.assertEqual(applied, self.viewers[1:])
+        # rendering again without changes publishes nothing
+        self.viewers[1].getRenderWindow().Render()
+        self.assertEqual(applied, self.viewers[1:])
+
+    def test_removed_viewer_is_not_synchronised(self):
+        self.hub.removeViewer(self.viewers[2])
+        self.change_slice(self.viewers[0], 3)
+        self.assertEqual(self.viewers[1].getActiveSlice(), 3)
+        self.assertNotEqual(self.viewers[2].getActiveSlice(), 3)
+
+    def test_disable(self):
+        self.hub.disable()
+        self.change_slice(self.viewers[0], 3)
+        self.assertNotEqual(self.viewers[1].getActiveSlice(), 3)
+
+    def test_3D_viewer_follows_slice(self):
+        viewer3D = make_viewer(CILViewer, self.image)
+        self.hub.addViewer(viewer3D)
+        self.change_slice(self.viewers[0], 4)
+        self.assertEqual(viewer3D.getSliceOrientation(), SLICE_ORIENTATION_XY)
+        self.assertEqual(viewer3D.getActiveSlice(), 4)
+
+    def test_propagation_latency(self):
+        # benchmark of the propagation of a slice change to 3 viewers, including their render
+        viewer = make_viewer(CILViewer2D, self.image)
+        self.hub.addViewer(viewer)
+        latencies = []
+        for sliceno in range(5):
+            start = time.perf_counter()
+            self.change_slice(self.viewers[0], sliceno)
+            latencies.append(time.perf_counter() - start)
+            self.assertEqual(viewer.getActiveSlice(), sliceno)
+        self.assertIsNotNone(self.hub.last_propagation_time)
+        self.assertLess(np.median(latencies), 1.0)
+
+    def test_perspective_camera_is_propagated_between_3D_viewers(self):
+        viewers3D = [make_viewer(CILViewer, self.image) for _ in range(2)]
+        hub = ViewerSyncHub(viewers3D)
+        hub.enable()
+        camera = viewers3D[0].getRenderer().GetActiveCamera()
+        self.assertFalse(camera.GetParallelProjection())
+        camera.Azimuth(30)
+        camera.Zoom(1.5)
+        camera.OrthogonalizeViewUp()
+        viewers3D[0].getRenderWindow().Render()
+        other_camera = viewers3D[1].getRenderer().GetActiveCamera()
+        for getter in ['GetPosition', 'GetFocalPoint', 'GetViewUp']:
+            np.testing.assert_allclose(getattr(other_camera, getter)(), getattr(camera, getter)())
+        self.assertEqual(other_camera.GetViewAngle(), camera.GetViewAngle())
+        # the parallel cameras of the 2D viewers are not moved
+        self.assertTrue(self.viewers[0].getRenderer().GetActiveCamera().GetParallelProjection())
+        hub.setLinkCamera(False)
+        camera.Elevation(20)
+        viewers3D[0].getRenderWindow().Render()
+        self.assertNotEqual(other_camera.GetPosition(), camera.GetPosition())
+        hub.disable()
+
+
+class TestViewerLinker(unittest.TestCase):
+
+    def test_linker_links_two_viewers(self):
+        data = np.random.randint(0, 100, size=(20, 30, 40), dtype=np.uint16)
+        image = Converter.numpy2vtkImage(data)
+        v1 = make_viewer(CILViewer2D, image)
+        v2 = make_viewer(CILViewer2D, image)
+        linker = ViewerLinker(v1, v2)
+        linker.setLinkSlice(True)
+        linker.enable()
+        v2.style.SetActiveSlice(5)
+        v2.style.UpdatePipeline()
+        self.assertEqual(v1.getActiveSlice(), 5)
+        linker.disable()
+        v2.style.SetActiveSlice(6)
+        v2.style.UpdatePipeline()
+        self.assertEqual(v1.getActiveSlice(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
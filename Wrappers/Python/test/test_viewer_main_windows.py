@@ -1,12 +1,20 @@
+import gc
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 from unittest import mock
 
+import numpy as np
 import vtk
 from ccpi.viewer.CILViewer import CILViewer
 from ccpi.viewer.CILViewer2D import CILViewer2D
-from ccpi.viewer.ui.main_windows import ViewerMainWindow
+from ccpi.viewer.ui.main_windows import ViewerMainWindow, TwoViewersMainWindowWithSessionManagement
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.utils.dataset_context import cilDatasetContext
+from ccpi.viewer.utils.io import ImageReader
+from ccpi.viewer.utils.memory import cilMemoryManager
 from qtpy.QtWidgets import QApplication
 
 # skip the tests on GitHub actions
@@ -31,8 +39,10 @@ class TestViewerMainWindow(TestCaseQt):
 
     def setUp(self):
         self.app = TestCaseQt.get_QApplication(sys.argv)
+        self.memory_budget = cilMemoryManager.GetInstance().GetBudget()
 
     def tearDown(self) -> None:
+        cilMemoryManager.GetInstance().SetBudget(self.memory_budget)
         TestCaseQt.get_QApplication(sys.argv).quit()
 
     def test_init(self):
@@ -60,9 +70,12 @@ class TestViewerMainWindow(TestCaseQt):
 
         vmw.acceptViewerSettings()
 
-        vmw.settings.assert_has_calls(
-            [mock.call.setValue('use_gpu_volume_mapper', True),
-             mock.call.setValue('vis_size', 1.0)], any_order=True)
+        vmw.settings.assert_has_calls([
+            mock.call.setValue('use_gpu_volume_mapper', True),
+            mock.call.setValue('vis_size', 1.0),
+            mock.call.setValue('memory_budget', 2.0)
+        ],
+                                      any_order=True)
 
         assert isinstance(vmw.viewers[0].volume_mapper, vtk.vtkSmartVolumeMapper)
 
@@ -86,12 +99,15 @@ class TestViewerMainWindow(TestCaseQt):
         vis_size_field.value.return_value = 1.0
         gpu_checkbox_field = mock.MagicMock()
         gpu_checkbox_field.isChecked.return_value = True
+        memory_budget_field = mock.MagicMock()
+        memory_budget_field.value.return_value = 2.0
         dark_checkbox_field = mock.MagicMock()
         dark_checkbox_field.isChecked.return_value = False
         settings_dialog = mock.MagicMock()
         settings_dialog.widgets = {
             'vis_size_field': vis_size_field,
             'gpu_checkbox_field': gpu_checkbox_field,
+            'memory_budget_field': memory_budget_field,
             'dark_checkbox_field': dark_checkbox_field
         }
         viewer3D = CILViewer()
@@ -140,6 +156,65 @@ class TestViewerMainWindow(TestCaseQt):
         vmw.getDefaultDownsampledSize.assert_not_called()
         assert (returned_target_size == 5 * (1024**3))
 
+    def test_getMemoryBudget(self):
+        vmw = ViewerMainWindow(title="Testing Title", app_name="testing app name")
+        vmw.settings.setValue("memory_budget", 0)
+        assert vmw.getMemoryBudget() is None
+        vmw.settings.setValue("memory_budget", 1.5)
+        assert vmw.getMemoryBudget() == int(1.5 * 1024**3)
+        vmw.applyMemoryBudget()
+        assert cilMemoryManager.GetInstance().GetBudget() == int(1.5 * 1024**3)
+        vmw.settings.remove("memory_budget")
+
+    def test_reserveImageMemory(self):
+        vmw = ViewerMainWindow(title="Testing Title", app_name="testing app name")
+        viewer = CILViewer2D()
+        image = Converter.numpy2vtkImage(np.zeros((40, 50, 60), dtype=np.uint8))
+        viewer.setInputData(image)
+        # the buffers of the objects of the previous tests are unregistered
+        gc.collect()
+        image_size = cilMemoryManager.GetInstance().GetBuffers(viewer.getDatasetContext())[0]['size']
+        manager = cilMemoryManager.GetInstance()
+        # evicts the caches, which would otherwise be evicted to make room
+        manager.SetBudget(0)
+        manager.SetBudget(manager.GetUsage() + 10**7)
+        available = manager.GetAvailable()
+        # the image displayed by the viewer is replaced, so its memory is available
+        assert vmw.reserveImageMemory(10**9, viewer) == available + image_size
+        other_viewer = CILViewer2D()
+        other_viewer.setInputData(image)
+        assert vmw.reserveImageMemory(10**9, viewer) == available
+        # but the image is not downsampled below a preview
+        manager.SetBudget(manager.GetUsage())
+        assert vmw.reserveImageMemory(10**9, viewer) == 128**3
+        assert vmw.reserveImageMemory(1000, viewer) == 1000
+
+    def test_updateViewerCoordsDockWidgetWithMemoryUsage(self):
+        vmw = ViewerMainWindow(title="Testing Title", app_name="testing app name")
+        cilMemoryManager.GetInstance().SetBudget(2 * 1024**3)
+        vmw.updateViewerCoordsDockWidgetWithMemoryUsage()
+        assert vmw.viewer_coords_dock.getWidgets()['memory_usage_field'].text().endswith("of 2.0 GB")
+
+    def test_updateViewerCoordsDockWidgetWithCoords_with_resampled_read_from_hdf5(self):
+        vmw = ViewerMainWindow(title="Testing Title", app_name="testing app name")
+        viewer2D = CILViewer2D()
+        viewer2D.img3D = vtk.vtkImageData()
+        viewer2D.img3D.SetDimensions(10, 10, 10)
+        vmw.viewer_coords_dock.viewers = [viewer2D]
+        reader = mock.MagicMock()
+        # the attributes read from an HDF5 file are numpy types
+        reader.GetLoadedImageAttrs.return_value = {"resampled": np.bool_(True)}
+        reader.GetOriginalImageAttrs.return_value = {"shape": [20, 20, 20]}
+        viewer_coords_widgets = vmw.viewer_coords_dock.getWidgets()
+        viewer_coords_widgets['coords_warning_field'].setVisible = mock.MagicMock()
+        viewer_coords_widgets['coords_combo_field'].setEnabled = mock.MagicMock()
+        vmw.updateViewerCoordsDockWidgetWithCoords(reader)
+
+        visible = viewer_coords_widgets['coords_warning_field'].setVisible.call_args[0][0]
+        enabled = viewer_coords_widgets['coords_combo_field'].setEnabled.call_args[0][0]
+        self.assertIs(visible, True)
+        self.assertIs(enabled, True)
+
     def test_updateViewerCoords_with_display_unsampled_coords_selected(self):
         vmw = ViewerMainWindow(title="Testing Title", app_name="testing app name")
         viewer2D = CILViewer2D()
@@ -220,6 +295,139 @@ class TestViewerMainWindow(TestCaseQt):
         viewer_coords_widgets['coords_warning_field'].setVisible.assert_not_called()
         viewer2D.updatePipeline.assert_not_called()
 
+    def _setup_prepareImage_test(self):
+        vmw = ViewerMainWindow(title="Testing Title", app_name="testing app name")
+        # runs the workers in this thread
+        vmw.threadpool = mock.MagicMock()
+        vmw.threadpool.start.side_effect = lambda worker: worker.run()
+        vmw.displayImage = mock.MagicMock()
+        viewer = CILViewer2D()
+        data = np.random.randint(0, 100, size=(10, 12, 14)).astype(np.uint16)
+        image = Converter.numpy2vtkImage(data)
+        return vmw, viewer, image
+
+    def test_prepareImage_computes_the_products_in_a_worker(self):
+        vmw, viewer, image = self._setup_prepareImage_test()
+        vmw.prepareImage(viewer, 1, None, "image", image)
+
+        vmw.displayImage.assert_called_once_with(viewer, 1, None, "image", image)
+        context = cilDatasetContext.GetContext(image)
+        with mock.patch.object(context, '_computeStatistics') as compute:
+            context.GetMapRange((5., 95.), 'scalar')
+            compute.assert_not_called()
+        context.Release()
+
+    def test_prepareImage_when_cancelled(self):
+        vmw, viewer, image = self._setup_prepareImage_test()
+
+        # cancels the process from its progress window, as its Cancel button, before the worker runs
+
+        def cancel_and_run(worker):
+            vmw.progress_windows["Preparing Image"].canceled.emit()
+            worker.run()
+
+        vmw.threadpool.start.side_effect = cancel_and_run
+        vmw.prepareImage(viewer, 1, None, "image", image)
+
+        vmw.displayImage.assert_not_called()
+
+    def test_prepareImage_of_overlay_displays_it(self):
+        vmw, viewer, image = self._setup_prepareImage_test()
+        vmw.prepareImage(viewer, 2, None, "image", image)
+        vmw.displayImage.assert_called_once_with(viewer, 2, None, "image", image)
+
+
+@unittest.skipIf(skip_as_conda_build, "On conda builds do not do any test with interfaces")
+class TestViewerMainWindowSessionData(TestCaseQt):
+    ''' Tests saving the images and the state of the viewers with a session, and restoring them.
+    '''
+
+    def setUp(self):
+        self.app = TestCaseQt.get_QApplication(sys.argv)
+        self.tmpdir = tempfile.mkdtemp()
+        self.image_file = os.path.join(self.tmpdir, "image.npy")
+        np.save(self.image_file, np.random.randint(0, 1000, size=(10, 12, 14)).astype(np.uint16))
+        self.session_folder = os.path.join(self.tmpdir, "session")
+        os.mkdir(self.session_folder)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmpdir)
+        TestCaseQt.get_QApplication(sys.argv).quit()
+
+    def _createWindow(self):
+        # the session selection dialogs are not opened
+        with mock.patch.object(TwoViewersMainWindowWithSessionManagement, "setupSession"):
+            vmw = TwoViewersMainWindowWithSessionManagement(app_name="testing session data app")
+        vmw.current_session_folder = self.session_folder
+        vmw.settings = mock.MagicMock()
+        vmw.settings.value.return_value = None
+        # runs the workers in this thread
+        vmw.threadpool = mock.MagicMock()
+        vmw.threadpool.start.side_effect = lambda worker: worker.run()
+        return vmw
+
+    def _saveSessionData(self):
+        vmw = self._createWindow()
+        vmw.setViewersInput(self.image_file, vmw.viewers)
+        vmw.viewers[0].setActiveSlice(3)
+        # the slice of the linked viewer follows
+        vmw.viewers[0].updatePipeline()
+        vmw.viewers[0].getCamera().SetPosition(1, 2, 100)
+        return vmw, vmw.saveSessionData()
+
+    def test_saveSessionData(self):
+        vmw, session_data = self._saveSessionData()
+
+        self.assertTrue(os.path.isfile(os.path.join(self.session_folder, "viewer_image_1.hdf5")))
+        image_config = session_data["images"][0]
+        self.assertEqual(image_config["viewers"], [0, 1])
+        self.assertIn(
+            [[5., 95.], "scalar", list(vmw.viewers[0].getImageMapRange(
+                (5., 95.), "scalar"))], image_config["statistics"]["map_ranges"])
+        self.assertEqual(session_data["viewers"][0]["slicenos"][vmw.viewers[0].getSliceOrientation()], 3)
+        self.assertEqual(session_data["viewers"][1]["slicenos"][vmw.viewers[1].getSliceOrientation()], 3)
+
+    def test_saveSession_reads_the_viewers_on_the_gui_thread(self):
+        vmw = self._createWindow()
+        vmw.setViewersInput(self.image_file, vmw.viewers)
+        vmw.viewers[0].setActiveSlice(3)
+        vmw.viewers[0].updatePipeline()
+        vmw.getCacheSessionData = mock.MagicMock(return_value=True)
+        vmw.sessions_directory = self.tmpdir
+        workers = []
+        vmw.threadpool.start.side_effect = workers.append
+        vmw.runSaveSessionWorker("saved", False, None)
+
+        # the worker only writes the files
+        with mock.patch.object(vmw, "getViewerState") as getViewerState, \
+                mock.patch("ccpi.viewer.ui.main_windows.zip_directory"):
+            workers[0].run()
+        getViewerState.assert_not_called()
+        viewer_states = vmw.getSessionConfig()["viewer_session_data"]["viewers"]
+        self.assertEqual(viewer_states[0]["slicenos"][vmw.viewers[0].getSliceOrientation()], 3)
+
+    def test_restoreSessionData_memory_maps_the_images(self):
+        vmw, session_data = self._saveSessionData()
+        saved_image = Converter.vtk2numpy(vmw.viewers[0].img3D)
+
+        restored = self._createWindow()
+        with mock.patch.object(ImageReader, "Read") as read:
+            restored.restoreSessionData(session_data)
+        read.assert_not_called()
+
+        np.testing.assert_array_equal(Converter.vtk2numpy(restored.viewers[1].img3D), saved_image)
+        self.assertEqual(restored.viewers[0].getActiveSlice(), 3)
+        self.assertEqual(restored.viewers[0].getCamera().GetPosition(), (1, 2, 100))
+
+    def test_restoreSessionData_reads_changed_files(self):
+        _, session_data = self._saveSessionData()
+        os.utime(self.image_file, ns=(0, 0))
+
+        restored = self._createWindow()
+        restored.setViewersInput = mock.MagicMock()
+        restored.restoreSessionData(session_data)
+        restored.setViewersInput.assert_called_once_with(self.image_file, restored.viewers, 1, None)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from ccpi.viewer.utils import cilClipPolyDataBetweenPlanes, cilMaskPolyData
+from ccpi.viewer.utils.conversion import Converter
+
+
+def make_point_cloud(points):
+    polydata = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points, deep=1))
+    polydata.SetPoints(vtk_points)
+    vertices = vtk.vtkCellArray()
+    for i in range(len(points)):
+        vertices.InsertNextCell(1)
+        vertices.InsertCellPoint(i)
+    polydata.SetVerts(vertices)
+    scalars = numpy_support.numpy_to_vtk(np.arange(len(points), dtype=np.float64), deep=1)
+    scalars.SetName("id")
+    polydata.GetPointData().SetScalars(scalars)
+    return polydata
+
+
+class TestClipPolyDataBetweenPlanes(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.points = np.random.uniform(0, 20, size=(2000, 3))
+        self.polydata = make_point_cloud(self.points)
+
+    def clip(self, use_spatial_index, orientation=2, below=4.5, above=5.5, polydata=None):
+        clipper = cilClipPolyDataBetweenPlanes()
+        clipper.SetUseSpatialIndex(use_spatial_index)
+        clipper.SetInputDataObject(self.polydata if polydata is None else polydata)
+        normal = [0, 0, 0]
+        normal[orientation] = 1
+        origin_above = [0, 0, 0]
+        origin_above[orientation] = above
+        origin_below = [0, 0, 0]
+        origin_below[orientation] = below
+        clipper.SetPlaneOriginAbove(origin_above)
+        clipper.SetPlaneNormalAbove(normal)
+        clipper.SetPlaneOriginBelow(origin_below)
+        clipper.SetPlaneNormalBelow([-n for n in normal])
+        clipper.Update()
+        return clipper
+
+    def test_spatial_index_matches_clip_polydata(self):
+        for orientation in range(3):
+            expected = self.clip(False, orientation).GetOutputDataObject(0)
+            clipped = self.clip(True, orientation).GetOutputDataObject(0)
+            self.assertGreater(clipped.GetNumberOfPoints(), 0)
+            self.assertEqual(clipped.GetNumberOfPoints(), expected.GetNumberOfPoints())
+            self.assertEqual(clipped.GetNumberOfVerts(), expected.GetNumberOfVerts())
+            np.testing.assert_array_equal(np.sort(numpy_support.vtk_to_numpy(clipped.GetPointData().GetScalars())),
+                                          np.sort(numpy_support.vtk_to_numpy(expected.GetPointData().GetScalars())))
+
+    def test_spatial_index_selects_points_between_planes(self):
+        clipped = self.clip(True).GetOutputDataObject(0)
+        ids = numpy_support.vtk_to_numpy(clipped.GetPointData().GetScalars()).astype(int)
+        expected = np.flatnonzero((self.points[:, 2] >= 4.5) & (self.points[:, 2] <= 5.5))
+        np.testing.assert_array_equal(ids, expected)
+        np.testing.assert_allclose(numpy_support.vtk_to_numpy(clipped.GetPoints().GetData()), self.points[expected])
+        self.assertEqual(clipped.GetPointData().GetScalars().GetName(), "id")
+
+    def test_spatial_index_is_reused_until_input_is_modified(self):
+        clipper = self.clip(True)
+        index = clipper.GetSpatialIndex(self.polydata, (0., 0., 1.))
+        clipper.SetPlaneOriginAbove([0, 0, 10.5])
+        clipper.SetPlaneOriginBelow([0, 0, 9.5])
+        clipper.Update()
+        self.assertIs(index, clipper.GetSpatialIndex(self.polydata, (0., 0., 1.)))
+        self.polydata.Modified()
+        self.assertIsNot(index, clipper.GetSpatialIndex(self.polydata, (0., 0., 1.)))
+
+    def test_CanUseSpatialIndex_rejects_polygons(self):
+        sphere = vtk.vtkSphereSource()
+        sphere.Update()
+        clipper = self.clip(True, below=-0.1, above=0.1, polydata=sphere.GetOutput())
+        self.assertFalse(clipper.CanUseSpatialIndex(sphere.GetOutput()))
+        self.assertTrue(clipper.CanUseSpatialIndex(self.polydata))
+        self.assertGreater(clipper.GetOutputDataObject(0).GetNumberOfPoints(), 0)
+
+
+class TestMaskPolyData(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        # labels 0, 1, 2, 3 in a 10 x 12 x 14 (x, y, z) mask
+        self.labels = np.random.randint(0, 4, size=(14, 12, 10)).astype(np.uint8)
+        self.mask = Converter.numpy2vtkImage(self.labels)
+        # some points are outside of the mask
+        self.points = np.random.uniform(-2, 16, size=(3000, 3))
+        self.polydata = make_point_cloud(self.points)
+
+    def expected_ids(self, values):
+        ic = np.round(self.points).astype(int)
+        ids = []
+        for i, (x, y, z) in enumerate(ic):
+            if 0 <= x < 10 and 0 <= y < 12 and 0 <= z < 14 and self.labels[z, y, x] in values:
+                ids.append(i)
+        return np.asarray(ids)
+
+    def mask_points(self, masker):
+        masker.SetInputDataObject(0, self.polydata)
+        masker.SetInputDataObject(1, self.mask)
+        masker.Update()
+        return masker.GetOutputDataObject(0)
+
+    def test_mask_value(self):
+        masker = cilMaskPolyData()
+        masker.SetMaskValue(2)
+        out = self.mask_points(masker)
+        expected = self.expected_ids([2])
+        self.assertEqual(masker.GetMaskValue(), 2)
+        self.assertEqual(out.GetNumberOfPoints(), len(expected))
+        self.assertEqual(out.GetNumberOfVerts(), len(expected))
+        np.testing.assert_allclose(numpy_support.vtk_to_numpy(out.GetPoints().GetData()), self.points[expected])
+        np.testing.assert_array_equal(numpy_support.vtk_to_numpy(out.GetPointData().GetScalars()), expected)
+
+    def test_mask_values(self):
+        masker = cilMaskPolyData()
+        masker.SetMaskValues([1, 3])
+        out = self.mask_points(masker)
+        expected = self.expected_ids([1, 3])
+        self.assertEqual(masker.GetMaskValues(), (1, 3))
+        self.assertEqual(masker.point_in_mask, len(expected))
+        np.testing.assert_array_equal(numpy_support.vtk_to_numpy(out.GetPointData().GetScalars()), expected)
+
+    def test_no_point_in_mask(self):
+        masker = cilMaskPolyData()
+        masker.SetMaskValue(10)
+        out = self.mask_points(masker)
+        self.assertEqual(out.GetNumberOfPoints(), 0)
+        self.assertEqual(out.GetNumberOfVerts(), 0)
+
+    def test_SetMaskValues_rejects_non_integers(self):
+        masker = cilMaskPolyData()
+        with self.assertRaises(ValueError):
+            masker.SetMaskValues([1, 2.5])
+        with self.assertRaises(ValueError):
+            masker.SetMaskValues([])
+
+
+if __name__ == '__main__':
+    unittest.main()